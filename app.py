@@ -1,9 +1,11 @@
 import streamlit as st
-import sqlite3
-import os
+import importlib
 import traceback
-import sys
-from models.usuarios_db import verificar_credenciales, crear_usuario, verificar_nickname_disponible, init_users_table
+from models.usuarios_db import (verificar_credenciales, crear_usuario, verificar_nickname_disponible, init_users_table,
+                                crear_sesion, restaurar_sesion, revocar_sesion, AccesoLimitado)
+from models.trazas import iniciar_registro, obtener_registro, resumir_registro, UMBRAL_CONSULTA_LENTA_MS, RUTA_CONSULTAS_LENTAS
+from models.metricas import iniciar_exportacion, medir_pagina, registrar_cache
+from models.memoria import perfilar_pagina, obtener_informes, PERFILADO_ACTIVO, MUESTREO
 
 # Evitar que se muestren las rutas en la barra lateral
 hide_streamlit_elements = """
@@ -16,16 +18,38 @@ footer {visibility: hidden;}
 </style>
 """
 
-# Función para cambiar de página
-def cambiar_pagina(opcion):
-    nueva_pagina = opcion
-    
-    # Si selecciona ensayos pero no hay subpágina seleccionada,
-    # establecer la primera opción como predeterminada
-    if nueva_pagina == "Ensayos" and not st.session_state.subpagina_ensayos:
-        st.session_state.subpagina_ensayos = opciones_ensayos[0]
-        
-    st.session_state.pagina_actual = nueva_pagina
+# Opciones principales del menú
+opciones_principales = ["Inicio", "Registro de Muestras", "Ensayos", "Consulta de Resultados", "Analítica", "Trabajos"]
+
+# Opciones del submenú de ensayos
+opciones_ensayos = [
+    "Ensayos Granulométricos", 
+    "Límites de Atterberg", 
+    "Densidad de Árido Grueso", 
+    "CBR",
+    "Índice de Lajas y Agujas",
+    "Picnómetro de Arena",
+    "Equivalente de Arena",
+    "Próctor"
+]
+
+# Registro de páginas: entrada del menú -> (módulo, función que la muestra).
+# Cada módulo se importa solo la primera vez que se navega a su página.
+REGISTRO_PAGINAS = {
+    "Inicio": ("pages.inicio", "mostrar_pagina_inicio"),
+    "Registro de Muestras": ("pages.registro", "mostrar_pagina_registro"),
+    "Consulta de Resultados": ("pages.consulta", "mostrar_pagina_consulta"),
+    "Analítica": ("pages.analitica", "mostrar_pagina_analitica"),
+    "Ensayos Granulométricos": ("pages.granulometria", "mostrar_pagina_granulometria"),
+    "Límites de Atterberg": ("pages.limites", "mostrar_pagina_limites"),
+    "Densidad de Árido Grueso": ("pages.densidad_arido", "mostrar_pagina_densidad_arido"),
+    "CBR": ("pages.cbr", "mostrar_pagina_cbr"),
+    "Índice de Lajas y Agujas": ("pages.lajas_agujas", "mostrar_pagina_lajas_agujas"),
+    "Picnómetro de Arena": ("pages.picnometro", "mostrar_pagina_picnometro"),
+    "Equivalente de Arena": ("pages.equivalente_arena", "mostrar_pagina_equivalente_arena"),
+    "Próctor": ("pages.proctor", "mostrar_pagina_proctor"),
+    "Trabajos": ("pages.trabajos", "mostrar_pagina_trabajos")
+}
 
 # Configuración de la página
 st.set_page_config(
@@ -62,12 +86,12 @@ if 'vista_login' not in st.session_state:
 @st.cache_resource
 def inicializar_sistema():
     """
-    Inicializa el sistema, asegurando que la base de datos existe
-    y cargando los módulos necesarios.
+    Inicializa el sistema, asegurando que la base de datos existe.
+    Los módulos de las páginas se cargan bajo demanda con cargar_pagina().
     """
     try:
         # Primero aseguramos que el módulo de base de datos está disponible
-        from models.db import inicializar_bd, obtener_conexion
+        from models.db import inicializar_bd
         
         # Inicializar la base de datos
         inicializar_bd()
@@ -75,38 +99,57 @@ def inicializar_sistema():
         # Inicializar la tabla de usuarios
         init_users_table()
         
-        # Cargar los módulos necesarios
-        from pages.inicio import mostrar_pagina_inicio
-        from pages.registro import mostrar_pagina_registro
-        from pages.granulometria import mostrar_pagina_granulometria
-        from pages.consulta import mostrar_pagina_consulta
-        from pages.densidad_arido import mostrar_pagina_densidad_arido
-        from pages.limites import mostrar_pagina_limites
-        from pages.cbr import mostrar_pagina_cbr
-        from pages.lajas_agujas import mostrar_pagina_lajas_agujas
-        from pages.picnometro import mostrar_pagina_picnometro
-        from pages.equivalente_arena import mostrar_pagina_equivalente_arena
-        from pages.proctor import mostrar_pagina_proctor
+        # Exportar métricas si GARNOCEX_METRICAS_PUERTO o GARNOCEX_METRICAS_FICHERO están definidas
+        iniciar_exportacion()
+        
+        # Reanudar los trabajos en segundo plano que quedaron sin terminar
+        from models.trabajos import reanudar_trabajos
+        reanudar_trabajos()
+        
+        # Programar las copias de seguridad si GARNOCEX_COPIAS_INTERVALO_H está definida
+        from models.copias import iniciar_copias_programadas
+        iniciar_copias_programadas()
         
+        # Programar el mantenimiento si GARNOCEX_MANTENIMIENTO_INTERVALO_H está definida
+        from models.mantenimiento import iniciar_mantenimiento_programado
+        iniciar_mantenimiento_programado()
+        
+        return {"inicializado": True}
+    except Exception as e:
         return {
-            "inicializado": True,
-            "modulos": {
-                "inicio": mostrar_pagina_inicio,
-                "registro": mostrar_pagina_registro,
-                "granulometria": mostrar_pagina_granulometria,
-                "consulta": mostrar_pagina_consulta,
-                "densidad_arido": mostrar_pagina_densidad_arido,
-                "limites": mostrar_pagina_limites,
-                "cbr": mostrar_pagina_cbr,
-                "lajas_agujas": mostrar_pagina_lajas_agujas,
-                "picnometro": mostrar_pagina_picnometro,
-                "equivalente_arena": mostrar_pagina_equivalente_arena,
-                "proctor": mostrar_pagina_proctor
-            }
+            "inicializado": False,
+            "error": str(e),
+            "traceback": traceback.format_exc()
         }
+
+@st.cache_resource
+def paginas_no_disponibles():
+    """
+    Conjunto compartido con las entradas del menú cuyo módulo no se pudo cargar.
+    """
+    return set()
+
+@st.cache_resource(show_spinner=False)
+def cargar_pagina(nombre_pagina):
+    """
+    Importa el módulo de una página la primera vez que se solicita.
+    
+    Args:
+        nombre_pagina (str): Entrada del menú registrada en REGISTRO_PAGINAS
+        
+    Returns:
+        dict: {"funcion": callable} si la página se cargó, o
+              {"error": str, "traceback": str} si su módulo falla al importarse
+    """
+    modulo, funcion = REGISTRO_PAGINAS[nombre_pagina]
+    registrar_cache("paginas", fallo=True)
+    
+    try:
+        return {"funcion": getattr(importlib.import_module(modulo), funcion)}
     except Exception as e:
+        # Un fallo solo inhabilita la entrada afectada, no el resto del sistema
+        paginas_no_disponibles().add(nombre_pagina)
         return {
-            "inicializado": False,
             "error": str(e),
             "traceback": traceback.format_exc()
         }
@@ -127,10 +170,16 @@ def mostrar_login():
     
     if submit_button:
         if nickname and password:
-            usuario = verificar_credenciales(nickname, password)
+            try:
+                usuario = verificar_credenciales(nickname, password, st.context.ip_address)
+            except AccesoLimitado as e:
+                st.warning(str(e))
+                return
             if usuario:
                 st.session_state.autenticado = True
                 st.session_state.usuario_actual = usuario
+                # El token en la URL permite recuperar la sesión sin volver a verificar la contraseña
+                st.query_params["sesion"] = crear_sesion(usuario["id"])
                 st.success("¡Inicio de sesión exitoso!")
                 st.rerun()
             else:
@@ -172,7 +221,12 @@ def mostrar_signup():
         else:
             # Verificar si el nickname está disponible
             if verificar_nickname_disponible(nickname):
-                if crear_usuario(nombre, nickname, password):
+                try:
+                    creado = crear_usuario(nombre, nickname, password)
+                except AccesoLimitado as e:
+                    st.warning(str(e))
+                    return
+                if creado:
                     st.success("Usuario creado con éxito. Ahora puede iniciar sesión.")
                     st.session_state.vista_login = "login"
                     st.rerun()
@@ -183,14 +237,57 @@ def mostrar_signup():
 
 # Función para cerrar sesión
 def cerrar_sesion():
+    revocar_sesion(st.query_params.get("sesion"))
+    st.query_params.pop("sesion", None)
     st.session_state.autenticado = False
     st.session_state.usuario_actual = None
     st.session_state.pagina_actual = "Inicio"
     st.session_state.vista_login = "login"
     st.rerun()
 
+# Panel de consultas SQL de la ejecución actual (solo administrador)
+def mostrar_panel_consultas():
+    registro = obtener_registro()
+    total_ms = sum(s["duracion_ms"] or 0 for s in registro)
+    
+    with st.expander(f"🛠️ Consultas SQL: {len(registro)} ({total_ms:.1f} ms)"):
+        resumen = resumir_registro(registro)
+        repetidas = [g for g in resumen if g["ejecuciones"] > 1 and not g["sql"].upper().startswith(("BEGIN", "COMMIT"))]
+        
+        if repetidas:
+            st.warning(f"{len(repetidas)} sentencias se ejecutan varias veces en esta página")
+        
+        st.caption("Agrupadas por sentencia")
+        st.dataframe(resumen)
+        
+        st.caption("En orden de ejecución")
+        st.dataframe(registro)
+        
+        st.caption(
+            f"Las sentencias de más de {UMBRAL_CONSULTA_LENTA_MS:g} ms se guardan con su plan de "
+            f"ejecución en {RUTA_CONSULTAS_LENTAS}"
+        )
+
+def mostrar_panel_memoria():
+    informes = obtener_informes()
+    excedidos = sum(1 for i in informes if i["excedido"])
+    
+    with st.expander(f"🧠 Memoria por página: {len(informes)} informes ({excedidos} sobre presupuesto)"):
+        st.caption(f"Se perfila una de cada {MUESTREO} ejecuciones de página")
+        
+        for informe in informes:
+            st.write(
+                f"**{informe['pagina']}** ({informe['fecha']}): pico {informe['pico_bytes'] / 1024 / 1024:.1f} MB, "
+                f"retenida {informe['retenida_bytes'] / 1024 / 1024:.1f} MB, "
+                f"presupuesto {informe['presupuesto_bytes'] / 1024 / 1024:.0f} MB"
+            )
+            st.dataframe(informe["asignaciones"])
+
 # Función principal
 def main():
+    # Registrar las sentencias SQL de esta ejecución del script
+    iniciar_registro()
+    
     # Inicializar sistema
     sistema = inicializar_sistema()
     
@@ -200,6 +297,15 @@ def main():
         st.code(sistema["traceback"], language="python")
         return
     
+    # Recuperar la sesión de un token tras una reconexión, un reinicio o en otra pestaña
+    if not st.session_state.autenticado and "sesion" in st.query_params:
+        usuario = restaurar_sesion(st.query_params["sesion"])
+        if usuario:
+            st.session_state.autenticado = True
+            st.session_state.usuario_actual = usuario
+        else:
+            del st.query_params["sesion"]
+    
     # Inicializar estado si no existe
     if "pagina_actual" not in st.session_state:
         st.session_state.pagina_actual = "Inicio"
@@ -207,21 +313,6 @@ def main():
     if 'subpagina_ensayos' not in st.session_state:
         st.session_state.subpagina_ensayos = None
 
-    # Opciones principales del menú
-    opciones_principales = ["Inicio", "Registro de Muestras", "Ensayos", "Consulta de Resultados"]
-
-    # Opciones del submenú de ensayos
-    opciones_ensayos = [
-        "Ensayos Granulométricos", 
-        "Límites de Atterberg", 
-        "Densidad de Árido Grueso", 
-        "CBR",
-        "Índice de Lajas y Agujas",
-        "Picnómetro de Arena",
-        "Equivalente de Arena",
-        "Próctor"
-    ]
-
     # Barra lateral
     with st.sidebar:
         # Título de la aplicación
@@ -264,6 +355,10 @@ def main():
                 # Actualizar la subpágina actual de ensayos
                 st.session_state.subpagina_ensayos = subopcion
                 st.session_state.pagina_actual = subopcion
+            
+            # Avisar de las páginas cuyo módulo no se ha podido cargar
+            if paginas_no_disponibles():
+                st.warning("Páginas no disponibles: " + ", ".join(sorted(paginas_no_disponibles())))
         else:
             # Si no está autenticado, mostrar opciones de login/registro
             st.write("👤 **Acceso al Sistema**")
@@ -290,47 +385,38 @@ def main():
     
     # Contenido principal
     if st.session_state.autenticado:
-        # Enrutar a la página correspondiente basado en la selección
-        try:
-            pagina_actual = st.session_state.pagina_actual
+        # Enrutar a la página correspondiente a través del registro
+        pagina_actual = st.session_state.pagina_actual
+        
+        if pagina_actual not in REGISTRO_PAGINAS:
+            st.error(f"Página no encontrada: {pagina_actual}")
+        else:
+            registrar_cache("paginas", fallo=False)
+            pagina = cargar_pagina(pagina_actual)
             
-            if pagina_actual == "Inicio":
-                sistema["modulos"]["inicio"]()
-            elif pagina_actual == "Registro de Muestras":
-                sistema["modulos"]["registro"]()
-            elif pagina_actual == "Consulta de Resultados":
-                sistema["modulos"]["consulta"]()
-            elif pagina_actual in opciones_ensayos:
-                # Manejar los distintos tipos de ensayos
-                if pagina_actual == "Ensayos Granulométricos":
-                    sistema["modulos"]["granulometria"]()
-                elif pagina_actual == "Límites de Atterberg":
-                    sistema["modulos"]["limites"]()
-                elif pagina_actual == "Densidad de Árido Grueso":
-                    sistema["modulos"]["densidad_arido"]()
-                elif pagina_actual == "CBR":
-                    sistema["modulos"]["cbr"]()
-                elif pagina_actual == "Índice de Lajas y Agujas":
-                    sistema["modulos"]["lajas_agujas"]()
-                elif pagina_actual == "Picnómetro de Arena":
-                    sistema["modulos"]["picnometro"]()
-                elif pagina_actual == "Equivalente de Arena":
-                    sistema["modulos"]["equivalente_arena"]()
-                elif pagina_actual == "Próctor":
-                    sistema["modulos"]["proctor"]()
-                else:
-                    st.error(f"Página de ensayo no implementada: {pagina_actual}")
+            if "error" in pagina:
+                st.error(f"La página '{pagina_actual}' no está disponible: {pagina['error']}")
+                st.code(pagina["traceback"], language="python")
             else:
-                st.error(f"Página no encontrada: {pagina_actual}")
-        except Exception as e:
-            st.error(f"Ha ocurrido un error: {str(e)}")
-            st.exception(e)
+                try:
+                    with medir_pagina(pagina_actual), perfilar_pagina(pagina_actual):
+                        pagina["funcion"]()
+                except Exception as e:
+                    st.error(f"Ha ocurrido un error: {str(e)}")
+                    st.exception(e)
     else:
         # Mostrar pantalla de login o registro
         if st.session_state.vista_login == "login":
             mostrar_login()
         else:
             mostrar_signup()
+    
+    # Panel de consultas SQL, al final para incluir las de la página mostrada
+    if st.session_state.autenticado and st.session_state.usuario_actual["id"] == 1:
+        with st.sidebar:
+            mostrar_panel_consultas()
+            if PERFILADO_ACTIVO:
+                mostrar_panel_memoria()
 
 # Punto de entrada de la aplicación
 if __name__ == "__main__":
@@ -0,0 +1,339 @@
+"""
+Benchmark del arranque en frío de la aplicación
+
+Mide, en procesos nuevos de Python, el tiempo de importación de cada módulo
+(-X importtime) y la latencia del primer render de la pantalla de login y de
+cada página registrada en app.py mediante streamlit.testing.v1.AppTest.
+
+Cada medición se ejecuta en un directorio temporal con una base de datos nueva,
+de modo que los efectos secundarios de los módulos (creación de tablas) no
+tocan la base de datos del proyecto. Los resultados se comparan con una
+referencia guardada (benchmarks/resultados/referencia_arranque.json) y, si no
+hay regresiones, se añaden como una línea JSON a
+benchmarks/resultados/arranque.jsonl. La primera ejecución, sin referencia,
+se guarda como referencia; para cambiarla se usa --actualizar-referencia.
+
+Uso:
+    python benchmarks/arranque.py
+    python benchmarks/arranque.py --repeticiones 5 --tolerancia 0.25
+    python benchmarks/arranque.py --actualizar-referencia
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from comun import RAIZ_PROYECTO, DIRECTORIO_RESULTADOS, commit_actual, guardar_resultado
+
+RUTA_APP = os.path.join(RAIZ_PROYECTO, "app.py")
+RUTA_RESULTADOS = os.path.join(DIRECTORIO_RESULTADOS, "arranque.jsonl")
+RUTA_REFERENCIA = os.path.join(DIRECTORIO_RESULTADOS, "referencia_arranque.json")
+
+# Módulos cuyo tiempo de importación se mide por separado
+MODULOS_IMPORTACION = [
+    "app",
+    "models.db",
+    "models.usuarios_db",
+    "models.muestras",
+    "utils",
+    "pandas",
+    "numpy",
+    "plotly.graph_objects",
+    "streamlit",
+]
+
+# Pantalla sin sesión iniciada
+PAGINA_LOGIN = "Login"
+
+# Usuario con el que se simula la sesión al renderizar las páginas
+USUARIO_BENCHMARK = {"id": 1, "nombre": "Benchmark", "nickname": "benchmark"}
+
+# Código que ejecuta el proceso hijo para medir el primer render de una página
+CODIGO_RENDER = """
+import json, sys, time
+from streamlit.testing.v1 import AppTest
+
+ruta_app, pagina, usuario = sys.argv[1], sys.argv[2], json.loads(sys.argv[3])
+at = AppTest.from_file(ruta_app, default_timeout=120)
+if pagina != "Login":
+    at.session_state["autenticado"] = True
+    at.session_state["usuario_actual"] = usuario
+    at.session_state["pagina_actual"] = pagina
+    at.session_state["subpagina_ensayos"] = pagina
+inicio = time.perf_counter()
+at.run()
+segundos = time.perf_counter() - inicio
+errores = [e.value for e in at.error] + [e.message for e in at.exception]
+print(json.dumps({"segundos": segundos, "errores": errores}))
+"""
+
+
+def _entorno_hijo():
+    """
+    Entorno para los procesos hijos: el proyecto en PYTHONPATH y sin caché
+    de bytecode escrita en el árbol del proyecto
+    """
+    entorno = dict(os.environ)
+    entorno["PYTHONPATH"] = os.pathsep.join(filter(None, [RAIZ_PROYECTO, entorno.get("PYTHONPATH")]))
+    entorno["PYTHONDONTWRITEBYTECODE"] = "1"
+    return entorno
+
+
+def _ejecutar_en_temporal(argumentos):
+    """
+    Ejecuta un proceso de Python en un directorio temporal nuevo
+
+    Args:
+        argumentos (list): Argumentos para el intérprete
+
+    Returns:
+        subprocess.CompletedProcess: Resultado del proceso
+    """
+    directorio = tempfile.mkdtemp(prefix="benchmark_arranque_")
+    try:
+        return subprocess.run(
+            [sys.executable] + argumentos,
+            cwd=directorio,
+            env=_entorno_hijo(),
+            capture_output=True,
+            text=True,
+        )
+    finally:
+        shutil.rmtree(directorio, ignore_errors=True)
+
+
+def analizar_importtime(salida, top=10):
+    """
+    Analiza la salida de -X importtime
+
+    Args:
+        salida (str): Salida de error del intérprete
+        top (int): Número de módulos más costosos a devolver
+
+    Returns:
+        dict: Tiempo total en segundos del módulo de primer nivel y los módulos
+            con mayor tiempo propio
+    """
+    registros = []
+    for linea in salida.splitlines():
+        if not linea.startswith("import time:") or "self [us]" in linea:
+            continue
+        propio, acumulado, nombre = linea[len("import time:"):].split("|")
+        registros.append((int(propio), int(acumulado), nombre.rstrip()))
+
+    if not registros:
+        return {"total": None, "mas_costosos": []}
+
+    # El último registro sin sangría es el módulo importado explícitamente
+    raiz = [r for r in registros if not r[2].startswith("  ")][-1]
+    mas_costosos = sorted(registros, key=lambda r: r[0], reverse=True)[:top]
+
+    return {
+        "total": raiz[1] / 1e6,
+        "mas_costosos": [
+            {"modulo": nombre.strip(), "propio": propio / 1e6}
+            for propio, _, nombre in mas_costosos
+        ],
+    }
+
+
+def medir_importacion(modulo):
+    """
+    Mide el tiempo de importación en frío de un módulo
+
+    Args:
+        modulo (str): Nombre del módulo a importar
+
+    Returns:
+        dict: Tiempo total y módulos más costosos, o el error de importación
+    """
+    proceso = _ejecutar_en_temporal(["-X", "importtime", "-c", f"import {modulo}"])
+    if proceso.returncode != 0:
+        return {"total": None, "error": proceso.stderr.strip().splitlines()[-1]}
+    return analizar_importtime(proceso.stderr)
+
+
+def medir_primer_render(pagina):
+    """
+    Mide el primer render de una página en un proceso nuevo
+
+    Args:
+        pagina (str): Entrada del menú de app.py o PAGINA_LOGIN
+
+    Returns:
+        dict: Segundos del primer render (incluida la importación de la página),
+            segundos totales del proceso y errores mostrados
+    """
+    inicio = time.perf_counter()
+    proceso = _ejecutar_en_temporal(["-c", CODIGO_RENDER, RUTA_APP, pagina, json.dumps(USUARIO_BENCHMARK)])
+    proceso_total = time.perf_counter() - inicio
+
+    if proceso.returncode != 0:
+        return {"segundos": None, "proceso": proceso_total, "errores": [proceso.stderr.strip().splitlines()[-1]]}
+
+    resultado = json.loads(proceso.stdout.strip().splitlines()[-1])
+    resultado["proceso"] = proceso_total
+    return resultado
+
+
+def _mediana(valores):
+    valores = [v for v in valores if v is not None]
+    return statistics.median(valores) if valores else None
+
+
+def ejecutar_benchmark(repeticiones=3, paginas=None):
+    """
+    Ejecuta el benchmark completo de arranque
+
+    Args:
+        repeticiones (int): Procesos por medición; se guarda la mediana
+        paginas (list, optional): Páginas a medir. Por defecto, todas las de app.py
+
+    Returns:
+        dict: Registro con los resultados de la ejecución
+    """
+    if paginas is None:
+        paginas = [PAGINA_LOGIN] + list(_registro_paginas())
+
+    importacion = {}
+    for modulo in MODULOS_IMPORTACION:
+        medidas = [medir_importacion(modulo) for _ in range(repeticiones)]
+        importacion[modulo] = {
+            "segundos": _mediana([m["total"] for m in medidas]),
+            "mas_costosos": medidas[-1].get("mas_costosos", []),
+        }
+        if "error" in medidas[-1]:
+            importacion[modulo]["error"] = medidas[-1]["error"]
+
+    render = {}
+    for pagina in paginas:
+        medidas = [medir_primer_render(pagina) for _ in range(repeticiones)]
+        render[pagina] = {
+            "segundos": _mediana([m["segundos"] for m in medidas]),
+            "proceso": _mediana([m["proceso"] for m in medidas]),
+            "errores": medidas[-1]["errores"],
+        }
+
+    return {
+        "fecha": datetime.now().isoformat(timespec="seconds"),
+        "commit": commit_actual(),
+        "python": platform.python_version(),
+        "repeticiones": repeticiones,
+        "importacion": importacion,
+        "render": render,
+    }
+
+
+def _registro_paginas():
+    """
+    Obtiene las páginas registradas en app.py sin ejecutar la aplicación
+    """
+    import ast
+
+    with open(RUTA_APP, encoding="utf-8") as f:
+        arbol = ast.parse(f.read())
+
+    for nodo in arbol.body:
+        if isinstance(nodo, ast.Assign) and any(
+            isinstance(t, ast.Name) and t.id == "REGISTRO_PAGINAS" for t in nodo.targets
+        ):
+            return ast.literal_eval(nodo.value)
+
+    return {}
+
+
+def comparar_resultados(actual, referencia, tolerancia=0.2):
+    """
+    Compara dos registros y detecta regresiones
+
+    Args:
+        actual (dict): Registro de la ejecución actual
+        referencia (dict): Registro de referencia
+        tolerancia (float): Aumento relativo permitido (0.2 = 20 %)
+
+    Returns:
+        list: Tuplas (medida, segundos_anteriores, segundos_actuales) que superan la tolerancia
+    """
+    regresiones = []
+    for seccion in ("importacion", "render"):
+        for nombre, medida in actual[seccion].items():
+            previa = referencia.get(seccion, {}).get(nombre, {}).get("segundos")
+            if previa and medida["segundos"] and medida["segundos"] > previa * (1 + tolerancia):
+                regresiones.append((f"{seccion}:{nombre}", previa, medida["segundos"]))
+    return regresiones
+
+
+def _formatear(segundos):
+    return "   error" if segundos is None else f"{segundos * 1000:8.1f}"
+
+
+def imprimir_informe(registro, referencia=None):
+    """
+    Imprime un resumen legible de un registro
+    """
+    def previo(seccion, nombre):
+        if referencia is None:
+            return ""
+        return _formatear(referencia.get(seccion, {}).get(nombre, {}).get("segundos"))
+
+    print(f"Arranque en frío ({registro['commit']}, Python {registro['python']}, "
+          f"mediana de {registro['repeticiones']} procesos)")
+    print("\nImportación (ms)" + ("          referencia" if referencia else ""))
+    for modulo, medida in registro["importacion"].items():
+        print(f"  {modulo:<28}{_formatear(medida['segundos'])}  {previo('importacion', modulo)}")
+
+    print("\nPrimer render (ms)" + ("        referencia" if referencia else ""))
+    for pagina, medida in registro["render"].items():
+        aviso = "  [errores]" if medida["errores"] else ""
+        print(f"  {pagina:<28}{_formatear(medida['segundos'])}  {previo('render', pagina)}{aviso}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del arranque en frío de la aplicación")
+    parser.add_argument("--repeticiones", type=int, default=3, help="Procesos por medición")
+    parser.add_argument("--pagina", action="append", dest="paginas",
+                        help="Página a medir (se puede repetir). Por defecto, todas")
+    parser.add_argument("--tolerancia", type=float, default=0.2,
+                        help="Aumento relativo permitido frente a la referencia")
+    parser.add_argument("--salida", default=RUTA_RESULTADOS, help="Fichero JSON lines de resultados")
+    parser.add_argument("--referencia", default=RUTA_REFERENCIA, help="Fichero de referencia")
+    parser.add_argument("--actualizar-referencia", action="store_true",
+                        help="Guardar los resultados como nueva referencia aunque haya regresiones")
+    parser.add_argument("--no-guardar", action="store_true", help="No añadir el resultado al fichero")
+    args = parser.parse_args()
+
+    referencia = None
+    if os.path.exists(args.referencia) and not args.actualizar_referencia:
+        with open(args.referencia, encoding="utf-8") as f:
+            referencia = json.load(f)
+
+    registro = ejecutar_benchmark(args.repeticiones, args.paginas)
+    imprimir_informe(registro, referencia)
+
+    # Una ejecución con regresiones no se guarda: la siguiente se sigue comparando con la referencia
+    regresiones = comparar_resultados(registro, referencia, args.tolerancia) if referencia else []
+    if not args.no_guardar and not regresiones:
+        guardar_resultado(registro, args.salida)
+
+    if referencia is None:
+        os.makedirs(os.path.dirname(args.referencia), exist_ok=True)
+        with open(args.referencia, "w", encoding="utf-8") as f:
+            json.dump(registro, f, ensure_ascii=False, indent=2)
+        print(f"\nReferencia guardada en {args.referencia}")
+
+    if regresiones:
+        print("\nRegresiones respecto a la referencia:")
+        for nombre, previa, actual in regresiones:
+            print(f"  {nombre}: {previa * 1000:.1f} ms -> {actual * 1000:.1f} ms")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
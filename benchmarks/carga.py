@@ -0,0 +1,385 @@
+"""
+Prueba de carga con varias sesiones simultáneas de la aplicación
+
+Lanza sesiones simuladas de operarios e ingenieros en procesos separados, cada
+una con su propia instancia de streamlit.testing.v1.AppTest sobre app.py, contra
+una base de datos temporal generada con benchmarks/generador.py. Los operarios
+inician sesión, registran una muestra y guardan ensayos con los formularios de
+cada página; los ingenieros consultan y comparan muestras en Consulta de
+Resultados.
+
+Informa de la latencia p50/p95/p99 por acción, los errores de bloqueo de la
+base de datos, el resto de errores y el rendimiento total. Los resultados se
+añaden a benchmarks/resultados/carga.jsonl.
+
+Uso:
+    python benchmarks/carga.py --operarios 4 --ingenieros 2 --iteraciones 10
+"""
+import argparse
+import multiprocessing
+import os
+import platform
+import random
+import re
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from comun import RAIZ_PROYECTO, DIRECTORIO_RESULTADOS, commit_actual, guardar_resultado
+
+RUTA_APP = os.path.join(RAIZ_PROYECTO, "app.py")
+RUTA_RESULTADOS = os.path.join(DIRECTORIO_RESULTADOS, "carga.jsonl")
+
+PASSWORD = "carga123"
+
+# Páginas de ensayo que usan los operarios
+PAGINAS_ENSAYO = [
+    "Ensayos Granulométricos",
+    "Límites de Atterberg",
+    "Densidad de Árido Grueso",
+    "CBR",
+    "Índice de Lajas y Agujas",
+    "Picnómetro de Arena",
+    "Equivalente de Arena",
+    "Próctor",
+]
+
+# Valores de los campos numéricos de los formularios, por inicio de etiqueta
+VALORES_FORMULARIO = [
+    ("Masa Total de Muestra", 1000.0),
+    ("Tamiz ", 60.0),
+    ("Límite Líquido", 45.0),
+    ("Límite Plástico", 25.0),
+    ("Masa seca", 3000.0),
+    ("Masa saturada superficie seca", 3050.0),
+    ("Masa sumergida", 1900.0),
+    ("Densidad Seca (g/cm³)", 1.9),
+    ("Humedad Inicial", 10.0),
+    ("Humedad Final", 12.0),
+    ("Índice CBR", 25.0),
+    ("Hinchamiento", 0.5),
+    ("Absorción de Agua", 2.0),
+    ("Masa total de arena empleada", 5000.0),
+    ("Masa de arena en el cono", 1600.0),
+    ("Densidad de la arena de calibración", 1.45),
+    ("Humedad del suelo", 10.0),
+    ("Masa del suelo extraído", 4000.0),
+    ("Altura del sedimento", 90.0),
+    ("Altura de los flóculos", 200.0),
+    ("Temperatura", 22.0),
+    ("Masa total de la muestra", 2000.0),
+    ("Masa de partículas con forma de laja", 300.0),
+    ("Masa de partículas con forma de aguja", 200.0),
+]
+
+# Mensajes que indican contención en la base de datos
+PATRON_BLOQUEO = re.compile(r"database is locked|database table is locked|SQLITE_BUSY", re.IGNORECASE)
+
+
+def _valor_formulario(etiqueta):
+    """
+    Valor verosímil para un campo numérico de un formulario de ensayo
+    """
+    punto = re.match(r"(Humedad|Densidad Seca) Punto (\d+)", etiqueta)
+    if punto:
+        # Puntos de una parábola Próctor
+        humedad = 6.0 + 2.0 * (int(punto.group(2)) - 1)
+        return humedad if punto.group(1) == "Humedad" else round(2.1 - 0.004 * (humedad - 10) ** 2, 2)
+
+    for prefijo, valor in VALORES_FORMULARIO:
+        if etiqueta.startswith(prefijo):
+            return valor
+    return None
+
+
+def _por_etiqueta(elementos, prefijo):
+    for elemento in elementos:
+        if elemento.label.startswith(prefijo):
+            return elemento
+    return None
+
+
+class Sesion:
+    """
+    Sesión simulada: una instancia de AppTest y las latencias de sus acciones
+    """
+
+    def __init__(self, nombre, semilla):
+        from streamlit.testing.v1 import AppTest
+
+        self.nombre = nombre
+        self.rng = random.Random(semilla)
+        self.at = AppTest.from_file(RUTA_APP, default_timeout=120)
+        self.medidas = []
+
+    def accion(self, nombre, paso):
+        """
+        Ejecuta un paso sobre la aplicación y registra su latencia y resultado
+
+        Args:
+            nombre (str): Nombre de la acción
+            paso (callable): Función que recibe el AppTest y ejecuta la interacción
+        """
+        inicio = time.perf_counter()
+        try:
+            paso(self.at)
+            mensajes = [e.value for e in self.at.error] + [str(e.message) for e in self.at.exception]
+        except Exception as e:
+            mensajes = [f"{type(e).__name__}: {e}"]
+        segundos = time.perf_counter() - inicio
+
+        if any(PATRON_BLOQUEO.search(m) for m in mensajes):
+            resultado = "bloqueo"
+        elif mensajes:
+            resultado = "error"
+        else:
+            resultado = "ok"
+
+        self.medidas.append({
+            "accion": nombre, "segundos": segundos, "resultado": resultado,
+            "mensaje": mensajes[0][:200] if mensajes else None,
+        })
+        return resultado == "ok"
+
+    def login(self, usuario):
+        def paso(at):
+            at.run()
+            _por_etiqueta(at.text_input, "Nombre de usuario").input(usuario)
+            _por_etiqueta(at.text_input, "Contraseña").input(PASSWORD)
+            _por_etiqueta(at.main.button, "Iniciar Sesión").click()
+            at.run()
+        return self.accion("login", paso)
+
+    def navegar(self, pagina):
+        def paso(at):
+            if pagina in PAGINAS_ENSAYO:
+                at.sidebar.radio[0].set_value("Ensayos").run()
+                at.sidebar.selectbox[0].set_value(pagina).run()
+            else:
+                at.sidebar.radio[0].set_value(pagina).run()
+        return self.accion(f"navegar:{pagina}", paso)
+
+    def registrar_muestra(self, codigo):
+        def paso(at):
+            _por_etiqueta(at.text_input, "Código de Muestra").input(codigo)
+            _por_etiqueta(at.main.button, "Guardar Muestra").click()
+            at.run()
+        return self.accion("registrar_muestra", paso)
+
+    def guardar_ensayo(self, pagina, codigo):
+        def paso(at):
+            seleccion = _por_etiqueta(at.main.selectbox, "Seleccionar Muestra")
+            if seleccion is not None and codigo in seleccion.options:
+                seleccion.set_value(codigo).run()
+
+            # Próctor pide confirmar si la muestra ya tiene un ensayo
+            nuevo = _por_etiqueta(at.main.button, "Nuevo Ensayo")
+            if nuevo is not None:
+                nuevo.click().run()
+
+            for campo in at.main.number_input:
+                valor = _valor_formulario(campo.label)
+                if valor is not None:
+                    campo.set_value(valor)
+
+            enviar = _por_etiqueta(at.main.button, "Calcular y Guardar") or _por_etiqueta(at.main.button, "Guardar Ensayo")
+            enviar.click()
+            at.run()
+
+            # Algunas páginas muestran los resultados y piden confirmación
+            confirmar = _por_etiqueta(at.main.button, "Confirmar y Guardar Resultados")
+            if confirmar is not None:
+                confirmar.click().run()
+        return self.accion(f"guardar:{pagina}", paso)
+
+    def comparar(self, num_muestras):
+        def paso(at):
+            seleccion = _por_etiqueta(at.multiselect, "Seleccionar Muestras")
+            opciones = list(seleccion.options)
+            seleccion.set_value(self.rng.sample(opciones, min(num_muestras, len(opciones)))).run()
+        return self.accion("comparar", paso)
+
+
+def sesion_operario(indice, iteraciones, semilla):
+    """
+    Operario: inicia sesión, registra una muestra y guarda ensayos en páginas al azar
+    """
+    sesion = Sesion(f"operario{indice}", semilla + indice)
+    if sesion.login(f"operario{indice}"):
+        for iteracion in range(iteraciones):
+            codigo = f"CARGA-{indice:02d}-{iteracion:04d}"
+            sesion.navegar("Registro de Muestras")
+            sesion.registrar_muestra(codigo)
+
+            pagina = sesion.rng.choice(PAGINAS_ENSAYO)
+            if sesion.navegar(pagina):
+                sesion.guardar_ensayo(pagina, codigo)
+    return sesion.medidas
+
+
+def sesion_ingeniero(indice, iteraciones, semilla):
+    """
+    Ingeniero: inicia sesión y compara muestras en Consulta de Resultados
+    """
+    sesion = Sesion(f"ingeniero{indice}", semilla + 1000 + indice)
+    if sesion.login(f"ingeniero{indice}"):
+        sesion.navegar("Consulta de Resultados")
+        for _ in range(iteraciones):
+            sesion.comparar(sesion.rng.randint(2, 8))
+    return sesion.medidas
+
+
+def _ejecutar_sesion(argumentos):
+    tipo, indice, iteraciones, semilla = argumentos
+    funcion = sesion_operario if tipo == "operario" else sesion_ingeniero
+    return funcion(indice, iteraciones, semilla)
+
+
+def preparar_base_datos(directorio, muestras, semilla, operarios, ingenieros):
+    """
+    Genera la base de datos temporal y los usuarios de las sesiones
+
+    Returns:
+        str: Ruta de la base de datos
+    """
+    ruta = os.path.join(directorio, "carga.db")
+    os.environ["GARNOCEX_DB_PATH"] = ruta
+    os.environ["GARNOCEX_LOG_CONSULTAS_LENTAS"] = os.path.join(directorio, "consultas_lentas.log")
+    if RAIZ_PROYECTO not in sys.path:
+        sys.path.insert(0, RAIZ_PROYECTO)
+
+    from generador import generar_archivo
+    generar_archivo(ruta, muestras, semilla, prob_imagen=0.05, bytes_imagen=20000)
+
+    import models.db
+    models.db.DB_PATH = ruta
+    from models.usuarios_db import crear_usuario
+
+    for i in range(operarios):
+        crear_usuario(f"Operario {i}", f"operario{i}", PASSWORD)
+    for i in range(ingenieros):
+        crear_usuario(f"Ingeniero {i}", f"ingeniero{i}", PASSWORD)
+
+    return ruta
+
+
+def _percentil(valores, p):
+    valores = sorted(valores)
+    if not valores:
+        return None
+    indice = min(len(valores) - 1, max(0, int(round(p / 100 * len(valores) + 0.5)) - 1))
+    return valores[indice]
+
+
+def resumir(medidas, duracion):
+    """
+    Resume las medidas por acción
+
+    Args:
+        medidas (list): Medidas de todas las sesiones
+        duracion (float): Duración total de la prueba en segundos
+
+    Returns:
+        dict: Latencias, errores y rendimiento por acción y en total
+    """
+    acciones = {}
+    for medida in medidas:
+        acciones.setdefault(medida["accion"], []).append(medida)
+
+    resumen = {}
+    for accion, lista in sorted(acciones.items()):
+        tiempos = [m["segundos"] for m in lista]
+        errores = [m for m in lista if m["resultado"] == "error"]
+        resumen[accion] = {
+            "n": len(lista),
+            "p50": _percentil(tiempos, 50),
+            "p95": _percentil(tiempos, 95),
+            "p99": _percentil(tiempos, 99),
+            "bloqueos": sum(1 for m in lista if m["resultado"] == "bloqueo"),
+            "errores": len(errores),
+            "ejemplo_error": errores[0]["mensaje"] if errores else None,
+        }
+
+    return {
+        "duracion": duracion,
+        "acciones_por_segundo": len(medidas) / duracion if duracion else None,
+        "bloqueos": sum(r["bloqueos"] for r in resumen.values()),
+        "errores": sum(r["errores"] for r in resumen.values()),
+        "acciones": resumen,
+    }
+
+
+def ejecutar_carga(operarios=4, ingenieros=2, iteraciones=10, muestras=2000, semilla=0):
+    """
+    Ejecuta la prueba de carga completa
+
+    Returns:
+        dict: Registro con la configuración y el resumen de resultados
+    """
+    directorio = tempfile.mkdtemp(prefix="benchmark_carga_")
+    try:
+        preparar_base_datos(directorio, muestras, semilla, operarios, ingenieros)
+
+        trabajos = [("operario", i, iteraciones, semilla) for i in range(operarios)]
+        trabajos += [("ingeniero", i, iteraciones, semilla) for i in range(ingenieros)]
+
+        # Un proceso por sesión; heredan GARNOCEX_DB_PATH del entorno
+        contexto = multiprocessing.get_context("spawn")
+        inicio = time.perf_counter()
+        with contexto.Pool(len(trabajos)) as pool:
+            resultados = pool.map(_ejecutar_sesion, trabajos)
+        duracion = time.perf_counter() - inicio
+    finally:
+        shutil.rmtree(directorio, ignore_errors=True)
+
+    medidas = [m for lista in resultados for m in lista]
+    return {
+        "fecha": datetime.now().isoformat(timespec="seconds"),
+        "commit": commit_actual(),
+        "python": platform.python_version(),
+        "operarios": operarios,
+        "ingenieros": ingenieros,
+        "iteraciones": iteraciones,
+        "muestras": muestras,
+        **resumir(medidas, duracion),
+    }
+
+
+def imprimir_informe(registro):
+    print(f"Prueba de carga ({registro['commit']}): {registro['operarios']} operarios, "
+          f"{registro['ingenieros']} ingenieros, {registro['iteraciones']} iteraciones, "
+          f"{registro['muestras']} muestras")
+    print(f"\n  {'acción':<40}{'n':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'bloqueos':>10}{'errores':>9}")
+    for accion, r in registro["acciones"].items():
+        print(f"  {accion:<40}{r['n']:>6}{r['p50'] * 1000:>10.0f}{r['p95'] * 1000:>10.0f}"
+              f"{r['p99'] * 1000:>10.0f}{r['bloqueos']:>10}{r['errores']:>9}")
+    print(f"\n  Duración: {registro['duracion']:.1f} s, {registro['acciones_por_segundo']:.2f} acciones/s, "
+          f"{registro['bloqueos']} bloqueos, {registro['errores']} errores")
+
+    for accion, r in registro["acciones"].items():
+        if r["ejemplo_error"]:
+            print(f"  {accion}: {r['ejemplo_error']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga con sesiones simultáneas")
+    parser.add_argument("--operarios", type=int, default=4, help="Sesiones que guardan ensayos")
+    parser.add_argument("--ingenieros", type=int, default=2, help="Sesiones que consultan resultados")
+    parser.add_argument("--iteraciones", type=int, default=10, help="Iteraciones por sesión")
+    parser.add_argument("--muestras", type=int, default=2000, help="Tamaño del archivo sintético inicial")
+    parser.add_argument("--semilla", type=int, default=0, help="Semilla del archivo y de las sesiones")
+    parser.add_argument("--salida", default=RUTA_RESULTADOS, help="Fichero JSON lines de resultados")
+    parser.add_argument("--no-guardar", action="store_true", help="No añadir el resultado al fichero")
+    args = parser.parse_args()
+
+    registro = ejecutar_carga(args.operarios, args.ingenieros, args.iteraciones, args.muestras, args.semilla)
+    imprimir_informe(registro)
+
+    if not args.no_guardar:
+        guardar_resultado(registro, args.salida)
+
+
+if __name__ == "__main__":
+    main()
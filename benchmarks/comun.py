@@ -0,0 +1,29 @@
+"""
+Utilidades compartidas por los scripts de benchmark
+"""
+import json
+import os
+import subprocess
+
+RAIZ_PROYECTO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DIRECTORIO_RESULTADOS = os.path.join(RAIZ_PROYECTO, "benchmarks", "resultados")
+
+
+def commit_actual():
+    """
+    Devuelve el commit actual abreviado o None si no se puede obtener
+    """
+    proceso = subprocess.run(
+        ["git", "rev-parse", "--short", "HEAD"],
+        cwd=RAIZ_PROYECTO, capture_output=True, text=True
+    )
+    return proceso.stdout.strip() or None
+
+
+def guardar_resultado(registro, ruta):
+    """
+    Añade un registro a un fichero JSON lines
+    """
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    with open(ruta, "a", encoding="utf-8") as f:
+        f.write(json.dumps(registro, ensure_ascii=False) + "\n")
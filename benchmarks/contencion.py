@@ -0,0 +1,247 @@
+"""
+Prueba de estrés de escrituras concurrentes
+
+Lanza varios procesos con varios hilos cada uno que escriben a la vez en la
+misma base de datos temporal a través de las funciones de models/: registran
+muestras, guardan ensayos de límites y CBR, adjuntan imágenes y actualizan
+estados. Al terminar comprueba que todas las escrituras confirmadas están en la
+base de datos y que ninguna ha fallado; el script termina con código 1 si se ha
+perdido alguna escritura o ha aparecido algún error.
+
+Informa de las escrituras por segundo, los reintentos por bloqueo y la latencia
+de cada operación. Con --sin-reintentos se desactiva el reintento de las
+escrituras para ver el comportamiento que tendría la aplicación sin él, y con
+--escritor-unico cada proceso confirma sus escrituras en grupos desde un único
+hilo escritor (GARNOCEX_ESCRITOR_UNICO=1).
+
+Uso:
+    python benchmarks/contencion.py --procesos 4 --hilos 8 --operaciones 50
+"""
+import argparse
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from datetime import date
+
+from comun import RAIZ_PROYECTO
+
+# Datos comunes de los ensayos escritos
+FECHA = date(2025, 1, 1)
+OPERARIO = "contencion"
+
+
+def _percentil(valores, p):
+    valores = sorted(valores)
+    if not valores:
+        return 0.0
+    return valores[min(len(valores) - 1, int(p / 100 * len(valores)))]
+
+
+def _escritor(proceso, hilo, operaciones, resultados):
+    """
+    Hilo escritor: cada iteración registra una muestra y escribe sobre ella
+
+    Args:
+        proceso (int): Índice del proceso
+        hilo (int): Índice del hilo dentro del proceso
+        operaciones (int): Iteraciones del hilo
+        resultados (dict): Diccionario compartido del proceso donde se anotan
+            escrituras confirmadas, errores y latencias
+    """
+    from PIL import Image
+    from models.muestras import guardar_muestra, guardar_imagen, actualizar_estado_muestra
+    from models.limites import guardar_ensayo_limites
+    from models.cbr import guardar_ensayo_cbr
+
+    imagen = Image.new("RGB", (32, 32), (proceso * 40 % 255, hilo * 20 % 255, 128))
+
+    for i in range(operaciones):
+        codigo = f"CONT-{proceso:02d}-{hilo:02d}-{i:05d}"
+        pasos = [
+            ("muestra", lambda: guardar_muestra(codigo, OPERARIO, FECHA, "Suelo", None) and codigo),
+            ("limites", lambda: guardar_ensayo_limites(codigo, FECHA, OPERARIO, 40.0, 20.0, 20.0)),
+            ("cbr", lambda: guardar_ensayo_cbr(codigo, FECHA, OPERARIO, 2.7, 1.9, 10.0, 12.0,
+                                               0.5, 25.0, 2.0, 4, 4.5)),
+            ("imagen", lambda: guardar_imagen(codigo, imagen, "contencion.png")),
+            ("estado", lambda: actualizar_estado_muestra(codigo, "revisado") and codigo),
+        ]
+
+        for nombre, paso in pasos:
+            inicio = time.perf_counter()
+            try:
+                valor = paso()
+                resultados["confirmadas"].append((nombre, valor))
+            except Exception as e:
+                resultados["errores"].append(f"{nombre} {codigo}: {type(e).__name__}: {e}")
+                # Sin la muestra el resto de pasos de la iteración no tiene sentido
+                if nombre == "muestra":
+                    break
+            finally:
+                resultados["latencias"].setdefault(nombre, []).append(time.perf_counter() - inicio)
+
+
+def _ejecutar_proceso(argumentos):
+    """
+    Proceso escritor: lanza sus hilos y devuelve lo que han escrito
+    """
+    proceso, hilos, operaciones = argumentos
+    sys.path.insert(0, RAIZ_PROYECTO)
+    from models.metricas import valor_contador
+    from models.db import ESCRITOR_ACTIVO
+
+    resultados = {"confirmadas": [], "errores": [], "latencias": {}}
+    trabajadores = [
+        threading.Thread(target=_escritor, args=(proceso, hilo, operaciones, resultados))
+        for hilo in range(hilos)
+    ]
+    for trabajador in trabajadores:
+        trabajador.start()
+    for trabajador in trabajadores:
+        trabajador.join()
+
+    if ESCRITOR_ACTIVO:
+        from models.escritor import detener_escritor
+        detener_escritor()
+
+    resultados["reintentos"] = valor_contador("reintentos_bloqueo_total")
+    resultados["grupos"] = valor_contador("escritor_grupos_total")
+    return resultados
+
+
+def verificar(ruta, confirmadas):
+    """
+    Comprueba que todas las escrituras confirmadas están en la base de datos
+
+    Args:
+        ruta (str): Ruta de la base de datos
+        confirmadas (list): Tuplas (operación, valor devuelto) de todas las escrituras
+
+    Returns:
+        list: Descripción de cada escritura perdida o incoherente
+    """
+    conn = sqlite3.connect(ruta)
+    problemas = []
+
+    comprobaciones = {
+        "muestra": "SELECT 1 FROM muestras WHERE codigo_muestra = ?",
+        "limites": "SELECT 1 FROM ensayos e JOIN ensayos_limites l ON l.ensayo_id = e.id WHERE e.id = ?",
+        "cbr": "SELECT 1 FROM ensayos e JOIN ensayos_cbr c ON c.ensayo_id = e.id WHERE e.id = ?",
+        "imagen": "SELECT 1 FROM imagenes WHERE id = ?",
+        "estado": "SELECT 1 FROM muestras WHERE codigo_muestra = ? AND estado = 'revisado'",
+    }
+    for nombre, valor in confirmadas:
+        if conn.execute(comprobaciones[nombre], (valor,)).fetchone() is None:
+            problemas.append(f"{nombre} {valor} no está en la base de datos")
+
+    # Ningún identificador devuelto puede repetirse
+    for nombre in ("limites", "cbr", "imagen"):
+        valores = [valor for operacion, valor in confirmadas if operacion == nombre]
+        if len(valores) != len(set(valores)):
+            problemas.append(f"{nombre}: identificadores repetidos")
+
+    # Y no puede haber ensayos sin su tabla específica (transacciones a medias)
+    huerfanos = conn.execute("""
+    SELECT COUNT(*) FROM ensayos e
+    WHERE NOT EXISTS (SELECT 1 FROM ensayos_limites l WHERE l.ensayo_id = e.id)
+      AND NOT EXISTS (SELECT 1 FROM ensayos_cbr c WHERE c.ensayo_id = e.id)
+    """).fetchone()[0]
+    if huerfanos:
+        problemas.append(f"{huerfanos} ensayos sin datos específicos")
+
+    conn.close()
+    return problemas
+
+
+def ejecutar_prueba(procesos=4, hilos=8, operaciones=50, sin_reintentos=False, escritor_unico=False):
+    """
+    Ejecuta la prueba de estrés completa
+
+    Returns:
+        dict: Escrituras, errores, problemas de verificación, reintentos, rendimiento y latencias
+    """
+    directorio = tempfile.mkdtemp(prefix="benchmark_contencion_")
+    try:
+        ruta = os.path.join(directorio, "contencion.db")
+        os.environ["GARNOCEX_DB_PATH"] = ruta
+        os.environ["GARNOCEX_LOG_CONSULTAS_LENTAS"] = os.path.join(directorio, "consultas_lentas.log")
+        if sin_reintentos:
+            os.environ["GARNOCEX_REINTENTOS_ESCRITURA"] = "0"
+        if escritor_unico:
+            os.environ["GARNOCEX_ESCRITOR_UNICO"] = "1"
+
+        if RAIZ_PROYECTO not in sys.path:
+            sys.path.insert(0, RAIZ_PROYECTO)
+        import models.db
+        models.db.DB_PATH = ruta
+        models.db.inicializar_bd()
+
+        # Los procesos hijos heredan las variables de entorno
+        contexto = multiprocessing.get_context("spawn")
+        inicio = time.perf_counter()
+        with contexto.Pool(procesos) as pool:
+            por_proceso = pool.map(_ejecutar_proceso, [(p, hilos, operaciones) for p in range(procesos)])
+        duracion = time.perf_counter() - inicio
+
+        confirmadas = [c for r in por_proceso for c in r["confirmadas"]]
+        latencias = {}
+        for r in por_proceso:
+            for nombre, valores in r["latencias"].items():
+                latencias.setdefault(nombre, []).extend(valores)
+
+        return {
+            "escrituras": len(confirmadas),
+            "esperadas": procesos * hilos * operaciones * 5,
+            "errores": [e for r in por_proceso for e in r["errores"]],
+            "problemas": verificar(ruta, confirmadas),
+            "reintentos": sum(r["reintentos"] for r in por_proceso),
+            "grupos": sum(r["grupos"] for r in por_proceso),
+            "duracion": duracion,
+            "latencias": {
+                nombre: {"p50": _percentil(v, 50), "p95": _percentil(v, 95), "max": max(v)}
+                for nombre, v in latencias.items()
+            },
+        }
+    finally:
+        shutil.rmtree(directorio, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de estrés de escrituras concurrentes")
+    parser.add_argument("--procesos", type=int, default=4, help="Procesos escritores")
+    parser.add_argument("--hilos", type=int, default=8, help="Hilos por proceso")
+    parser.add_argument("--operaciones", type=int, default=50, help="Muestras escritas por hilo")
+    parser.add_argument("--sin-reintentos", action="store_true", help="Desactivar el reintento de escrituras")
+    parser.add_argument("--escritor-unico", action="store_true", help="Confirmar las escrituras en grupos desde un hilo")
+    args = parser.parse_args()
+
+    resultado = ejecutar_prueba(args.procesos, args.hilos, args.operaciones, args.sin_reintentos,
+                                args.escritor_unico)
+
+    print(f"Contención: {args.procesos} procesos x {args.hilos} hilos x {args.operaciones} muestras")
+    print(f"\n  {'operación':<12}{'p50 ms':>10}{'p95 ms':>10}{'máx ms':>10}")
+    for nombre, l in resultado["latencias"].items():
+        print(f"  {nombre:<12}{l['p50'] * 1000:>10.1f}{l['p95'] * 1000:>10.1f}{l['max'] * 1000:>10.1f}")
+    print(f"\n  Escrituras confirmadas: {resultado['escrituras']} de {resultado['esperadas']} "
+          f"({resultado['escrituras'] / resultado['duracion']:.0f}/s), "
+          f"reintentos por bloqueo: {resultado['reintentos']:.0f}")
+    if resultado["grupos"]:
+        print(f"  Transacciones del escritor único: {resultado['grupos']:.0f} "
+              f"({resultado['escrituras'] / resultado['grupos']:.1f} escrituras por transacción)")
+
+    fallos = resultado["errores"] + resultado["problemas"]
+    if fallos:
+        print(f"\n  {len(resultado['errores'])} errores y {len(resultado['problemas'])} problemas de verificación:")
+        for fallo in fallos[:20]:
+            print(f"    {fallo}")
+        sys.exit(1)
+
+    print("  Sin errores ni escrituras perdidas")
+
+
+if __name__ == "__main__":
+    main()
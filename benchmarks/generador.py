@@ -0,0 +1,460 @@
+"""
+Generador determinista de archivos sintéticos de ensayos
+
+Crea una base de datos con la estructura de models/db.py y la llena con
+muestras y ensayos verosímiles: curvas granulométricas log-normales sobre la
+serie de tamices estándar, pares LL/IP alrededor de la línea A, parábolas
+Próctor, valores CBR, densidades de campo, y otros ensayos e imágenes PNG del
+tamaño indicado. La misma semilla y los mismos parámetros producen siempre el
+mismo archivo.
+
+Uso:
+    python benchmarks/generador.py --muestras 10000 --salida /tmp/archivo_10k.db
+    python benchmarks/generador.py --muestras 1000000 --semilla 7 --salida /tmp/archivo_1m.db
+"""
+import argparse
+import io
+import math
+import os
+import sqlite3
+import sys
+import time
+from datetime import date, timedelta
+
+import numpy as np
+
+RAIZ_PROYECTO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if RAIZ_PROYECTO not in sys.path:
+    sys.path.insert(0, RAIZ_PROYECTO)
+
+from models.db import inicializar_tablas
+from utils.tamices import get_tamices_estandar
+
+OPERARIOS = [
+    "Jesús Torrecilla", "Ana Martín", "Luis García", "Marta López",
+    "Carlos Ruiz", "Elena Sánchez", "Pablo Díaz", "Lucía Romero",
+]
+
+TIPOS_MATERIAL = ["Suelo", "Roca", "Otro"]
+PROBABILIDAD_TIPOS = [0.8, 0.15, 0.05]
+
+FECHA_INICIAL = date(2020, 1, 1)
+DIAS_ARCHIVO = 5 * 365
+
+# Probabilidad de que una muestra tenga cada tipo de ensayo
+PROBABILIDAD_ENSAYOS = {
+    "Granulométrico": 0.9,
+    "Límites de Atterberg": 0.6,
+    "Próctor": 0.4,
+    "CBR": 0.3,
+    "Picnómetro de Arena": 0.5,
+    "Densidad de Árido Grueso": 0.2,
+    "Índice de Lajas y Agujas": 0.2,
+    "Equivalente de Arena": 0.3,
+}
+
+# Estado que queda en la muestra tras su último ensayo (como actualizar_estado_muestra)
+ESTADO_TRAS_ENSAYO = {
+    "Granulométrico": "con ensayo granulométrico",
+    "Límites de Atterberg": "con ensayo de límites",
+    "Próctor": "con ensayo Próctor",
+    "CBR": "con ensayo CBR",
+    "Picnómetro de Arena": "con ensayo de picnómetro de arena",
+    "Densidad de Árido Grueso": "con ensayo de densidad de árido",
+    "Índice de Lajas y Agujas": "con ensayo de lajas y agujas",
+    "Equivalente de Arena": "con ensayo de equivalente de arena",
+}
+
+PUNTOS_PROCTOR = 5
+TAMANO_LOTE = 10000
+
+# Columnas que rellena el generador en cada tabla, en el orden de sus filas. Se
+# nombran en el INSERT para que las columnas que añadan las migraciones tomen su
+# valor por defecto.
+COLUMNAS = {
+    "muestras": ("codigo_muestra", "operario", "fecha", "tipo_material", "estado", "notas", "version"),
+    "ensayos": ("id", "codigo_muestra", "tipo_ensayo", "fecha_ensayo", "operario", "notas", "uid", "version"),
+    "ensayos_granulometricos": ("ensayo_id", "masa_total", "d10", "d30", "d60",
+                                "coef_uniformidad", "coef_curvatura"),
+    "curvas_granulometricas": ("ensayo_id", "serie_tamices", "masas_retenidas"),
+    "ensayos_limites": ("ensayo_id", "limite_liquido", "limite_plastico", "indice_plasticidad"),
+    "ensayos_proctor": ("ensayo_id", "tipo_proctor", "densidad_maxima", "humedad_optima",
+                        "energia_compactacion", "numero_capas", "golpes_capa"),
+    "puntos_proctor": ("id", "ensayo_id", "humedad", "densidad_seca", "numero_punto"),
+    "ensayos_cbr": ("ensayo_id", "energia_compactacion", "densidad_seca", "humedad_inicial",
+                    "humedad_final", "hinchamiento", "indice_cbr", "absorcion_agua",
+                    "dias_inmersion", "sobrecarga"),
+    "ensayos_picnometro": ("ensayo_id", "densidad_aparente", "volumen_hoyo", "masa_arena_empleada",
+                           "masa_arena_cono", "densidad_arena", "humedad"),
+    "ensayos_densidad_arido": ("ensayo_id", "densidad_aparente", "densidad_tras_secado", "densidad_sss",
+                               "absorcion_agua", "masa_sumergida", "masa_sss", "masa_seca"),
+    "ensayos_lajas_agujas": ("ensayo_id", "indice_lajas", "indice_agujas", "masa_total",
+                             "masa_lajas", "masa_agujas"),
+    "ensayos_equivalente_arena": ("ensayo_id", "altura_sedimento", "altura_floculos",
+                                  "equivalente_arena", "temperatura"),
+    "imagenes": ("id", "codigo_muestra", "ensayo_id", "imagen", "nombre_archivo",
+                 "fecha_subida", "descripcion", "uid"),
+}
+
+# Versión de sincronización de las filas generadas (models/sincronizacion.py).
+# Los disparadores la derivarían de la hora y del nodo; fija, el archivo solo
+# depende de la semilla. Es anterior a cualquier modificación real.
+VERSION_GENERADA = "0000000000000:generador"
+
+
+def _fechas(dias):
+    return [(FECHA_INICIAL + timedelta(days=int(d))).isoformat() for d in dias]
+
+
+def _cdf_normal(z):
+    # Función de distribución normal estándar vectorizada
+    return 0.5 * (1 + np.vectorize(math.erf)(z / math.sqrt(2)))
+
+
+def curvas_granulometricas(rng, n, aperturas):
+    """
+    Genera curvas granulométricas log-normales
+
+    Args:
+        rng (numpy.random.Generator): Generador aleatorio
+        n (int): Número de curvas
+        aperturas (numpy.ndarray): Aperturas de los tamices en mm (0 para el fondo)
+
+    Returns:
+        tuple: (masa_total, masas_retenidas, porcentaje_pasa) con una fila por curva
+    """
+    d50 = np.exp(rng.uniform(np.log(0.02), np.log(20.0), n))
+    sigma = rng.uniform(0.6, 2.5, n)
+
+    con_abertura = aperturas > 0
+    pasa = np.zeros((n, len(aperturas)))
+    z = (np.log(aperturas[con_abertura])[None, :] - np.log(d50)[:, None]) / sigma[:, None]
+    pasa[:, con_abertura] = 100 * _cdf_normal(z)
+
+    masa_total = np.round(rng.uniform(500, 5000, n), 1)
+    # Masa retenida en cada tamiz: lo que pasa por el anterior menos lo que pasa por este
+    pasa_anterior = np.hstack([np.full((n, 1), 100.0), pasa[:, :-1]])
+    masas = np.round((pasa_anterior - pasa) / 100 * masa_total[:, None], 2)
+    # El fondo recoge el resto para que las masas sumen la masa total
+    masas[:, -1] = np.round(masa_total - masas[:, :-1].sum(axis=1), 2)
+
+    # Recalcular los porcentajes a partir de las masas, como procesar_datos_tamices
+    acumulado = np.cumsum(masas, axis=1) / masa_total[:, None] * 100
+    return masa_total, masas, np.clip(100 - acumulado, 0, 100)
+
+
+def diametros_caracteristicos(aperturas, porcentaje_pasa):
+    """
+    Calcula D10, D30 y D60 interpolando linealmente cada curva
+
+    Args:
+        aperturas (numpy.ndarray): Aperturas de los tamices en mm
+        porcentaje_pasa (numpy.ndarray): Porcentaje que pasa, una fila por curva
+
+    Returns:
+        numpy.ndarray: Matriz (n, 3) con D10, D30 y D60 (0 si no se alcanzan)
+    """
+    con_abertura = aperturas > 0
+    x = aperturas[con_abertura][::-1]
+    resultados = np.zeros((len(porcentaje_pasa), 3))
+
+    for i, y in enumerate(porcentaje_pasa[:, con_abertura][:, ::-1]):
+        for j, objetivo in enumerate((10, 30, 60)):
+            if y[0] <= objetivo <= y[-1]:
+                resultados[i, j] = np.interp(objetivo, y, x)
+
+    return resultados
+
+
+def imagenes_png(rng, num_imagenes, bytes_imagen):
+    """
+    Genera un conjunto de imágenes PNG de ruido de aproximadamente el tamaño indicado
+
+    Args:
+        rng (numpy.random.Generator): Generador aleatorio
+        num_imagenes (int): Número de imágenes distintas
+        bytes_imagen (int): Tamaño aproximado de cada imagen en bytes
+
+    Returns:
+        list: Imágenes codificadas en PNG
+    """
+    from PIL import Image
+
+    # El ruido RGB apenas se comprime: unos 3 bytes por píxel
+    lado = max(8, int(math.sqrt(bytes_imagen / 3)))
+    imagenes = []
+    for _ in range(num_imagenes):
+        pixeles = rng.integers(0, 256, (lado, lado, 3), dtype=np.uint8)
+        buffer = io.BytesIO()
+        Image.fromarray(pixeles, "RGB").save(buffer, format="PNG")
+        imagenes.append(buffer.getvalue())
+    return imagenes
+
+
+class _Lote:
+    """
+    Filas pendientes de insertar para un lote de muestras
+    """
+
+    def __init__(self):
+        self.tablas = {}
+
+    def agregar(self, tabla, filas):
+        self.tablas.setdefault(tabla, []).extend(filas)
+
+    def insertar(self, conn):
+        for tabla, filas in self.tablas.items():
+            if filas:
+                columnas = COLUMNAS[tabla]
+                marcadores = ", ".join("?" * len(columnas))
+                conn.executemany(f"INSERT INTO {tabla} ({', '.join(columnas)}) VALUES ({marcadores})", filas)
+
+
+def generar_archivo(ruta, num_muestras, semilla=0, prob_imagen=0.2, bytes_imagen=50000,
+                    progreso=None):
+    """
+    Genera un archivo sintético de muestras y ensayos
+
+    Args:
+        ruta (str): Ruta de la base de datos a crear (se sobrescribe si existe)
+        num_muestras (int): Número de muestras
+        semilla (int): Semilla del generador aleatorio
+        prob_imagen (float): Probabilidad de que una muestra tenga una imagen
+        bytes_imagen (int): Tamaño aproximado de cada imagen en bytes
+        progreso (callable, optional): Función llamada con el número de muestras generadas
+
+    Returns:
+        dict: Número de filas generadas por tabla
+    """
+    if os.path.exists(ruta):
+        os.remove(ruta)
+
+    rng = np.random.default_rng(semilla)
+    tamices = get_tamices_estandar()
+    aperturas = np.array([t["apertura"] for t in tamices])
+    imagenes = imagenes_png(rng, 16, bytes_imagen) if prob_imagen > 0 else []
+
+    conn = sqlite3.connect(ruta)
+    inicializar_tablas(conn)
+    # Solo para la generación: el fichero se descarta si el proceso se interrumpe
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+
+    # Las filas generadas no son cambios de datos: se insertan sin los
+    # disparadores de cambios y de sincronización, que se vuelven a crear al final
+    disparadores = conn.execute("SELECT name, sql FROM sqlite_master WHERE type = 'trigger'").fetchall()
+    for nombre, _ in disparadores:
+        conn.execute(f"DROP TRIGGER {nombre}")
+
+    siguiente_ensayo = 1
+    siguiente_punto = 1
+    siguiente_imagen = 1
+
+    try:
+        for inicio in range(0, num_muestras, TAMANO_LOTE):
+            n = min(TAMANO_LOTE, num_muestras - inicio)
+            lote = _Lote()
+
+            codigos = [f"M{i:07d}" for i in range(inicio + 1, inicio + n + 1)]
+            dias_muestra = rng.integers(0, DIAS_ARCHIVO, n)
+            operarios = rng.choice(OPERARIOS, n)
+            tipos = rng.choice(TIPOS_MATERIAL, n, p=PROBABILIDAD_TIPOS)
+            estados = np.full(n, "registrado", dtype=object)
+
+            # Ensayos de cada tipo: muestras, fechas (posteriores a la muestra) y operarios
+            ensayos = {}
+            for tipo, probabilidad in PROBABILIDAD_ENSAYOS.items():
+                indices = np.flatnonzero(rng.random(n) < probabilidad)
+                ids = np.arange(siguiente_ensayo, siguiente_ensayo + len(indices))
+                siguiente_ensayo += len(indices)
+                dias = dias_muestra[indices] + rng.integers(0, 60, len(indices))
+                ensayos[tipo] = (indices, ids)
+                lote.agregar("ensayos", zip(
+                    ids.tolist(), [codigos[i] for i in indices], [tipo] * len(indices),
+                    _fechas(dias), operarios[indices].tolist(), [None] * len(indices),
+                    [f"generado-{semilla}-{ensayo_id}" for ensayo_id in ids.tolist()],
+                    [VERSION_GENERADA] * len(indices)
+                ))
+                estados[indices] = ESTADO_TRAS_ENSAYO[tipo]
+
+            lote.agregar("muestras", zip(
+                codigos, operarios.tolist(), _fechas(dias_muestra), tipos.tolist(),
+                estados.tolist(), [None] * n, [VERSION_GENERADA] * n
+            ))
+
+            # Granulometría
+            indices, ids = ensayos["Granulométrico"]
+            if len(ids):
+                masa_total, masas, pasa = curvas_granulometricas(rng, len(ids), aperturas)
+                diametros = diametros_caracteristicos(aperturas, pasa)
+                d10, d30, d60 = diametros.T
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    cu = np.where((d10 > 0) & (d60 > 0), d60 / d10, 0)
+                    cc = np.where((d10 > 0) & (d30 > 0) & (d60 > 0), d30 ** 2 / (d10 * d60), 0)
+                lote.agregar("ensayos_granulometricos", zip(
+                    ids.tolist(), masa_total.tolist(), d10.tolist(), d30.tolist(), d60.tolist(),
+                    cu.tolist(), cc.tolist()
+                ))
+
+                # Una curva por ensayo con las masas empaquetadas (serie ASTM)
+                masas_empaquetadas = masas.astype("<f8")
+                lote.agregar("curvas_granulometricas", (
+                    (ensayo_id, "ASTM", masas_empaquetadas[k].tobytes())
+                    for k, ensayo_id in enumerate(ids.tolist())
+                ))
+
+            # Límites de Atterberg: IP alrededor de la línea A
+            indices, ids = ensayos["Límites de Atterberg"]
+            if len(ids):
+                ll = np.round(rng.uniform(18, 85, len(ids)), 1)
+                ip = np.round(np.clip(0.73 * (ll - 20) + rng.normal(0, 6, len(ids)), 0, ll - 5), 1)
+                lote.agregar("ensayos_limites", zip(ids.tolist(), ll.tolist(), (ll - ip).tolist(), ip.tolist()))
+
+            # Próctor: parábola alrededor de la humedad óptima
+            indices, ids = ensayos["Próctor"]
+            if len(ids):
+                modificado = rng.random(len(ids)) < 0.6
+                humedad_optima = np.round(rng.uniform(6, 22, len(ids)), 2)
+                densidad_maxima = np.round(
+                    2.25 - 0.025 * (humedad_optima - 6) + 0.08 * modificado + rng.normal(0, 0.04, len(ids)), 3
+                )
+                curvatura = rng.uniform(0.002, 0.008, len(ids))
+                lote.agregar("ensayos_proctor", zip(
+                    ids.tolist(), np.where(modificado, "Modificado", "Normal").tolist(),
+                    densidad_maxima.tolist(), humedad_optima.tolist(),
+                    np.where(modificado, 2.71, 0.59).tolist(),
+                    np.where(modificado, 5, 3).tolist(), np.where(modificado, 56, 25).tolist()
+                ))
+
+                filas = []
+                desplazamientos = np.arange(PUNTOS_PROCTOR) - PUNTOS_PROCTOR // 2
+                for k, ensayo_id in enumerate(ids.tolist()):
+                    humedades = humedad_optima[k] + 2 * desplazamientos + rng.normal(0, 0.3, PUNTOS_PROCTOR)
+                    densidades = densidad_maxima[k] - curvatura[k] * (humedades - humedad_optima[k]) ** 2
+                    for numero, (w, d) in enumerate(zip(humedades, densidades), start=1):
+                        filas.append((siguiente_punto, ensayo_id, round(w, 2), round(d, 3), numero))
+                        siguiente_punto += 1
+                lote.agregar("puntos_proctor", filas)
+
+            # CBR: distribución log-normal
+            indices, ids = ensayos["CBR"]
+            if len(ids):
+                m = len(ids)
+                humedad_inicial = np.round(rng.uniform(6, 20, m), 2)
+                lote.agregar("ensayos_cbr", zip(
+                    ids.tolist(), [2.71] * m, np.round(rng.uniform(1.6, 2.3, m), 3).tolist(),
+                    humedad_inicial.tolist(), np.round(humedad_inicial + rng.uniform(0, 5, m), 2).tolist(),
+                    np.round(rng.exponential(0.8, m), 2).tolist(),
+                    np.round(np.exp(rng.normal(np.log(12), 0.9, m)), 1).tolist(),
+                    np.round(rng.uniform(0, 5, m), 2).tolist(), [4] * m, [4.5] * m
+                ))
+
+            # Picnómetro de arena (densidad de campo)
+            indices, ids = ensayos["Picnómetro de Arena"]
+            if len(ids):
+                m = len(ids)
+                densidad_arena = np.round(rng.uniform(1.35, 1.5, m), 3)
+                masa_cono = np.round(rng.uniform(1500, 1700, m), 1)
+                masa_empleada = np.round(masa_cono + rng.uniform(1500, 4000, m), 1)
+                volumen = (masa_empleada - masa_cono) / densidad_arena
+                lote.agregar("ensayos_picnometro", zip(
+                    ids.tolist(), np.round(rng.uniform(1.6, 2.3, m), 3).tolist(), np.round(volumen, 1).tolist(),
+                    masa_empleada.tolist(), masa_cono.tolist(), densidad_arena.tolist(),
+                    np.round(rng.uniform(4, 20, m), 2).tolist()
+                ))
+
+            # Densidad de árido grueso
+            indices, ids = ensayos["Densidad de Árido Grueso"]
+            if len(ids):
+                m = len(ids)
+                masa_seca = np.round(rng.uniform(2000, 5000, m), 1)
+                absorcion = rng.uniform(0.3, 3, m)
+                masa_sss = np.round(masa_seca * (1 + absorcion / 100), 1)
+                masa_sumergida = np.round(masa_seca * (1 - 1 / rng.uniform(2.5, 2.8, m)), 1)
+                lote.agregar("ensayos_densidad_arido", zip(
+                    ids.tolist(), np.round(masa_seca / (masa_seca - masa_sumergida), 3).tolist(),
+                    np.round(masa_seca / (masa_sss - masa_sumergida), 3).tolist(),
+                    np.round(masa_sss / (masa_sss - masa_sumergida), 3).tolist(),
+                    np.round((masa_sss - masa_seca) / masa_seca * 100, 2).tolist(),
+                    masa_sumergida.tolist(), masa_sss.tolist(), masa_seca.tolist()
+                ))
+
+            # Índice de lajas y agujas
+            indices, ids = ensayos["Índice de Lajas y Agujas"]
+            if len(ids):
+                m = len(ids)
+                masa = np.round(rng.uniform(1000, 5000, m), 1)
+                lajas = np.round(masa * rng.beta(2, 10, m), 1)
+                agujas = np.round(masa * rng.beta(2, 12, m), 1)
+                lote.agregar("ensayos_lajas_agujas", zip(
+                    ids.tolist(), (lajas / masa * 100).tolist(), (agujas / masa * 100).tolist(),
+                    masa.tolist(), lajas.tolist(), agujas.tolist()
+                ))
+
+            # Equivalente de arena
+            indices, ids = ensayos["Equivalente de Arena"]
+            if len(ids):
+                m = len(ids)
+                floculos = np.round(rng.uniform(100, 300, m), 1)
+                sedimento = np.round(floculos * rng.uniform(0.2, 0.95, m), 1)
+                lote.agregar("ensayos_equivalente_arena", zip(
+                    ids.tolist(), sedimento.tolist(), floculos.tolist(),
+                    np.round(sedimento / floculos * 100, 1).tolist(), np.round(rng.uniform(18, 26, m), 1).tolist()
+                ))
+
+            # Imágenes de muestra
+            if imagenes:
+                indices = np.flatnonzero(rng.random(n) < prob_imagen)
+                elegidas = rng.integers(0, len(imagenes), len(indices))
+                filas = []
+                for i, k in zip(indices.tolist(), elegidas.tolist()):
+                    filas.append((
+                        siguiente_imagen, codigos[i], None, imagenes[k], f"{codigos[i]}.png",
+                        _fechas([dias_muestra[i]])[0], None, f"generado-{semilla}-{siguiente_imagen}"
+                    ))
+                    siguiente_imagen += 1
+                lote.agregar("imagenes", filas)
+
+            conn.execute("BEGIN")
+            lote.insertar(conn)
+            conn.execute("COMMIT")
+
+            if progreso:
+                progreso(inicio + n)
+
+        for _, sql in disparadores:
+            conn.execute(sql)
+        conn.execute("ANALYZE")
+        tablas = [fila[0] for fila in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"
+        )]
+        return {tabla: conn.execute(f"SELECT COUNT(*) FROM {tabla}").fetchone()[0] for tabla in tablas}
+
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Genera un archivo sintético de ensayos geotécnicos")
+    parser.add_argument("--muestras", type=int, default=10000, help="Número de muestras")
+    parser.add_argument("--semilla", type=int, default=0, help="Semilla del generador")
+    parser.add_argument("--prob-imagen", type=float, default=0.2,
+                        help="Probabilidad de que una muestra tenga imagen")
+    parser.add_argument("--bytes-imagen", type=int, default=50000, help="Tamaño aproximado de cada imagen")
+    parser.add_argument("--salida", required=True, help="Ruta de la base de datos a crear")
+    args = parser.parse_args()
+
+    inicio = time.perf_counter()
+    filas = generar_archivo(
+        args.salida, args.muestras, args.semilla, args.prob_imagen, args.bytes_imagen,
+        progreso=lambda n: print(f"  {n} muestras", file=sys.stderr)
+    )
+
+    print(f"Archivo generado en {time.perf_counter() - inicio:.1f} s: {args.salida} "
+          f"({os.path.getsize(args.salida) / 1e6:.1f} MB)")
+    for tabla, num in filas.items():
+        print(f"  {tabla:<30}{num:>12}")
+
+
+if __name__ == "__main__":
+    main()
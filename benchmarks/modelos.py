@@ -0,0 +1,686 @@
+"""
+Benchmark de las funciones públicas de models/ y utils/
+
+Genera (o reutiliza) un archivo sintético con benchmarks/generador.py, trabaja
+sobre una copia temporal para que las escrituras no lo alteren y mide cada
+función pública con los argumentos definidos en CASOS. Las funciones sin caso
+se listan para que la cobertura del benchmark sea visible.
+
+Los resultados se comparan con una referencia guardada por tamaño de archivo
+(benchmarks/resultados/referencia_modelos_<muestras>.json) y se añaden al
+histórico benchmarks/resultados/modelos.jsonl. El script termina con código 1
+si alguna función supera la tolerancia.
+
+Uso:
+    python benchmarks/modelos.py --muestras 10000 --actualizar-referencia
+    python benchmarks/modelos.py --muestras 10000
+    python benchmarks/modelos.py --archivo /tmp/archivo_1m.db --filtro muestras
+"""
+import argparse
+import importlib
+import inspect
+import json
+import os
+import pkgutil
+import platform
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import date, datetime
+
+from comun import RAIZ_PROYECTO, DIRECTORIO_RESULTADOS, commit_actual, guardar_resultado
+
+PAQUETES = ["models", "utils"]
+
+RUTA_HISTORICO = os.path.join(DIRECTORIO_RESULTADOS, "modelos.jsonl")
+
+# Funciones que no se miden, con el motivo
+OMITIDAS = {
+    "models.db.apartar_estructura_antigua": "solo actúa sobre bases de datos con la estructura antigua",
+    "models.db.migrar_datos_estructura_antigua": "solo actúa sobre bases de datos con la estructura antigua",
+    "models.metricas.iniciar_exportacion": "arranca hilos en segundo plano una sola vez por proceso",
+    "models.escritor.iniciar_escritor": "arranca el hilo escritor",
+    "models.escritor.detener_escritor": "detiene el hilo escritor",
+    "models.escritor.enviar_escritura": "se mide a través de ejecutar_escritura con GARNOCEX_ESCRITOR_UNICO=1",
+    "models.escritor.esperar_escritura": "se mide a través de ejecutar_escritura con GARNOCEX_ESCRITOR_UNICO=1",
+    "models.trabajos.encolar_trabajo": "lanza un trabajo en segundo plano",
+    "models.trabajos.reanudar_trabajos": "lanza los trabajos pendientes en segundo plano",
+    "models.trabajos.iniciar_trabajadores": "arranca los hilos de trabajos",
+    "models.exportacion.main": "punto de entrada de la línea de comandos (se mide exportar_archivo)",
+    "models.db.leer_blob_por_trozos": "generador; se mide a través de copiar_imagenes y exportar_zip",
+    "models.copias.iniciar_copias_programadas": "arranca el hilo del planificador una sola vez por proceso",
+    "models.copias.main": "punto de entrada de la línea de comandos (se mide crear_copia)",
+    "models.trabajos.programar_trabajo": "arranca el hilo del planificador de trabajos",
+    "models.mantenimiento.activar_vaciado_incremental": "reescribe el fichero entero una sola vez (VACUUM)",
+    "models.mantenimiento.iniciar_mantenimiento_programado": "programa un trabajo en segundo plano",
+    "models.mantenimiento.main": "punto de entrada de la línea de comandos (se mide ejecutar_mantenimiento)",
+    "models.cambios.recorrer_cambios": "generador; se mide a través de cambios_netos",
+    "models.sincronizacion.aplicar_paquete": "necesita un paquete de otra base de datos (se mide crear_paquete)",
+    "models.sincronizacion.renovar_nodo": "cambia la identidad de la base de datos y olvida los pares",
+    "models.sincronizacion.main": "punto de entrada de la línea de comandos (se mide crear_paquete)",
+}
+
+
+class Contexto:
+    """
+    Datos del archivo que necesitan los casos: códigos existentes, IDs y
+    generadores de valores nuevos. Todo se deriva de la semilla.
+    """
+
+    def __init__(self, semilla):
+        from PIL import Image
+        from models.db import obtener_conexion
+        from models.usuarios_db import crear_usuario, verificar_credenciales, crear_sesion
+        from utils.tamices import get_tamices_estandar
+        from utils.calculo import procesar_datos_tamices
+
+        self.rng = random.Random(semilla)
+        conn = obtener_conexion()
+        self.codigos = [fila[0] for fila in conn.execute("SELECT codigo_muestra FROM muestras ORDER BY codigo_muestra")]
+        self.ensayos = [tuple(fila) for fila in conn.execute(
+            "SELECT codigo_muestra, id FROM ensayos ORDER BY id LIMIT 10000"
+        )]
+        self.imagenes = [fila[0] for fila in conn.execute("SELECT id FROM imagenes ORDER BY id LIMIT 10000")]
+        conn.close()
+
+        if not self.codigos:
+            raise ValueError("El archivo no contiene muestras")
+
+        # Muestras que se pueden eliminar sin afectar a las que usan el resto de casos
+        self.eliminables = self.rng.sample(self.codigos, min(len(self.codigos) // 10, 1000))
+        self.consultables = sorted(set(self.codigos) - set(self.eliminables))
+
+        self.contador = 0
+        self.password = "benchmark"
+        crear_usuario("Usuario de benchmark", "benchmark", self.password)
+        self.usuario = verificar_credenciales("benchmark", self.password)
+        self.token_sesion = crear_sesion(self.usuario["id"])
+
+        self.imagen = Image.new("RGB", (64, 64), (120, 90, 60))
+        self.tamices = get_tamices_estandar()
+        masas = [0, 50, 40, 80, 70, 120, 90, 180, 220, 150, 100, 60, 40, 30, 20]
+        self.datos_tamices = procesar_datos_tamices(self.tamices, masas, sum(masas))
+        self.puntos_proctor = [
+            {"humedad": w, "densidad_seca": 2.1 - 0.004 * (w - 10) ** 2, "numero_punto": i}
+            for i, w in enumerate((6, 8, 10, 12, 14), start=1)
+        ]
+
+    def codigo(self):
+        return self.rng.choice(self.consultables)
+
+    def eliminable(self):
+        return self.eliminables.pop()
+
+    def nuevo(self, prefijo):
+        self.contador += 1
+        return f"{prefijo}{self.contador:06d}"
+
+    def ensayo(self):
+        # (codigo_muestra, ensayo_id) de un ensayo cuya muestra no se elimina
+        while True:
+            codigo, ensayo_id = self.rng.choice(self.ensayos)
+            if codigo not in self.eliminables:
+                return codigo, ensayo_id
+
+    def imagen_id(self):
+        return self.rng.choice(self.imagenes) if self.imagenes else 1
+
+
+def _dataframe_campo_proctor(n):
+    import numpy as np
+    import pandas as pd
+
+    rng = np.random.default_rng(0)
+    codigos = [f"M{i:07d}" for i in rng.integers(1, max(n // 4, 2), n)]
+    fechas = pd.Timestamp("2021-01-01") + pd.to_timedelta(rng.integers(0, 900, n), unit="D")
+    campo = pd.DataFrame({
+        "ensayo_id": np.arange(n), "codigo_muestra": codigos, "fecha_ensayo": fechas.astype(str),
+        "tipo_material": "Suelo", "densidad_aparente": rng.uniform(1.6, 2.3, n),
+        "humedad_campo": rng.uniform(4, 20, n),
+    })
+    proctor = pd.DataFrame({
+        "ensayo_proctor_id": np.arange(n), "codigo_muestra": codigos[::-1], "fecha_ensayo": fechas.astype(str),
+        "tipo_material": "Suelo", "densidad_maxima": rng.uniform(1.9, 2.3, n),
+        "humedad_optima": rng.uniform(6, 20, n),
+    })
+    return campo, proctor
+
+
+def _dataframe_resultados(n):
+    import numpy as np
+    import pandas as pd
+
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({
+        "indice_cbr": rng.uniform(0, 80, n),
+        "equivalente_arena": rng.uniform(10, 90, n),
+        "densidad_aparente": rng.uniform(1.0, 2.2, n),
+        "tipo_material": rng.choice(["suelo", "arena", "arcilla", "roca"], n),
+    })
+
+
+def _vectores_sucs(n):
+    import numpy as np
+
+    rng = np.random.default_rng(0)
+    return (rng.uniform(0, 100, n), rng.uniform(0, 100, n), rng.uniform(1, 20, n),
+            rng.uniform(0.5, 4, n), rng.uniform(15, 90, n), rng.uniform(0, 50, n))
+
+
+# Caso de cada función: recibe el contexto y devuelve (args, kwargs).
+# La preparación que hace el caso no se incluye en el tiempo medido.
+CASOS = {
+    # models.muestras
+    "models.muestras.guardar_muestra": lambda c: ((c.nuevo("B"), "Benchmark", date(2024, 1, 1), "Suelo", None), {}),
+    "models.muestras.guardar_imagen": lambda c: ((c.codigo(), c.imagen, "benchmark.png"), {}),
+    "models.muestras.guardar_imagen_ensayo": lambda c: (c.ensayo() + (c.imagen, "benchmark.png"), {}),
+    "models.muestras.obtener_imagenes": lambda c: ((c.codigo(),), {}),
+    "models.muestras.obtener_imagen_por_id": lambda c: ((c.imagen_id(),), {}),
+    "models.muestras.obtener_muestras": lambda c: ((), {}),
+    "models.muestras.obtener_muestra": lambda c: ((c.codigo(),), {}),
+    "models.muestras.actualizar_estado_muestra": lambda c: ((c.codigo(), "registrado"), {}),
+    "models.muestras.eliminar_muestra": lambda c: ((c.eliminable(),), {}),
+    "models.muestras.obtener_tipos_materiales": lambda c: ((), {}),
+    "models.muestras.obtener_estados_muestras": lambda c: ((), {}),
+    "models.muestras.obtener_operarios": lambda c: ((), {}),
+    "models.muestras.obtener_estadisticas_muestras": lambda c: ((), {}),
+
+    # models.granulometria
+    "models.granulometria.guardar_ensayo_granulometrico": lambda c: (
+        (c.codigo(), date(2024, 1, 1), "Benchmark", 1000, c.datos_tamices, 0.1, 0.4, 1.2, 12, 1.3), {}),
+    "models.granulometria.obtener_ensayo_granulometrico": lambda c: ((c.codigo(),), {}),
+    "models.granulometria.obtener_todos_ensayos_granulometricos": lambda c: ((), {}),
+    "models.granulometria.calcular_pasa_en_aperturas": lambda c: ((_curvas(), [0.075, 4.75]), {}),
+    "models.series_tamices.obtener_catalogo": lambda c: ((), {}),
+    "models.series_tamices.invalidar_catalogo": lambda c: ((), {}),
+    "models.series_tamices.obtener_serie": lambda c: (("UNE-EN 933-2",), {}),
+    "models.series_tamices.series_disponibles": lambda c: ((), {}),
+    "models.series_tamices.registrar_serie": lambda c: ((_conexion(), [t["nombre"] for t in c.tamices], [t["apertura"] for t in c.tamices]), {}),
+
+    # models.analitica
+    "models.analitica.directorio_espejo": lambda c: ((), {}),
+    "models.analitica.estado_espejo": lambda c: ((), {}),
+    "models.analitica.espejo_desactualizado": lambda c: ((), {}),
+    "models.analitica.actualizar_espejo": lambda c: ((), {}),
+    "models.analitica.consultar": lambda c: (("SELECT count(*) AS ensayos FROM ensayos_muestra",), {}),
+    "models.analitica.ejecutar_informe": lambda c: (("cbr_material_mes",), {}),
+
+    # models.exportacion
+    "models.exportacion.tipo_arrow": lambda c: (("REAL",), {}),
+    "models.exportacion.expresion_columna": lambda c: (
+        ("fecha_ensayo", importlib.import_module("models.exportacion").tipo_arrow("DATE"), "e"), {}),
+    "models.exportacion.directorio_exportacion": lambda c: ((), {}),
+    "models.exportacion.estado_exportacion": lambda c: ((), {}),
+    "models.exportacion.exportar_archivo": lambda c: ((), {}),
+    "models.exportacion.exportar_zip": lambda c: ((c.consultables[:200],), {}),
+    # models.copias
+    "models.copias.directorio_copias": lambda c: ((), {}),
+    "models.copias.crear_copia": lambda c: ((), {}),
+    "models.copias.verificar_copia": lambda c: ((importlib.import_module("models.db").DB_PATH,), {}),
+    "models.copias.listar_copias": lambda c: ((), {}),
+    "models.copias.rotar_copias": lambda c: ((), {}),
+    "models.copias.copiar_imagenes": lambda c: ((), {}),
+    # models.mantenimiento
+    "models.mantenimiento.estado_bd": lambda c: ((), {}),
+    "models.mantenimiento.actualizar_estadisticas": lambda c: ((), {}),
+    "models.mantenimiento.vaciar_incremental": lambda c: ((), {}),
+    "models.mantenimiento.esperar_inactividad": lambda c: ((0.1, 1), {}),
+    "models.mantenimiento.checkpoint_wal": lambda c: ((), {}),
+    "models.mantenimiento.ejecutar_mantenimiento": lambda c: ((), {}),
+    # models.cambios
+    "models.cambios.ultima_secuencia": lambda c: ((), {}),
+    "models.cambios.leer_cambios": lambda c: ((_cursor_cambios(),), {}),
+    "models.cambios.cambios_netos": lambda c: ((_cursor_cambios(),), {}),
+    "models.cambios.obtener_cursor": lambda c: (("benchmark",), {}),
+    "models.cambios.guardar_cursor": lambda c: (("benchmark", 0), {}),
+    "models.cambios.compactar_cambios": lambda c: ((0,), {}),
+    # models.sincronizacion
+    "models.sincronizacion.identificador_nodo": lambda c: ((), {}),
+    "models.sincronizacion.listar_pares": lambda c: ((), {}),
+    "models.sincronizacion.crear_paquete": lambda c: (
+        (os.path.join(tempfile.gettempdir(), "garnocex-benchmark-paquete.zip"),), {}),
+
+    # models.limites
+    "models.limites.guardar_ensayo_limites": lambda c: ((c.codigo(), date(2024, 1, 1), "Benchmark", 40, 22, 18), {}),
+    "models.limites.obtener_ensayo_limites": lambda c: ((c.codigo(),), {}),
+    "models.limites.obtener_todos_ensayos_limites": lambda c: ((), {}),
+    "models.limites.calcular_indice_plasticidad": lambda c: ((40, 22), {}),
+    "models.limites.obtener_clasificacion_sucs": lambda c: ((40, 18), {}),
+
+    # models.densidad_arido
+    "models.densidad_arido.guardar_ensayo_densidad_arido": lambda c: (
+        (c.codigo(), date(2024, 1, 1), "Benchmark", 3000, 3050, 1900, 2.6, 2.65, 2.63, 1.7), {}),
+    "models.densidad_arido.obtener_ensayo_densidad_arido": lambda c: ((c.codigo(),), {}),
+    "models.densidad_arido.obtener_todos_ensayos_densidad_arido": lambda c: ((), {}),
+    "models.densidad_arido.calcular_parametros_densidad": lambda c: ((3000, 3050, 1900), {}),
+
+    # models.cbr
+    "models.cbr.guardar_ensayo_cbr": lambda c: (
+        (c.codigo(), date(2024, 1, 1), "Benchmark", 2.71, 1.9, 10, 12, 0.5, 25, 2, 4, 4.5), {}),
+    "models.cbr.obtener_ensayo_cbr": lambda c: ((c.codigo(),), {}),
+    "models.cbr.obtener_todos_ensayos_cbr": lambda c: ((), {}),
+    "models.cbr.calcular_hinchamiento": lambda c: ((116.4, 117.0), {}),
+    "models.cbr.calcular_absorcion_agua": lambda c: ((4500, 4620), {}),
+    "models.cbr.interpretar_resultado_cbr": lambda c: ((25,), {}),
+
+    # models.agujas
+    "models.agujas.guardar_ensayo_lajas_agujas": lambda c: (
+        (c.codigo(), date(2024, 1, 1), "Benchmark", 2000, 300, 200, 15, 10), {}),
+    "models.agujas.obtener_ensayo_lajas_agujas": lambda c: ((c.codigo(),), {}),
+    "models.agujas.obtener_todos_ensayos_lajas_agujas": lambda c: ((), {}),
+    "models.agujas.calcular_indices_lajas_agujas": lambda c: ((2000, 300, 200), {}),
+    "models.agujas.interpretar_indices": lambda c: ((15, 10), {}),
+
+    # models.picnometro
+    "models.picnometro.guardar_ensayo_picnometro": lambda c: (
+        (c.codigo(), date(2024, 1, 1), "Benchmark", 1.9, 1500, 4000, 1600, 1.45), {"humedad": 10}),
+    "models.picnometro.obtener_ensayo_picnometro": lambda c: ((c.codigo(),), {}),
+    "models.picnometro.obtener_todos_ensayos_picnometro": lambda c: ((), {}),
+    "models.picnometro.calcular_volumen_hoyo": lambda c: ((4000, 1600, 1.45), {}),
+    "models.picnometro.calcular_densidad_aparente": lambda c: ((3100, 1655), {}),
+    "models.picnometro.interpretar_densidad": lambda c: ((1.7, "arena"), {}),
+
+    # models.equivalente_arena
+    "models.equivalente_arena.guardar_ensayo_equivalente_arena": lambda c: (
+        (c.codigo(), date(2024, 1, 1), "Benchmark", 90, 200, 45, 22), {}),
+    "models.equivalente_arena.obtener_ensayo_equivalente_arena": lambda c: ((c.codigo(),), {}),
+    "models.equivalente_arena.obtener_todos_ensayos_equivalente_arena": lambda c: ((), {}),
+    "models.equivalente_arena.calcular_equivalente_arena": lambda c: ((90, 200), {}),
+    "models.equivalente_arena.interpretar_equivalente_arena": lambda c: ((45,), {}),
+
+    # models.proctor
+    "models.proctor.guardar_ensayo_proctor": lambda c: (
+        (c.codigo(), date(2024, 1, 1), "Benchmark", "Modificado", 2.1, 10, 2.71, 5, 56, c.puntos_proctor), {}),
+    "models.proctor.obtener_ensayo_proctor": lambda c: ((c.codigo(),), {}),
+    "models.proctor.obtener_todos_ensayos_proctor": lambda c: ((), {}),
+    "models.proctor.ajustar_curva_proctor": lambda c: ((c.puntos_proctor,), {}),
+    "models.proctor.calcular_energia_compactacion": lambda c: (("Modificado", 4.54, 0.457, 5, 56, 2124), {}),
+    "models.proctor.obtener_parametros_proctor": lambda c: (("Modificado",), {}),
+
+    # models.clasificacion
+    "models.clasificacion.clasificar_sucs_vectorizado": lambda c: (_vectores_sucs(100000), {}),
+    "models.clasificacion.obtener_datos_clasificacion": lambda c: ((), {}),
+    "models.clasificacion.clasificar_muestras": lambda c: ((), {}),
+    "models.clasificacion.actualizar_clasificacion_sucs": lambda c: ((), {}),
+    "models.clasificacion.obtener_clasificacion_muestra": lambda c: ((c.codigo(),), {}),
+    "models.clasificacion.obtener_muestras_por_grupo_sucs": lambda c: (("SM",), {}),
+
+    # models.compactacion
+    "models.compactacion.calcular_control_compactacion": lambda c: (_dataframe_campo_proctor(100000), {}),
+    "models.compactacion.actualizar_control_compactacion": lambda c: ((), {"completo": True}),
+    "models.compactacion.obtener_control_compactacion": lambda c: ((c.codigo(),), {}),
+
+    # models.interpretacion
+    "models.interpretacion.obtener_tabla_umbrales": lambda c: (("cbr",), {}),
+    "models.interpretacion.interpretar_valor": lambda c: ((25, "cbr"), {}),
+    "models.interpretacion.interpretar_valores": lambda c: ((_dataframe_resultados(100000)["indice_cbr"], "cbr"), {}),
+    "models.interpretacion.anotar_resultados": lambda c: (
+        (_dataframe_resultados(100000), {"indice_cbr": "cbr", "equivalente_arena": "equivalente_arena"}), {}),
+    "models.interpretacion.anotar_densidades": lambda c: ((_dataframe_resultados(100000),), {}),
+
+    # models.db
+    "models.db.obtener_conexion": lambda c: ((), {}),
+    "models.db.inicializar_bd": lambda c: ((), {}),
+    "models.db.inicializar_tablas": lambda c: ((_conexion(),), {}),
+    "models.db.sembrar_series_tamices": lambda c: ((_conexion(),), {}),
+    "models.db.migrar_datos_tamices": lambda c: ((_conexion(),), {}),
+    "models.db.migrar_series_personalizadas": lambda c: ((_conexion(),), {}),
+    "models.db.crear_disparadores_cambios": lambda c: ((_conexion(),), {}),
+    "models.db.crear_disparadores_sincronizacion": lambda c: ((_conexion(),), {}),
+    "models.db.migrar_identidades_sincronizacion": lambda c: ((_conexion(),), {}),
+    "models.db.empaquetar_valores": lambda c: (([m["masa_retenida"] for m in c.datos_tamices],), {}),
+    "models.db.desempaquetar_valores": lambda c: ((bytes(8 * len(c.tamices)),), {}),
+    "models.db.agregar_columna_si_no_existe": lambda c: ((_conexion(), "muestras", "notas", "TEXT"), {}),
+    "models.db.es_error_bloqueo": lambda c: ((sqlite3.OperationalError("database is locked"),), {}),
+    "models.db.revertir": lambda c: ((_conexion(),), {}),
+    "models.db.ejecutar_escritura": lambda c: ((lambda conn: conn.execute("UPDATE muestras SET notas = notas WHERE 0"),), {}),
+    "models.db.fragmento_de": lambda c: ((c.consultables[0],), {}),
+    "models.db.fragmento_actual": lambda c: ((), {}),
+    "models.db.en_fragmento": lambda c: ((None,), {}),
+    "models.db.enrutar_por_muestra": lambda c: ((lambda codigo_muestra: None,), {}),
+    "models.db.ruta_bd": lambda c: ((), {}),
+    "models.db.directorio_fragmento": lambda c: (("copias",), {}),
+    "models.db.listar_fragmentos": lambda c: ((), {}),
+    "models.db.bases_de_datos": lambda c: ((), {}),
+    "models.db.consultar_fragmentos": lambda c: (("SELECT COUNT(*) FROM muestras",), {}),
+    "models.db.repartir_en_fragmentos": lambda c: ((), {}),
+
+    # models.memoria
+    "models.memoria.presupuesto_pagina": lambda c: (("Consulta de Resultados",), {}),
+    "models.memoria.perfilar_pagina": lambda c: (("benchmark",), {}),
+    "models.memoria.obtener_informes": lambda c: ((), {}),
+
+    # models.metricas
+    "models.metricas.incrementar": lambda c: (("llamadas_total",), {"funcion": "benchmark"}),
+    "models.metricas.valor_contador": lambda c: (("llamadas_total",), {}),
+    "models.metricas.observar": lambda c: (("duracion_funcion_segundos", 0.02), {"funcion": "benchmark"}),
+    "models.metricas.registrar_cache": lambda c: (("benchmark",), {"fallo": False}),
+    "models.metricas.medir": lambda c: ((lambda: None,), {}),
+    "models.metricas.medir_pagina": lambda c: (("benchmark",), {}),
+    "models.metricas.exportar_prometheus": lambda c: ((), {}),
+    "models.metricas.escribir_fichero": lambda c: ((os.environ["GARNOCEX_DB_PATH"] + ".prom",), {}),
+
+    # models.trabajos
+    "models.trabajos.tipo_trabajo": lambda c: (("benchmark", "Trabajo de benchmark"), {}),
+    "models.trabajos.obtener_trabajo": lambda c: ((1,), {}),
+    "models.trabajos.obtener_trabajos": lambda c: ((), {}),
+    "models.trabajos.ultima_ejecucion": lambda c: (("mantenimiento_bd",), {}),
+    "models.trabajos.cancelar_trabajo": lambda c: ((0,), {}),
+
+    # models.trazas
+    "models.trazas.iniciar_registro": lambda c: ((), {}),
+    "models.trazas.obtener_registro": lambda c: ((), {}),
+    "models.trazas.resumir_registro": lambda c: (([{"sql": f"SELECT {i % 50}", "duracion_ms": 0.1, "filas": 1}
+                                                     for i in range(10000)],), {}),
+    "models.trazas.conectar": lambda c: ((os.environ["GARNOCEX_DB_PATH"],), {}),
+
+    # models.usuarios_db
+    "models.usuarios_db.get_db_connection": lambda c: ((), {}),
+    "models.usuarios_db.init_users_table": lambda c: ((), {}),
+    "models.usuarios_db.hash_password": lambda c: ((c.password,), {}),
+    "models.usuarios_db.crear_usuario": lambda c: (("Benchmark", c.nuevo("usuario"), c.password), {}),
+    "models.usuarios_db.verificar_credenciales": lambda c: (("benchmark", c.password), {}),
+    "models.usuarios_db.obtener_usuario_por_id": lambda c: ((c.usuario["id"],), {}),
+    "models.usuarios_db.obtener_todos_usuarios": lambda c: ((), {}),
+    "models.usuarios_db.actualizar_usuario": lambda c: ((c.usuario["id"],), {"nombre": "Usuario de benchmark"}),
+    "models.usuarios_db.eliminar_usuario": lambda c: ((_usuario_temporal(c),), {}),
+    "models.usuarios_db.verificar_nickname_disponible": lambda c: ((c.nuevo("libre"),), {}),
+    "models.usuarios_db.crear_sesion": lambda c: ((c.usuario["id"],), {}),
+    "models.usuarios_db.restaurar_sesion": lambda c: ((c.token_sesion,), {}),
+    "models.usuarios_db.revocar_sesion": lambda c: ((_sesion_temporal(c),), {}),
+
+    # utils
+    "utils.calculo.procesar_datos_tamices": lambda c: ((c.tamices, [m["masa_retenida"] for m in c.datos_tamices], 1000), {}),
+    "utils.calculo.calcular_porcentajes_tamices": lambda c: (([m["masa_retenida"] for m in c.datos_tamices], 1000), {}),
+    "utils.calculo.remuestrear_pasa": lambda c: (([t["apertura"] for t in c.tamices], [[m["porcentaje_pasa"] for m in c.datos_tamices]] * 100, [0.075, 4.75]), {}),
+    "utils.calculo.interpolar": lambda c: (([0.075, 0.15, 0.25, 0.425], [5, 12, 25, 40], 10), {}),
+    "utils.calculo.calcular_diametros_caracteristicos": lambda c: ((c.datos_tamices,), {}),
+    "utils.calculo.calcular_coeficientes": lambda c: ((0.1, 0.4, 1.2), {}),
+    "utils.graficos.generar_grafico_granulometrico": lambda c: ((c.datos_tamices,), {}),
+    "utils.tamices.get_tamices_estandar": lambda c: ((), {}),
+    "utils.tamices.clave_serie": lambda c: (([t["nombre"] for t in c.tamices], [t["apertura"] for t in c.tamices]), {}),
+}
+
+
+def _conexion():
+    from models.db import obtener_conexion
+    return obtener_conexion()
+
+
+def _cursor_cambios():
+    # Los casos se ejecutan en orden alfabético: compactar_cambios ya ha borrado
+    # el principio del registro cuando se leen los cambios desde el cursor 0
+    from models.cambios import ultima_secuencia
+
+    conn = _conexion()
+    try:
+        primera = conn.execute("SELECT MIN(secuencia) FROM cambios").fetchone()[0]
+    finally:
+        conn.close()
+    return ultima_secuencia() if primera is None else primera - 1
+
+
+def _curvas():
+    import pandas as pd
+    from models.db import obtener_conexion
+
+    conn = obtener_conexion()
+    try:
+        return pd.read_sql_query("""
+        SELECT eg.masa_total, cg.serie_tamices, cg.masas_retenidas
+        FROM ensayos_granulometricos eg
+        LEFT JOIN curvas_granulometricas cg ON cg.ensayo_id = eg.ensayo_id
+        """, conn)
+    finally:
+        conn.close()
+
+
+def _sesion_temporal(contexto):
+    from models.usuarios_db import crear_sesion
+    return crear_sesion(contexto.usuario["id"])
+
+
+def _usuario_temporal(contexto):
+    from models.usuarios_db import crear_usuario, verificar_credenciales
+
+    nickname = contexto.nuevo("temporal")
+    crear_usuario("Temporal", nickname, contexto.password)
+    return verificar_credenciales(nickname, contexto.password)["id"]
+
+
+def funciones_publicas():
+    """
+    Enumera las funciones públicas de los paquetes medidos
+
+    Returns:
+        dict: Nombre completo ("paquete.modulo.funcion") -> función
+    """
+    funciones = {}
+    for paquete in PAQUETES:
+        ruta = os.path.join(RAIZ_PROYECTO, paquete)
+        for modulo in pkgutil.iter_modules([ruta]):
+            nombre_modulo = f"{paquete}.{modulo.name}"
+            objeto = importlib.import_module(nombre_modulo)
+            for nombre, funcion in inspect.getmembers(objeto, inspect.isfunction):
+                # Solo funciones definidas en el módulo, y una vez aunque tengan alias
+                if nombre.startswith("_") or funcion.__module__ != nombre_modulo or nombre != funcion.__name__:
+                    continue
+                funciones[f"{nombre_modulo}.{nombre}"] = funcion
+    return funciones
+
+
+def medir(funcion, caso, contexto, repeticiones):
+    """
+    Mide una función con su caso
+
+    Args:
+        funcion (callable): Función a medir
+        caso (callable): Caso que prepara los argumentos
+        contexto (Contexto): Datos del archivo
+        repeticiones (int): Número de llamadas
+
+    Returns:
+        dict: Mediana, mínimo y máximo en segundos, o el error producido
+    """
+    tiempos = []
+    for _ in range(repeticiones):
+        args, kwargs = caso(contexto)
+        inicio = time.perf_counter()
+        try:
+            funcion(*args, **kwargs)
+        except Exception as e:
+            return {"error": f"{type(e).__name__}: {e}"}
+        tiempos.append(time.perf_counter() - inicio)
+
+        # Cerrar las conexiones que el caso haya abierto como argumento
+        for arg in args:
+            if hasattr(arg, "close") and hasattr(arg, "execute"):
+                arg.close()
+
+    tiempos.sort()
+    return {
+        "mediana": tiempos[len(tiempos) // 2],
+        "minimo": tiempos[0],
+        "maximo": tiempos[-1],
+    }
+
+
+def ejecutar_suite(archivo, semilla=0, repeticiones=5, filtro=None):
+    """
+    Ejecuta el benchmark sobre una copia temporal del archivo
+
+    Args:
+        archivo (str): Base de datos generada con benchmarks/generador.py
+        semilla (int): Semilla para elegir muestras y valores
+        repeticiones (int): Llamadas por función
+        filtro (str, optional): Medir solo las funciones cuyo nombre lo contenga
+
+    Returns:
+        dict: Resultados por función, funciones sin caso y omitidas
+    """
+    directorio = tempfile.mkdtemp(prefix="benchmark_modelos_")
+    copia = os.path.join(directorio, "archivo.db")
+    shutil.copyfile(archivo, copia)
+
+    # Los módulos leen la ruta de la base de datos de esta variable al importarse
+    os.environ["GARNOCEX_DB_PATH"] = copia
+    os.environ["GARNOCEX_LOG_CONSULTAS_LENTAS"] = os.path.join(directorio, "consultas_lentas.log")
+    if RAIZ_PROYECTO not in sys.path:
+        sys.path.insert(0, RAIZ_PROYECTO)
+
+    try:
+        import models.db
+        import models.trazas
+
+        # Por si models.db ya se había importado (al generar el archivo)
+        models.db.DB_PATH = copia
+        models.trazas.RUTA_CONSULTAS_LENTAS = os.environ["GARNOCEX_LOG_CONSULTAS_LENTAS"]
+        models.db.inicializar_bd()
+
+        funciones = funciones_publicas()
+        contexto = Contexto(semilla)
+
+        resultados = {}
+        for nombre, funcion in funciones.items():
+            if nombre in OMITIDAS or nombre not in CASOS:
+                continue
+            if filtro and filtro not in nombre:
+                continue
+            resultados[nombre] = medir(funcion, CASOS[nombre], contexto, repeticiones)
+
+        return {
+            "funciones": resultados,
+            "sin_caso": sorted(n for n in funciones if n not in CASOS and n not in OMITIDAS),
+            "omitidas": {n: OMITIDAS[n] for n in funciones if n in OMITIDAS},
+        }
+    finally:
+        shutil.rmtree(directorio, ignore_errors=True)
+
+
+def comparar_con_referencia(funciones, referencia, tolerancia=0.25, minimo_ms=1.0):
+    """
+    Compara las medianas con las de la referencia
+
+    Args:
+        funciones (dict): Resultados por función
+        referencia (dict): Registro de referencia
+        tolerancia (float): Aumento relativo permitido
+        minimo_ms (float): Diferencia absoluta por debajo de la cual no se considera regresión
+
+    Returns:
+        list: Tuplas (función, mediana_referencia, mediana_actual) que superan la tolerancia
+    """
+    regresiones = []
+    for nombre, medida in funciones.items():
+        previa = referencia["funciones"].get(nombre, {}).get("mediana")
+        actual = medida.get("mediana")
+        if previa is None or actual is None:
+            continue
+        if actual > previa * (1 + tolerancia) and (actual - previa) * 1000 > minimo_ms:
+            regresiones.append((nombre, previa, actual))
+    return regresiones
+
+
+def imprimir_informe(registro, referencia=None):
+    """
+    Imprime un resumen legible de los resultados
+    """
+    print(f"Funciones de models/ y utils/ ({registro['muestras']} muestras, semilla {registro['semilla']}, "
+          f"{registro['commit']}, mediana de {registro['repeticiones']} llamadas)")
+    print(f"\n  {'función':<64}{'mediana ms':>12}{'máx ms':>10}" + (f"{'ref. ms':>10}" if referencia else ""))
+
+    for nombre, medida in registro["funciones"].items():
+        if "error" in medida:
+            print(f"  {nombre:<64}  ERROR {medida['error']}")
+            continue
+        linea = f"  {nombre:<64}{medida['mediana'] * 1000:>12.2f}{medida['maximo'] * 1000:>10.2f}"
+        if referencia:
+            previa = referencia["funciones"].get(nombre, {}).get("mediana")
+            linea += f"{previa * 1000:>10.2f}" if previa is not None else f"{'-':>10}"
+        print(linea)
+
+    if registro["sin_caso"]:
+        print("\nFunciones públicas sin caso de benchmark:")
+        for nombre in registro["sin_caso"]:
+            print(f"  {nombre}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de las funciones de models/ y utils/")
+    parser.add_argument("--archivo", help="Archivo generado con benchmarks/generador.py")
+    parser.add_argument("--muestras", type=int, default=10000,
+                        help="Tamaño del archivo a generar si no se indica --archivo")
+    parser.add_argument("--semilla", type=int, default=0, help="Semilla del archivo y de los casos")
+    parser.add_argument("--repeticiones", type=int, default=5, help="Llamadas por función")
+    parser.add_argument("--filtro", help="Medir solo las funciones cuyo nombre contenga este texto")
+    parser.add_argument("--referencia", help="Fichero de referencia (por defecto, según el tamaño del archivo)")
+    parser.add_argument("--actualizar-referencia", action="store_true",
+                        help="Guardar los resultados como nueva referencia")
+    parser.add_argument("--tolerancia", type=float, default=0.25, help="Aumento relativo permitido")
+    parser.add_argument("--minimo-ms", type=float, default=1.0,
+                        help="Diferencia absoluta mínima para considerar una regresión")
+    args = parser.parse_args()
+
+    archivo = args.archivo
+    temporal = None
+    if archivo is None:
+        from generador import generar_archivo
+
+        temporal = tempfile.mkdtemp(prefix="benchmark_archivo_")
+        archivo = os.path.join(temporal, f"archivo_{args.muestras}.db")
+        print(f"Generando archivo sintético de {args.muestras} muestras...", file=sys.stderr)
+        generar_archivo(archivo, args.muestras, args.semilla)
+
+    try:
+        import sqlite3
+        with sqlite3.connect(archivo) as conn:
+            muestras = conn.execute("SELECT COUNT(*) FROM muestras").fetchone()[0]
+
+        resultado = ejecutar_suite(archivo, args.semilla, args.repeticiones, args.filtro)
+    finally:
+        if temporal:
+            shutil.rmtree(temporal, ignore_errors=True)
+
+    registro = {
+        "fecha": datetime.now().isoformat(timespec="seconds"),
+        "commit": commit_actual(),
+        "python": platform.python_version(),
+        "muestras": muestras,
+        "semilla": args.semilla,
+        "repeticiones": args.repeticiones,
+        **resultado,
+    }
+
+    ruta_referencia = args.referencia or os.path.join(DIRECTORIO_RESULTADOS, f"referencia_modelos_{muestras}.json")
+    referencia = None
+    if os.path.exists(ruta_referencia) and not args.actualizar_referencia:
+        with open(ruta_referencia, encoding="utf-8") as f:
+            referencia = json.load(f)
+
+    imprimir_informe(registro, referencia)
+    guardar_resultado(registro, RUTA_HISTORICO)
+
+    if args.actualizar_referencia:
+        os.makedirs(os.path.dirname(ruta_referencia), exist_ok=True)
+        with open(ruta_referencia, "w", encoding="utf-8") as f:
+            json.dump(registro, f, ensure_ascii=False, indent=2)
+        print(f"\nReferencia guardada en {ruta_referencia}")
+
+    errores = [n for n, m in registro["funciones"].items() if "error" in m]
+    regresiones = comparar_con_referencia(registro["funciones"], referencia, args.tolerancia, args.minimo_ms) \
+        if referencia else []
+
+    if regresiones:
+        print("\nRegresiones respecto a la referencia:")
+        for nombre, previa, actual in regresiones:
+            print(f"  {nombre}: {previa * 1000:.2f} ms -> {actual * 1000:.2f} ms")
+
+    if regresiones or errores:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
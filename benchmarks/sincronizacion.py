@@ -0,0 +1,146 @@
+"""
+Comprobación de la sincronización entre dos copias de la misma base de datos
+
+Copia una base de datos (por defecto, la del proyecto) en dos ficheros
+temporales, los inicializa en procesos nuevos (con las migraciones de
+estructura e identidad que haga falta), da a la segunda copia una identidad de
+nodo propia y sincroniza las dos en ambos sentidos con models/sincronizacion.py.
+Las dos copias ya compartían todas sus filas, así que la sincronización no debe
+duplicar ninguna: el script termina con código 1 si las migraciones anotan
+cambios, si los ensayos o las imágenes no tienen el mismo uid en las dos copias
+o si el número de filas cambia al aplicar los paquetes.
+
+Uso:
+    python benchmarks/sincronizacion.py
+    python benchmarks/sincronizacion.py --base /tmp/archivo_100k.db
+"""
+import argparse
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+from comun import RAIZ_PROYECTO
+
+RUTA_BASE = os.path.join(RAIZ_PROYECTO, "ensayos_geotecnicos.db")
+
+# Tablas cuyas filas se comparan entre las dos copias
+TABLAS_COMPARADAS = ["muestras", "ensayos", "imagenes"]
+
+# Tablas con uid propio: las filas compartidas deben tener el mismo en las dos copias
+TABLAS_UID = ["ensayos", "imagenes"]
+
+
+def _ejecutar(ruta, argumentos):
+    """
+    Ejecuta un proceso de Python sobre una de las copias
+
+    Args:
+        ruta (str): Base de datos de la copia (GARNOCEX_DB_PATH)
+        argumentos (list): Argumentos para el intérprete
+
+    Returns:
+        float: Segundos que ha tardado el proceso
+    """
+    entorno = dict(os.environ)
+    entorno["GARNOCEX_DB_PATH"] = ruta
+    entorno["PYTHONPATH"] = os.pathsep.join(filter(None, [RAIZ_PROYECTO, entorno.get("PYTHONPATH")]))
+    entorno["PYTHONDONTWRITEBYTECODE"] = "1"
+    inicio = time.perf_counter()
+    proceso = subprocess.run([sys.executable] + argumentos, cwd=os.path.dirname(ruta),
+                             env=entorno, capture_output=True, text=True)
+    if proceso.returncode != 0:
+        raise RuntimeError(f"Falló {' '.join(argumentos)}:\n{proceso.stderr.strip()}")
+    return time.perf_counter() - inicio
+
+
+def _estado(ruta):
+    """
+    Lee el número de filas, los uid y los cambios anotados de una copia
+
+    Args:
+        ruta (str): Base de datos de la copia
+
+    Returns:
+        dict: Filas por tabla, conjunto de uid por tabla y filas de cambios
+    """
+    conn = sqlite3.connect(ruta)
+    try:
+        return {
+            "filas": {t: conn.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0] for t in TABLAS_COMPARADAS},
+            "uid": {t: {fila[0] for fila in conn.execute(f"SELECT uid FROM {t}")} for t in TABLAS_UID},
+            "cambios": conn.execute("SELECT COUNT(*) FROM cambios").fetchone()[0],
+        }
+    finally:
+        conn.close()
+
+
+def comprobar_copias(base):
+    """
+    Sincroniza dos copias de una base de datos y comprueba que no se duplica nada
+
+    Args:
+        base (str): Base de datos de la que se hacen las copias
+
+    Returns:
+        tuple: (lista de problemas encontrados, dict de tiempos en segundos)
+    """
+    directorio = tempfile.mkdtemp(prefix="benchmark_sincronizacion_")
+    try:
+        copias = {nombre: os.path.join(directorio, f"{nombre}.db") for nombre in ("A", "B")}
+        tiempos = {}
+        for nombre, ruta in copias.items():
+            shutil.copyfile(base, ruta)
+            tiempos[f"inicializar_{nombre}"] = _ejecutar(
+                ruta, ["-c", "import models.db; models.db.inicializar_bd()"])
+        _ejecutar(copias["B"], ["-m", "models.sincronizacion", "nodo", "--renovar"])
+
+        problemas = []
+        iniciales = {nombre: _estado(ruta) for nombre, ruta in copias.items()}
+        for nombre, estado in iniciales.items():
+            if estado["cambios"]:
+                problemas.append(f"La inicialización de {nombre} ha anotado {estado['cambios']} cambios")
+        for tabla in TABLAS_UID:
+            if iniciales["A"]["uid"][tabla] != iniciales["B"]["uid"][tabla]:
+                problemas.append(f"Las copias no dan el mismo uid a las filas de {tabla}")
+
+        for origen, destino in (("A", "B"), ("B", "A")):
+            paquete = os.path.join(directorio, f"{origen}.zip")
+            tiempos[f"crear_{origen}"] = _ejecutar(
+                copias[origen], ["-m", "models.sincronizacion", "crear", paquete])
+            tiempos[f"aplicar_en_{destino}"] = _ejecutar(
+                copias[destino], ["-m", "models.sincronizacion", "aplicar", paquete])
+
+        for nombre, ruta in copias.items():
+            final = _estado(ruta)
+            for tabla in TABLAS_COMPARADAS:
+                antes, despues = iniciales[nombre]["filas"][tabla], final["filas"][tabla]
+                if antes != despues:
+                    problemas.append(f"{tabla} de {nombre} ha pasado de {antes} a {despues} filas")
+        return problemas, tiempos
+    finally:
+        shutil.rmtree(directorio, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Comprobación de la sincronización entre dos copias")
+    parser.add_argument("--base", default=RUTA_BASE, help="Base de datos de la que se hacen las copias")
+    args = parser.parse_args()
+
+    problemas, tiempos = comprobar_copias(args.base)
+    for nombre, segundos in tiempos.items():
+        print(f"  {nombre:<20} {segundos * 1000:10.1f} ms")
+
+    if problemas:
+        print("\nProblemas:")
+        for problema in problemas:
+            print(f"  {problema}")
+        sys.exit(1)
+    print("\nLas dos copias se han sincronizado sin duplicar filas")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,11 @@
 import sqlite3
-from models.db import obtener_conexion
+from models.db import obtener_conexion, ejecutar_escritura, enrutar_por_muestra
 from models.muestras import actualizar_estado_muestra
+from models.interpretacion import interpretar_valor
+from models.metricas import medir
 
+@medir
+@enrutar_por_muestra
 def guardar_ensayo_lajas_agujas(codigo_muestra, fecha_ensayo, operario, 
                                masa_total, masa_lajas, masa_agujas,
                                indice_lajas, indice_agujas, notas=None):
@@ -22,12 +26,8 @@ def guardar_ensayo_lajas_agujas(codigo_muestra, fecha_ensayo, operario,
     Returns:
         int: ID del ensayo guardado
     """
-    conn = obtener_conexion()
-    c = conn.cursor()
-    
-    try:
-        # Iniciar transacción
-        conn.execute("BEGIN")
+    def insertar(conn):
+        c = conn.cursor()
         
         # Insertar en la tabla general de ensayos
         c.execute("""
@@ -46,22 +46,17 @@ def guardar_ensayo_lajas_agujas(codigo_muestra, fecha_ensayo, operario,
         VALUES (?, ?, ?, ?, ?, ?)
         """, (ensayo_id, indice_lajas, indice_agujas, masa_total, masa_lajas, masa_agujas))
         
-        # Confirmar transacción
-        conn.execute("COMMIT")
-        
-        # Actualizar estado de la muestra
-        actualizar_estado_muestra(codigo_muestra, "con ensayo de lajas y agujas")
-        
         return ensayo_id
-        
-    except Exception as e:
-        # Revertir cambios en caso de error
-        conn.execute("ROLLBACK")
-        raise e
     
-    finally:
-        conn.close()
+    ensayo_id = ejecutar_escritura(insertar)
+    
+    # Actualizar estado de la muestra
+    actualizar_estado_muestra(codigo_muestra, "con ensayo de lajas y agujas")
+    
+    return ensayo_id
 
+@medir
+@enrutar_por_muestra
 def obtener_ensayo_lajas_agujas(codigo_muestra):
     """
     Obtiene el último ensayo de índice de lajas y agujas de una muestra
@@ -93,6 +88,8 @@ def obtener_ensayo_lajas_agujas(codigo_muestra):
     # Convertir a diccionario
     return dict(ensayo)
 
+@medir
+@enrutar_por_muestra
 def obtener_todos_ensayos_lajas_agujas(codigo_muestra=None):
     """
     Obtiene todos los ensayos de índice de lajas y agujas, opcionalmente filtrados por muestra
@@ -130,6 +127,7 @@ def obtener_todos_ensayos_lajas_agujas(codigo_muestra=None):
     
     return ensayos
 
+@medir
 def calcular_indices_lajas_agujas(masa_total, masa_lajas, masa_agujas):
     """
     Calcula los índices de lajas y agujas
@@ -158,6 +156,7 @@ def calcular_indices_lajas_agujas(masa_total, masa_lajas, masa_agujas):
     
     return indice_lajas, indice_agujas
 
+@medir
 def interpretar_indices(indice_lajas, indice_agujas):
     """
     Interpreta los índices de lajas y agujas según normativas (UNE-EN 933-3 y UNE-EN 933-4)
@@ -169,24 +168,7 @@ def interpretar_indices(indice_lajas, indice_agujas):
     Returns:
         tuple: (interpretacion_lajas, interpretacion_agujas)
     """
-    # Interpretación índice de lajas
-    if indice_lajas <= 10:
-        interpretacion_lajas = "Muy buena forma (IL ≤ 10%)"
-    elif indice_lajas <= 20:
-        interpretacion_lajas = "Buena forma (10% < IL ≤ 20%)"
-    elif indice_lajas <= 35:
-        interpretacion_lajas = "Forma aceptable (20% < IL ≤ 35%)"
-    else:
-        interpretacion_lajas = "Mala forma (IL > 35%)"
-    
-    # Interpretación índice de agujas
-    if indice_agujas <= 10:
-        interpretacion_agujas = "Muy buena forma (IA ≤ 10%)"
-    elif indice_agujas <= 20:
-        interpretacion_agujas = "Buena forma (10% < IA ≤ 20%)"
-    elif indice_agujas <= 35:
-        interpretacion_agujas = "Forma aceptable (20% < IA ≤ 35%)"
-    else:
-        interpretacion_agujas = "Mala forma (IA > 35%)"
-    
-    return interpretacion_lajas, interpretacion_agujas
\ No newline at end of file
+    return (
+        interpretar_valor(indice_lajas, "indice_lajas"),
+        interpretar_valor(indice_agujas, "indice_agujas")
+    )
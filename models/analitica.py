@@ -0,0 +1,467 @@
+import json
+import os
+import threading
+import time
+
+import duckdb
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import models.db as db
+from models.cambios import CambiosCompactados, leer_cambios, ultima_secuencia
+from models.db import TABLAS_CAMBIOS, TABLAS_ENSAYOS, obtener_conexion
+from models.exportacion import expresion_columna, tipo_arrow
+from models.metricas import medir
+
+# Origen de los datos de analítica:
+# - "parquet" (por defecto): espejo en Parquet del archivo, actualizado periódicamente
+# - "sqlite": el fichero SQLite adjuntado en solo lectura con la extensión sqlite de
+#   DuckDB. Siempre está al día, pero DuckDB la descarga la primera vez y, sin WAL
+#   (GARNOCEX_ESCRITOR_UNICO=1), sus lecturas retrasan las escrituras de los operarios.
+ORIGEN = os.environ.get("GARNOCEX_ANALITICA_ORIGEN", "parquet")
+
+# Directorio del espejo Parquet (por defecto, "analitica" junto a la base de datos)
+DIRECTORIO_ESPEJO = os.environ.get("GARNOCEX_ANALITICA_DIR")
+
+# Minutos tras los que el espejo se considera desactualizado
+REFRESCO_MINUTOS = float(os.environ.get("GARNOCEX_ANALITICA_REFRESCO_MIN", "60"))
+
+# Hilos y memoria máxima de DuckDB
+HILOS = int(os.environ.get("GARNOCEX_ANALITICA_HILOS", str(os.cpu_count() or 1)))
+LIMITE_MEMORIA = os.environ.get("GARNOCEX_ANALITICA_MEMORIA", "1GB")
+
+# Filas leídas de SQLite por consulta al copiar una tabla al espejo. Cada consulta
+# es una lectura corta, de modo que las escrituras nunca esperan a la copia entera.
+FILAS_POR_LOTE = 20000
+
+# Tablas del archivo que se copian al espejo (las imágenes y los BLOB de curvas no)
+TABLAS_ESPEJO = (
+    "muestras",
+    "ensayos",
+    "ensayos_granulometricos",
+    "ensayos_limites",
+    "ensayos_proctor",
+    "puntos_proctor",
+    "ensayos_cbr",
+    "ensayos_densidad_arido",
+    "ensayos_picnometro",
+    "ensayos_equivalente_arena",
+    "ensayos_lajas_agujas",
+    "clasificacion_sucs",
+)
+
+# Vista de cada tipo de ensayo: nombre -> tabla de datos específicos
+VISTAS_ENSAYOS = TABLAS_ENSAYOS
+
+# Propiedades del último ensayo de cada tipo que se reúnen por muestra:
+# vista -> [(columna, alias)]
+PROPIEDADES_MUESTRA = {
+    "granulometria": [("coef_uniformidad", "cu"), ("coef_curvatura", "cc"), ("d60", "d60")],
+    "limites": [("limite_liquido", "limite_liquido"), ("indice_plasticidad", "indice_plasticidad")],
+    "proctor": [("densidad_maxima", "densidad_maxima"), ("humedad_optima", "humedad_optima")],
+    "cbr": [("indice_cbr", "indice_cbr"), ("hinchamiento", "hinchamiento")],
+    "equivalente_arena": [("equivalente_arena", "equivalente_arena")],
+    "lajas_agujas": [("indice_lajas", "indice_lajas")],
+    "densidad_arido": [("absorcion_agua", "absorcion_agua_arido")],
+}
+
+# Pares de propiedades del informe de correlaciones
+PARES_CORRELACION = [
+    ("limite_liquido", "indice_cbr"),
+    ("indice_plasticidad", "indice_cbr"),
+    ("porcentaje_finos", "indice_cbr"),
+    ("cu", "indice_cbr"),
+    ("densidad_maxima", "indice_cbr"),
+    ("humedad_optima", "densidad_maxima"),
+    ("limite_liquido", "humedad_optima"),
+    ("porcentaje_finos", "equivalente_arena"),
+    ("indice_plasticidad", "equivalente_arena"),
+]
+
+
+def _vistas():
+    """
+    Construye las vistas curadas sobre las tablas del archivo (esquema "archivo")
+
+    Returns:
+        dict: Nombre de la vista -> consulta SQL
+    """
+    fecha = "CAST(TRY_CAST({} AS TIMESTAMP) AS DATE)"
+    vistas = {
+        "ensayos_muestra": f"""
+        SELECT e.id AS ensayo_id, e.codigo_muestra, e.tipo_ensayo,
+               {fecha.format("e.fecha_ensayo")} AS fecha_ensayo,
+               year({fecha.format("e.fecha_ensayo")}) AS anio,
+               date_trunc('month', {fecha.format("e.fecha_ensayo")}) AS mes,
+               e.operario, m.tipo_material, m.estado,
+               {fecha.format("m.fecha")} AS fecha_muestra
+        FROM archivo.ensayos e
+        LEFT JOIN archivo.muestras m ON m.codigo_muestra = e.codigo_muestra
+        """,
+    }
+
+    for vista, tabla in VISTAS_ENSAYOS.items():
+        vistas[vista] = f"""
+        SELECT em.*, t.* EXCLUDE (ensayo_id)
+        FROM ensayos_muestra em
+        JOIN archivo.{tabla} t ON t.ensayo_id = em.ensayo_id
+        """
+
+    # Una fila por muestra con el último ensayo de cada tipo y su clasificación SUCS
+    subconsultas = []
+    for vista, columnas in PROPIEDADES_MUESTRA.items():
+        seleccion = ", ".join(f"arg_max({columna}, ensayo_id) AS {alias}" for columna, alias in columnas)
+        subconsultas.append(f"""
+        LEFT JOIN (SELECT codigo_muestra, {seleccion} FROM {vista} GROUP BY codigo_muestra) {vista}
+            ON {vista}.codigo_muestra = m.codigo_muestra""")
+    alias = ", ".join(f"{vista}.{nombre}" for vista, columnas in PROPIEDADES_MUESTRA.items() for _, nombre in columnas)
+    vistas["propiedades_muestra"] = f"""
+    SELECT m.codigo_muestra, m.tipo_material, {fecha.format("m.fecha")} AS fecha_muestra,
+           s.grupo_sucs, s.porcentaje_finos, {alias}
+    FROM archivo.muestras m
+    LEFT JOIN archivo.clasificacion_sucs s ON s.codigo_muestra = m.codigo_muestra
+    {"".join(subconsultas)}
+    """
+
+    return vistas
+
+
+def _consulta_correlaciones():
+    # Las propiedades se calculan una sola vez para todos los pares
+    pares = " UNION ALL ".join(f"""
+    SELECT '{a} / {b}' AS propiedades,
+           count(*) FILTER (WHERE {a} IS NOT NULL AND {b} IS NOT NULL) AS muestras,
+           corr({a}, {b}) AS correlacion
+    FROM p""" for a, b in PARES_CORRELACION)
+    return f"""
+    WITH p AS MATERIALIZED (
+        SELECT * FROM propiedades_muestra
+        WHERE ($desde IS NULL OR fecha_muestra >= $desde) AND ($hasta IS NULL OR fecha_muestra <= $hasta)
+    )
+    SELECT * FROM ({pares}) ORDER BY abs(correlacion) DESC NULLS LAST
+    """
+
+
+# Informes disponibles: ID -> (título, consulta, gráfico). Las consultas reciben las
+# fechas $desde y $hasta (NULL para no filtrar). El gráfico es (tipo, x, y, color) o None.
+FILTRO_FECHAS = "($desde IS NULL OR fecha_ensayo >= $desde) AND ($hasta IS NULL OR fecha_ensayo <= $hasta)"
+
+INFORMES = {
+    "cbr_material_mes": (
+        "Distribución del CBR por material y mes",
+        f"""
+        SELECT tipo_material, mes, count(*) AS ensayos,
+               avg(indice_cbr) AS media,
+               quantile_cont(indice_cbr, 0.1) AS p10,
+               median(indice_cbr) AS mediana,
+               quantile_cont(indice_cbr, 0.9) AS p90
+        FROM cbr
+        WHERE indice_cbr IS NOT NULL AND {FILTRO_FECHAS}
+        GROUP BY tipo_material, mes
+        ORDER BY tipo_material, mes
+        """,
+        ("line", "mes", "mediana", "tipo_material"),
+    ),
+    "cu_material": (
+        "Percentiles del coeficiente de uniformidad por material",
+        f"""
+        SELECT tipo_material, count(*) AS ensayos,
+               quantile_cont(coef_uniformidad, 0.1) AS p10,
+               quantile_cont(coef_uniformidad, 0.25) AS p25,
+               median(coef_uniformidad) AS mediana,
+               quantile_cont(coef_uniformidad, 0.75) AS p75,
+               quantile_cont(coef_uniformidad, 0.9) AS p90
+        FROM granulometria
+        WHERE coef_uniformidad > 0 AND {FILTRO_FECHAS}
+        GROUP BY tipo_material
+        ORDER BY tipo_material
+        """,
+        ("bar", "tipo_material", "mediana", None),
+    ),
+    "correlaciones": (
+        "Correlaciones entre ensayos (último ensayo de cada muestra)",
+        _consulta_correlaciones(),
+        None,
+    ),
+    "sucs_material": (
+        "Grupos SUCS por material",
+        """
+        SELECT tipo_material, grupo_sucs, count(*) AS muestras,
+               round(100 * count(*) / sum(count(*)) OVER (PARTITION BY tipo_material), 1) AS porcentaje
+        FROM propiedades_muestra
+        WHERE grupo_sucs IS NOT NULL
+          AND ($desde IS NULL OR fecha_muestra >= $desde) AND ($hasta IS NULL OR fecha_muestra <= $hasta)
+        GROUP BY tipo_material, grupo_sucs
+        ORDER BY tipo_material, muestras DESC
+        """,
+        ("bar", "tipo_material", "muestras", "grupo_sucs"),
+    ),
+    "ensayos_tipo_mes": (
+        "Ensayos por tipo y mes",
+        f"""
+        SELECT mes, tipo_ensayo, count(*) AS ensayos
+        FROM ensayos_muestra
+        WHERE {FILTRO_FECHAS}
+        GROUP BY mes, tipo_ensayo
+        ORDER BY mes, tipo_ensayo
+        """,
+        ("bar", "mes", "ensayos", "tipo_ensayo"),
+    ),
+}
+
+_conexion = None
+_bases_conexion = None
+_bloqueo_conexion = threading.Lock()
+_bloqueo_espejo = threading.Lock()
+
+
+def directorio_espejo():
+    """
+    Devuelve el directorio del espejo Parquet
+
+    Returns:
+        str: Ruta del directorio
+    """
+    return DIRECTORIO_ESPEJO or os.path.join(os.path.dirname(os.path.abspath(db.DB_PATH)), "analitica")
+
+
+def _copiar_tabla(tabla, destino):
+    """
+    Copia una tabla de SQLite a un fichero Parquet por lotes de FILAS_POR_LOTE filas
+
+    Args:
+        tabla (str): Nombre de la tabla
+        destino (str): Ruta del fichero Parquet
+
+    Returns:
+        int: Filas copiadas
+    """
+    conn = obtener_conexion()
+    conn.row_factory = None
+    try:
+        columnas = [(fila[1], tipo_arrow(fila[2])) for fila in conn.execute(f"PRAGMA table_info({tabla})")]
+        esquema = pa.schema(columnas)
+        expresiones = ", ".join(expresion_columna(nombre, tipo) for nombre, tipo in columnas)
+
+        copiadas = 0
+        ultimo = -2 ** 63
+        with pq.ParquetWriter(destino, esquema, compression="zstd") as escritor:
+            while True:
+                # Paginación por rowid: cada lote es una consulta independiente
+                filas = conn.execute(f"""
+                SELECT rowid, {expresiones} FROM {tabla} WHERE rowid > ? ORDER BY rowid LIMIT ?
+                """, (ultimo, FILAS_POR_LOTE)).fetchall()
+                if not filas:
+                    break
+                ultimo = filas[-1][0]
+                valores = list(zip(*filas))[1:]
+                escritor.write_table(pa.Table.from_arrays(
+                    [pa.array(columna, type=tipo) for columna, (_, tipo) in zip(valores, columnas)],
+                    schema=esquema
+                ))
+                copiadas += len(filas)
+    finally:
+        conn.close()
+
+    return copiadas
+
+
+def _escribir_json(ruta, datos):
+    temporal = f"{ruta}.{os.getpid()}.tmp"
+    with open(temporal, "w", encoding="utf-8") as f:
+        json.dump(datos, f)
+    os.replace(temporal, ruta)
+
+
+def _tabla_sin_cambios(estado, clave, tabla, secuencia, destino):
+    """
+    Indica si una tabla del espejo está al día: el registro de cambios no anota
+    ninguno desde que se copió. Las tablas sin registro (clasificacion_sucs) se
+    copian siempre.
+    """
+    desde = estado.get("secuencias", {}).get(clave)
+    if tabla not in TABLAS_CAMBIOS or desde is None or not os.path.exists(destino):
+        return False
+    try:
+        return not leer_cambios(desde, (tabla,), limite=1, hasta=secuencia)
+    except CambiosCompactados:
+        return False
+
+
+@medir
+def estado_espejo():
+    """
+    Devuelve el estado del espejo Parquet
+
+    Returns:
+        dict: {"fecha": epoch de la última actualización, "tablas": filas por
+            tabla, "secuencias": cursor del registro de cambios con el que se
+            copió cada tabla}, o None si el espejo no existe
+    """
+    try:
+        with open(os.path.join(directorio_espejo(), "espejo.json"), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def espejo_desactualizado():
+    """
+    Indica si el espejo no existe o tiene más de REFRESCO_MINUTOS minutos
+
+    Returns:
+        bool: True si hay que actualizarlo
+    """
+    if ORIGEN != "parquet":
+        return False
+    estado = estado_espejo()
+    return estado is None or time.time() - estado["fecha"] > REFRESCO_MINUTOS * 60
+
+
+def _ficheros_espejo():
+    """
+    Ficheros Parquet del espejo: uno por tabla de TABLAS_ESPEJO y, con
+    fragmentación, por fragmento (en su subdirectorio)
+
+    Returns:
+        list: [(clave en el estado del espejo, fragmento, tabla, ruta)], por
+            fragmentos y en el orden de TABLAS_ESPEJO
+    """
+    directorio = directorio_espejo()
+    return [
+        (tabla if base is None else f"{base}/{tabla}", base, tabla,
+         os.path.join(directorio, *(() if base is None else (base,)), f"{tabla}.parquet"))
+        for base in db.bases_de_datos(principal=False) for tabla in TABLAS_ESPEJO
+    ]
+
+
+@medir
+def actualizar_espejo(progreso=None, desde=0):
+    """
+    Copia las tablas del archivo al espejo Parquet. Cada tabla se escribe en un
+    fichero temporal que sustituye al anterior de forma atómica, de modo que las
+    consultas en curso siguen leyendo la versión anterior. Las tablas en las que
+    el registro de cambios no anota ninguno desde la copia anterior no se copian.
+    Con fragmentación, las tablas de cada fragmento se copian en su
+    subdirectorio, con el registro de cambios del fragmento.
+
+    Args:
+        progreso (callable, optional): Función (tablas copiadas, total, tabla)
+            que se llama tras copiar cada tabla
+        desde (int): Índice de la primera tabla que se copia (en TABLAS_ESPEJO
+            o, con fragmentos, en la lista de tablas de todos ellos)
+
+    Returns:
+        dict: Estado del espejo (ver estado_espejo)
+    """
+    directorio = directorio_espejo()
+    os.makedirs(directorio, exist_ok=True)
+    ficheros = _ficheros_espejo()
+
+    with _bloqueo_espejo:
+        estado = estado_espejo() or {"fecha": None, "tablas": {}}
+        estado.setdefault("secuencias", {})
+        for i, (clave, base, tabla, destino) in enumerate(ficheros[desde:], start=desde):
+            os.makedirs(os.path.dirname(destino), exist_ok=True)
+            with db.en_fragmento(base):
+                # El cursor se toma antes de leer: un cambio posterior se vuelve a copiar
+                secuencia = ultima_secuencia()
+                if not _tabla_sin_cambios(estado, clave, tabla, secuencia, destino):
+                    temporal = f"{destino}.{os.getpid()}.tmp"
+                    try:
+                        estado["tablas"][clave] = _copiar_tabla(tabla, temporal)
+                        os.replace(temporal, destino)
+                    finally:
+                        if os.path.exists(temporal):
+                            os.remove(temporal)
+            estado["secuencias"][clave] = secuencia
+            if progreso:
+                progreso(i + 1, len(ficheros), tabla)
+
+        estado["fecha"] = time.time()
+        _escribir_json(os.path.join(directorio, "espejo.json"), estado)
+
+    return estado
+
+
+def _conexion_analitica():
+    """
+    Devuelve un cursor de la base de datos DuckDB en memoria con las vistas de
+    analítica. La base de datos se crea una vez por proceso (y de nuevo si
+    cambian los fragmentos); cada cursor puede usarse desde un hilo distinto.
+    Con fragmentación, cada tabla de "archivo" une las de todos los fragmentos.
+    """
+    global _conexion, _bases_conexion
+    bases = db.bases_de_datos(principal=False)
+    with _bloqueo_conexion:
+        if _conexion is not None and _bases_conexion != bases:
+            _conexion.close()
+            _conexion = None
+
+        if _conexion is None:
+            conn = duckdb.connect(":memory:", config={"threads": HILOS, "memory_limit": LIMITE_MEMORIA})
+            conn.execute("CREATE SCHEMA archivo")
+            if ORIGEN == "sqlite":
+                for i, base in enumerate(bases):
+                    with db.en_fragmento(base):
+                        ruta = os.path.abspath(db.ruta_bd()).replace("'", "''")
+                    conn.execute(f"ATTACH '{ruta}' AS origen_{i} (TYPE sqlite, READ_ONLY)")
+                for tabla in TABLAS_ESPEJO:
+                    union = " UNION ALL BY NAME ".join(
+                        f"SELECT * FROM origen_{i}.{tabla}" for i in range(len(bases))
+                    )
+                    conn.execute(f"CREATE VIEW archivo.{tabla} AS {union}")
+            else:
+                ficheros = _ficheros_espejo()
+                if estado_espejo() is None or not all(os.path.exists(f[3]) for f in ficheros):
+                    actualizar_espejo()
+                for tabla in TABLAS_ESPEJO:
+                    rutas = ", ".join(
+                        "'" + ruta.replace("'", "''") + "'" for _, _, t, ruta in ficheros if t == tabla
+                    )
+                    conn.execute(
+                        f"CREATE VIEW archivo.{tabla} AS "
+                        f"SELECT * FROM read_parquet([{rutas}], union_by_name = true)"
+                    )
+
+            for nombre, consulta in _vistas().items():
+                conn.execute(f"CREATE VIEW {nombre} AS {consulta}")
+            _conexion, _bases_conexion = conn, bases
+
+        return _conexion.cursor()
+
+
+@medir
+def consultar(consulta, parametros=None):
+    """
+    Ejecuta una consulta sobre las vistas de analítica
+
+    Args:
+        consulta (str): Consulta SQL de DuckDB
+        parametros (dict o list, optional): Parámetros de la consulta
+
+    Returns:
+        pandas.DataFrame: Resultado
+    """
+    cursor = _conexion_analitica()
+    try:
+        return cursor.execute(consulta, parametros).df()
+    finally:
+        cursor.close()
+
+
+@medir
+def ejecutar_informe(informe, desde=None, hasta=None):
+    """
+    Ejecuta uno de los informes de INFORMES
+
+    Args:
+        informe (str): ID del informe
+        desde (date, optional): Primera fecha incluida
+        hasta (date, optional): Última fecha incluida
+
+    Returns:
+        pandas.DataFrame: Resultado del informe
+    """
+    _, consulta, _ = INFORMES[informe]
+    return consultar(consulta, {"desde": desde, "hasta": hasta})
@@ -0,0 +1,235 @@
+import os
+
+from models.db import TABLAS_CAMBIOS, ejecutar_escritura, obtener_conexion
+from models.metricas import medir
+
+# Días que se conservan los cambios. Un consumidor que lleve más tiempo sin
+# leerlos recibe CambiosCompactados y debe volver a leer las tablas completas.
+RETENCION_CAMBIOS_DIAS = float(os.environ.get("GARNOCEX_CAMBIOS_RETENCION_DIAS", "30"))
+
+# Cambios leídos por consulta y borrados por transacción al compactar
+FILAS_POR_LOTE = 5000
+
+class CambiosCompactados(Exception):
+    """
+    Se lanza al leer los cambios desde un cursor si alguno de los posteriores ya
+    se ha compactado, o si el cursor es posterior al último cambio (la base de
+    datos se ha restaurado de una copia anterior). El consumidor debe volver a
+    leer las tablas completas y continuar desde ultima_secuencia().
+    """
+
+
+def _secuencia_asignada(conn):
+    # Última secuencia asignada, aunque sus cambios ya se hayan compactado
+    fila = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'cambios'").fetchone()
+    return fila[0] if fila else 0
+
+
+def _comprobar_cursor(conn, desde):
+    """
+    Lanza CambiosCompactados si faltan cambios posteriores a desde. Las
+    secuencias son consecutivas (AUTOINCREMENT dentro de la misma transacción
+    que el cambio), así que solo puede faltar el principio del registro.
+    """
+    ultima = _secuencia_asignada(conn)
+    if desde > ultima:
+        raise CambiosCompactados(f"El cursor {desde} es posterior al último cambio ({ultima})")
+    if desde == ultima:
+        return
+    primera = conn.execute("SELECT MIN(secuencia) FROM cambios").fetchone()[0]
+    if primera is None or primera > desde + 1:
+        raise CambiosCompactados(f"Los cambios posteriores a {desde} ya se han compactado")
+
+
+def _filtro_tablas(tablas):
+    if not tablas:
+        return "", ()
+    desconocidas = set(tablas) - set(TABLAS_CAMBIOS)
+    if desconocidas:
+        raise ValueError(f"Tablas sin registro de cambios: {', '.join(sorted(desconocidas))}")
+    return f"AND tabla IN ({', '.join('?' * len(tablas))})", tuple(tablas)
+
+
+@medir
+def ultima_secuencia():
+    """
+    Devuelve el cursor del último cambio anotado. Un consumidor nuevo lo toma
+    antes de leer las tablas completas y después lee los cambios desde él.
+
+    Returns:
+        int: Secuencia del último cambio (0 si no hay ninguno)
+    """
+    conn = obtener_conexion()
+    try:
+        return _secuencia_asignada(conn)
+    finally:
+        conn.close()
+
+
+@medir
+def leer_cambios(desde=0, tablas=None, limite=FILAS_POR_LOTE, hasta=None):
+    """
+    Lee los cambios posteriores a un cursor, en orden
+
+    Args:
+        desde (int): Cursor: secuencia del último cambio ya procesado
+        tablas (iterable, optional): Leer solo los cambios de estas tablas
+        limite (int): Número máximo de cambios
+        hasta (int, optional): No leer cambios posteriores a esta secuencia
+
+    Returns:
+        list: Diccionarios con secuencia, tabla, clave, operacion, codigo_muestra
+            y fecha. El cursor siguiente es la secuencia del último.
+
+    Raises:
+        CambiosCompactados: Si faltan cambios posteriores al cursor
+    """
+    filtro, parametros = _filtro_tablas(tablas)
+    conn = obtener_conexion()
+    try:
+        _comprobar_cursor(conn, desde)
+        filas = conn.execute(f"""
+        SELECT secuencia, tabla, clave, operacion, codigo_muestra, fecha
+        FROM cambios
+        WHERE secuencia > ? AND secuencia <= ? {filtro}
+        ORDER BY secuencia
+        LIMIT ?
+        """, (desde, hasta if hasta is not None else 2 ** 63 - 1, *parametros, limite)).fetchall()
+    finally:
+        conn.close()
+
+    return [dict(fila) for fila in filas]
+
+
+def recorrer_cambios(desde=0, tablas=None, hasta=None):
+    """
+    Recorre todos los cambios posteriores a un cursor con lecturas cortas de
+    FILAS_POR_LOTE cambios
+
+    Args:
+        desde (int): Cursor: secuencia del último cambio ya procesado
+        tablas (iterable, optional): Recorrer solo los cambios de estas tablas
+        hasta (int, optional): No recorrer cambios posteriores a esta secuencia
+
+    Yields:
+        dict: Cambios, como en leer_cambios()
+
+    Raises:
+        CambiosCompactados: Si faltan cambios posteriores al cursor
+    """
+    while True:
+        cambios = leer_cambios(desde, tablas, FILAS_POR_LOTE, hasta)
+        if not cambios:
+            return
+        yield from cambios
+        desde = cambios[-1]["secuencia"]
+
+
+@medir
+def cambios_netos(desde=0, tablas=None, hasta=None):
+    """
+    Reduce los cambios posteriores a un cursor a la última operación de cada
+    fila: lo que necesita un consumidor que vuelve a leer las filas modificadas
+    y descarta las borradas
+
+    Args:
+        desde (int): Cursor: secuencia del último cambio ya procesado
+        tablas (iterable, optional): Solo los cambios de estas tablas
+        hasta (int, optional): No tener en cuenta cambios posteriores a esta secuencia
+
+    Returns:
+        dict: tabla -> {clave: operación}; las claves son texto
+
+    Raises:
+        CambiosCompactados: Si faltan cambios posteriores al cursor
+    """
+    netos = {}
+    for cambio in recorrer_cambios(desde, tablas, hasta):
+        netos.setdefault(cambio["tabla"], {})[cambio["clave"]] = cambio["operacion"]
+    return netos
+
+
+@medir
+def obtener_cursor(consumidor):
+    """
+    Devuelve el cursor guardado de un consumidor
+
+    Args:
+        consumidor (str): Nombre del consumidor
+
+    Returns:
+        int: Secuencia del último cambio que procesó, o None si no tiene cursor
+    """
+    conn = obtener_conexion()
+    try:
+        fila = conn.execute(
+            "SELECT secuencia FROM consumidores_cambios WHERE consumidor = ?", (consumidor,)
+        ).fetchone()
+    finally:
+        conn.close()
+    return fila[0] if fila else None
+
+
+@medir
+def guardar_cursor(consumidor, secuencia):
+    """
+    Guarda el cursor de un consumidor después de procesar sus cambios
+
+    Args:
+        consumidor (str): Nombre del consumidor
+        secuencia (int): Secuencia del último cambio procesado
+    """
+    ejecutar_escritura(lambda conn: conn.execute("""
+    INSERT INTO consumidores_cambios (consumidor, secuencia, fecha_actualizacion)
+    VALUES (?, ?, CURRENT_TIMESTAMP)
+    ON CONFLICT (consumidor) DO UPDATE SET
+        secuencia = excluded.secuencia, fecha_actualizacion = excluded.fecha_actualizacion
+    """, (consumidor, secuencia)))
+
+
+@medir
+def compactar_cambios(retencion_dias=None):
+    """
+    Borra los cambios anotados hace más de retencion_dias días, en
+    transacciones cortas de FILAS_POR_LOTE cambios
+
+    Args:
+        retencion_dias (float, optional): Por defecto, RETENCION_CAMBIOS_DIAS
+
+    Returns:
+        dict: eliminados (número de cambios borrados) y consumidores_afectados
+            (consumidores con cursor cuyos cambios pendientes se han borrado)
+    """
+    retencion_dias = RETENCION_CAMBIOS_DIAS if retencion_dias is None else retencion_dias
+    limite = f"-{retencion_dias * 86400:.0f} seconds"
+
+    def borrar(conn):
+        return conn.execute("""
+        DELETE FROM cambios
+        WHERE secuencia IN (
+            SELECT secuencia FROM cambios
+            WHERE fecha < datetime('now', ?)
+            ORDER BY secuencia
+            LIMIT ?
+        )
+        """, (limite, FILAS_POR_LOTE)).rowcount
+
+    eliminados = 0
+    while True:
+        borrados = ejecutar_escritura(borrar)
+        eliminados += borrados
+        if borrados < FILAS_POR_LOTE:
+            break
+
+    conn = obtener_conexion()
+    try:
+        primera = conn.execute("SELECT MIN(secuencia) FROM cambios").fetchone()[0]
+        if primera is None:
+            primera = _secuencia_asignada(conn) + 1
+        afectados = [fila[0] for fila in conn.execute(
+            "SELECT consumidor FROM consumidores_cambios WHERE secuencia < ? ORDER BY consumidor", (primera - 1,)
+        )]
+    finally:
+        conn.close()
+
+    return {"eliminados": eliminados, "consumidores_afectados": afectados}
@@ -1,7 +1,11 @@
 import sqlite3
-from models.db import obtener_conexion
+from models.db import obtener_conexion, ejecutar_escritura, enrutar_por_muestra
 from models.muestras import actualizar_estado_muestra
+from models.interpretacion import interpretar_valor
+from models.metricas import medir
 
+@medir
+@enrutar_por_muestra
 def guardar_ensayo_cbr(codigo_muestra, fecha_ensayo, operario, 
                       energia_compactacion, densidad_seca, humedad_inicial, humedad_final,
                       hinchamiento, indice_cbr, absorcion_agua, dias_inmersion, sobrecarga,
@@ -27,12 +31,8 @@ def guardar_ensayo_cbr(codigo_muestra, fecha_ensayo, operario,
     Returns:
         int: ID del ensayo guardado
     """
-    conn = obtener_conexion()
-    c = conn.cursor()
-    
-    try:
-        # Iniciar transacción
-        conn.execute("BEGIN")
+    def insertar(conn):
+        c = conn.cursor()
         
         # Insertar en la tabla general de ensayos
         c.execute("""
@@ -55,22 +55,17 @@ def guardar_ensayo_cbr(codigo_muestra, fecha_ensayo, operario,
             hinchamiento, indice_cbr, absorcion_agua, dias_inmersion, sobrecarga
         ))
         
-        # Confirmar transacción
-        conn.execute("COMMIT")
-        
-        # Actualizar estado de la muestra
-        actualizar_estado_muestra(codigo_muestra, "con ensayo CBR")
-        
         return ensayo_id
-        
-    except Exception as e:
-        # Revertir cambios en caso de error
-        conn.execute("ROLLBACK")
-        raise e
     
-    finally:
-        conn.close()
+    ensayo_id = ejecutar_escritura(insertar)
+    
+    # Actualizar estado de la muestra
+    actualizar_estado_muestra(codigo_muestra, "con ensayo CBR")
+    
+    return ensayo_id
 
+@medir
+@enrutar_por_muestra
 def obtener_ensayo_cbr(codigo_muestra):
     """
     Obtiene el último ensayo CBR de una muestra
@@ -102,6 +97,8 @@ def obtener_ensayo_cbr(codigo_muestra):
     # Convertir a diccionario
     return dict(ensayo)
 
+@medir
+@enrutar_por_muestra
 def obtener_todos_ensayos_cbr(codigo_muestra=None):
     """
     Obtiene todos los ensayos CBR, opcionalmente filtrados por muestra
@@ -139,6 +136,7 @@ def obtener_todos_ensayos_cbr(codigo_muestra=None):
     
     return ensayos
 
+@medir
 def calcular_hinchamiento(altura_inicial, altura_final):
     """
     Calcula el hinchamiento en porcentaje
@@ -152,6 +150,7 @@ def calcular_hinchamiento(altura_inicial, altura_final):
     """
     return ((altura_final - altura_inicial) / altura_inicial) * 100
 
+@medir
 def calcular_absorcion_agua(masa_inicial, masa_final):
     """
     Calcula la absorción de agua en porcentaje
@@ -165,6 +164,7 @@ def calcular_absorcion_agua(masa_inicial, masa_final):
     """
     return ((masa_final - masa_inicial) / masa_inicial) * 100
 
+@medir
 def interpretar_resultado_cbr(indice_cbr):
     """
     Interpreta el resultado del ensayo CBR según valores típicos
@@ -175,13 +175,4 @@ def interpretar_resultado_cbr(indice_cbr):
     Returns:
         str: Interpretación del resultado
     """
-    if indice_cbr < 3:
-        return "Muy pobre (subrasante)"
-    elif indice_cbr < 7:
-        return "Pobre a regular (subrasante)"
-    elif indice_cbr < 20:
-        return "Regular (subbase)"
-    elif indice_cbr < 50:
-        return "Bueno (base)"
-    else:
-        return "Excelente (base)"
\ No newline at end of file
+    return interpretar_valor(indice_cbr, "cbr")
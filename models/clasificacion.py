@@ -0,0 +1,330 @@
+import numpy as np
+import pandas as pd
+from models.db import (obtener_conexion, ejecutar_escritura, enrutar_por_muestra, en_fragmento,
+                       fragmento_actual, fragmento_de, listar_fragmentos)
+from models.metricas import medir
+from models.granulometria import calcular_pasa_en_aperturas
+
+# Descripción de cada grupo del Sistema Unificado de Clasificación de Suelos
+DESCRIPCIONES_SUCS = {
+    "GW": "Grava bien graduada",
+    "GP": "Grava mal graduada",
+    "GM": "Grava limosa",
+    "GC": "Grava arcillosa",
+    "GC-GM": "Grava limo-arcillosa",
+    "GW-GM": "Grava bien graduada con limo",
+    "GW-GC": "Grava bien graduada con arcilla",
+    "GP-GM": "Grava mal graduada con limo",
+    "GP-GC": "Grava mal graduada con arcilla",
+    "SW": "Arena bien graduada",
+    "SP": "Arena mal graduada",
+    "SM": "Arena limosa",
+    "SC": "Arena arcillosa",
+    "SC-SM": "Arena limo-arcillosa",
+    "SW-SM": "Arena bien graduada con limo",
+    "SW-SC": "Arena bien graduada con arcilla",
+    "SP-SM": "Arena mal graduada con limo",
+    "SP-SC": "Arena mal graduada con arcilla",
+    "CL": "Arcilla de baja plasticidad",
+    "ML": "Limo de baja plasticidad",
+    "CL-ML": "Arcilla limosa de baja plasticidad",
+    "CH": "Arcilla de alta plasticidad",
+    "MH": "Limo de alta plasticidad",
+}
+
+# Aperturas (mm) de los tamices que delimitan finos y fracción grava
+APERTURA_FINOS = 0.075
+APERTURA_GRAVA = 4.75
+
+
+@medir
+def clasificar_sucs_vectorizado(porcentaje_finos, porcentaje_pasa_grava, coef_uniformidad,
+                                coef_curvatura, limite_liquido, indice_plasticidad):
+    """
+    Clasifica un conjunto de muestras según el SUCS (ASTM D2487) en una sola pasada
+
+    Todos los argumentos son secuencias de la misma longitud; los valores
+    ausentes se indican con NaN. Las muestras sin datos suficientes para
+    determinar su grupo quedan sin clasificar (None).
+
+    Args:
+        porcentaje_finos (array-like): Porcentaje que pasa por el tamiz 0.075 mm
+        porcentaje_pasa_grava (array-like): Porcentaje que pasa por el tamiz 4.75 mm
+        coef_uniformidad (array-like): Coeficiente de uniformidad (Cu)
+        coef_curvatura (array-like): Coeficiente de curvatura (Cc)
+        limite_liquido (array-like): Límite líquido en porcentaje
+        indice_plasticidad (array-like): Índice de plasticidad en porcentaje
+
+    Returns:
+        numpy.ndarray: Símbolo del grupo SUCS de cada muestra (dtype object)
+    """
+    finos = np.asarray(porcentaje_finos, dtype=float)
+    pasa_grava = np.asarray(porcentaje_pasa_grava, dtype=float)
+    cu = np.asarray(coef_uniformidad, dtype=float)
+    cc = np.asarray(coef_curvatura, dtype=float)
+    ll = np.asarray(limite_liquido, dtype=float)
+    ip = np.asarray(indice_plasticidad, dtype=float)
+
+    with np.errstate(invalid="ignore"):
+        # Posición respecto a la Línea A de la carta de plasticidad: IP = 0.73 * (LL - 20)
+        hay_limites = ~np.isnan(ll) & ~np.isnan(ip)
+        sobre_linea_a = ip >= 0.73 * (ll - 20)
+        arcilla = hay_limites & (ip > 7) & sobre_linea_a
+        limo = hay_limites & ((ip < 4) | ~sobre_linea_a)
+        arcilla_limosa = hay_limites & ~arcilla & ~limo
+        alta_plasticidad = ll >= 50
+
+        # Suelos de grano fino (50 % o más pasa por el tamiz 0.075 mm)
+        fino = finos >= 50
+        grupo_fino = np.select(
+            [
+                fino & hay_limites & alta_plasticidad & sobre_linea_a,
+                fino & hay_limites & alta_plasticidad,
+                fino & arcilla,
+                fino & arcilla_limosa,
+                fino & limo,
+            ],
+            ["CH", "MH", "CL", "CL-ML", "ML"],
+            default="",
+        )
+
+        # Suelos de grano grueso: grava si predomina la fracción retenida en 4.75 mm
+        grueso = (finos < 50) & ~np.isnan(pasa_grava)
+        grava = (100 - pasa_grava) > (pasa_grava - finos)
+        prefijo = np.where(grava, "G", "S")
+        bien_graduado = np.where(grava, cu >= 4, cu >= 6) & (cc >= 1) & (cc <= 3)
+        graduacion = np.char.add(prefijo, np.where(bien_graduado, "W", "P"))
+
+        sufijo_finos = np.select(
+            [arcilla, arcilla_limosa, limo],
+            [np.char.add(prefijo, "C"), np.char.add(prefijo, "C-GM"), np.char.add(prefijo, "M")],
+            default="",
+        )
+        # El sufijo dual de una arena limo-arcillosa es SC-SM
+        sufijo_finos = np.where(sufijo_finos == "SC-GM", "SC-SM", sufijo_finos)
+
+        doble_simbolo = np.where(
+            arcilla | arcilla_limosa,
+            np.char.add(graduacion, np.char.add("-", np.char.add(prefijo, "C"))),
+            np.char.add(graduacion, np.char.add("-", np.char.add(prefijo, "M"))),
+        )
+
+        grupo_grueso = np.select(
+            [
+                grueso & (finos < 5),
+                grueso & (finos <= 12) & hay_limites,
+                grueso & (finos > 12) & hay_limites,
+            ],
+            [graduacion, doble_simbolo, sufijo_finos],
+            default="",
+        )
+
+    grupos = np.where(fino, grupo_fino, grupo_grueso).astype(object)
+    grupos[grupos == ""] = None
+    return grupos
+
+
+@medir
+def obtener_datos_clasificacion(codigos_muestra=None):
+    """
+    Reúne, para cada muestra, el último ensayo granulométrico y el último ensayo
+    de límites de Atterberg en una única consulta por tabla
+
+    Args:
+        codigos_muestra (list, optional): Códigos de las muestras a incluir.
+            Si no se indica, se incluyen todas las muestras del archivo.
+
+    Returns:
+        pandas.DataFrame: Una fila por muestra con las columnas codigo_muestra,
+            porcentaje_finos, porcentaje_pasa_grava, coef_uniformidad,
+            coef_curvatura, limite_liquido e indice_plasticidad
+    """
+    conn = obtener_conexion()
+
+    try:
+        filtro = ""
+        if codigos_muestra is not None:
+            # Tabla temporal para filtrar por muchas muestras sin límite de parámetros
+            conn.execute("CREATE TEMP TABLE IF NOT EXISTS filtro_clasificacion (codigo_muestra TEXT PRIMARY KEY)")
+            conn.execute("DELETE FROM filtro_clasificacion")
+            conn.executemany(
+                "INSERT OR IGNORE INTO filtro_clasificacion (codigo_muestra) VALUES (?)",
+                ((codigo,) for codigo in codigos_muestra)
+            )
+            filtro = "AND m.codigo_muestra IN (SELECT codigo_muestra FROM filtro_clasificacion)"
+
+        df_muestras = pd.read_sql_query(f"""
+        SELECT m.codigo_muestra FROM muestras m
+        WHERE m.codigo_muestra IS NOT NULL {filtro}
+        """, conn)
+
+        df_granulometria = pd.read_sql_query(f"""
+        SELECT ultimo.codigo_muestra,
+               eg.coef_uniformidad,
+               eg.coef_curvatura,
+               eg.masa_total,
+               cg.serie_tamices,
+               cg.masas_retenidas
+        FROM (
+            SELECT e.codigo_muestra, MAX(e.id) AS ensayo_id
+            FROM ensayos e
+            JOIN ensayos_granulometricos g ON e.id = g.ensayo_id
+            GROUP BY e.codigo_muestra
+        ) ultimo
+        JOIN ensayos_granulometricos eg ON eg.ensayo_id = ultimo.ensayo_id
+        JOIN muestras m ON m.codigo_muestra = ultimo.codigo_muestra
+        LEFT JOIN curvas_granulometricas cg ON cg.ensayo_id = eg.ensayo_id
+        WHERE ultimo.codigo_muestra IS NOT NULL {filtro}
+        """, conn)
+
+        df_limites = pd.read_sql_query(f"""
+        SELECT codigo_muestra, limite_liquido, indice_plasticidad
+        FROM (
+            SELECT e.codigo_muestra, l.limite_liquido, l.indice_plasticidad,
+                   ROW_NUMBER() OVER (
+                       PARTITION BY e.codigo_muestra
+                       ORDER BY e.fecha_ensayo DESC, e.id DESC
+                   ) AS orden
+            FROM ensayos e
+            JOIN ensayos_limites l ON e.id = l.ensayo_id
+            JOIN muestras m ON m.codigo_muestra = e.codigo_muestra
+            WHERE e.tipo_ensayo = 'Límites de Atterberg' {filtro}
+        )
+        WHERE orden = 1
+        """, conn)
+    finally:
+        conn.close()
+
+    # Porcentajes que pasan por los tamices de la clasificación, calculados a partir de las curvas
+    pasa = calcular_pasa_en_aperturas(df_granulometria, [APERTURA_FINOS, APERTURA_GRAVA])
+    df_granulometria = df_granulometria[["codigo_muestra", "coef_uniformidad", "coef_curvatura"]].assign(
+        porcentaje_finos=pasa[:, 0], porcentaje_pasa_grava=pasa[:, 1]
+    )
+
+    return (df_muestras
+            .merge(df_granulometria, on="codigo_muestra", how="left")
+            .merge(df_limites, on="codigo_muestra", how="left"))
+
+
+@medir
+def clasificar_muestras(codigos_muestra=None):
+    """
+    Calcula la clasificación SUCS completa (granulometría y plasticidad) de un
+    conjunto de muestras
+
+    Args:
+        codigos_muestra (list, optional): Códigos de las muestras a clasificar.
+            Si no se indica, se clasifica todo el archivo.
+
+    Returns:
+        pandas.DataFrame: Datos de clasificación con las columnas adicionales
+            grupo_sucs y descripcion_sucs
+    """
+    df = obtener_datos_clasificacion(codigos_muestra)
+
+    df["grupo_sucs"] = clasificar_sucs_vectorizado(
+        df["porcentaje_finos"], df["porcentaje_pasa_grava"],
+        df["coef_uniformidad"], df["coef_curvatura"],
+        df["limite_liquido"], df["indice_plasticidad"]
+    )
+    df["descripcion_sucs"] = df["grupo_sucs"].map(DESCRIPCIONES_SUCS)
+
+    return df
+
+
+@medir
+def actualizar_clasificacion_sucs(codigos_muestra=None):
+    """
+    Clasifica las muestras indicadas y guarda el resultado en la tabla
+    clasificacion_sucs, reemplazando la clasificación anterior
+
+    Args:
+        codigos_muestra (list, optional): Códigos de las muestras a reclasificar.
+            Si no se indica, se reclasifica todo el archivo.
+
+    Returns:
+        pandas.DataFrame: Clasificaciones calculadas
+    """
+    fragmentos = listar_fragmentos() if fragmento_actual() is None else []
+    if fragmentos:
+        # Con fragmentos, cada uno clasifica y guarda sus muestras
+        resultados = []
+        for nombre in fragmentos:
+            codigos = None if codigos_muestra is None else [
+                codigo for codigo in codigos_muestra if fragmento_de(codigo) == nombre
+            ]
+            with en_fragmento(nombre):
+                resultados.append(actualizar_clasificacion_sucs(codigos))
+        return pd.concat(resultados, ignore_index=True)
+
+    df = clasificar_muestras(codigos_muestra)
+
+    columnas = ["codigo_muestra", "grupo_sucs", "porcentaje_finos", "porcentaje_pasa_grava",
+                "coef_uniformidad", "coef_curvatura", "limite_liquido", "indice_plasticidad"]
+    # Las filas se materializan para poder repetir la transacción si hay bloqueo
+    filas = list(df[columnas].astype(object).where(df[columnas].notna(), None).itertuples(index=False, name=None))
+
+    def guardar(conn):
+        conn.executemany("""
+        INSERT OR REPLACE INTO clasificacion_sucs
+        (codigo_muestra, grupo_sucs, porcentaje_finos, porcentaje_pasa_grava,
+         coef_uniformidad, coef_curvatura, limite_liquido, indice_plasticidad, fecha_calculo)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+        """, filas)
+
+    ejecutar_escritura(guardar)
+
+    return df
+
+
+@medir
+@enrutar_por_muestra
+def obtener_clasificacion_muestra(codigo_muestra):
+    """
+    Obtiene la clasificación SUCS guardada de una muestra
+
+    Args:
+        codigo_muestra (str): Código de la muestra
+
+    Returns:
+        dict: Clasificación guardada o None si la muestra no se ha clasificado
+    """
+    conn = obtener_conexion()
+    c = conn.cursor()
+
+    c.execute("SELECT * FROM clasificacion_sucs WHERE codigo_muestra = ?", (codigo_muestra,))
+    clasificacion = c.fetchone()
+    conn.close()
+
+    if not clasificacion:
+        return None
+
+    clasificacion_dict = dict(clasificacion)
+    clasificacion_dict["descripcion_sucs"] = DESCRIPCIONES_SUCS.get(clasificacion_dict["grupo_sucs"])
+    return clasificacion_dict
+
+
+@medir
+def obtener_muestras_por_grupo_sucs(grupo_sucs):
+    """
+    Obtiene los códigos de las muestras clasificadas en un grupo SUCS
+
+    Args:
+        grupo_sucs (str): Símbolo del grupo (por ejemplo "SC" o "GW-GM")
+
+    Returns:
+        list: Lista de códigos de muestra
+    """
+    conn = obtener_conexion()
+    c = conn.cursor()
+
+    c.execute("""
+    SELECT codigo_muestra FROM clasificacion_sucs
+    WHERE grupo_sucs = ?
+    ORDER BY codigo_muestra
+    """, (grupo_sucs,))
+
+    codigos = [row[0] for row in c.fetchall()]
+    conn.close()
+
+    return codigos
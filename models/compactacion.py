@@ -0,0 +1,247 @@
+import hashlib
+
+import pandas as pd
+from models.db import (obtener_conexion, ejecutar_escritura, enrutar_por_muestra, en_fragmento,
+                       fragmento_actual, listar_fragmentos)
+from models.metricas import medir
+
+# Criterios de enlace entre cada ensayo de campo y su Próctor de referencia.
+# En todos los casos se elige el Próctor de fecha más próxima al ensayo de campo
+# dentro del grupo indicado ("fecha" no restringe el grupo).
+CRITERIOS_ENLACE = {
+    "muestra": "codigo_muestra",
+    "material": "tipo_material",
+    "fecha": None,
+}
+
+COLUMNAS_CONTROL = [
+    "ensayo_id", "criterio", "codigo_muestra", "fecha_ensayo", "ensayo_proctor_id",
+    "densidad_seca_campo", "densidad_maxima", "grado_compactacion",
+    "humedad_campo", "humedad_optima", "desviacion_humedad"
+]
+
+
+def _leer_ensayos_campo(conn, desde_ensayo_id=0):
+    """
+    Lee los ensayos de picnómetro de arena posteriores a un ID de ensayo
+    """
+    return pd.read_sql_query("""
+    SELECT e.id AS ensayo_id, e.codigo_muestra, e.fecha_ensayo, m.tipo_material,
+           p.densidad_aparente, p.humedad AS humedad_campo
+    FROM ensayos e
+    JOIN ensayos_picnometro p ON e.id = p.ensayo_id
+    JOIN muestras m ON e.codigo_muestra = m.codigo_muestra
+    WHERE e.tipo_ensayo = 'Picnómetro de Arena' AND e.id > ?
+    """, conn, params=(desde_ensayo_id,))
+
+
+def _leer_ensayos_proctor(conn):
+    """
+    Lee todos los ensayos Próctor de referencia
+    """
+    return pd.read_sql_query("""
+    SELECT e.id AS ensayo_proctor_id, e.codigo_muestra, e.fecha_ensayo, m.tipo_material,
+           p.densidad_maxima, p.humedad_optima
+    FROM ensayos e
+    JOIN ensayos_proctor p ON e.id = p.ensayo_id
+    JOIN muestras m ON e.codigo_muestra = m.codigo_muestra
+    WHERE e.tipo_ensayo = 'Próctor' AND p.densidad_maxima > 0
+    """, conn)
+
+
+def _huella_materiales(conn):
+    """
+    Huella del tipo de material de las muestras con ensayos de campo o Próctor.
+    Con el criterio "material", cambiar el material de una muestra puede
+    cambiar cualquier enlace.
+    """
+    huella = hashlib.blake2b(digest_size=16)
+    for codigo, material in conn.execute("""
+    SELECT codigo_muestra, tipo_material FROM muestras
+    WHERE codigo_muestra IN (
+        SELECT codigo_muestra FROM ensayos WHERE tipo_ensayo IN ('Picnómetro de Arena', 'Próctor')
+    )
+    ORDER BY codigo_muestra
+    """):
+        huella.update(f"{codigo}\x1f{material}\x1e".encode("utf-8"))
+    return huella.hexdigest()
+
+
+@medir
+def calcular_control_compactacion(df_campo, df_proctor, criterio="muestra", tolerancia_dias=None):
+    """
+    Enlaza cada ensayo de campo con su Próctor de referencia y calcula el grado
+    de compactación y la desviación de humedad en una sola pasada
+
+    La densidad seca de campo se obtiene de la densidad aparente y la humedad
+    del ensayo de campo. Sin humedad no se puede calcular: la densidad seca, el
+    grado de compactación y la desviación de humedad quedan vacíos.
+
+    Args:
+        df_campo (pandas.DataFrame): Ensayos de picnómetro de arena
+        df_proctor (pandas.DataFrame): Ensayos Próctor de referencia
+        criterio (str): Criterio de enlace ("muestra", "material" o "fecha")
+        tolerancia_dias (int, optional): Diferencia máxima en días entre ambos ensayos
+
+    Returns:
+        pandas.DataFrame: Resultados del control, uno por ensayo de campo
+    """
+    if criterio not in CRITERIOS_ENLACE:
+        raise ValueError(f"Criterio de enlace no reconocido: {criterio}")
+
+    grupo = CRITERIOS_ENLACE[criterio]
+
+    if df_campo.empty:
+        return pd.DataFrame(columns=COLUMNAS_CONTROL)
+
+    campo = df_campo.copy()
+    proctor = df_proctor.copy()
+    campo["fecha"] = pd.to_datetime(campo["fecha_ensayo"], errors="coerce")
+    proctor["fecha"] = pd.to_datetime(proctor["fecha_ensayo"], errors="coerce")
+    proctor = proctor.drop(columns=["fecha_ensayo"] + [c for c in CRITERIOS_ENLACE.values() if c and c != grupo])
+    if grupo:
+        campo[grupo] = campo[grupo].astype(object)
+        proctor[grupo] = proctor[grupo].astype(object)
+
+    # merge_asof exige claves de fecha no nulas y ordenadas
+    con_fecha = campo["fecha"].notna()
+    proctor = proctor[proctor["fecha"].notna()].sort_values("fecha")
+
+    enlazado = pd.merge_asof(
+        campo[con_fecha].sort_values("fecha"),
+        proctor,
+        on="fecha",
+        by=grupo,
+        direction="nearest",
+        tolerance=pd.Timedelta(days=tolerancia_dias) if tolerancia_dias is not None else None,
+    )
+    enlazado = pd.concat([enlazado, campo[~con_fecha]], ignore_index=True)
+
+    humedad = enlazado["humedad_campo"].astype(float)
+    enlazado["densidad_seca_campo"] = enlazado["densidad_aparente"].astype(float) / (1 + humedad / 100)
+    enlazado["grado_compactacion"] = 100 * enlazado["densidad_seca_campo"] / enlazado["densidad_maxima"]
+    enlazado["desviacion_humedad"] = humedad - enlazado["humedad_optima"]
+    enlazado["criterio"] = criterio
+
+    return enlazado[COLUMNAS_CONTROL].sort_values("ensayo_id").reset_index(drop=True)
+
+
+@medir
+def actualizar_control_compactacion(criterio="muestra", completo=False, tolerancia_dias=None):
+    """
+    Refresca de forma incremental la tabla control_compactacion
+
+    Solo se procesan los ensayos de campo nuevos desde el último refresco. Si
+    han cambiado los ensayos Próctor (altas o bajas) o, con el criterio
+    "material", el material de alguna muestra, los enlaces pueden variar y se
+    recalcula el criterio completo.
+
+    Args:
+        criterio (str): Criterio de enlace ("muestra", "material" o "fecha")
+        completo (bool): Forzar el recálculo de todos los ensayos de campo
+        tolerancia_dias (int, optional): Diferencia máxima en días entre ensayos
+
+    Returns:
+        int: Número de ensayos de campo procesados
+    """
+    if criterio not in CRITERIOS_ENLACE:
+        raise ValueError(f"Criterio de enlace no reconocido: {criterio}")
+
+    fragmentos = listar_fragmentos() if fragmento_actual() is None else []
+    if fragmentos:
+        # Con fragmentos, cada uno enlaza y guarda sus propios ensayos
+        procesados = 0
+        for nombre in fragmentos:
+            with en_fragmento(nombre):
+                procesados += actualizar_control_compactacion(criterio, completo, tolerancia_dias)
+        return procesados
+
+    def refrescar(conn, completo):
+        c = conn.cursor()
+
+        c.execute("""
+        SELECT ultimo_ensayo_campo, ultimo_ensayo_proctor, num_ensayos_proctor, huella_materiales
+        FROM estado_control_compactacion WHERE criterio = ?
+        """, (criterio,))
+        estado = c.fetchone()
+
+        c.execute("SELECT COALESCE(MAX(ensayo_id), 0), COUNT(*) FROM ensayos_proctor")
+        ultimo_proctor, num_proctor = c.fetchone()
+        huella = _huella_materiales(conn) if criterio == "material" else None
+
+        # Los Próctor nuevos o eliminados, y los cambios de material con el
+        # criterio "material", pueden cambiar cualquier enlace
+        if estado is None or (estado[1], estado[2], estado[3]) != (ultimo_proctor, num_proctor, huella):
+            completo = True
+
+        if completo:
+            c.execute("DELETE FROM control_compactacion WHERE criterio = ?", (criterio,))
+            desde = 0
+        else:
+            # Descartar resultados de ensayos de campo eliminados
+            c.execute("""
+            DELETE FROM control_compactacion
+            WHERE criterio = ? AND ensayo_id NOT IN (SELECT ensayo_id FROM ensayos_picnometro)
+            """, (criterio,))
+            desde = estado[0]
+
+        df_campo = _leer_ensayos_campo(conn, desde)
+        df_control = calcular_control_compactacion(df_campo, _leer_ensayos_proctor(conn),
+                                                   criterio, tolerancia_dias)
+
+        filas = df_control.astype(object).where(df_control.notna(), None)
+        filas["fecha_ensayo"] = filas["fecha_ensayo"].map(lambda f: None if f is None else str(f))
+
+        c.executemany(f"""
+        INSERT OR REPLACE INTO control_compactacion
+        ({", ".join(COLUMNAS_CONTROL)}, fecha_calculo)
+        VALUES ({", ".join("?" for _ in COLUMNAS_CONTROL)}, CURRENT_TIMESTAMP)
+        """, filas.itertuples(index=False, name=None))
+
+        ultimo_campo = int(df_campo["ensayo_id"].max()) if not df_campo.empty else desde
+
+        c.execute("""
+        INSERT OR REPLACE INTO estado_control_compactacion
+        (criterio, ultimo_ensayo_campo, ultimo_ensayo_proctor, num_ensayos_proctor, huella_materiales,
+         fecha_actualizacion)
+        VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+        """, (criterio, ultimo_campo, ultimo_proctor, num_proctor, huella))
+
+        return len(df_control)
+
+    return ejecutar_escritura(lambda conn: refrescar(conn, completo))
+
+
+@medir
+@enrutar_por_muestra
+def obtener_control_compactacion(codigo_muestra=None, criterio="muestra"):
+    """
+    Obtiene los resultados del control de compactación, opcionalmente filtrados por muestra
+
+    Args:
+        codigo_muestra (str, optional): Código de la muestra para filtrar
+        criterio (str): Criterio de enlace con el que se calcularon los resultados
+
+    Returns:
+        list: Lista de resultados del control de compactación
+    """
+    conn = obtener_conexion()
+    c = conn.cursor()
+
+    if codigo_muestra:
+        c.execute("""
+        SELECT * FROM control_compactacion
+        WHERE criterio = ? AND codigo_muestra = ?
+        ORDER BY fecha_ensayo DESC
+        """, (criterio, codigo_muestra))
+    else:
+        c.execute("""
+        SELECT * FROM control_compactacion
+        WHERE criterio = ?
+        ORDER BY fecha_ensayo DESC
+        """, (criterio,))
+
+    resultados = [dict(row) for row in c.fetchall()]
+    conn.close()
+
+    return resultados
@@ -0,0 +1,518 @@
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+import models.db as db
+from models.db import leer_blob_por_trozos, obtener_conexion
+from models.metricas import medir
+
+# Directorio de las copias de seguridad (por defecto, "copias" junto a la base de datos)
+DIRECTORIO_COPIAS = os.environ.get("GARNOCEX_COPIAS_DIR")
+
+# Número de copias de la base de datos que se conservan al rotar
+COPIAS_RETENIDAS = max(1, int(os.environ.get("GARNOCEX_COPIAS_RETENER", "7")))
+
+# Horas entre copias programadas (0 desactiva la programación)
+INTERVALO_COPIAS_HORAS = float(os.environ.get("GARNOCEX_COPIAS_INTERVALO_H", "0"))
+
+# Páginas copiadas en cada paso de la API de backup y pausa entre pasos. Durante
+# la pausa la copia no tiene abierta ninguna transacción de lectura, así que los
+# escritores y los checkpoints del WAL no la esperan.
+PAGINAS_POR_PASO = 256
+PAUSA_ENTRE_PASOS = float(os.environ.get("GARNOCEX_COPIAS_PAUSA_MS", "20")) / 1000
+
+# Si otra conexión escribe durante la copia, SQLite la vuelve a empezar desde la
+# primera página. Tras este número de reinicios, con WAL se copia el resto en un
+# solo paso (una lectura larga no bloquea a los escritores). Sin WAL ese paso
+# bloquearía todas las escrituras durante la copia, así que se espera y se
+# repite la copia por pasos, con una espera que se dobla en cada intento; tras
+# INTENTOS_COPIA intentos la copia falla.
+REINICIOS_MAXIMOS = 3
+INTENTOS_COPIA = 4
+ESPERA_REINTENTO_COPIA = float(os.environ.get("GARNOCEX_COPIAS_ESPERA_REINTENTO_S", "30"))
+
+# Nombre de los ficheros de copia: garnocex-AAAAMMDD-HHMMSS.db
+PREFIJO_COPIA = "garnocex-"
+
+# Almacén de imágenes direccionado por contenido, dentro del directorio de copias
+DIRECTORIO_IMAGENES = "imagenes"
+INDICE_IMAGENES = "indice.json"
+
+# Tablas cuyas filas se cuentan al verificar una copia
+TABLAS_VERIFICADAS = ("muestras", "ensayos", "imagenes", "usuarios")
+
+class _CopiaReiniciada(Exception):
+    """
+    Interrumpe una copia que SQLite ha reiniciado demasiadas veces
+    """
+
+
+def directorio_copias():
+    """
+    Devuelve el directorio de las copias de seguridad
+
+    Con fragmentación, dentro de un fragmento es su subdirectorio.
+
+    Returns:
+        str: Ruta del directorio
+    """
+    return db.directorio_fragmento(
+        DIRECTORIO_COPIAS or os.path.join(os.path.dirname(os.path.abspath(db.DB_PATH)), "copias")
+    )
+
+
+def _copiar_por_pasos(origen, destino, paginas, pausa, progreso):
+    """
+    Copia la base de datos con la API de backup de SQLite, de paginas en paginas
+
+    Returns:
+        int: Número de veces que SQLite reinició la copia
+    """
+    estado = {"restantes": None, "reinicios": 0}
+
+    def avance(status, restantes, total):
+        # Sin reinicios las páginas restantes bajan en cada paso; tras un reinicio
+        # vuelven a ser las del primer paso
+        if estado["restantes"] is not None and restantes >= estado["restantes"]:
+            estado["reinicios"] += 1
+            if estado["reinicios"] > REINICIOS_MAXIMOS:
+                raise _CopiaReiniciada()
+        estado["restantes"] = restantes
+        if progreso:
+            progreso(1 - restantes / max(total, 1), f"{total - restantes} de {total} páginas copiadas")
+        # El parámetro sleep de backup() solo se aplica si el paso encuentra la base
+        # de datos bloqueada: la pausa entre pasos se hace aquí, ya sin la lectura abierta
+        if restantes and pausa:
+            time.sleep(pausa)
+
+    origen.backup(destino, pages=paginas, progress=avance)
+    return estado["reinicios"]
+
+
+def _copiar_a_fichero(origen, ruta, paginas, pausa, progreso):
+    """
+    Copia la base de datos en un fichero nuevo con _copiar_por_pasos
+
+    Returns:
+        int: Número de veces que SQLite reinició la copia
+    """
+    if os.path.exists(ruta):
+        os.remove(ruta)
+    copia = sqlite3.connect(ruta)
+    try:
+        reinicios = _copiar_por_pasos(origen, copia, paginas, pausa, progreso)
+        # Una copia es un único fichero, sin WAL que haya que llevar junto a ella
+        copia.execute("PRAGMA journal_mode=DELETE")
+    finally:
+        copia.close()
+    return reinicios
+
+
+@medir
+def crear_copia(destino=None, verificar=True, progreso=None):
+    """
+    Crea una copia de seguridad de la base de datos sin detener la aplicación.
+    Se usa la API de backup de SQLite por pasos de PAGINAS_POR_PASO páginas con
+    una pausa entre pasos, de modo que los escritores nunca esperan más de un
+    paso. Si las escrituras reinician la copia una y otra vez, con WAL el resto
+    se copia en un solo paso y sin WAL se espera y se repite (ver
+    REINICIOS_MAXIMOS). La copia se escribe en un fichero oculto y solo se
+    renombra cuando está completa (y verificada), así que una copia
+    interrumpida nunca parece válida.
+
+    Args:
+        destino (str, optional): Directorio de las copias. Por defecto, directorio_copias()
+        verificar (bool): Ejecuta verificar_copia() antes de dar la copia por buena
+        progreso (callable, optional): Función (fraccion, mensaje) a la que se
+            informa del avance
+
+    Returns:
+        dict: Ruta, tamaño en bytes, segundos, reinicios y resultado de la verificación
+
+    Raises:
+        RuntimeError: Si la copia no supera la verificación o, sin WAL, no se
+            completa en INTENTOS_COPIA intentos
+    """
+    destino = destino or directorio_copias()
+    os.makedirs(destino, exist_ok=True)
+
+    nombre = f"{PREFIJO_COPIA}{datetime.now().strftime('%Y%m%d-%H%M%S')}.db"
+    ruta = os.path.join(destino, nombre)
+    temporal = os.path.join(destino, f".{nombre}.tmp")
+
+    inicio = time.perf_counter()
+    origen = obtener_conexion()
+    try:
+        wal = origen.execute("PRAGMA journal_mode").fetchone()[0].lower() == "wal"
+        reinicios = 0
+        for intento in range(INTENTOS_COPIA):
+            try:
+                reinicios += _copiar_a_fichero(origen, temporal, PAGINAS_POR_PASO, PAUSA_ENTRE_PASOS, progreso)
+                break
+            except _CopiaReiniciada:
+                reinicios += REINICIOS_MAXIMOS + 1
+            if wal:
+                # Con escrituras continuas la copia por pasos no termina nunca
+                reinicios += _copiar_a_fichero(origen, temporal, -1, 0, progreso)
+                break
+            if intento == INTENTOS_COPIA - 1:
+                raise RuntimeError(f"La base de datos ha cambiado durante los {INTENTOS_COPIA} intentos de copia")
+            espera = ESPERA_REINTENTO_COPIA * 2 ** intento
+            if progreso:
+                progreso(0.0, f"La base de datos cambia sin parar; nuevo intento en {espera:g} s")
+            time.sleep(espera)
+    except BaseException:
+        if os.path.exists(temporal):
+            os.remove(temporal)
+        raise
+    finally:
+        origen.close()
+
+    verificacion = None
+    if verificar:
+        if progreso:
+            progreso(1.0, "Verificando la copia")
+        verificacion = verificar_copia(temporal)
+        if not verificacion["correcta"]:
+            os.replace(temporal, os.path.join(destino, f".{nombre}.defectuosa"))
+            raise RuntimeError(f"La copia no supera la verificación: {'; '.join(verificacion['integridad'])}")
+
+    os.replace(temporal, ruta)
+    if verificacion:
+        verificacion["ruta"] = ruta
+
+    return {
+        "ruta": ruta,
+        "bytes": os.path.getsize(ruta),
+        "segundos": round(time.perf_counter() - inicio, 3),
+        "reinicios": reinicios,
+        "verificacion": verificacion
+    }
+
+
+@medir
+def verificar_copia(ruta):
+    """
+    Comprueba que una copia se puede restaurar: la abre en solo lectura, ejecuta
+    PRAGMA integrity_check y cuenta las filas de las tablas principales
+
+    Args:
+        ruta (str): Fichero de la copia
+
+    Returns:
+        dict: ruta, correcta (bool), integridad (mensajes de integrity_check) y
+            tablas (filas por tabla; None si la tabla no existe)
+
+    Raises:
+        FileNotFoundError: Si el fichero no existe
+    """
+    if not os.path.isfile(ruta):
+        raise FileNotFoundError(ruta)
+
+    # mode=ro: la verificación no puede modificar la copia ni crear un WAL
+    conn = sqlite3.connect(f"{Path(os.path.abspath(ruta)).as_uri()}?mode=ro", uri=True)
+    try:
+        try:
+            integridad = [fila[0] for fila in conn.execute("PRAGMA integrity_check")]
+        except sqlite3.DatabaseError as e:
+            # El fichero no es una base de datos o tiene la cabecera dañada
+            return {"ruta": ruta, "correcta": False, "integridad": [str(e)], "tablas": {}}
+
+        existentes = {fila[0] for fila in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        tablas = {
+            tabla: conn.execute(f"SELECT COUNT(*) FROM {tabla}").fetchone()[0] if tabla in existentes else None
+            for tabla in TABLAS_VERIFICADAS
+        }
+    finally:
+        conn.close()
+
+    return {"ruta": ruta, "correcta": integridad == ["ok"], "integridad": integridad, "tablas": tablas}
+
+
+@medir
+def listar_copias(destino=None):
+    """
+    Devuelve las copias de seguridad completas, de la más reciente a la más antigua
+
+    Args:
+        destino (str, optional): Directorio de las copias
+
+    Returns:
+        list: Diccionarios con nombre, ruta, bytes y fecha (timestamp de modificación)
+    """
+    destino = destino or directorio_copias()
+    try:
+        ficheros = os.listdir(destino)
+    except OSError:
+        return []
+
+    copias = []
+    for fichero in sorted(ficheros, reverse=True):
+        if fichero.startswith(PREFIJO_COPIA) and fichero.endswith(".db"):
+            ruta = os.path.join(destino, fichero)
+            informacion = os.stat(ruta)
+            copias.append({"nombre": fichero, "ruta": ruta, "bytes": informacion.st_size,
+                           "fecha": informacion.st_mtime})
+    return copias
+
+
+@medir
+def rotar_copias(destino=None, retener=None):
+    """
+    Borra las copias más antiguas, conservando las retener más recientes, y los
+    ficheros temporales de copias que no llegaron a terminar
+
+    Args:
+        destino (str, optional): Directorio de las copias
+        retener (int, optional): Copias que se conservan. Por defecto, COPIAS_RETENIDAS
+
+    Returns:
+        list: Nombres de los ficheros borrados
+    """
+    destino = destino or directorio_copias()
+    retener = retener or COPIAS_RETENIDAS
+
+    borrados = [copia["nombre"] for copia in listar_copias(destino)[retener:]]
+    try:
+        # Temporales de una copia interrumpida (no de una que está en curso)
+        limite = time.time() - 24 * 3600
+        borrados += [fichero for fichero in os.listdir(destino)
+                     if fichero.startswith(f".{PREFIJO_COPIA}")
+                     and os.path.getmtime(os.path.join(destino, fichero)) < limite]
+    except OSError:
+        pass
+
+    for fichero in borrados:
+        try:
+            os.remove(os.path.join(destino, fichero))
+        except OSError:
+            pass
+    return borrados
+
+
+def _leer_indice(ruta):
+    try:
+        with open(ruta, encoding="utf-8") as f:
+            return {int(clave): valor for clave, valor in json.load(f).items()}
+    except FileNotFoundError:
+        return {}
+
+
+def _escribir_indice(ruta, indice):
+    temporal = f"{ruta}.tmp"
+    with open(temporal, "w", encoding="utf-8") as f:
+        json.dump({str(clave): valor for clave, valor in sorted(indice.items())}, f, ensure_ascii=False)
+    os.replace(temporal, ruta)
+
+
+def _guardar_imagen(conn, imagen_id, almacen):
+    """
+    Copia una imagen al almacén por trozos, calculando su SHA-256 al leerla
+
+    Returns:
+        str: SHA-256 de la imagen, o None si ya no existe
+    """
+    temporal = os.path.join(almacen, f".{imagen_id}.tmp")
+    resumen = hashlib.sha256()
+    try:
+        with open(temporal, "wb") as f:
+            for trozo in leer_blob_por_trozos(conn, "imagenes", "imagen", imagen_id):
+                resumen.update(trozo)
+                f.write(trozo)
+    except KeyError:
+        os.remove(temporal)
+        return None
+
+    sha = resumen.hexdigest()
+    ruta = os.path.join(almacen, sha[:2], f"{sha}.png")
+    if os.path.exists(ruta):
+        # Mismo contenido que otra imagen ya copiada
+        os.remove(temporal)
+    else:
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        os.replace(temporal, ruta)
+    return sha
+
+
+@medir
+def copiar_imagenes(destino=None, completa=False, progreso=None):
+    """
+    Copia incrementalmente las imágenes a un almacén direccionado por contenido
+    (imagenes/<sha[:2]>/<sha256>.png) con un índice id -> contenido. Solo se leen
+    las imágenes nuevas y las que han cambiado de tamaño desde la última copia;
+    las imágenes repetidas se guardan una sola vez. Las que ya no se usan se
+    borran cuando son más antiguas que la copia de la base de datos más antigua
+    que se conserva.
+
+    Args:
+        destino (str, optional): Directorio de las copias
+        completa (bool): Vuelve a leer todas las imágenes, aunque no hayan cambiado de tamaño
+        progreso (callable, optional): Función (fraccion, mensaje)
+
+    Returns:
+        dict: imagenes (total), copiadas, eliminadas (del índice) y huerfanos (ficheros borrados)
+    """
+    destino = destino or directorio_copias()
+    almacen = os.path.join(destino, DIRECTORIO_IMAGENES)
+    os.makedirs(almacen, exist_ok=True)
+    ruta_indice = os.path.join(almacen, INDICE_IMAGENES)
+    indice = _leer_indice(ruta_indice)
+
+    # Tamaño de cada imagen sin leer su contenido, por lotes cortos
+    actuales = {}
+    ultimo_id = 0
+    while True:
+        conn = obtener_conexion()
+        try:
+            filas = conn.execute("""
+            SELECT id, length(imagen), codigo_muestra, nombre_archivo
+            FROM imagenes
+            WHERE id > ? AND imagen IS NOT NULL
+            ORDER BY id
+            LIMIT ?
+            """, (ultimo_id, 5000)).fetchall()
+        finally:
+            conn.close()
+        if not filas:
+            break
+        for fila in filas:
+            actuales[fila[0]] = (fila[1], fila[2], fila[3])
+        ultimo_id = filas[-1][0]
+
+    pendientes = [imagen_id for imagen_id, (tamano, _, _) in actuales.items()
+                  if completa or imagen_id not in indice or indice[imagen_id]["bytes"] != tamano]
+    eliminadas = [imagen_id for imagen_id in indice if imagen_id not in actuales]
+    for imagen_id in eliminadas:
+        del indice[imagen_id]
+
+    copiadas = 0
+    for i, imagen_id in enumerate(pendientes):
+        conn = obtener_conexion()
+        try:
+            sha = _guardar_imagen(conn, imagen_id, almacen)
+        finally:
+            conn.close()
+        if sha is None:
+            indice.pop(imagen_id, None)
+            continue
+        tamano, codigo, nombre = actuales[imagen_id]
+        indice[imagen_id] = {"sha256": sha, "bytes": tamano, "codigo_muestra": codigo, "nombre_archivo": nombre}
+        copiadas += 1
+        if progreso:
+            progreso((i + 1) / len(pendientes), f"{i + 1} de {len(pendientes)} imágenes copiadas")
+        # El índice se guarda de vez en cuando para no repetir lo copiado si se interrumpe
+        if copiadas % 500 == 0:
+            _escribir_indice(ruta_indice, indice)
+
+    _escribir_indice(ruta_indice, indice)
+
+    return {"imagenes": len(indice), "copiadas": copiadas, "eliminadas": len(eliminadas),
+            "huerfanos": _borrar_imagenes_huerfanas(destino, almacen, indice)}
+
+
+def _borrar_imagenes_huerfanas(destino, almacen, indice):
+    """
+    Borra del almacén las imágenes que no están en el índice y son anteriores a
+    la copia más antigua que se conserva (las copias posteriores no las contienen)
+    """
+    copias = listar_copias(destino)
+    if not copias:
+        return 0
+    limite = copias[-1]["fecha"]
+    usadas = {entrada["sha256"] for entrada in indice.values()}
+
+    borradas = 0
+    for raiz, _, ficheros in os.walk(almacen):
+        for fichero in ficheros:
+            ruta = os.path.join(raiz, fichero)
+            if (fichero.endswith(".png") and fichero[:-4] not in usadas
+                    and os.path.getmtime(ruta) < limite):
+                os.remove(ruta)
+                borradas += 1
+    return borradas
+
+
+def _ultima_copia():
+    copias = listar_copias()
+    return copias[0]["fecha"] if copias else None
+
+
+def iniciar_copias_programadas():
+    """
+    Programa un trabajo de copia de seguridad cada INTERVALO_COPIAS_HORAS horas
+    (GARNOCEX_COPIAS_INTERVALO_H), contadas desde la última copia que hay en el
+    directorio. Sin intervalo no tiene efecto.
+
+    Returns:
+        bool: True si esta llamada programó las copias
+    """
+    from models.trabajos import programar_trabajo
+
+    return programar_trabajo("copia_seguridad", INTERVALO_COPIAS_HORAS, _ultima_copia)
+
+
+def _formatear_bytes(num):
+    for unidad in ("B", "KB", "MB", "GB"):
+        if num < 1024 or unidad == "GB":
+            return f"{num:.0f} {unidad}" if unidad == "B" else f"{num:.1f} {unidad}"
+        num /= 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Copias de seguridad de la base de datos en caliente")
+    parser.add_argument("--destino", help="Directorio de las copias (por defecto, GARNOCEX_COPIAS_DIR "
+                                          "o 'copias' junto a la base de datos)")
+    ordenes = parser.add_subparsers(dest="orden", required=True)
+    crear = ordenes.add_parser("crear", help="Crea una copia, rota las antiguas y copia las imágenes")
+    crear.add_argument("--sin-imagenes", action="store_true", help="No actualiza el almacén de imágenes")
+    verificar = ordenes.add_parser("verificar", help="Comprueba que una copia se puede restaurar")
+    verificar.add_argument("ruta", nargs="?", help="Fichero de la copia (por defecto, la más reciente)")
+    ordenes.add_parser("listar", help="Lista las copias existentes")
+    args = parser.parse_args()
+
+    if args.orden == "crear":
+        # La base de datos principal y cada fragmento, cada uno en su subdirectorio
+        con_muestras = db.bases_de_datos(principal=False)
+        for base in db.bases_de_datos():
+            destino = os.path.join(args.destino, base) if args.destino and base else args.destino
+            with db.en_fragmento(base):
+                copia = crear_copia(destino,
+                                    progreso=lambda fraccion, mensaje: print(f"  {mensaje}", file=sys.stderr))
+                print(f"Copia {copia['ruta']} ({_formatear_bytes(copia['bytes'])}) creada en {copia['segundos']:.1f} s")
+                for fichero in rotar_copias(destino):
+                    print(f"  Borrada {fichero}")
+                if not args.sin_imagenes and base in con_muestras:
+                    imagenes = copiar_imagenes(destino)
+                    print(f"Imágenes: {imagenes['copiadas']} copiadas de {imagenes['imagenes']}")
+
+    elif args.orden == "verificar":
+        ruta = args.ruta
+        if ruta is None:
+            copias = listar_copias(args.destino)
+            if not copias:
+                sys.exit("No hay copias de seguridad")
+            ruta = copias[0]["ruta"]
+        resultado = verificar_copia(ruta)
+        print(f"{ruta}: {'correcta' if resultado['correcta'] else 'DAÑADA'}")
+        for mensaje in resultado["integridad"][:20]:
+            if mensaje != "ok":
+                print(f"  {mensaje}")
+        for tabla, num in resultado["tablas"].items():
+            print(f"  {tabla:<12}{'-' if num is None else num:>12}")
+        if not resultado["correcta"]:
+            sys.exit(1)
+
+    else:
+        for copia in listar_copias(args.destino):
+            fecha = datetime.fromtimestamp(copia["fecha"]).strftime("%Y-%m-%d %H:%M")
+            print(f"{copia['nombre']}  {fecha}  {_formatear_bytes(copia['bytes']):>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,407 @@
 import sqlite3
+import contextvars
+import functools
+import itertools
+import json
 import os
+import queue
+import random
+import re
+import sys
+import time
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from models.trazas import conectar, ConexionTrazada
+from models.metricas import incrementar
 
-# Ruta de la base de datos
-DB_PATH = 'ensayos_geotecnicos.db'
+# Ruta de la base de datos (se puede cambiar con la variable de entorno GARNOCEX_DB_PATH)
+DB_PATH = os.environ.get("GARNOCEX_DB_PATH", "ensayos_geotecnicos.db")
 
-def obtener_conexion():
+# Espera máxima (s) de SQLite a que se libere un bloqueo antes de devolver "database is locked"
+TIEMPO_ESPERA_BLOQUEO = float(os.environ.get("GARNOCEX_BUSY_TIMEOUT_MS", "1000")) / 1000
+
+# Reintentos de una transacción de escritura bloqueada
+REINTENTOS_ESCRITURA = int(os.environ.get("GARNOCEX_REINTENTOS_ESCRITURA", "8"))
+
+# Espera base y máxima (s) del backoff exponencial entre reintentos
+ESPERA_BASE_REINTENTO = 0.05
+ESPERA_MAXIMA_REINTENTO = 2.0
+
+# Escritor único: un hilo con la única conexión de escritura confirma las escrituras en grupos
+# (models/escritor.py) y las lecturas usan un pool de conexiones bajo WAL
+ESCRITOR_ACTIVO = os.environ.get("GARNOCEX_ESCRITOR_UNICO", "") == "1"
+
+# Escrituras máximas por grupo y espera máxima (s) para completar un grupo
+TAMANO_MAXIMO_GRUPO = int(os.environ.get("GARNOCEX_GRUPO_MAX_ESCRITURAS", "32"))
+ESPERA_MAXIMA_GRUPO = float(os.environ.get("GARNOCEX_GRUPO_MAX_MS", "5")) / 1000
+
+# Espera máxima (s) de una escritura al escritor único: lo que tardaría un grupo
+# con todos sus reintentos, con margen para los grupos que tiene delante
+ESPERA_ESCRITOR = float(os.environ.get(
+    "GARNOCEX_ESPERA_ESCRITOR_S",
+    str(4 * (REINTENTOS_ESCRITURA + 1) * (TIEMPO_ESPERA_BLOQUEO + ESPERA_MAXIMA_REINTENTO))
+))
+
+# Conexiones de lectura que se conservan abiertas para reutilizarlas
+TAMANO_POOL_LECTURAS = int(os.environ.get("GARNOCEX_POOL_LECTURAS", "8"))
+
+# Tabla con los datos específicos de cada tipo de ensayo (enlazada con ensayos por ensayo_id):
+# nombre corto del tipo -> tabla
+TABLAS_ENSAYOS = {
+    "granulometria": "ensayos_granulometricos",
+    "limites": "ensayos_limites",
+    "proctor": "ensayos_proctor",
+    "cbr": "ensayos_cbr",
+    "densidad_arido": "ensayos_densidad_arido",
+    "picnometro": "ensayos_picnometro",
+    "equivalente_arena": "ensayos_equivalente_arena",
+    "lajas_agujas": "ensayos_lajas_agujas",
+}
+
+# Tablas cuyos cambios anotan los disparadores en la tabla cambios (models/cambios.py):
+# tabla -> (clave de la fila, código de su muestra), como expresiones SQL sobre la
+# fila {fila} (NEW u OLD)
+_CODIGO_ENSAYO = "(SELECT codigo_muestra FROM ensayos WHERE id = {fila}.ensayo_id)"
+TABLAS_CAMBIOS = {
+    "muestras": ("{fila}.codigo_muestra", "{fila}.codigo_muestra"),
+    "ensayos": ("{fila}.id", "{fila}.codigo_muestra"),
+    **{tabla: ("{fila}.ensayo_id", _CODIGO_ENSAYO) for tabla in TABLAS_ENSAYOS.values()},
+    "curvas_granulometricas": ("{fila}.ensayo_id", _CODIGO_ENSAYO),
+    "puntos_proctor": ("{fila}.id", _CODIGO_ENSAYO),
+    "imagenes": ("{fila}.id", "{fila}.codigo_muestra"),
+}
+
+# Tablas con los datos de un ensayo cuyos cambios cambian la versión del ensayo
+# (sincronización, models/sincronizacion.py)
+TABLAS_DETALLE_ENSAYO = (*TABLAS_ENSAYOS.values(), "curvas_granulometricas", "puntos_proctor")
+
+# Versión de una fila para la sincronización: milisegundos desde 1970 con 13
+# cifras (nunca menos que la versión anterior {anterior} + 1) y el nodo que la
+# escribió. Las versiones se comparan como texto.
+_ESTAMPA_VERSION = (
+    "printf('%013d:%s', max(CAST((julianday('now') - 2440587.5) * 86400000 AS INTEGER), "
+    "COALESCE(CAST(substr({anterior}, 1, 13) AS INTEGER), 0) + 1), (SELECT id FROM nodo_local))"
+)
+
+# Fragmentación opcional: directorio con una base de datos por proyecto (o por
+# año). Vacío: todas las muestras en DB_PATH. Con fragmentos, DB_PATH guarda el
+# resto (usuarios, trabajos, catálogo de fragmentos) y las consultas sobre todas
+# las muestras adjuntan los fragmentos.
+DIRECTORIO_FRAGMENTOS = os.environ.get("GARNOCEX_FRAGMENTOS_DIR", "")
+
+# Expresión regular cuyo primer grupo es el fragmento de un código de muestra.
+# Por defecto, el proyecto: lo que precede al primer "-", "_" o "/" ("OBRA12-034"
+# -> "obra12"). Por año, p. ej. r"^(?:\D*)(\d{4})" ("M2024-0012" -> "2024").
+PATRON_FRAGMENTO = re.compile(os.environ.get("GARNOCEX_FRAGMENTO_PATRON", r"^([^-_/]+)[-_/]"))
+
+# Fragmento de los códigos que no siguen el patrón
+FRAGMENTO_GENERAL = "general"
+
+# Los IDs autoincrementales del fragmento número n empiezan en n * IDS_POR_FRAGMENTO,
+# de modo que el ID de un ensayo o una imagen no se repite entre fragmentos
+IDS_POR_FRAGMENTO = 10 ** 12
+TABLAS_AUTOINCREMENTALES = ("ensayos", "imagenes", "puntos_proctor")
+
+# Tablas con los datos de las muestras, que se guardan en su fragmento
+TABLAS_FRAGMENTADAS = (
+    "muestras", "ensayos", *TABLAS_DETALLE_ENSAYO, "imagenes", "clasificacion_sucs",
+    "control_compactacion", "series_tamices",
+)
+
+# Hilos que consultan los fragmentos en paralelo (consultar_fragmentos)
+HILOS_FRAGMENTOS = max(1, int(os.environ.get("GARNOCEX_HILOS_FRAGMENTOS", "4")))
+
+# Muestras que se pasan a su fragmento por transacción (repartir_en_fragmentos)
+MUESTRAS_POR_REPARTO = 200
+
+# Fragmento al que se dirigen las conexiones del contexto actual (en_fragmento)
+_fragmento = contextvars.ContextVar("fragmento", default=None)
+
+_pool_lecturas = queue.LifoQueue(maxsize=TAMANO_POOL_LECTURAS)
+
+class ConexionReutilizable(ConexionTrazada):
+    """
+    Conexión del pool de lecturas: al cerrarla vuelve al pool en lugar de cerrarse
     """
-    Crea y devuelve una conexión a la base de datos SQLite.
-    Si la base de datos no existe, la crea y inicializa las tablas.
     
+    def close(self):
+        if self._en_pool:
+            return
+        revertir(self)
+        self.row_factory = sqlite3.Row
+        if self._ruta == DB_PATH:
+            try:
+                self._en_pool = True
+                _pool_lecturas.put_nowait(self)
+                return
+            except queue.Full:
+                self._en_pool = False
+        super().close()
+
+def _conexion_pool():
+    """
+    Toma una conexión del pool de lecturas o abre una nueva si está vacío
+    """
+    while True:
+        try:
+            conn = _pool_lecturas.get_nowait()
+        except queue.Empty:
+            break
+        if conn._ruta == DB_PATH:
+            conn._en_pool = False
+            return conn
+        # Conexión a una base de datos anterior
+        sqlite3.Connection.close(conn)
+    
+    conn = conectar(DB_PATH, timeout=TIEMPO_ESPERA_BLOQUEO, factory=ConexionReutilizable,
+                    check_same_thread=False)
+    conn._ruta = DB_PATH
+    conn._en_pool = False
+    return conn
+
+def fragmento_de(codigo_muestra):
+    """
+    Devuelve el fragmento en el que se guarda una muestra, según PATRON_FRAGMENTO
+
+    Args:
+        codigo_muestra (str): Código de la muestra
+
     Returns:
-        sqlite3.Connection: Objeto de conexión a la base de datos
+        str: Nombre del fragmento (en minúsculas y utilizable como nombre de fichero)
+    """
+    coincidencia = PATRON_FRAGMENTO.search(str(codigo_muestra))
+    nombre = re.sub(r"[^0-9a-z_-]+", "_", coincidencia.group(1).lower()).strip("_") if coincidencia else ""
+    return nombre or FRAGMENTO_GENERAL
+
+def fragmento_actual():
+    """
+    Devuelve el fragmento al que se dirigen las conexiones del contexto actual
+
+    Returns:
+        str: Nombre del fragmento, o None fuera de un fragmento o sin fragmentación
+    """
+    return _fragmento.get() if DIRECTORIO_FRAGMENTOS else None
+
+@contextmanager
+def en_fragmento(nombre):
+    """
+    Dirige al fragmento indicado las conexiones que se abren dentro del bloque
+    (obtener_conexion y ejecutar_escritura). El contexto se hereda en las
+    llamadas anidadas, no en otros hilos. Sin fragmentación no tiene efecto.
+
+    Args:
+        nombre (str): Nombre del fragmento, o None para volver a la conexión
+            global (la base de datos principal con los fragmentos adjuntos)
+    """
+    marca = _fragmento.set(nombre)
+    try:
+        yield
+    finally:
+        _fragmento.reset(marca)
+
+def enrutar_por_muestra(funcion):
+    """
+    Decorador de las funciones cuyo primer argumento es codigo_muestra: las
+    ejecuta en el fragmento de esa muestra. Sin código (None) se ejecutan en la
+    conexión global.
+
+    Args:
+        funcion (callable): Función a decorar
+
+    Returns:
+        callable: Función decorada
+    """
+    @functools.wraps(funcion)
+    def enrutada(*args, **kwargs):
+        codigo_muestra = args[0] if args else kwargs.get("codigo_muestra")
+        if not DIRECTORIO_FRAGMENTOS or codigo_muestra is None:
+            return funcion(*args, **kwargs)
+        with en_fragmento(fragmento_de(codigo_muestra)):
+            return funcion(*args, **kwargs)
+    return enrutada
+
+def ruta_bd():
+    """
+    Devuelve la ruta del fichero al que se dirigen las conexiones del contexto
+    actual: el del fragmento activo o DB_PATH
+
+    Returns:
+        str: Ruta del fichero de base de datos
+    """
+    nombre = fragmento_actual()
+    return DB_PATH if nombre is None else os.path.join(DIRECTORIO_FRAGMENTOS, f"{nombre}.db")
+
+def directorio_fragmento(directorio):
+    """
+    Devuelve el subdirectorio del fragmento activo dentro de un directorio de
+    datos derivados (copias, exportaciones, espejo de analítica)
+
+    Args:
+        directorio (str): Directorio de la base de datos principal
+
+    Returns:
+        str: directorio/<fragmento>, o el propio directorio fuera de un fragmento
+    """
+    nombre = fragmento_actual()
+    return directorio if nombre is None else os.path.join(directorio, nombre)
+
+def listar_fragmentos():
+    """
+    Devuelve los fragmentos creados, en el orden en que se crearon
+
+    Returns:
+        list: Nombres de los fragmentos (vacía sin fragmentación)
+    """
+    if not DIRECTORIO_FRAGMENTOS:
+        return []
+    conn = _conexion_principal()
+    try:
+        return [fila[0] for fila in conn.execute("SELECT nombre FROM fragmentos ORDER BY numero")]
+    finally:
+        conn.close()
+
+def bases_de_datos(principal=True):
+    """
+    Devuelve las bases de datos sobre las que se repite una operación que
+    trabaja con un fichero entero (copias, mantenimiento, recálculos), para
+    usarlas con en_fragmento()
+
+    Args:
+        principal (bool): Incluir la base de datos principal. Sin ella, con
+            fragmentos solo se devuelven estos, que son los que tienen muestras.
+
+    Returns:
+        list: None (la base de datos principal) y los nombres de los fragmentos
+    """
+    fragmentos = listar_fragmentos()
+    return [None, *fragmentos] if principal or not fragmentos else fragmentos
+
+def _crear_fragmento(nombre, ruta):
+    """
+    Registra un fragmento en la base de datos principal, que le asigna su número,
+    y crea su fichero con todas las tablas y los IDs a partir de número *
+    IDS_POR_FRAGMENTO. El fichero se prepara aparte y se enlaza con su nombre
+    al final, así que nadie abre un fragmento a medio crear.
+
+    Raises:
+        ValueError: Si ya hay tantos fragmentos como SQLite puede adjuntar a una
+            conexión (SQLITE_LIMIT_ATTACHED): con uno más, las consultas de todo
+            el archivo (obtener_conexion fuera de un fragmento) dejarían de funcionar
+    """
+    def registrar(conn):
+        if conn.execute("SELECT 1 FROM fragmentos WHERE nombre = ?", (nombre,)).fetchone() is None:
+            total = conn.execute("SELECT COUNT(*) FROM fragmentos").fetchone()[0]
+            limite = conn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+            if total >= limite:
+                raise ValueError(
+                    f"No se puede crear el fragmento '{nombre}': ya hay {total} y SQLite solo puede "
+                    f"adjuntar {limite} a una conexión. Agrupe los códigos con GARNOCEX_FRAGMENTO_PATRON"
+                )
+        conn.execute("""
+        INSERT OR IGNORE INTO fragmentos (nombre, numero, fecha_creacion)
+        SELECT ?, COALESCE(MAX(numero), 0) + 1, CURRENT_TIMESTAMP FROM fragmentos
+        """, (nombre,))
+        return conn.execute("SELECT numero FROM fragmentos WHERE nombre = ?", (nombre,)).fetchone()[0]
+
+    numero = ejecutar_escritura(registrar, _conexion_principal)
+
+    os.makedirs(DIRECTORIO_FRAGMENTOS, exist_ok=True)
+    temporal = f"{ruta}.{os.getpid()}.tmp"
+    conn = conectar(temporal, timeout=TIEMPO_ESPERA_BLOQUEO)
+    try:
+        inicializar_tablas(conn)
+        for tabla in TABLAS_AUTOINCREMENTALES:
+            conn.execute("""
+            INSERT INTO sqlite_sequence (name, seq)
+            SELECT ?, 0 WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = ?)
+            """, (tabla, tabla))
+            conn.execute("UPDATE sqlite_sequence SET seq = max(seq, ?) WHERE name = ?",
+                         (numero * IDS_POR_FRAGMENTO, tabla))
+        conn.commit()
+    finally:
+        conn.close()
+
+    try:
+        os.link(temporal, ruta)
+    except FileExistsError:
+        # Otro proceso lo ha creado a la vez
+        pass
+    finally:
+        os.remove(temporal)
+
+def _conexion_fragmento(nombre):
+    """
+    Abre una conexión al fichero de un fragmento, creándolo si no existe
+    """
+    ruta = os.path.join(DIRECTORIO_FRAGMENTOS, f"{nombre}.db")
+    if not os.path.exists(ruta):
+        _crear_fragmento(nombre, ruta)
+    conn = conectar(ruta, timeout=TIEMPO_ESPERA_BLOQUEO)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def _adjuntar_fragmentos(conn):
+    """
+    Adjunta los fragmentos a una conexión a la base de datos principal y crea
+    una vista temporal con el nombre de cada tabla de TABLAS_FRAGMENTADAS que
+    une (UNION ALL) la tabla de la base principal y las de los fragmentos. Las
+    vistas ocultan las tablas de la base principal: las lecturas ven todas las
+    muestras y una escritura en esas tablas falla en lugar de guardarse fuera de
+    su fragmento. Las conexiones del pool conservan lo adjuntado mientras no
+    cambie la lista de fragmentos.
+
+    Raises:
+        sqlite3.OperationalError: Si hay más fragmentos de los que SQLite puede
+            adjuntar a una conexión (SQLITE_LIMIT_ATTACHED, 10 por defecto)
+    """
+    fragmentos = tuple(tuple(fila) for fila in conn.execute("SELECT numero, nombre FROM fragmentos ORDER BY numero"))
+    adjuntos = getattr(conn, "_fragmentos", None)
+    if adjuntos == fragmentos:
+        return
+
+    limite = conn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+    if len(fragmentos) > limite:
+        raise sqlite3.OperationalError(
+            f"Hay {len(fragmentos)} fragmentos y SQLite solo puede adjuntar {limite} a una conexión: "
+            "agrupe los códigos con GARNOCEX_FRAGMENTO_PATRON o use consultar_fragmentos()"
+        )
+
+    for numero, _ in adjuntos or ():
+        conn.execute(f"DETACH DATABASE fragmento_{numero}")
+    for numero, nombre in fragmentos:
+        conn.execute(f"ATTACH DATABASE ? AS fragmento_{numero}",
+                     (os.path.join(DIRECTORIO_FRAGMENTOS, f"{nombre}.db"),))
+
+    for tabla in TABLAS_FRAGMENTADAS:
+        # Las columnas se nombran: su orden puede variar entre ficheros
+        columnas = ", ".join(f'"{fila[1]}"' for fila in conn.execute(f"PRAGMA main.table_info({tabla})"))
+        union = " UNION ALL ".join(
+            f"SELECT {columnas} FROM {esquema}.{tabla}"
+            for esquema in ("main", *(f"fragmento_{numero}" for numero, _ in fragmentos))
+        )
+        if tabla == "series_tamices":
+            # Cada fragmento tiene su copia del catálogo
+            union = f"SELECT * FROM ({union}) GROUP BY id"
+        conn.execute(f"DROP VIEW IF EXISTS temp.{tabla}")
+        conn.execute(f"CREATE TEMP VIEW {tabla} AS {union}")
+
+    conn._fragmentos = fragmentos
+
+def _conexion_principal(pool=False):
+    """
+    Abre una conexión a la base de datos principal (DB_PATH), creándola si no
+    existe. Con pool, la toma del pool de lecturas del escritor único; esas
+    conexiones pueden tener los fragmentos adjuntos.
     """
     # Comprobar si la base de datos existe
     db_existe = os.path.exists(DB_PATH)
     
-    # Crear conexión
-    conn = sqlite3.connect(DB_PATH)
+    # Crear conexión (o reutilizar una del pool con el escritor único)
+    if pool and ESCRITOR_ACTIVO and db_existe:
+        conn = _conexion_pool()
+    else:
+        conn = conectar(DB_PATH, timeout=TIEMPO_ESPERA_BLOQUEO)
     conn.row_factory = sqlite3.Row
     
     # Si la base de datos no existía, inicializar las tablas
@@ -25,6 +410,142 @@ def obtener_conexion():
     
     return conn
 
+def obtener_conexion():
+    """
+    Crea y devuelve una conexión a la base de datos SQLite.
+    Si la base de datos no existe, la crea y inicializa las tablas.
+    
+    Con fragmentación (GARNOCEX_FRAGMENTOS_DIR), dentro de en_fragmento() la
+    conexión es al fichero del fragmento; fuera de él, a la base de datos
+    principal con los fragmentos adjuntos (ver _adjuntar_fragmentos).
+    
+    Returns:
+        sqlite3.Connection: Objeto de conexión a la base de datos
+    """
+    nombre = fragmento_actual()
+    if nombre is not None:
+        return _conexion_fragmento(nombre)
+    
+    conn = _conexion_principal(pool=True)
+    if DIRECTORIO_FRAGMENTOS:
+        try:
+            _adjuntar_fragmentos(conn)
+        except BaseException:
+            conn.close()
+            raise
+    
+    return conn
+
+def consultar_fragmentos(consulta, parametros=()):
+    """
+    Ejecuta una consulta de lectura en cada fragmento por separado, en paralelo
+    con HILOS_FRAGMENTOS hilos, y reúne las filas. A diferencia de la conexión
+    global, no tiene límite de fragmentos y cada fichero se lee con su propia
+    conexión. Sin fragmentación, la consulta se ejecuta en la conexión global.
+
+    Args:
+        consulta (str): Consulta SQL sobre las tablas de un fragmento
+        parametros (tuple): Parámetros de la consulta
+
+    Returns:
+        list: Filas (sqlite3.Row) de todos los fragmentos, en el orden de los
+            fragmentos; el orden entre fragmentos lo debe rehacer quien llama
+    """
+    def leer(nombre):
+        with en_fragmento(nombre):
+            conn = obtener_conexion()
+            try:
+                return conn.execute(consulta, parametros).fetchall()
+            finally:
+                conn.close()
+
+    fragmentos = listar_fragmentos()
+    if not fragmentos:
+        return leer(None)
+    with ThreadPoolExecutor(max_workers=min(HILOS_FRAGMENTOS, len(fragmentos))) as ejecutor:
+        return [fila for filas in ejecutor.map(leer, fragmentos) for fila in filas]
+
+def es_error_bloqueo(error):
+    """
+    Indica si un error de SQLite se debe a que otra conexión tiene bloqueada la base de datos
+    
+    Args:
+        error (Exception): Error capturado
+        
+    Returns:
+        bool: True para "database is locked" y errores SQLITE_BUSY/SQLITE_LOCKED
+    """
+    if not isinstance(error, sqlite3.OperationalError):
+        return False
+    if getattr(error, "sqlite_errorname", None) in ("SQLITE_BUSY", "SQLITE_LOCKED"):
+        return True
+    return "locked" in str(error).lower()
+
+def revertir(conn):
+    """
+    Revierte la transacción abierta de una conexión sin ocultar el error que la
+    interrumpió: si el propio ROLLBACK falla, se informa y se ignora.
+    
+    Args:
+        conn (sqlite3.Connection): Conexión a la base de datos
+    """
+    if not conn.in_transaction:
+        return
+    try:
+        conn.rollback()
+    except sqlite3.Error as e:
+        print(f"Error al revertir la transacción: {str(e)}")
+
+def ejecutar_escritura(operacion, obtener=None):
+    """
+    Ejecuta una operación de escritura en su propia transacción BEGIN IMMEDIATE,
+    reintentándola con backoff exponencial y jitter si la base de datos está bloqueada.
+    
+    BEGIN IMMEDIATE toma el bloqueo de escritura al empezar, de modo que la
+    transacción espera (busy_timeout) o falla antes de haber escrito nada y puede
+    repetirse entera. La operación debe limitarse a la base de datos: se vuelve a
+    llamar en cada reintento.
+    
+    Con el escritor único activo (GARNOCEX_ESCRITOR_UNICO=1), la operación se
+    encola para el hilo escritor, que la confirma junto con las que lleguen a la
+    vez, y esta función espera a su resultado durante ESPERA_ESCRITOR segundos
+    como máximo (TimeoutError). Si el hilo escritor se detiene, se arranca otro;
+    si tampoco puede escribir, la escritura falla. Las escrituras en un fragmento
+    (en_fragmento) no pasan por el escritor único: cada fichero tiene su propio
+    bloqueo de escritura.
+    
+    Args:
+        operacion (callable): Función que recibe la conexión, ejecuta las sentencias
+            y devuelve el resultado. No debe hacer COMMIT ni ROLLBACK.
+        obtener (callable, optional): Función que abre la conexión. Por defecto, obtener_conexion
+        
+    Returns:
+        El valor devuelto por la operación
+    """
+    if ESCRITOR_ACTIVO and fragmento_actual() is None:
+        from models.escritor import enviar_escritura, esperar_escritura
+        return esperar_escritura(enviar_escritura(operacion), ESPERA_ESCRITOR)
+    
+    obtener = obtener or obtener_conexion
+    
+    for intento in range(REINTENTOS_ESCRITURA + 1):
+        conn = obtener()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            resultado = operacion(conn)
+            conn.execute("COMMIT")
+            return resultado
+        except Exception as e:
+            revertir(conn)
+            if not es_error_bloqueo(e) or intento == REINTENTOS_ESCRITURA:
+                raise
+        finally:
+            conn.close()
+        
+        # Backoff exponencial con jitter completo para que los escritores no se sincronicen
+        incrementar("reintentos_bloqueo_total")
+        time.sleep(random.uniform(0, min(ESPERA_MAXIMA_REINTENTO, ESPERA_BASE_REINTENTO * 2 ** intento)))
+
 def inicializar_tablas(conn):
     """
     Inicializa las tablas necesarias en la base de datos.
@@ -34,6 +555,10 @@ def inicializar_tablas(conn):
     """
     c = conn.cursor()
     
+    # Las páginas libres se devuelven al sistema de ficheros con incremental_vacuum
+    # (models/mantenimiento.py). Solo tiene efecto en una base de datos nueva.
+    c.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    
     # Crear tabla de muestras
     c.execute('''
     CREATE TABLE IF NOT EXISTS muestras (
@@ -59,6 +584,10 @@ def inicializar_tablas(conn):
     )
     ''')
     
+    # Apartar la tabla de ensayos granulométricos con la estructura antigua; sus
+    # datos se migran más abajo (migrar_datos_estructura_antigua)
+    apartar_estructura_antigua(conn)
+
     # Crear tabla de ensayos granulométricos
     c.execute('''
     CREATE TABLE IF NOT EXISTS ensayos_granulometricos (
@@ -73,18 +602,31 @@ def inicializar_tablas(conn):
     )
     ''')
     
-    # Crear tabla para los datos de tamices
+    # Crear catálogo de series de tamices (models/series_tamices.py). Las series
+    # no se modifican: un cambio de norma se añade como una versión nueva
     c.execute('''
-    CREATE TABLE IF NOT EXISTS datos_tamices (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        ensayo_id INTEGER,
-        tamiz TEXT,
-        apertura REAL,
-        masa_retenida REAL,
-        porcentaje_retenido REAL,
-        porcentaje_retenido_acumulado REAL,
-        porcentaje_pasa REAL,
-        FOREIGN KEY (ensayo_id) REFERENCES ensayos (id) ON DELETE CASCADE
+    CREATE TABLE IF NOT EXISTS series_tamices (
+        id TEXT PRIMARY KEY,
+        norma TEXT NOT NULL,
+        version INTEGER NOT NULL,
+        descripcion TEXT,
+        clave TEXT NOT NULL UNIQUE,
+        tamices TEXT NOT NULL,
+        aperturas BLOB NOT NULL,
+        fecha_creacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+    
+    # Crear tabla de curvas granulométricas: una fila por ensayo con su serie de
+    # tamices y las masas retenidas empaquetadas (empaquetar_valores). Los
+    # porcentajes se calculan al leer.
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS curvas_granulometricas (
+        ensayo_id INTEGER PRIMARY KEY,
+        serie_tamices TEXT NOT NULL,
+        masas_retenidas BLOB NOT NULL,
+        FOREIGN KEY (ensayo_id) REFERENCES ensayos (id) ON DELETE CASCADE,
+        FOREIGN KEY (serie_tamices) REFERENCES series_tamices (id)
     )
     ''')
     
@@ -168,6 +710,7 @@ def inicializar_tablas(conn):
         masa_arena_empleada REAL,
         masa_arena_cono REAL,
         densidad_arena REAL,
+        humedad REAL,
         FOREIGN KEY (ensayo_id) REFERENCES ensayos (id) ON DELETE CASCADE
     )
     ''')
@@ -209,79 +752,679 @@ def inicializar_tablas(conn):
         FOREIGN KEY (ensayo_id) REFERENCES ensayos_proctor (ensayo_id) ON DELETE CASCADE
     )
     ''')
+
+    # Crear tabla con la clasificación SUCS calculada de cada muestra
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS clasificacion_sucs (
+        codigo_muestra TEXT PRIMARY KEY,
+        grupo_sucs TEXT,
+        porcentaje_finos REAL,
+        porcentaje_pasa_grava REAL,
+        coef_uniformidad REAL,
+        coef_curvatura REAL,
+        limite_liquido REAL,
+        indice_plasticidad REAL,
+        fecha_calculo TIMESTAMP,
+        FOREIGN KEY (codigo_muestra) REFERENCES muestras (codigo_muestra) ON DELETE CASCADE
+    )
+    ''')
+
+    c.execute('''
+    CREATE INDEX IF NOT EXISTS idx_clasificacion_sucs_grupo
+    ON clasificacion_sucs (grupo_sucs)
+    ''')
+
+    # Crear tabla de control de compactación (densidad de campo frente a Próctor)
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS control_compactacion (
+        ensayo_id INTEGER,
+        criterio TEXT,
+        codigo_muestra TEXT,
+        fecha_ensayo DATE,
+        ensayo_proctor_id INTEGER,
+        densidad_seca_campo REAL,
+        densidad_maxima REAL,
+        grado_compactacion REAL,
+        humedad_campo REAL,
+        humedad_optima REAL,
+        desviacion_humedad REAL,
+        fecha_calculo TIMESTAMP,
+        PRIMARY KEY (ensayo_id, criterio),
+        FOREIGN KEY (ensayo_id) REFERENCES ensayos (id) ON DELETE CASCADE
+    )
+    ''')
+
+    c.execute('''
+    CREATE INDEX IF NOT EXISTS idx_control_compactacion_muestra
+    ON control_compactacion (codigo_muestra)
+    ''')
+
+    # Crear tabla con el estado del último refresco del control de compactación
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS estado_control_compactacion (
+        criterio TEXT PRIMARY KEY,
+        ultimo_ensayo_campo INTEGER,
+        ultimo_ensayo_proctor INTEGER,
+        num_ensayos_proctor INTEGER,
+        huella_materiales TEXT,
+        fecha_actualizacion TIMESTAMP
+    )
+    ''')
+
+    # Crear tabla de trabajos en segundo plano (models/trabajos.py)
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS trabajos (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        tipo TEXT NOT NULL,
+        parametros TEXT,
+        estado TEXT NOT NULL DEFAULT 'pendiente',
+        progreso REAL DEFAULT 0,
+        mensaje TEXT,
+        punto_control TEXT,
+        resultado TEXT,
+        error TEXT,
+        cancelar INTEGER DEFAULT 0,
+        propietario TEXT,
+        usuario TEXT,
+        fecha_creacion TIMESTAMP,
+        fecha_inicio TIMESTAMP,
+        fecha_fin TIMESTAMP
+    )
+    ''')
+
+    c.execute('''
+    CREATE INDEX IF NOT EXISTS idx_trabajos_estado
+    ON trabajos (estado)
+    ''')
+
+    # Crear el registro de cambios de las tablas de TABLAS_CAMBIOS, que llenan los
+    # disparadores, y los cursores de sus consumidores (models/cambios.py)
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS cambios (
+        secuencia INTEGER PRIMARY KEY AUTOINCREMENT,
+        tabla TEXT NOT NULL,
+        clave TEXT NOT NULL,
+        operacion TEXT NOT NULL,
+        codigo_muestra TEXT,
+        fecha TIMESTAMP
+    )
+    ''')
+
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS consumidores_cambios (
+        consumidor TEXT PRIMARY KEY,
+        secuencia INTEGER NOT NULL,
+        fecha_actualizacion TIMESTAMP
+    )
+    ''')
+
+    # Crear el identificador de esta base de datos para la sincronización
+    # (models/sincronizacion.py). Una copia de otra base de datos debe renovarlo.
+    c.execute('CREATE TABLE IF NOT EXISTS nodo_local (id TEXT NOT NULL)')
+    c.execute('''
+    INSERT INTO nodo_local (id)
+    SELECT lower(hex(randomblob(8))) WHERE NOT EXISTS (SELECT 1 FROM nodo_local)
+    ''')
+
+    # Crear la tabla de bajas: muestras, ensayos e imágenes borrados, con su
+    # identidad global y la versión del borrado
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS bajas (
+        secuencia INTEGER PRIMARY KEY AUTOINCREMENT,
+        tabla TEXT NOT NULL,
+        uid TEXT NOT NULL,
+        version TEXT,
+        fecha TIMESTAMP,
+        UNIQUE (tabla, uid)
+    )
+    ''')
+
+    # Crear la tabla de las bases de datos con las que se sincroniza: cursores
+    # enviados (confirmados por el par) y recibidos de cada una
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS pares_sincronizacion (
+        nodo TEXT PRIMARY KEY,
+        enviado_cambios INTEGER,
+        enviado_bajas INTEGER,
+        recibido_cambios INTEGER,
+        recibido_bajas INTEGER,
+        fecha_envio TIMESTAMP,
+        fecha_recepcion TIMESTAMP
+    )
+    ''')
+
+    # Crear el catálogo de fragmentos (una base de datos por proyecto o por año):
+    # el número de cada fragmento fija el rango de sus IDs
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS fragmentos (
+        nombre TEXT PRIMARY KEY,
+        numero INTEGER NOT NULL UNIQUE,
+        fecha_creacion TIMESTAMP
+    )
+    ''')
+
+    # Añadir columnas incorporadas después de crear bases de datos existentes
+    agregar_columna_si_no_existe(conn, "ensayos_picnometro", "humedad", "REAL")
+    agregar_columna_si_no_existe(conn, "estado_control_compactacion", "huella_materiales", "TEXT")
+    agregar_columna_si_no_existe(conn, "imagenes", "ensayo_id", "INTEGER NULL")
+    agregar_columna_si_no_existe(conn, "imagenes", "fecha_subida", "DATE")
+    agregar_columna_si_no_existe(conn, "imagenes", "descripcion", "TEXT")
+    agregar_columna_si_no_existe(conn, "muestras", "version", "TEXT")
+    agregar_columna_si_no_existe(conn, "ensayos", "uid", "TEXT")
+    agregar_columna_si_no_existe(conn, "ensayos", "version", "TEXT")
+    agregar_columna_si_no_existe(conn, "imagenes", "uid", "TEXT")
+    
+    # Pasar los ensayos granulométricos de la estructura antigua a la nueva
+    migrar_datos_estructura_antigua(conn)
+    
+    # Cargar las series normalizadas en el catálogo de series de tamices
+    sembrar_series_tamices(conn)
+    
+    # Pasar los datos de tamices (una fila por tamiz) a curvas empaquetadas
+    migrar_datos_tamices(conn)
     
+    # Pasar las series personalizadas guardadas en cada curva al catálogo
+    migrar_series_personalizadas(conn)
+
+    # Dar identidad global a los ensayos e imágenes anteriores a la sincronización
+    migrar_identidades_sincronizacion(conn)
+    c.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_ensayos_uid ON ensayos (uid)")
+    c.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_imagenes_uid ON imagenes (uid)")
+
+    # Anotar los cambios y las versiones a partir de aquí (las migraciones no son
+    # cambios de datos)
+    crear_disparadores_cambios(conn)
+    crear_disparadores_sincronizacion(conn)
+
     conn.commit()
 
+def agregar_columna_si_no_existe(conn, tabla, columna, definicion):
+    """
+    Añade una columna a una tabla existente si todavía no la tiene.
+    
+    Args:
+        conn (sqlite3.Connection): Conexión a la base de datos
+        tabla (str): Nombre de la tabla
+        columna (str): Nombre de la columna
+        definicion (str): Tipo y restricciones de la columna
+    """
+    columnas = [row[1] for row in conn.execute(f"PRAGMA table_info({tabla})").fetchall()]
+    
+    if columnas and columna not in columnas:
+        conn.execute(f"ALTER TABLE {tabla} ADD COLUMN {columna} {definicion}")
+
+def crear_disparadores_cambios(conn):
+    """
+    Crea los disparadores que anotan en la tabla cambios cada inserción,
+    modificación y borrado de las tablas de TABLAS_CAMBIOS. Si una modificación
+    cambia la clave de la fila, la clave anterior se anota además como borrada.
+    
+    Args:
+        conn (sqlite3.Connection): Conexión a la base de datos
+    """
+    for tabla, (clave, codigo) in TABLAS_CAMBIOS.items():
+        for operacion, fila in (("insert", "NEW"), ("update", "NEW"), ("delete", "OLD")):
+            conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS cambios_{tabla}_{operacion}
+            AFTER {operacion.upper()} ON {tabla}
+            BEGIN
+                INSERT INTO cambios (tabla, clave, operacion, codigo_muestra, fecha)
+                VALUES ('{tabla}', {clave.format(fila=fila)}, '{operacion}', {codigo.format(fila=fila)},
+                        CURRENT_TIMESTAMP);
+            END
+            """)
+        conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS cambios_{tabla}_clave
+        AFTER UPDATE ON {tabla}
+        WHEN {clave.format(fila="OLD")} IS NOT {clave.format(fila="NEW")}
+        BEGIN
+            INSERT INTO cambios (tabla, clave, operacion, codigo_muestra, fecha)
+            VALUES ('{tabla}', {clave.format(fila="OLD")}, 'delete', {codigo.format(fila="OLD")},
+                    CURRENT_TIMESTAMP);
+        END
+        """)
+
+def crear_disparadores_sincronizacion(conn):
+    """
+    Crea los disparadores que mantienen la identidad y la versión de las filas
+    que se sincronizan (models/sincronizacion.py): asignan un uid a los ensayos e
+    imágenes nuevos, cambian la versión de una muestra o un ensayo cada vez que
+    se modifica (también al modificar sus datos en TABLAS_DETALLE_ENSAYO) y
+    anotan los borrados en bajas. Una escritura que ya trae su versión (al
+    aplicar un paquete de sincronización) la conserva.
+
+    Args:
+        conn (sqlite3.Connection): Conexión a la base de datos
+    """
+    def estampa(anterior):
+        return _ESTAMPA_VERSION.format(anterior=anterior)
+
+    disparadores = {
+        "muestras_insert": f"""
+        AFTER INSERT ON muestras BEGIN
+            UPDATE muestras SET version = {estampa("NULL")}
+            WHERE codigo_muestra = NEW.codigo_muestra AND NEW.version IS NULL;
+            DELETE FROM bajas WHERE tabla = 'muestras' AND uid = NEW.codigo_muestra;
+        END""",
+        "muestras_update": f"""
+        AFTER UPDATE ON muestras WHEN NEW.version IS OLD.version BEGIN
+            UPDATE muestras SET version = {estampa("OLD.version")} WHERE codigo_muestra = NEW.codigo_muestra;
+        END""",
+        "muestras_delete": f"""
+        AFTER DELETE ON muestras BEGIN
+            INSERT OR REPLACE INTO bajas (tabla, uid, version, fecha)
+            VALUES ('muestras', OLD.codigo_muestra, {estampa("OLD.version")}, CURRENT_TIMESTAMP);
+        END""",
+        "ensayos_insert": f"""
+        AFTER INSERT ON ensayos WHEN NEW.uid IS NULL OR NEW.version IS NULL BEGIN
+            UPDATE ensayos SET uid = COALESCE(uid, lower(hex(randomblob(16)))),
+                               version = COALESCE(version, {estampa("NULL")})
+            WHERE id = NEW.id;
+        END""",
+        "ensayos_update": f"""
+        AFTER UPDATE ON ensayos WHEN NEW.version IS OLD.version BEGIN
+            UPDATE ensayos SET version = {estampa("OLD.version")} WHERE id = NEW.id;
+        END""",
+        "ensayos_delete": f"""
+        AFTER DELETE ON ensayos WHEN OLD.uid IS NOT NULL BEGIN
+            INSERT OR REPLACE INTO bajas (tabla, uid, version, fecha)
+            VALUES ('ensayos', OLD.uid, {estampa("OLD.version")}, CURRENT_TIMESTAMP);
+        END""",
+        "imagenes_insert": """
+        AFTER INSERT ON imagenes WHEN NEW.uid IS NULL BEGIN
+            UPDATE imagenes SET uid = lower(hex(randomblob(16))) WHERE id = NEW.id;
+        END""",
+        "imagenes_delete": f"""
+        AFTER DELETE ON imagenes WHEN OLD.uid IS NOT NULL BEGIN
+            INSERT OR REPLACE INTO bajas (tabla, uid, version, fecha)
+            VALUES ('imagenes', OLD.uid, {estampa("NULL")}, CURRENT_TIMESTAMP);
+        END""",
+    }
+    for tabla in TABLAS_DETALLE_ENSAYO:
+        for operacion, fila in (("insert", "NEW"), ("update", "NEW"), ("delete", "OLD")):
+            disparadores[f"{tabla}_{operacion}"] = f"""
+            AFTER {operacion.upper()} ON {tabla} BEGIN
+                UPDATE ensayos SET version = {estampa("version")} WHERE id = {fila}.ensayo_id;
+            END"""
+
+    for nombre, definicion in disparadores.items():
+        conn.execute(f"CREATE TRIGGER IF NOT EXISTS sincronizacion_{nombre} {definicion}")
+
+def migrar_identidades_sincronizacion(conn):
+    """
+    Asigna un uid a los ensayos e imágenes guardados antes de la sincronización.
+    El uid se deriva del ID local, la muestra y el tipo (o el nombre del
+    fichero), de modo que dos bases de datos copiadas a mano de la misma dan la
+    misma identidad a las filas que ya compartían.
+
+    Args:
+        conn (sqlite3.Connection): Conexión a la base de datos
+    """
+    identidades = {
+        "ensayos": "'legado-' || id || '-' || COALESCE(codigo_muestra, '') || '-' || COALESCE(tipo_ensayo, '')",
+        "imagenes": "'legado-' || id || '-' || COALESCE(codigo_muestra, '') || '-' || COALESCE(nombre_archivo, '')",
+    }
+    for tabla, uid in identidades.items():
+        if conn.execute(f"SELECT 1 FROM {tabla} WHERE uid IS NULL LIMIT 1").fetchone() is None:
+            continue
+        # La asignación no es un cambio de datos: se quitan los disparadores de la
+        # tabla, que inicializar_tablas vuelve a crear a continuación
+        disparadores = conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = ?", (tabla,)
+        ).fetchall()
+        for (disparador,) in disparadores:
+            conn.execute(f"DROP TRIGGER {disparador}")
+        conn.execute(f"UPDATE {tabla} SET uid = {uid} WHERE uid IS NULL")
+
+def repartir_en_fragmentos(progreso=None):
+    """
+    Pasa a su fragmento las muestras que siguen en la base de datos principal,
+    con sus ensayos, imágenes y resultados calculados, por transacciones de
+    MUESTRAS_POR_REPARTO muestras. Cada lote se copia y se borra de la base
+    principal en la misma transacción, así que se puede interrumpir y repetir.
+    El borrado no se anota en el registro de cambios ni en las bajas de la base
+    principal: las muestras no se han borrado, solo han cambiado de fichero.
+
+    Args:
+        progreso (callable, optional): Función (fracción, mensaje) que se llama
+            tras cada lote
+
+    Returns:
+        dict: Fragmento -> número de muestras pasadas a él
+    """
+    if not DIRECTORIO_FRAGMENTOS:
+        return {}
+
+    codigos_pendientes = """
+    SELECT codigo_muestra FROM muestras UNION SELECT codigo_muestra FROM ensayos
+    UNION SELECT codigo_muestra FROM imagenes UNION SELECT codigo_muestra FROM clasificacion_sucs
+    """
+    conn = _conexion_principal()
+    try:
+        total = conn.execute(f"SELECT COUNT(*) FROM ({codigos_pendientes})").fetchone()[0]
+    finally:
+        conn.close()
+
+    # Orden de copia; los borrados van en el orden inverso (los datos de los
+    # ensayos se localizan por main.ensayos)
+    filtro_codigo = "codigo_muestra IN (SELECT value FROM json_each(?))"
+    filtro_ensayo = f"ensayo_id IN (SELECT id FROM main.ensayos WHERE {filtro_codigo})"
+    tablas = [("muestras", filtro_codigo), ("ensayos", filtro_codigo),
+              *((tabla, filtro_ensayo) for tabla in TABLAS_DETALLE_ENSAYO),
+              ("imagenes", filtro_codigo), ("clasificacion_sucs", filtro_codigo),
+              ("control_compactacion", filtro_codigo)]
+
+    def copiar(conn, tabla, filtro="1", parametros=()):
+        # Las columnas se nombran: su orden puede variar entre ficheros
+        columnas = ", ".join(f'"{fila[1]}"' for fila in conn.execute(f"PRAGMA main.table_info({tabla})"))
+        conn.execute(f"""
+        INSERT OR IGNORE INTO destino.{tabla} ({columnas})
+        SELECT {columnas} FROM main.{tabla} WHERE {filtro}
+        """, parametros)
+
+    def mover(conn, codigos):
+        parametro = (json.dumps(codigos),)
+        # Las series personalizadas que usan las curvas se registraron en la base principal
+        copiar(conn, "series_tamices")
+        for tabla, filtro in tablas:
+            copiar(conn, tabla, filtro, parametro)
+
+        # Los disparadores de la base principal se quitan durante el borrado y se
+        # vuelven a crear en la misma transacción
+        disparadores = conn.execute(f"""
+        SELECT name FROM main.sqlite_master WHERE type = 'trigger'
+        AND tbl_name IN ({", ".join("?" * len(tablas))})
+        """, [tabla for tabla, _ in tablas]).fetchall()
+        for (disparador,) in disparadores:
+            conn.execute(f"DROP TRIGGER main.{disparador}")
+        for tabla, filtro in reversed(tablas):
+            conn.execute(f"DELETE FROM main.{tabla} WHERE {filtro}", parametro)
+        crear_disparadores_cambios(conn)
+        crear_disparadores_sincronizacion(conn)
+
+    repartidas = {}
+    while True:
+        conn = _conexion_principal()
+        try:
+            codigos = [fila[0] for fila in conn.execute(f"""
+            SELECT codigo_muestra FROM ({codigos_pendientes})
+            WHERE codigo_muestra IS NOT NULL ORDER BY codigo_muestra LIMIT ?
+            """, (MUESTRAS_POR_REPARTO,))]
+        finally:
+            conn.close()
+        if not codigos:
+            break
+
+        grupos = {}
+        for codigo in codigos:
+            grupos.setdefault(fragmento_de(codigo), []).append(codigo)
+        for nombre, grupo in grupos.items():
+            with en_fragmento(nombre):
+                # Crea el fragmento si no existe
+                obtener_conexion().close()
+
+                def abrir():
+                    conn = conectar(DB_PATH, timeout=TIEMPO_ESPERA_BLOQUEO)
+                    conn.execute("ATTACH DATABASE ? AS destino", (ruta_bd(),))
+                    return conn
+
+                ejecutar_escritura(lambda conn: mover(conn, grupo), abrir)
+            repartidas[nombre] = repartidas.get(nombre, 0) + len(grupo)
+
+        if progreso:
+            hechas = sum(repartidas.values())
+            progreso(hechas / max(total, 1), f"{hechas} de {total} muestras repartidas")
+
+    return repartidas
+
 def inicializar_bd():
     """
     Inicializa la base de datos creando las tablas necesarias si no existen.
     Esta función es redundante pero se mantiene por compatibilidad.
+    
+    Con fragmentación, actualiza también las tablas de cada fragmento y pasa a
+    su fragmento las muestras que sigan en la base de datos principal.
     """
-    conn = obtener_conexion()
+    conn = _conexion_principal()
     inicializar_tablas(conn)
     conn.close()
+    
+    for nombre in listar_fragmentos():
+        with en_fragmento(nombre):
+            conn = obtener_conexion()
+            inicializar_tablas(conn)
+            conn.close()
+    repartir_en_fragmentos()
+
+def empaquetar_valores(valores):
+    """
+    Empaqueta una lista de números como float64 little-endian para guardarla en un BLOB
+    
+    Args:
+        valores (list): Valores numéricos
+        
+    Returns:
+        bytes: Valores empaquetados (se leen con numpy.frombuffer(blob, "<f8"))
+    """
+    datos = array("d", valores)
+    if sys.byteorder == "big":
+        datos.byteswap()
+    return datos.tobytes()
+
+def desempaquetar_valores(blob):
+    """
+    Recupera los valores guardados con empaquetar_valores
+    
+    Args:
+        blob (bytes): Valores empaquetados
+        
+    Returns:
+        list: Valores numéricos
+    """
+    datos = array("d")
+    datos.frombytes(blob)
+    if sys.byteorder == "big":
+        datos.byteswap()
+    return datos.tolist()
+
+def leer_blob_por_trozos(conn, tabla, columna, fila_id, tamano=1 << 20):
+    """
+    Lee un BLOB por trozos sin cargarlo entero en memoria. Usa Connection.blobopen
+    (Python 3.11 o superior); con versiones anteriores el BLOB se lee entero.
+    
+    Args:
+        conn (sqlite3.Connection): Conexión a la base de datos
+        tabla (str): Tabla
+        columna (str): Columna del BLOB
+        fila_id (int): rowid de la fila
+        tamano (int): Bytes de cada trozo
+        
+    Yields:
+        bytes: Trozos del BLOB
+        
+    Raises:
+        KeyError: Si la fila no existe o el valor es nulo
+    """
+    if not hasattr(conn, "blobopen"):
+        fila = conn.execute(f"SELECT {columna} FROM {tabla} WHERE rowid = ?", (fila_id,)).fetchone()
+        if fila is None or fila[0] is None:
+            raise KeyError(fila_id)
+        yield bytes(fila[0])
+        return
+    
+    try:
+        blob = conn.blobopen(tabla, columna, fila_id, readonly=True)
+    except sqlite3.OperationalError:
+        raise KeyError(fila_id)
+    with blob:
+        while True:
+            trozo = blob.read(tamano)
+            if not trozo:
+                return
+            yield trozo
+
+def sembrar_series_tamices(conn):
+    """
+    Añade al catálogo de series de tamices las series normalizadas que falten
+    
+    Args:
+        conn (sqlite3.Connection): Conexión a la base de datos
+    """
+    from utils.tamices import SERIES_NORMALIZADAS, clave_serie
+    
+    for serie_id, serie in SERIES_NORMALIZADAS.items():
+        nombres = [nombre for nombre, _ in serie["tamices"]]
+        aperturas = [apertura for _, apertura in serie["tamices"]]
+        conn.execute("""
+        INSERT OR IGNORE INTO series_tamices (id, norma, version, descripcion, clave, tamices, aperturas)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, (
+            serie_id, serie["norma"], serie["version"], serie["descripcion"],
+            clave_serie(nombres, aperturas), json.dumps(nombres, ensure_ascii=False),
+            empaquetar_valores(aperturas)
+        ))
+
+def migrar_datos_tamices(conn, lote=10000):
+    """
+    Migra la tabla datos_tamices (una fila por tamiz) a curvas_granulometricas
+    (una fila por ensayo) y elimina la tabla antigua.
+    
+    El espacio liberado no se devuelve al sistema hasta ejecutar VACUUM.
+    
+    Args:
+        conn (sqlite3.Connection): Conexión a la base de datos
+        lote (int): Curvas insertadas por sentencia
+    """
+    from models.series_tamices import registrar_serie
+    
+    tablas = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall()}
+    # Durante la migración de la estructura antigua los IDs de ensayo aún no son los definitivos
+    if "datos_tamices" not in tablas or "ensayos_granulometricos_old" in tablas:
+        return
+    
+    def curvas():
+        filas = conn.execute("""
+        SELECT ensayo_id, tamiz, apertura, masa_retenida FROM datos_tamices
+        WHERE ensayo_id IS NOT NULL
+        ORDER BY ensayo_id, apertura DESC, id
+        """)
+        for ensayo_id, grupo in itertools.groupby(filas, key=lambda fila: fila[0]):
+            grupo = list(grupo)
+            serie = registrar_serie(conn, [fila[1] for fila in grupo], [fila[2] or 0 for fila in grupo])
+            yield ensayo_id, serie, empaquetar_valores([fila[3] or 0 for fila in grupo])
+    
+    # Se lee por lotes para no cargar todas las filas de tamices en memoria
+    iterador = curvas()
+    while True:
+        filas = list(itertools.islice(iterador, lote))
+        if not filas:
+            break
+        conn.executemany("""
+        INSERT OR IGNORE INTO curvas_granulometricas (ensayo_id, serie_tamices, masas_retenidas)
+        VALUES (?, ?, ?)
+        """, filas)
+    
+    conn.execute("DROP TABLE datos_tamices")
+
+def migrar_series_personalizadas(conn):
+    """
+    Registra en el catálogo las series de tamices que las curvas granulométricas
+    guardaban en sus propias columnas tamices y aperturas, y elimina esas columnas.
+    
+    Args:
+        conn (sqlite3.Connection): Conexión a la base de datos
+    """
+    from models.series_tamices import registrar_serie
+    
+    columnas = [row[1] for row in conn.execute("PRAGMA table_info(curvas_granulometricas)").fetchall()]
+    if "aperturas" not in columnas:
+        return
+    
+    filas = conn.execute("""
+    SELECT ensayo_id, tamices, aperturas FROM curvas_granulometricas
+    WHERE serie_tamices IS NULL
+    """).fetchall()
+    for ensayo_id, nombres, aperturas in filas:
+        serie = registrar_serie(conn, json.loads(nombres), desempaquetar_valores(aperturas))
+        conn.execute("UPDATE curvas_granulometricas SET serie_tamices = ? WHERE ensayo_id = ?",
+                     (serie, ensayo_id))
+    
+    conn.execute("ALTER TABLE curvas_granulometricas DROP COLUMN tamices")
+    conn.execute("ALTER TABLE curvas_granulometricas DROP COLUMN aperturas")
+
+def apartar_estructura_antigua(conn):
+    """
+    Renombra la tabla ensayos_granulometricos a ensayos_granulometricos_old si
+    tiene la estructura antigua, para que inicializar_tablas cree la nueva.
+
+    El renombrado abre la transacción que confirma inicializar_tablas al final,
+    de modo que no queda aplicado si la migración de los datos falla.
+
+    Args:
+        conn (sqlite3.Connection): Conexión a la base de datos
+    """
+    columnas = [row[1] for row in conn.execute("PRAGMA table_info(ensayos_granulometricos)").fetchall()]
+    if "codigo_muestra" not in columnas:
+        return
+    if not conn.in_transaction:
+        conn.execute("BEGIN IMMEDIATE")
+    conn.execute("ALTER TABLE ensayos_granulometricos RENAME TO ensayos_granulometricos_old")
 
 def migrar_datos_estructura_antigua(conn):
     """
     Migra datos desde la estructura antigua a la nueva estructura con múltiples ensayos.
     
+    En la estructura antigua, ensayos_granulometricos guardaba directamente la
+    muestra, la fecha y el operario; en la nueva, cada ensayo granulométrico
+    cuelga de un registro de la tabla general de ensayos. Se ejecuta antes de
+    crear los disparadores de cambios y de sincronización: la migración no se
+    anota como cambio y los ensayos migrados reciben después su uid de legado
+    (migrar_identidades_sincronizacion), igual en todas las copias de la base
+    de datos.
+    
     Args:
         conn (sqlite3.Connection): Conexión a la base de datos
     """
     cursor = conn.cursor()
     
-    # Comprobar si existen datos en la tabla antigua de ensayos granulométricos
-    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='ensayos_granulometricos_old'")
-    if cursor.fetchone() is None:
-        # Verificar si hay datos en la tabla actual de ensayos granulométricos
-        cursor.execute("SELECT COUNT(*) FROM ensayos_granulometricos")
-        if cursor.fetchone()[0] > 0:
-            # Renombrar la tabla actual
-            cursor.execute("ALTER TABLE ensayos_granulometricos RENAME TO ensayos_granulometricos_old")
-            
-            # Crear la nueva estructura
-            inicializar_tablas(conn)
-            
-            # Migrar los datos
-            cursor.execute("""
-                INSERT INTO ensayos (codigo_muestra, tipo_ensayo, fecha_ensayo, operario)
-                SELECT codigo_muestra, 'Granulométrico', fecha_ensayo, operario
-                FROM ensayos_granulometricos_old
-            """)
-            
-            # Obtener los ID de los nuevos ensayos
-            cursor.execute("""
-                SELECT e.id, eg.id as old_id
-                FROM ensayos e
-                JOIN ensayos_granulometricos_old eg ON e.codigo_muestra = eg.codigo_muestra
-                    AND e.fecha_ensayo = eg.fecha_ensayo
-                    AND e.operario = eg.operario
-            """)
-            
-            id_mapping = {old_id: new_id for new_id, old_id in cursor.fetchall()}
-            
-            # Migrar datos granulométricos
-            for old_id, new_id in id_mapping.items():
-                cursor.execute("""
-                    INSERT INTO ensayos_granulometricos 
-                    (ensayo_id, masa_total, d10, d30, d60, coef_uniformidad, coef_curvatura)
-                    SELECT ?, masa_total, d10, d30, d60, coef_uniformidad, coef_curvatura
-                    FROM ensayos_granulometricos_old
-                    WHERE id = ?
-                """, (new_id, old_id))
-                
-                # Migrar datos de tamices
-                cursor.execute("""
-                    INSERT INTO datos_tamices
-                    (ensayo_id, tamiz, apertura, masa_retenida, porcentaje_retenido, 
-                     porcentaje_retenido_acumulado, porcentaje_pasa)
-                    SELECT ?, tamiz, apertura, masa_retenida, porcentaje_retenido, 
-                           porcentaje_retenido_acumulado, porcentaje_pasa
-                    FROM datos_tamices
-                    WHERE ensayo_id = ?
-                """, (new_id, old_id))
-            
-            # Actualizar las imágenes (todas apuntan a muestras en la estructura antigua)
-            cursor.execute("UPDATE imagenes SET ensayo_id = NULL")
-            
-            conn.commit()
\ No newline at end of file
+    # La tabla antigua la ha apartado apartar_estructura_antigua
+    if cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'ensayos_granulometricos_old'"
+    ).fetchone() is None:
+        return
+    
+    # Migrar los ensayos uno a uno para conservar la correspondencia de IDs
+    cursor.execute("""
+        SELECT id, codigo_muestra, fecha_ensayo, operario, masa_total,
+               d10, d30, d60, coef_uniformidad, coef_curvatura
+        FROM ensayos_granulometricos_old
+        ORDER BY id
+    """)
+    id_mapping = {}
+    for row in cursor.fetchall():
+        nuevo = conn.execute("""
+            INSERT INTO ensayos (codigo_muestra, tipo_ensayo, fecha_ensayo, operario)
+            VALUES (?, 'Granulométrico', ?, ?)
+        """, (row[1], row[2], row[3]))
+        id_mapping[row[0]] = nuevo.lastrowid
+        
+        conn.execute("""
+            INSERT INTO ensayos_granulometricos 
+            (ensayo_id, masa_total, d10, d30, d60, coef_uniformidad, coef_curvatura)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, (nuevo.lastrowid,) + tuple(row[4:]))
+    
+    # Reasignar los datos de tamices en una sola sentencia, de modo que los IDs
+    # antiguos y nuevos que coincidan no se mezclen
+    cursor.execute("CREATE TEMP TABLE mapa_ensayos_granulometricos (antiguo INTEGER PRIMARY KEY, nuevo INTEGER)")
+    cursor.executemany("INSERT INTO mapa_ensayos_granulometricos VALUES (?, ?)", id_mapping.items())
+    cursor.execute("""
+        UPDATE datos_tamices
+        SET ensayo_id = (SELECT nuevo FROM mapa_ensayos_granulometricos WHERE antiguo = datos_tamices.ensayo_id)
+        WHERE ensayo_id IN (SELECT antiguo FROM mapa_ensayos_granulometricos)
+    """)
+    cursor.execute("DROP TABLE mapa_ensayos_granulometricos")
+    cursor.execute("DROP TABLE ensayos_granulometricos_old")
+    
+    # Actualizar las imágenes (todas apuntan a muestras en la estructura antigua)
+    cursor.execute("UPDATE imagenes SET ensayo_id = NULL")
@@ -1,7 +1,10 @@
 import sqlite3
-from models.db import obtener_conexion
+from models.db import obtener_conexion, ejecutar_escritura, enrutar_por_muestra
 from models.muestras import actualizar_estado_muestra
+from models.metricas import medir
 
+@medir
+@enrutar_por_muestra
 def guardar_ensayo_densidad_arido(codigo_muestra, fecha_ensayo, operario, 
                                  masa_seca, masa_sss, masa_sumergida,
                                  densidad_aparente, densidad_tras_secado, densidad_sss, absorcion_agua,
@@ -25,12 +28,8 @@ def guardar_ensayo_densidad_arido(codigo_muestra, fecha_ensayo, operario,
     Returns:
         int: ID del ensayo guardado
     """
-    conn = obtener_conexion()
-    c = conn.cursor()
-    
-    try:
-        # Iniciar transacción
-        conn.execute("BEGIN")
+    def insertar(conn):
+        c = conn.cursor()
         
         # Insertar en la tabla general de ensayos
         c.execute("""
@@ -59,22 +58,17 @@ def guardar_ensayo_densidad_arido(codigo_muestra, fecha_ensayo, operario,
             masa_seca
         ))
         
-        # Confirmar transacción
-        conn.execute("COMMIT")
-        
-        # Actualizar estado de la muestra
-        actualizar_estado_muestra(codigo_muestra, "con ensayo de densidad de árido")
-        
         return ensayo_id
-        
-    except Exception as e:
-        # Revertir cambios en caso de error
-        conn.execute("ROLLBACK")
-        raise e
     
-    finally:
-        conn.close()
+    ensayo_id = ejecutar_escritura(insertar)
+    
+    # Actualizar estado de la muestra
+    actualizar_estado_muestra(codigo_muestra, "con ensayo de densidad de árido")
+    
+    return ensayo_id
 
+@medir
+@enrutar_por_muestra
 def obtener_ensayo_densidad_arido(codigo_muestra):
     """
     Obtiene el último ensayo de densidad de árido de una muestra
@@ -106,6 +100,8 @@ def obtener_ensayo_densidad_arido(codigo_muestra):
     # Convertir a diccionario
     return dict(ensayo)
 
+@medir
+@enrutar_por_muestra
 def obtener_todos_ensayos_densidad_arido(codigo_muestra=None):
     """
     Obtiene todos los ensayos de densidad de árido grueso, opcionalmente filtrados por muestra
@@ -143,6 +139,7 @@ def obtener_todos_ensayos_densidad_arido(codigo_muestra=None):
     
     return ensayos
 
+@medir
 def calcular_parametros_densidad(masa_seca, masa_sss, masa_sumergida):
     """
     Calcula los parámetros del ensayo de densidad de árido grueso
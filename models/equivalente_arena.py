@@ -1,7 +1,11 @@
 import sqlite3
-from models.db import obtener_conexion
+from models.db import obtener_conexion, ejecutar_escritura, enrutar_por_muestra
 from models.muestras import actualizar_estado_muestra
+from models.interpretacion import interpretar_valor
+from models.metricas import medir
 
+@medir
+@enrutar_por_muestra
 def guardar_ensayo_equivalente_arena(codigo_muestra, fecha_ensayo, operario, 
                                    altura_sedimento, altura_floculos, equivalente_arena,
                                    temperatura, notas=None):
@@ -21,12 +25,8 @@ def guardar_ensayo_equivalente_arena(codigo_muestra, fecha_ensayo, operario,
     Returns:
         int: ID del ensayo guardado
     """
-    conn = obtener_conexion()
-    c = conn.cursor()
-    
-    try:
-        # Iniciar transacción
-        conn.execute("BEGIN")
+    def insertar(conn):
+        c = conn.cursor()
         
         # Insertar en la tabla general de ensayos
         c.execute("""
@@ -45,22 +45,17 @@ def guardar_ensayo_equivalente_arena(codigo_muestra, fecha_ensayo, operario,
         VALUES (?, ?, ?, ?, ?)
         """, (ensayo_id, altura_sedimento, altura_floculos, equivalente_arena, temperatura))
         
-        # Confirmar transacción
-        conn.execute("COMMIT")
-        
-        # Actualizar estado de la muestra
-        actualizar_estado_muestra(codigo_muestra, "con ensayo de equivalente de arena")
-        
         return ensayo_id
-        
-    except Exception as e:
-        # Revertir cambios en caso de error
-        conn.execute("ROLLBACK")
-        raise e
     
-    finally:
-        conn.close()
+    ensayo_id = ejecutar_escritura(insertar)
+    
+    # Actualizar estado de la muestra
+    actualizar_estado_muestra(codigo_muestra, "con ensayo de equivalente de arena")
+    
+    return ensayo_id
 
+@medir
+@enrutar_por_muestra
 def obtener_ensayo_equivalente_arena(codigo_muestra):
     """
     Obtiene el último ensayo de equivalente de arena de una muestra
@@ -92,6 +87,8 @@ def obtener_ensayo_equivalente_arena(codigo_muestra):
     # Convertir a diccionario
     return dict(ensayo)
 
+@medir
+@enrutar_por_muestra
 def obtener_todos_ensayos_equivalente_arena(codigo_muestra=None):
     """
     Obtiene todos los ensayos de equivalente de arena, opcionalmente filtrados por muestra
@@ -129,6 +126,7 @@ def obtener_todos_ensayos_equivalente_arena(codigo_muestra=None):
     
     return ensayos
 
+@medir
 def calcular_equivalente_arena(altura_sedimento, altura_floculos):
     """
     Calcula el equivalente de arena
@@ -155,6 +153,7 @@ def calcular_equivalente_arena(altura_sedimento, altura_floculos):
     
     return ea_redondeado
 
+@medir
 def interpretar_equivalente_arena(ea_valor):
     """
     Interpreta el resultado del ensayo de equivalente de arena según normativas
@@ -166,17 +165,7 @@ def interpretar_equivalente_arena(ea_valor):
         tuple: (clasificacion, recomendacion)
     """
     # Clasificación según PG-3 (España)
-    if ea_valor >= 50:
-        clasificacion = "Árido limpio (EA ≥ 50)"
-        recomendacion = "Apto para la mayoría de usos en obra civil"
-    elif ea_valor >= 40:
-        clasificacion = "Árido con contenido limitado de finos arcillosos (40 ≤ EA < 50)"
-        recomendacion = "Apto para algunas capas de firmes y ciertas aplicaciones"
-    elif ea_valor >= 30:
-        clasificacion = "Árido con contenido significativo de finos arcillosos (30 ≤ EA < 40)"
-        recomendacion = "Uso limitado, verificar requisitos específicos de la aplicación"
-    else:
-        clasificacion = "Árido con alto contenido de finos arcillosos (EA < 30)"
-        recomendacion = "No recomendado para capas de firmes, posible uso en aplicaciones no estructurales"
+    clasificacion = interpretar_valor(ea_valor, "equivalente_arena", "clasificacion")
+    recomendacion = interpretar_valor(ea_valor, "equivalente_arena", "recomendacion")
     
-    return clasificacion, recomendacion
\ No newline at end of file
+    return clasificacion, recomendacion
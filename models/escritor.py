@@ -0,0 +1,265 @@
+import atexit
+import queue
+import random
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as TiempoAgotado
+
+import models.db
+from models.db import es_error_bloqueo, revertir
+from models.metricas import incrementar
+from models.trazas import conectar
+
+# Cola de trabajos pendientes del escritor (None detiene el hilo)
+_cola = queue.Queue()
+
+_hilo = None
+_bloqueo_arranque = threading.Lock()
+
+# Excepción con la que se detuvo el último hilo escritor, si terminó por un error
+_error = None
+
+# Segundos entre comprobaciones de que el hilo escritor sigue vivo mientras se espera una escritura
+INTERVALO_VIGILANCIA = 0.5
+
+_ESCRITURAS = (sqlite3.SQLITE_INSERT, sqlite3.SQLITE_UPDATE, sqlite3.SQLITE_DELETE)
+
+# Tabla fragmentada en la que la última operación ha intentado escribir (_autorizar)
+_tabla_denegada = None
+
+
+def _autorizar(accion, tabla, _columna, base, _disparador):
+    """
+    Autorizador de la conexión de escritura con fragmentación: rechaza las
+    escrituras en las tablas de TABLAS_FRAGMENTADAS de la base principal, como
+    las vistas de la conexión global (_adjuntar_fragmentos en models/db.py).
+    Esta conexión no adjunta los fragmentos: BEGIN IMMEDIATE los bloquearía todos.
+    """
+    global _tabla_denegada
+    if accion in _ESCRITURAS and base == "main" and tabla in models.db.TABLAS_FRAGMENTADAS:
+        _tabla_denegada = tabla
+        return sqlite3.SQLITE_DENY
+    return sqlite3.SQLITE_OK
+
+
+def _conexion_escritura():
+    conn = conectar(models.db.DB_PATH, timeout=models.db.TIEMPO_ESPERA_BLOQUEO)
+    conn.row_factory = sqlite3.Row
+    # Con WAL las lecturas no bloquean al escritor ni el escritor a las lecturas
+    conn.execute("PRAGMA journal_mode=WAL")
+    if models.db.DIRECTORIO_FRAGMENTOS:
+        conn.set_authorizer(_autorizar)
+    return conn
+
+
+def _error_operacion(error):
+    """
+    Explica el error de una operación rechazada por _autorizar
+    """
+    if _tabla_denegada is None or not isinstance(error, sqlite3.DatabaseError):
+        return error
+    return sqlite3.OperationalError(
+        f"No se puede escribir en {_tabla_denegada} fuera de su fragmento: use en_fragmento()"
+    )
+
+
+def _recoger_grupo(primero):
+    """
+    Reúne los trabajos que llegan poco después del primero, hasta el tamaño o el
+    tiempo máximo del grupo
+    """
+    grupo = [primero]
+    limite = time.monotonic() + models.db.ESPERA_MAXIMA_GRUPO
+    while len(grupo) < models.db.TAMANO_MAXIMO_GRUPO:
+        restante = limite - time.monotonic()
+        if restante <= 0:
+            break
+        try:
+            trabajo = _cola.get(timeout=restante)
+        except queue.Empty:
+            break
+        if trabajo is None:
+            # Se procesa el grupo y luego se detiene el hilo
+            _cola.put(None)
+            break
+        grupo.append(trabajo)
+    return grupo
+
+
+def _confirmar_grupo(conn, grupo):
+    """
+    Ejecuta un grupo de trabajos en una sola transacción y resuelve sus futuros
+
+    Cada trabajo se ejecuta dentro de un SAVEPOINT: si falla, solo se deshacen
+    sus cambios y su futuro recibe la excepción, sin afectar al resto del grupo.
+    Los resultados se entregan después del COMMIT. Si la base de datos está
+    bloqueada (p. ej. por otro proceso), el grupo entero se repite con backoff.
+    """
+    global _tabla_denegada
+    for intento in range(models.db.REINTENTOS_ESCRITURA + 1):
+        resultados = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for operacion, _ in grupo:
+                conn.execute("SAVEPOINT escritura")
+                _tabla_denegada = None
+                try:
+                    resultados.append((True, operacion(conn)))
+                    conn.execute("RELEASE escritura")
+                except Exception as e:
+                    if es_error_bloqueo(e):
+                        raise
+                    conn.execute("ROLLBACK TO escritura")
+                    conn.execute("RELEASE escritura")
+                    resultados.append((False, _error_operacion(e)))
+            conn.execute("COMMIT")
+        except Exception as e:
+            revertir(conn)
+            if not es_error_bloqueo(e) or intento == models.db.REINTENTOS_ESCRITURA:
+                for _, futuro in grupo:
+                    futuro.set_exception(e)
+                return
+            incrementar("reintentos_bloqueo_total")
+            time.sleep(random.uniform(0, min(models.db.ESPERA_MAXIMA_REINTENTO,
+                                             models.db.ESPERA_BASE_REINTENTO * 2 ** intento)))
+            continue
+
+        incrementar("escritor_grupos_total")
+        incrementar("escritor_escrituras_total", len(grupo))
+        for (_, futuro), (correcto, valor) in zip(grupo, resultados):
+            if correcto:
+                futuro.set_result(valor)
+            else:
+                futuro.set_exception(valor)
+        return
+
+
+def _bucle_escritor():
+    global _error
+    grupo, conn = [], None
+    try:
+        ruta, conn = models.db.DB_PATH, _conexion_escritura()
+        while True:
+            trabajo = _cola.get()
+            if trabajo is None:
+                break
+            if ruta != models.db.DB_PATH:
+                # Se ha cambiado de base de datos (p. ej. en los benchmarks)
+                conn.close()
+                ruta, conn = models.db.DB_PATH, _conexion_escritura()
+            # Las escrituras que su emisor ha cancelado (esperar_escritura) no se ejecutan
+            grupo = [(operacion, futuro) for operacion, futuro in _recoger_grupo(trabajo)
+                     if futuro.set_running_or_notify_cancel()]
+            if grupo:
+                _confirmar_grupo(conn, grupo)
+            grupo = []
+    except BaseException as e:
+        # Quien espera el grupo en curso recibe el error en lugar de esperar para siempre
+        _error = e
+        for _, futuro in grupo:
+            if not futuro.done():
+                futuro.set_exception(e)
+        raise
+    finally:
+        if conn is not None:
+            conn.close()
+
+
+def iniciar_escritor():
+    """
+    Arranca el hilo escritor si no está en marcha
+
+    Returns:
+        threading.Thread: Hilo escritor
+    """
+    global _hilo
+    with _bloqueo_arranque:
+        if _hilo is None or not _hilo.is_alive():
+            _hilo = threading.Thread(target=_bucle_escritor, name="escritor-bd", daemon=True)
+            _hilo.start()
+        return _hilo
+
+
+def detener_escritor(espera=10):
+    """
+    Procesa los trabajos pendientes y detiene el hilo escritor
+
+    Args:
+        espera (float): Segundos máximos de espera
+    """
+    global _hilo
+    with _bloqueo_arranque:
+        if _hilo is not None and _hilo.is_alive():
+            _cola.put(None)
+            _hilo.join(espera)
+        _hilo = None
+
+
+def enviar_escritura(operacion):
+    """
+    Encola una operación de escritura para el hilo escritor
+
+    Args:
+        operacion (callable): Función que recibe la conexión de escritura y
+            devuelve un resultado. No debe hacer COMMIT ni ROLLBACK y se puede
+            ejecutar más de una vez si la base de datos está bloqueada.
+
+    Returns:
+        concurrent.futures.Future: Futuro con el resultado, disponible tras el COMMIT
+    """
+    hilo = iniciar_escritor()
+    if threading.current_thread() is hilo:
+        raise RuntimeError("Una operación de escritura no puede encolar otra escritura")
+
+    futuro = Future()
+    _cola.put((operacion, futuro))
+    return futuro
+
+
+def esperar_escritura(futuro, espera):
+    """
+    Espera el resultado de una escritura encolada con enviar_escritura. Si el
+    hilo escritor se ha detenido, se arranca otro una vez; si también se
+    detiene, o si la escritura no termina en el tiempo indicado, la espera
+    falla en lugar de bloquear al hilo que escribe para siempre.
+
+    Args:
+        futuro (concurrent.futures.Future): Futuro devuelto por enviar_escritura
+        espera (float): Segundos máximos de espera
+
+    Returns:
+        El valor devuelto por la operación
+
+    Raises:
+        RuntimeError: Si el hilo escritor se detiene antes de ejecutar la escritura
+        TimeoutError: Si la escritura no termina a tiempo
+    """
+    limite = time.monotonic() + espera
+    reiniciado = False
+    while True:
+        try:
+            return futuro.result(timeout=max(0, min(INTERVALO_VIGILANCIA, limite - time.monotonic())))
+        except TiempoAgotado:
+            # La propia operación puede haber lanzado TimeoutError
+            if futuro.done():
+                raise
+
+        if time.monotonic() >= limite:
+            if futuro.cancel():
+                raise TimeoutError(f"El hilo escritor no ha ejecutado la escritura en {espera:g} s; "
+                                   "no se ha aplicado")
+            raise TimeoutError(f"La escritura no ha terminado en {espera:g} s; "
+                               "puede confirmarse más tarde")
+
+        hilo = _hilo
+        if futuro.done() or (hilo is not None and hilo.is_alive()):
+            continue
+        if reiniciado and futuro.cancel():
+            raise RuntimeError(f"El hilo escritor se ha detenido: {_error!r}")
+        # La escritura sigue en la cola: otro hilo escritor la ejecutará
+        reiniciado = True
+        iniciar_escritor()
+
+
+atexit.register(detener_escritor)
@@ -0,0 +1,906 @@
+import argparse
+import csv
+import hashlib
+import io
+import itertools
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+from datetime import datetime
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import models.db as db
+from models.cambios import CambiosCompactados, cambios_netos, ultima_secuencia
+from models.db import TABLAS_ENSAYOS, leer_blob_por_trozos, obtener_conexion
+from models.metricas import medir
+from models.series_tamices import obtener_serie
+from utils.calculo import calcular_porcentajes_tamices
+
+# Directorio de la exportación (por defecto, "exportacion" junto a la base de datos)
+DIRECTORIO_EXPORTACION = os.environ.get("GARNOCEX_EXPORTACION_DIR")
+
+# Filas leídas de SQLite por consulta y filas máximas que se acumulan antes de
+# escribir un grupo de filas en Parquet: la memoria no depende del tamaño del archivo
+FILAS_POR_LOTE = 20000
+
+# Conjuntos de datos de la exportación (un subdirectorio del destino cada uno)
+CONJUNTOS = ("muestras", "ensayos", "curvas_granulometricas", "puntos_proctor", "eliminados")
+
+# Ficheros de control de la exportación. Empiezan por "_" para que los lectores
+# de conjuntos de datos Parquet (pyarrow, DuckDB, Spark) los ignoren.
+MANIFIESTO = "_exportacion.json"
+DIRECTORIO_ESTADO = "_estado"
+
+# Columnas de las curvas granulométricas y de los puntos Próctor exportados
+COLUMNAS_CURVAS = [
+    ("ensayo_id", pa.int64()),
+    ("codigo_muestra", pa.string()),
+    ("serie_tamices", pa.string()),
+    ("numero_tamiz", pa.int64()),
+    ("tamiz", pa.string()),
+    ("apertura", pa.float64()),
+    ("masa_retenida", pa.float64()),
+    ("porcentaje_retenido", pa.float64()),
+    ("porcentaje_pasa", pa.float64()),
+]
+COLUMNAS_PUNTOS = [
+    ("id", pa.int64()),
+    ("ensayo_id", pa.int64()),
+    ("codigo_muestra", pa.string()),
+    ("numero_punto", pa.int64()),
+    ("humedad", pa.float64()),
+    ("densidad_seca", pa.float64()),
+]
+COLUMNAS_ELIMINADOS = [
+    ("lote", pa.int64()),
+    ("entidad", pa.string()),
+    ("clave", pa.string()),
+]
+
+# Directorio de los ZIP exportados para descargar y horas tras las que se borran
+DIRECTORIO_ZIP = os.environ.get("GARNOCEX_EXPORTACION_ZIP_DIR",
+                                os.path.join(tempfile.gettempdir(), "garnocex-exportaciones"))
+CADUCIDAD_ZIP_HORAS = float(os.environ.get("GARNOCEX_EXPORTACION_ZIP_HORAS", "24"))
+
+# Bytes que se copian de cada vez de una imagen al ZIP
+TAMANO_TROZO = 1 << 20
+
+COLUMNAS_IMAGENES = ["id", "codigo_muestra", "ensayo_id", "nombre_archivo", "fecha_subida", "descripcion", "archivo"]
+
+_bloqueo_exportacion = threading.Lock()
+
+
+def tipo_arrow(declarado):
+    """
+    Tipo de Arrow de una columna según su tipo declarado en SQLite (reglas de afinidad)
+
+    Args:
+        declarado (str): Tipo declarado de la columna
+
+    Returns:
+        pyarrow.DataType: Tipo de Arrow
+    """
+    declarado = (declarado or "").upper()
+    if "INT" in declarado:
+        return pa.int64()
+    if any(tipo in declarado for tipo in ("REAL", "FLOA", "DOUB")):
+        return pa.float64()
+    if "BLOB" in declarado:
+        return pa.binary()
+    return pa.string()
+
+
+def expresion_columna(columna, tipo, tabla=None):
+    """
+    Expresión SQL que lee una columna con un tipo de Arrow. SQLite admite
+    cualquier valor en cualquier columna; los que no encajan se leen como NULL.
+
+    Args:
+        columna (str): Nombre de la columna
+        tipo (pyarrow.DataType): Tipo de tipo_arrow()
+        tabla (str, optional): Tabla o alias que precede a la columna
+
+    Returns:
+        str: Expresión SQL
+    """
+    columna = f'"{columna}"' if tabla is None else f'{tabla}."{columna}"'
+    if tipo == pa.int64():
+        return f"CASE WHEN typeof({columna}) IN ('integer', 'real') THEN CAST({columna} AS INTEGER) END"
+    if tipo == pa.float64():
+        return f"CASE WHEN typeof({columna}) IN ('integer', 'real') THEN CAST({columna} AS REAL) END"
+    if tipo == pa.binary():
+        return f"CAST({columna} AS BLOB)"
+    return f"CAST({columna} AS TEXT)"
+
+
+def _anio(columna):
+    # Año de una fecha ISO guardada como texto; 0 si no tiene fecha
+    return f"COALESCE(CAST(substr({columna}, 1, 4) AS INTEGER), 0)"
+
+
+def _columnas(conn, tabla, excluir=()):
+    """
+    Columnas de una tabla con su tipo de Arrow
+
+    Returns:
+        list: [(nombre, tipo)]
+    """
+    return [(fila[1], tipo_arrow(fila[2])) for fila in conn.execute(f"PRAGMA table_info({tabla})")
+            if fila[1] not in excluir]
+
+
+def _recorrer(conn, consulta, desde, *parametros):
+    """
+    Recorre el resultado de una consulta por lotes de FILAS_POR_LOTE filas. Cada
+    lote es una lectura corta, de modo que las escrituras nunca esperan a la
+    exportación entera.
+
+    Args:
+        conn (sqlite3.Connection): Conexión sin row_factory
+        consulta (str): Consulta con los parámetros (último valor de la clave,
+            *parametros, límite), que devuelve la clave en la primera columna y
+            en orden creciente
+        desde: Valor de la clave anterior al primero que se lee
+
+    Yields:
+        tuple: Filas de la consulta
+    """
+    ultimo = desde
+    while True:
+        filas = conn.execute(consulta, (ultimo, *parametros, FILAS_POR_LOTE)).fetchall()
+        if not filas:
+            return
+        yield from filas
+        ultimo = filas[-1][0]
+
+
+class _EscritorParticionado:
+    """
+    Escribe un conjunto de datos en un fichero Parquet por partición
+    (subdirectorios clave=valor). Las filas se acumulan y se escriben en grupos
+    de hasta FILAS_POR_LOTE filas. Los ficheros se escriben con un nombre
+    temporal oculto y solo aparecen con su nombre definitivo al publicarlos.
+    """
+
+    def __init__(self, directorio, columnas, nombre):
+        self.directorio = directorio
+        self.esquema = pa.schema(columnas)
+        self.nombre = nombre
+        self.filas = 0
+        self._escritores = {}
+        self._pendientes = {}
+        self._num_pendientes = 0
+        self._temporales = []
+
+    def agregar(self, particion, fila):
+        """
+        Añade una fila
+
+        Args:
+            particion (tuple): Pares (clave, valor) de la partición de la fila
+            fila (tuple): Valores de las columnas del esquema
+        """
+        self._pendientes.setdefault(particion, []).append(fila)
+        self._num_pendientes += 1
+        self.filas += 1
+        if self._num_pendientes >= FILAS_POR_LOTE:
+            self._vaciar()
+
+    def _vaciar(self):
+        for particion, filas in self._pendientes.items():
+            if particion not in self._escritores:
+                directorio = os.path.join(self.directorio, *(f"{clave}={valor}" for clave, valor in particion))
+                os.makedirs(directorio, exist_ok=True)
+                temporal = os.path.join(directorio, f".{self.nombre}.tmp")
+                self._temporales.append(temporal)
+                self._escritores[particion] = pq.ParquetWriter(temporal, self.esquema, compression="zstd")
+            columnas = list(zip(*filas))
+            self._escritores[particion].write_table(pa.Table.from_arrays(
+                [pa.array(valores, type=campo.type) for valores, campo in zip(columnas, self.esquema)],
+                schema=self.esquema
+            ))
+        self._pendientes = {}
+        self._num_pendientes = 0
+
+    def cerrar(self):
+        """
+        Escribe las filas pendientes y cierra los ficheros
+        """
+        self._vaciar()
+        for escritor in self._escritores.values():
+            escritor.close()
+        self._escritores = {}
+
+    def publicar(self):
+        """
+        Da a los ficheros escritos su nombre definitivo
+        """
+        self.cerrar()
+        for temporal in self._temporales:
+            os.replace(temporal, os.path.join(os.path.dirname(temporal), self.nombre))
+        self._temporales = []
+
+    def descartar(self):
+        """
+        Cierra y borra los ficheros escritos
+        """
+        for escritor in self._escritores.values():
+            escritor.close()
+        self._escritores = {}
+        for temporal in self._temporales:
+            if os.path.exists(temporal):
+                os.remove(temporal)
+        self._temporales = []
+
+
+def directorio_exportacion():
+    """
+    Devuelve el directorio de la exportación por defecto (dentro de un
+    fragmento, su subdirectorio)
+
+    Returns:
+        str: Ruta del directorio
+    """
+    return db.directorio_fragmento(
+        DIRECTORIO_EXPORTACION or os.path.join(os.path.dirname(os.path.abspath(db.DB_PATH)), "exportacion")
+    )
+
+
+@medir
+def estado_exportacion(destino=None):
+    """
+    Devuelve el manifiesto de una exportación
+
+    Args:
+        destino (str, optional): Directorio de la exportación
+
+    Returns:
+        dict: {"lote": último lote, "fecha": fecha ISO, "lotes": resumen de cada lote},
+            o None si no hay exportación
+    """
+    try:
+        with open(os.path.join(destino or directorio_exportacion(), MANIFIESTO), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _huella(fila):
+    # Resumen de 64 bits del contenido de una fila, para detectar cambios
+    return int.from_bytes(hashlib.blake2b(repr(fila).encode("utf-8"), digest_size=8).digest(), "little", signed=True)
+
+
+def _leer_estado(destino, lote):
+    """
+    Lee las muestras (con su huella) y los ensayos exportados hasta un lote
+
+    Returns:
+        tuple: (dict código -> huella, array ordenado de IDs de ensayo)
+    """
+    directorio = os.path.join(destino, DIRECTORIO_ESTADO)
+    if not lote:
+        return {}, np.empty(0, dtype=np.int64)
+    muestras = pq.read_table(os.path.join(directorio, f"muestras-{lote}.parquet"))
+    ensayos = pq.read_table(os.path.join(directorio, f"ensayos-{lote}.parquet"))
+    huellas = dict(zip(muestras.column("codigo_muestra").to_pylist(), muestras.column("huella").to_pylist()))
+    return huellas, ensayos.column("ensayo_id").to_numpy()
+
+
+def _escribir_estado(destino, lote, huellas, ensayos):
+    """
+    Guarda las muestras y los ensayos exportados hasta un lote
+    """
+    directorio = os.path.join(destino, DIRECTORIO_ESTADO)
+    os.makedirs(directorio, exist_ok=True)
+    tablas = {
+        "muestras": pa.table({"codigo_muestra": pa.array(list(huellas), pa.string()),
+                              "huella": pa.array(list(huellas.values()), pa.int64())}),
+        "ensayos": pa.table({"ensayo_id": pa.array(ensayos, pa.int64())}),
+    }
+    for nombre, tabla in tablas.items():
+        ruta = os.path.join(directorio, f"{nombre}-{lote}.parquet")
+        temporal = os.path.join(directorio, f".{nombre}-{lote}.tmp")
+        pq.write_table(tabla, temporal, compression="zstd")
+        os.replace(temporal, ruta)
+
+
+def _escribir_manifiesto(destino, manifiesto):
+    ruta = os.path.join(destino, MANIFIESTO)
+    temporal = os.path.join(destino, f".{MANIFIESTO}.tmp")
+    with open(temporal, "w", encoding="utf-8") as f:
+        json.dump(manifiesto, f, indent=2, ensure_ascii=False)
+    os.replace(temporal, ruta)
+
+
+def _limpiar_lote(destino, nombre):
+    """
+    Borra los ficheros de un lote que no llegó a terminar, para repetirlo
+    """
+    for conjunto in CONJUNTOS:
+        for raiz, _, ficheros in os.walk(os.path.join(destino, conjunto)):
+            for fichero in ficheros:
+                if fichero in (nombre, f".{nombre}.tmp"):
+                    os.remove(os.path.join(raiz, fichero))
+
+
+def _contiene(ordenados, valor):
+    # Indica si un array ordenado contiene un valor
+    i = np.searchsorted(ordenados, valor)
+    return i < len(ordenados) and ordenados[i] == valor
+
+
+def _leer_muestras(conn, codigos=None):
+    """
+    Recorre las muestras
+
+    Args:
+        codigos (list, optional): Recorrer solo las muestras con estos códigos
+
+    Returns:
+        tuple: (columnas [(nombre, tipo)], iterador de (valores, año))
+    """
+    columnas = _columnas(conn, "muestras")
+    # Los códigos se pasan como un único parámetro JSON: no hay límite de parámetros
+    filtro, parametros = "", ()
+    if codigos is not None:
+        filtro, parametros = "AND codigo_muestra IN (SELECT value FROM json_each(?))", (json.dumps(codigos),)
+    consulta = f"""
+    SELECT rowid, {", ".join(expresion_columna(nombre, tipo) for nombre, tipo in columnas)}, {_anio("fecha")}
+    FROM muestras WHERE rowid > ? {filtro} ORDER BY rowid LIMIT ?
+    """
+    return columnas, ((fila[1:-1], fila[-1]) for fila in _recorrer(conn, consulta, -2 ** 63, *parametros))
+
+
+def _leer_ensayos(conn, tabla, desde=0):
+    """
+    Recorre los ensayos de un tipo con sus columnas generales (de ensayos) y las
+    de su tabla específica
+
+    Args:
+        tabla (str): Tabla específica del tipo de ensayo
+        desde (int): Se leen los ensayos con ID mayor
+
+    Returns:
+        tuple: (columnas [(nombre, tipo)], iterador de (valores, año)); el
+            primer valor es el ID del ensayo
+    """
+    generales = _columnas(conn, "ensayos", excluir=("id", "tipo_ensayo"))
+    especificas = _columnas(conn, tabla, excluir=("ensayo_id",))
+    expresiones = [expresion_columna(nombre, tipo, "e") for nombre, tipo in generales]
+    expresiones += [expresion_columna(nombre, tipo, "t") for nombre, tipo in especificas]
+    consulta = f"""
+    SELECT e.id, {", ".join(expresiones)}, {_anio("e.fecha_ensayo")}
+    FROM ensayos e JOIN {tabla} t ON t.ensayo_id = e.id
+    WHERE e.id > ? ORDER BY e.id LIMIT ?
+    """
+    columnas = [("ensayo_id", pa.int64()), *generales, *especificas]
+    return columnas, ((fila[:-1], fila[-1]) for fila in _recorrer(conn, consulta, desde))
+
+
+def _leer_curvas(conn, desde=0, incluir=None):
+    """
+    Recorre las curvas granulométricas, una fila por tamiz con los porcentajes
+    calculados
+
+    Args:
+        desde (int): Se leen las curvas de los ensayos con ID mayor
+        incluir (callable, optional): Función (ensayo_id, código de muestra) que
+            indica si se lee una curva
+
+    Yields:
+        tuple: (valores de COLUMNAS_CURVAS, año)
+    """
+    consulta = f"""
+    SELECT c.ensayo_id, e.codigo_muestra, c.serie_tamices, c.masas_retenidas, g.masa_total,
+           {_anio("e.fecha_ensayo")}
+    FROM curvas_granulometricas c
+    JOIN ensayos e ON e.id = c.ensayo_id
+    LEFT JOIN ensayos_granulometricos g ON g.ensayo_id = c.ensayo_id
+    WHERE c.ensayo_id > ? ORDER BY c.ensayo_id LIMIT ?
+    """
+
+    for ensayo_id, codigo, serie_id, blob, masa_total, anio in _recorrer(conn, consulta, desde):
+        if incluir and not incluir(ensayo_id, codigo):
+            continue
+        serie = obtener_serie(serie_id)
+        masas = np.frombuffer(blob, dtype="<f8")
+        retenido, _, pasa = calcular_porcentajes_tamices(masas, masa_total or 0)
+        for i, (nombre, apertura) in enumerate(zip(serie.nombres, serie.aperturas)):
+            yield (ensayo_id, codigo, serie_id, i + 1, nombre, float(apertura),
+                   float(masas[i]), float(retenido[i]), float(pasa[i])), anio
+
+
+def _leer_puntos(conn, desde=0):
+    """
+    Recorre los puntos de las curvas Próctor
+
+    Args:
+        desde (int): Se leen los puntos de los ensayos con ID mayor
+
+    Yields:
+        tuple: (valores de COLUMNAS_PUNTOS, año)
+    """
+    # Los puntos se recorren por su ID; el filtro por ensayo lo resuelve SQLite
+    consulta = f"""
+    SELECT p.id, p.ensayo_id, e.codigo_muestra, p.numero_punto, p.humedad, p.densidad_seca,
+           {_anio("e.fecha_ensayo")}
+    FROM puntos_proctor p JOIN ensayos e ON e.id = p.ensayo_id
+    WHERE p.id > ? AND p.ensayo_id > ? ORDER BY p.id LIMIT ?
+    """
+    return ((fila[:-1], fila[-1]) for fila in _recorrer(conn, consulta, -2 ** 63, desde))
+
+
+@medir
+def exportar_archivo(destino=None, completa=False, progreso=None):
+    """
+    Exporta el archivo de ensayos a Parquet, particionado por tipo de ensayo y
+    año. La primera exportación escribe todo el archivo; las siguientes añaden
+    solo las muestras nuevas o modificadas, los ensayos nuevos y las
+    eliminaciones desde la anterior. El manifiesto guarda el cursor del
+    registro de cambios (models/cambios.py), de modo que solo se leen las filas
+    anotadas desde entonces; si sus cambios ya se han compactado, se comparan
+    las huellas de todas las muestras.
+
+    Cada exportación es un lote numerado que escribe un fichero parte-NNNNNN.parquet
+    en cada partición con cambios. Todas las filas llevan la columna lote: la
+    versión vigente de una muestra es la del lote mayor, y las muestras y
+    ensayos borrados se anotan en el conjunto "eliminados".
+
+    Args:
+        destino (str, optional): Directorio de la exportación (por defecto,
+            directorio_exportacion())
+        completa (bool): Si es True, borra la exportación existente y la rehace
+        progreso (callable, optional): Función (fracción, mensaje) que se llama
+            tras cada paso
+
+    Con fragmentación, fuera de un fragmento se exporta cada fragmento a su
+    propio directorio (destino/<fragmento> o el directorio por defecto del
+    fragmento).
+
+    Returns:
+        dict: Resumen del lote: número, fecha, si fue completa y filas por
+            conjunto (con fragmentos, las sumas y el resumen de cada uno en
+            "fragmentos")
+
+    Raises:
+        ValueError: Si el destino no está vacío y no contiene una exportación
+    """
+    fragmentos = db.listar_fragmentos() if db.fragmento_actual() is None else []
+    if fragmentos:
+        return _exportar_fragmentos(fragmentos, destino, completa, progreso)
+
+    destino = destino or directorio_exportacion()
+
+    with _bloqueo_exportacion:
+        manifiesto = estado_exportacion(destino)
+        if manifiesto is None and os.path.isdir(destino) and os.listdir(destino):
+            raise ValueError(f"El directorio {destino} no está vacío y no contiene una exportación")
+
+        if manifiesto is None or completa:
+            for nombre in (*CONJUNTOS, DIRECTORIO_ESTADO, MANIFIESTO):
+                ruta = os.path.join(destino, nombre)
+                if os.path.isdir(ruta):
+                    shutil.rmtree(ruta)
+                elif os.path.exists(ruta):
+                    os.remove(ruta)
+            manifiesto = {"lote": 0, "fecha": None, "lotes": []}
+            completa = True
+
+        lote = manifiesto["lote"] + 1
+        nombre = f"parte-{lote:06d}.parquet"
+        os.makedirs(destino, exist_ok=True)
+        _limpiar_lote(destino, nombre)
+
+        huellas_previas, ensayos_previos = _leer_estado(destino, manifiesto["lote"])
+
+        # Con el registro de cambios solo se leen las muestras y los ensayos
+        # anotados desde el lote anterior. Si no hay cursor o sus cambios ya se
+        # han compactado, se comparan las huellas de todas las muestras.
+        secuencia = ultima_secuencia()
+        netos = None
+        if not completa and manifiesto.get("secuencia") is not None:
+            try:
+                netos = cambios_netos(manifiesto["secuencia"], ("muestras", "ensayos"), secuencia)
+            except CambiosCompactados:
+                netos = None
+
+        conn = obtener_conexion()
+        conn.row_factory = None
+        escritores = {}
+        try:
+            escritores["muestras"] = _EscritorParticionado(
+                os.path.join(destino, "muestras"),
+                [("lote", pa.int64()), *_columnas(conn, "muestras")], nombre
+            )
+            escritores["eliminados"] = _EscritorParticionado(
+                os.path.join(destino, "eliminados"), COLUMNAS_ELIMINADOS, nombre
+            )
+            escritores["curvas_granulometricas"] = _EscritorParticionado(
+                os.path.join(destino, "curvas_granulometricas"), [("lote", pa.int64()), *COLUMNAS_CURVAS], nombre
+            )
+            escritores["puntos_proctor"] = _EscritorParticionado(
+                os.path.join(destino, "puntos_proctor"), [("lote", pa.int64()), *COLUMNAS_PUNTOS], nombre
+            )
+
+            pasos = 3 + len(TABLAS_ENSAYOS)
+
+            # Muestras nuevas o modificadas (su huella ha cambiado) y eliminadas. Con
+            # el registro de cambios se leen solo las anotadas; las que ya no
+            # existen se han eliminado.
+            if netos is None:
+                huellas, leidas = {}, None
+            else:
+                huellas, leidas = dict(huellas_previas), list(netos.get("muestras", {}))
+            vistas = set()
+            for valores, anio in _leer_muestras(conn, leidas)[1]:
+                codigo = valores[0]
+                vistas.add(codigo)
+                huellas[codigo] = _huella(valores)
+                if huellas_previas.get(codigo) != huellas[codigo]:
+                    escritores["muestras"].agregar((("anio", anio),), (lote, *valores))
+            for codigo in (huellas_previas if leidas is None else leidas):
+                if codigo not in vistas:
+                    huellas.pop(codigo, None)
+                    if codigo in huellas_previas:
+                        escritores["eliminados"].agregar((), (lote, "muestra", codigo))
+            escritores["muestras"].cerrar()
+            if progreso:
+                progreso(1 / pasos, "Muestras exportadas")
+
+            # Los ensayos no se modifican: se exportan los que no estaban en el lote
+            # anterior. Con el registro de cambios solo se comprueban los anotados.
+            if netos is None:
+                ensayos = np.fromiter((fila[0] for fila in conn.execute("SELECT id FROM ensayos ORDER BY id")),
+                                      dtype=np.int64)
+                eliminados = np.setdiff1d(ensayos_previos, ensayos, assume_unique=True)
+            else:
+                anotados = np.unique(np.array([int(clave) for clave in netos.get("ensayos", {})], dtype=np.int64))
+                existentes = np.fromiter((fila[0] for fila in conn.execute(
+                    "SELECT id FROM ensayos WHERE id IN (SELECT value FROM json_each(?)) ORDER BY id",
+                    (json.dumps(anotados.tolist()),)
+                )), dtype=np.int64)
+                eliminados = np.intersect1d(np.setdiff1d(anotados, existentes, assume_unique=True), ensayos_previos)
+                ensayos = np.union1d(np.setdiff1d(ensayos_previos, eliminados, assume_unique=True), existentes)
+            nuevos = np.setdiff1d(ensayos, ensayos_previos, assume_unique=True)
+            for ensayo_id in eliminados:
+                escritores["eliminados"].agregar((), (lote, "ensayo", str(ensayo_id)))
+            desde = int(nuevos[0]) - 1 if len(nuevos) else None
+
+            for i, (tipo, tabla) in enumerate(TABLAS_ENSAYOS.items(), start=2):
+                if desde is not None:
+                    columnas, filas = _leer_ensayos(conn, tabla, desde)
+                    escritor = escritores[f"ensayos/{tipo}"] = _EscritorParticionado(
+                        os.path.join(destino, "ensayos", f"tipo_ensayo={tipo}"),
+                        [("lote", pa.int64()), *columnas], nombre
+                    )
+                    for valores, anio in filas:
+                        if _contiene(nuevos, valores[0]):
+                            escritor.agregar((("anio", anio),), (lote, *valores))
+                    escritor.cerrar()
+                if progreso:
+                    progreso(i / pasos, f"Ensayos de {tipo} exportados")
+
+            if desde is not None:
+                for valores, anio in _leer_curvas(conn, desde, lambda ensayo_id, _: _contiene(nuevos, ensayo_id)):
+                    escritores["curvas_granulometricas"].agregar((("anio", anio),), (lote, *valores))
+            escritores["curvas_granulometricas"].cerrar()
+            if progreso:
+                progreso((pasos - 1) / pasos, "Curvas granulométricas exportadas")
+
+            if desde is not None:
+                for valores, anio in _leer_puntos(conn, desde):
+                    if _contiene(nuevos, valores[1]):
+                        escritores["puntos_proctor"].agregar((("anio", anio),), (lote, *valores))
+            escritores["puntos_proctor"].cerrar()
+        except BaseException:
+            for escritor in escritores.values():
+                escritor.descartar()
+            raise
+        finally:
+            conn.close()
+
+        # Se publican los ficheros, después el estado y por último el manifiesto. Si
+        # el proceso se interrumpe antes del manifiesto, el lote se repite entero.
+        for escritor in escritores.values():
+            escritor.publicar()
+        _escribir_estado(destino, lote, huellas, ensayos)
+
+        filas = {"muestras": 0, "ensayos": 0, "curvas_granulometricas": 0, "puntos_proctor": 0, "eliminados": 0}
+        for clave, escritor in escritores.items():
+            filas[clave.split("/")[0]] += escritor.filas
+        resumen = {
+            "lote": lote,
+            "fecha": datetime.now().isoformat(timespec="seconds"),
+            "completa": completa,
+            "incremental_por_cambios": netos is not None,
+            "filas": filas,
+        }
+        manifiesto.update(lote=lote, fecha=resumen["fecha"], secuencia=secuencia)
+        manifiesto["lotes"].append(resumen)
+        _escribir_manifiesto(destino, manifiesto)
+
+        # El estado del lote anterior ya no hace falta
+        for anterior in ("muestras", "ensayos"):
+            ruta = os.path.join(destino, DIRECTORIO_ESTADO, f"{anterior}-{lote - 1}.parquet")
+            if os.path.exists(ruta):
+                os.remove(ruta)
+
+        if progreso:
+            progreso(1.0, f"Lote {lote} exportado")
+
+    return resumen
+
+
+def _progreso_fragmento(progreso, indice, total, nombre):
+    """
+    Adapta el progreso de la exportación de un fragmento (de 0 a 1) al de todos
+
+    Returns:
+        callable: Función de progreso del fragmento, o None sin progreso
+    """
+    if not progreso:
+        return None
+
+    def parcial(fraccion, mensaje):
+        progreso((indice + fraccion) / total, f"{nombre}: {mensaje}")
+    return parcial
+
+
+def _exportar_fragmentos(fragmentos, destino, completa, progreso):
+    """
+    Exporta cada fragmento con exportar_archivo y reúne sus resúmenes
+    """
+    resumenes = {}
+    for i, nombre in enumerate(fragmentos):
+        parcial = _progreso_fragmento(progreso, i, len(fragmentos), nombre)
+        with db.en_fragmento(nombre):
+            resumenes[nombre] = exportar_archivo(destino and os.path.join(destino, nombre), completa, parcial)
+
+    filas = {}
+    for resumen in resumenes.values():
+        for conjunto, num in resumen["filas"].items():
+            filas[conjunto] = filas.get(conjunto, 0) + num
+    return {
+        "lote": max(resumen["lote"] for resumen in resumenes.values()),
+        "fecha": datetime.now().isoformat(timespec="seconds"),
+        "completa": all(resumen["completa"] for resumen in resumenes.values()),
+        "incremental_por_cambios": all(resumen["incremental_por_cambios"] for resumen in resumenes.values()),
+        "filas": filas,
+        "fragmentos": resumenes,
+    }
+
+
+def _escribir_csv(archivo_zip, nombre, columnas, filas):
+    """
+    Escribe un CSV en el ZIP fila a fila, sin reunirlo en memoria
+
+    Returns:
+        int: Filas escritas
+    """
+    escritas = 0
+    with io.TextIOWrapper(archivo_zip.open(nombre, "w", force_zip64=True), encoding="utf-8", newline="") as texto:
+        escritor = csv.writer(texto)
+        escritor.writerow(columnas)
+        for fila in filas:
+            escritor.writerow(fila)
+            escritas += 1
+    return escritas
+
+
+def _copiar_imagen(conn, imagen_id, archivo_zip, informacion):
+    """
+    Copia una imagen de la base de datos al ZIP por trozos de TAMANO_TROZO bytes
+
+    Returns:
+        bool: False si la imagen ya no existe
+    """
+    trozos = leer_blob_por_trozos(conn, "imagenes", "imagen", imagen_id, TAMANO_TROZO)
+    try:
+        primero = next(trozos, b"")
+    except KeyError:
+        # Borrada desde que se escribió el índice
+        return False
+    with archivo_zip.open(informacion, "w", force_zip64=True) as destino:
+        destino.write(primero)
+        for trozo in trozos:
+            destino.write(trozo)
+    return True
+
+
+def _leer_imagenes(conn):
+    """
+    Recorre los datos de las imágenes (sin la imagen) con la ruta que tienen en el ZIP
+
+    Yields:
+        tuple: Valores de COLUMNAS_IMAGENES
+    """
+    consulta = """
+    SELECT id, codigo_muestra, ensayo_id, nombre_archivo, fecha_subida, descripcion
+    FROM imagenes WHERE id > ? AND length(imagen) > 0 ORDER BY id LIMIT ?
+    """
+    for fila in _recorrer(conn, consulta, 0):
+        # Las imágenes se guardan en PNG (guardar_imagen)
+        nombre = os.path.splitext(os.path.basename(fila[3] or ""))[0]
+        yield (*fila, f"imagenes/{_nombre_seguro(fila[1])}/{fila[0]}_{_nombre_seguro(nombre)}.png")
+
+
+def _leer_fragmentos(conexiones, leer):
+    """
+    Encadena una lectura de tabla (_leer_muestras, _leer_ensayos) en varias
+    conexiones, una por fragmento, con las columnas en el orden de la primera
+
+    Args:
+        conexiones (list): Conexiones sin row_factory
+        leer (callable): Función (conexión) -> (columnas, iterador de (valores, año))
+
+    Returns:
+        tuple: (columnas [(nombre, tipo)], iterador de (valores, año))
+    """
+    columnas, filas = leer(conexiones[0])
+    nombres = [nombre for nombre, _ in columnas]
+    partes = [filas]
+    for conn in conexiones[1:]:
+        otras, filas = leer(conn)
+        otros = [nombre for nombre, _ in otras]
+        partes.append(_reordenar(filas, [otros.index(nombre) for nombre in nombres]))
+    return columnas, itertools.chain.from_iterable(partes)
+
+
+def _reordenar(filas, orden):
+    # Valores de cada fila en el orden de columnas indicado
+    for valores, anio in filas:
+        yield tuple(valores[i] for i in orden), anio
+
+
+def _nombre_seguro(texto):
+    # Nombre utilizable como ruta dentro del ZIP
+    return re.sub(r"[^\w.-]+", "_", str(texto or "")).strip("._") or "sin_nombre"
+
+
+def _borrar_zip_caducados():
+    """
+    Borra los ZIP exportados hace más de CADUCIDAD_ZIP_HORAS horas
+    """
+    limite = time.time() - CADUCIDAD_ZIP_HORAS * 3600
+    try:
+        ficheros = os.listdir(DIRECTORIO_ZIP)
+    except OSError:
+        return
+    for fichero in ficheros:
+        ruta = os.path.join(DIRECTORIO_ZIP, fichero)
+        try:
+            if os.path.getmtime(ruta) < limite:
+                os.remove(ruta)
+        except OSError:
+            pass
+
+
+@medir
+def exportar_zip(codigos=None, imagenes=True, progreso=None):
+    """
+    Exporta muestras con sus ensayos e imágenes a un ZIP con un CSV por tabla
+    (muestras, un fichero por tipo de ensayo, curvas granulométricas y puntos
+    Próctor) y las imágenes en imagenes/<código>/. Las tablas se leen por lotes
+    con lecturas cortas y se escriben en el ZIP a medida que se leen; las
+    imágenes se copian por trozos. La memoria no depende del tamaño de la
+    exportación. Con fragmentación se leen todos los fragmentos, cada uno
+    con su conexión.
+
+    Args:
+        codigos (list, optional): Códigos de las muestras; todas si es None
+        imagenes (bool): Si es True, incluye las imágenes
+        progreso (callable, optional): Función (fracción, mensaje) que se llama
+            tras cada paso
+
+    Returns:
+        dict: {"ruta": ruta del ZIP en DIRECTORIO_ZIP, "muestras", "ensayos",
+            "imagenes": número exportado de cada uno, "bytes": tamaño del ZIP}
+    """
+    seleccion = set(codigos) if codigos is not None else None
+
+    def incluida(codigo):
+        return seleccion is None or codigo in seleccion
+
+    os.makedirs(DIRECTORIO_ZIP, exist_ok=True)
+    _borrar_zip_caducados()
+    descriptor, ruta = tempfile.mkstemp(prefix=f"ensayos_{datetime.now():%Y%m%d_%H%M%S}_",
+                                        suffix=".zip", dir=DIRECTORIO_ZIP)
+    os.close(descriptor)
+
+    resumen = {"ruta": ruta, "muestras": 0, "ensayos": 0, "imagenes": 0}
+    pasos = 4 + len(TABLAS_ENSAYOS)
+    conexiones = []
+    try:
+        for base in db.bases_de_datos(principal=False):
+            with db.en_fragmento(base):
+                conexiones.append(obtener_conexion())
+            conexiones[-1].row_factory = None
+
+        with zipfile.ZipFile(ruta, "w", compression=zipfile.ZIP_DEFLATED, allowZip64=True) as archivo_zip:
+            columnas, filas = _leer_fragmentos(conexiones, _leer_muestras)
+            resumen["muestras"] = _escribir_csv(
+                archivo_zip, "muestras.csv", [nombre for nombre, _ in columnas],
+                (valores for valores, _ in filas if incluida(valores[0]))
+            )
+            if progreso:
+                progreso(1 / pasos, f"{resumen['muestras']} muestras exportadas")
+
+            for i, (tipo, tabla) in enumerate(TABLAS_ENSAYOS.items(), start=2):
+                columnas, filas = _leer_fragmentos(conexiones, lambda conn: _leer_ensayos(conn, tabla))
+                nombres = [nombre for nombre, _ in columnas]
+                posicion = nombres.index("codigo_muestra")
+                resumen["ensayos"] += _escribir_csv(
+                    archivo_zip, f"ensayos/{tipo}.csv", nombres,
+                    (valores for valores, _ in filas if incluida(valores[posicion]))
+                )
+                if progreso:
+                    progreso(i / pasos, f"Ensayos de {tipo} exportados")
+
+            _escribir_csv(
+                archivo_zip, "curvas_granulometricas.csv", [nombre for nombre, _ in COLUMNAS_CURVAS],
+                (valores for conn in conexiones
+                 for valores, _ in _leer_curvas(conn, incluir=lambda _, codigo: incluida(codigo)))
+            )
+            _escribir_csv(
+                archivo_zip, "puntos_proctor.csv", [nombre for nombre, _ in COLUMNAS_PUNTOS],
+                (valores for conn in conexiones for valores, _ in _leer_puntos(conn) if incluida(valores[2]))
+            )
+            if progreso:
+                progreso((pasos - 2) / pasos, "Curvas exportadas")
+
+            # Índice de imágenes y, en una segunda pasada, los ficheros de imagen
+            if imagenes:
+                _escribir_csv(archivo_zip, "imagenes.csv", COLUMNAS_IMAGENES,
+                              (fila for conn in conexiones for fila in _leer_imagenes(conn) if incluida(fila[1])))
+                for conn in conexiones:
+                    for fila in _leer_imagenes(conn):
+                        if not incluida(fila[1]):
+                            continue
+                        informacion = zipfile.ZipInfo(fila[-1], date_time=time.localtime()[:6])
+                        informacion.compress_type = zipfile.ZIP_STORED
+                        if _copiar_imagen(conn, fila[0], archivo_zip, informacion):
+                            resumen["imagenes"] += 1
+                        if progreso:
+                            progreso((pasos - 1) / pasos, f"{resumen['imagenes']} imágenes exportadas")
+    except BaseException:
+        os.remove(ruta)
+        raise
+    finally:
+        for conn in conexiones:
+            conn.close()
+
+    resumen["bytes"] = os.path.getsize(ruta)
+    if progreso:
+        progreso(1.0, f"Exportación terminada ({resumen['bytes'] / 1e6:.1f} MB)")
+    return resumen
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exporta el archivo de ensayos a Parquet particionado")
+    parser.add_argument("--destino", help="Directorio de la exportación (por defecto, GARNOCEX_EXPORTACION_DIR "
+                                          "o 'exportacion' junto a la base de datos)")
+    parser.add_argument("--completa", action="store_true",
+                        help="Rehace la exportación entera en lugar de añadir los cambios")
+    args = parser.parse_args()
+
+    inicio = time.perf_counter()
+    resumen = exportar_archivo(args.destino, args.completa,
+                               progreso=lambda fraccion, mensaje: print(f"  {mensaje}", file=sys.stderr))
+
+    print(f"Lote {resumen['lote']} exportado en {time.perf_counter() - inicio:.1f} s "
+          f"({'completo' if resumen['completa'] else 'incremental'})")
+    for conjunto, num in resumen["filas"].items():
+        print(f"  {conjunto:<30}{num:>12}")
+
+
+if __name__ == "__main__":
+    main()
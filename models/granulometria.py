@@ -1,7 +1,13 @@
 import sqlite3
-from models.db import obtener_conexion
+import numpy as np
+from models.db import obtener_conexion, ejecutar_escritura, empaquetar_valores, enrutar_por_muestra
 from models.muestras import actualizar_estado_muestra
+from models.metricas import medir
+from models.series_tamices import REJILLA_LOG, obtener_serie, registrar_serie
+from utils.calculo import calcular_porcentajes_tamices, remuestrear_pasa
 
+@medir
+@enrutar_por_muestra
 def guardar_ensayo_granulometrico(codigo_muestra, fecha_ensayo, operario, masa_total, datos_tamices, d10, d30, d60, cu, cc):
     """
     Guarda un ensayo granulométrico y sus datos asociados
@@ -21,56 +27,45 @@ def guardar_ensayo_granulometrico(codigo_muestra, fecha_ensayo, operario, masa_t
     Returns:
         int: ID del ensayo guardado
     """
-    conn = obtener_conexion()
-    c = conn.cursor()
-    
-    try:
-        # Iniciar transacción
-        conn.execute("BEGIN")
+    def insertar(conn):
+        c = conn.cursor()
         
-        # Insertar datos del ensayo
+        # Insertar en la tabla general de ensayos
         c.execute("""
-        INSERT INTO ensayos_granulometricos 
-        (codigo_muestra, fecha_ensayo, operario, masa_total, d10, d30, d60, coef_uniformidad, coef_curvatura)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (codigo_muestra, fecha_ensayo, operario, masa_total, d10, d30, d60, cu, cc))
+        INSERT INTO ensayos (codigo_muestra, tipo_ensayo, fecha_ensayo, operario)
+        VALUES (?, ?, ?, ?)
+        """, (codigo_muestra, "Granulométrico", fecha_ensayo, operario))
         
         # Obtener el ID del ensayo insertado
         ensayo_id = c.lastrowid
         
-        # Insertar datos de los tamices
-        for dato in datos_tamices:
-            c.execute("""
-            INSERT INTO datos_tamices 
-            (ensayo_id, tamiz, apertura, masa_retenida, porcentaje_retenido, 
-             porcentaje_retenido_acumulado, porcentaje_pasa)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-            """, (
-                ensayo_id,
-                dato["tamiz"],
-                dato["apertura"],
-                dato["masa_retenida"],
-                dato["porcentaje_retenido"],
-                dato["porcentaje_retenido_acumulado"],
-                dato["porcentaje_pasa"]
-            ))
-        
-        # Confirmar transacción
-        conn.execute("COMMIT")
+        # Insertar datos específicos del ensayo
+        c.execute("""
+        INSERT INTO ensayos_granulometricos 
+        (ensayo_id, masa_total, d10, d30, d60, coef_uniformidad, coef_curvatura)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, (ensayo_id, masa_total, d10, d30, d60, cu, cc))
         
-        # Actualizar estado de la muestra
-        actualizar_estado_muestra(codigo_muestra, "con ensayo granulométrico")
+        # Insertar la curva: ID de la serie de tamices y masas retenidas empaquetadas
+        serie = registrar_serie(
+            conn, [dato["tamiz"] for dato in datos_tamices], [dato["apertura"] for dato in datos_tamices]
+        )
+        c.execute("""
+        INSERT INTO curvas_granulometricas (ensayo_id, serie_tamices, masas_retenidas)
+        VALUES (?, ?, ?)
+        """, (ensayo_id, serie, empaquetar_valores([dato["masa_retenida"] for dato in datos_tamices])))
         
         return ensayo_id
-        
-    except Exception as e:
-        # Revertir cambios en caso de error
-        conn.execute("ROLLBACK")
-        raise e
     
-    finally:
-        conn.close()
+    ensayo_id = ejecutar_escritura(insertar)
+    
+    # Actualizar estado de la muestra
+    actualizar_estado_muestra(codigo_muestra, "con ensayo granulométrico")
+    
+    return ensayo_id
 
+@medir
+@enrutar_por_muestra
 def obtener_ensayo_granulometrico(codigo_muestra):
     """
     Obtiene el último ensayo granulométrico de una muestra
@@ -84,35 +79,91 @@ def obtener_ensayo_granulometrico(codigo_muestra):
     conn = obtener_conexion()
     c = conn.cursor()
     
-    # Obtener ensayo
+    # Obtener ensayo y su curva granulométrica
     c.execute("""
-    SELECT * FROM ensayos_granulometricos 
-    WHERE codigo_muestra = ? 
-    ORDER BY id DESC LIMIT 1
+    SELECT e.*, eg.*, cg.serie_tamices, cg.masas_retenidas
+    FROM ensayos e
+    JOIN ensayos_granulometricos eg ON e.id = eg.ensayo_id
+    LEFT JOIN curvas_granulometricas cg ON cg.ensayo_id = eg.ensayo_id
+    WHERE e.codigo_muestra = ? 
+    ORDER BY e.id DESC LIMIT 1
     """, (codigo_muestra,))
     
     ensayo = c.fetchone()
+    conn.close()
     
     if not ensayo:
-        conn.close()
         return None
     
     # Convertir a diccionario
     ensayo_dict = dict(ensayo)
+    serie = ensayo_dict.pop("serie_tamices")
+    blob_masas = ensayo_dict.pop("masas_retenidas")
     
-    # Obtener datos de tamices
-    c.execute("""
-    SELECT * FROM datos_tamices 
-    WHERE ensayo_id = ? 
-    ORDER BY apertura DESC
-    """, (ensayo['id'],))
+    if blob_masas is None:
+        ensayo_dict['tamices'] = []
+        return ensayo_dict
     
-    tamices = [dict(row) for row in c.fetchall()]
-    ensayo_dict['tamices'] = tamices
+    # Tamices de la serie y porcentajes calculados a partir de las masas
+    serie = obtener_serie(serie)
+    masas = np.frombuffer(blob_masas, dtype="<f8")
+    retenido, acumulado, pasa = calcular_porcentajes_tamices(masas, ensayo_dict["masa_total"])
+    
+    ensayo_dict['tamices'] = [
+        {
+            "ensayo_id": ensayo_dict["ensayo_id"],
+            "tamiz": nombre,
+            "apertura": float(apertura),
+            "masa_retenida": float(masas[i]),
+            "porcentaje_retenido": float(retenido[i]),
+            "porcentaje_retenido_acumulado": float(acumulado[i]),
+            "porcentaje_pasa": float(pasa[i])
+        }
+        for i, (nombre, apertura) in enumerate(zip(serie.nombres, serie.aperturas))
+    ]
     
-    conn.close()
     return ensayo_dict
 
+@medir
+def calcular_pasa_en_aperturas(curvas, aperturas_objetivo=REJILLA_LOG):
+    """
+    Calcula el porcentaje que pasa por unas mismas aperturas en muchas curvas
+    granulométricas a la vez, aunque sean de series de tamices distintas. Las
+    curvas se agrupan por serie y se remuestrean en escala logarítmica de
+    apertura; en las aperturas de la propia serie el valor es exacto.
+    
+    Args:
+        curvas (pandas.DataFrame): Curvas con las columnas masa_total, serie_tamices
+            y masas_retenidas (las de curvas_granulometricas)
+        aperturas_objetivo (array-like): Aperturas en mm. Por defecto, la rejilla
+            logarítmica común REJILLA_LOG
+        
+    Returns:
+        numpy.ndarray: Matriz (curvas, aperturas) con el porcentaje que pasa; NaN si
+            la curva no tiene datos o la apertura queda fuera de su serie
+    """
+    resultado = np.full((len(curvas), len(aperturas_objetivo)), np.nan)
+    
+    grupos = {}
+    for posicion, (serie, blob) in enumerate(zip(curvas["serie_tamices"], curvas["masas_retenidas"])):
+        if isinstance(blob, bytes):
+            grupos.setdefault(serie, []).append(posicion)
+    
+    masas_totales = curvas["masa_total"].to_numpy(dtype=float)
+    blobs = curvas["masas_retenidas"].to_numpy()
+    for serie_id, filas in grupos.items():
+        serie = obtener_serie(serie_id)
+        
+        # Una lectura de todas las masas del grupo como matriz (curvas, tamices)
+        filas = np.array(filas)
+        masas = np.frombuffer(b"".join(blobs[filas]), dtype="<f8").reshape(len(filas), len(serie))
+        _, _, pasa = calcular_porcentajes_tamices(masas, masas_totales[filas])
+        resultado[filas] = remuestrear_pasa(serie.aperturas, pasa, aperturas_objetivo)
+    
+    return resultado
+
+@medir
+@enrutar_por_muestra
 def obtener_todos_ensayos_granulometricos(codigo_muestra=None):
     """
     Obtiene todos los ensayos granulométricos, opcionalmente filtrados por muestra
@@ -128,18 +179,20 @@ def obtener_todos_ensayos_granulometricos(codigo_muestra=None):
     
     if codigo_muestra:
         c.execute("""
-        SELECT eg.*, m.codigo_muestra 
-        FROM ensayos_granulometricos eg
-        JOIN muestras m ON eg.codigo_muestra = m.codigo_muestra
-        WHERE eg.codigo_muestra = ?
-        ORDER BY eg.fecha_ensayo DESC
+        SELECT e.*, eg.*, m.codigo_muestra 
+        FROM ensayos e
+        JOIN ensayos_granulometricos eg ON e.id = eg.ensayo_id
+        JOIN muestras m ON e.codigo_muestra = m.codigo_muestra
+        WHERE e.codigo_muestra = ?
+        ORDER BY e.fecha_ensayo DESC
         """, (codigo_muestra,))
     else:
         c.execute("""
-        SELECT eg.*, m.codigo_muestra 
-        FROM ensayos_granulometricos eg
-        JOIN muestras m ON eg.codigo_muestra = m.codigo_muestra
-        ORDER BY eg.fecha_ensayo DESC
+        SELECT e.*, eg.*, m.codigo_muestra 
+        FROM ensayos e
+        JOIN ensayos_granulometricos eg ON e.id = eg.ensayo_id
+        JOIN muestras m ON e.codigo_muestra = m.codigo_muestra
+        ORDER BY e.fecha_ensayo DESC
         """)
     
     ensayos = [dict(row) for row in c.fetchall()]
@@ -0,0 +1,278 @@
+from bisect import bisect_left, bisect_right
+
+import numpy as np
+
+from models.metricas import medir
+
+# Tablas de umbrales para la interpretación de resultados.
+# Cada clave admite varias versiones (norma y versión); la última de la lista
+# es la vigente. "limites" son los valores frontera en orden ascendente y
+# "etiquetas" contiene, para cada columna de salida, una etiqueta por intervalo
+# (una más que límites). "cierre" indica a qué intervalo pertenece un valor
+# igual a un límite: "izquierda" -> [a, b), "derecha" -> (a, b].
+TABLAS_UMBRALES = {
+    "cbr": [
+        {
+            "norma": "Valores típicos CBR",
+            "version": "1",
+            "limites": (3, 7, 20, 50),
+            "cierre": "izquierda",
+            "etiquetas": {
+                "interpretacion": (
+                    "Muy pobre (subrasante)",
+                    "Pobre a regular (subrasante)",
+                    "Regular (subbase)",
+                    "Bueno (base)",
+                    "Excelente (base)",
+                ),
+            },
+        },
+    ],
+    "indice_lajas": [
+        {
+            "norma": "UNE-EN 933-3",
+            "version": "1",
+            "limites": (10, 20, 35),
+            "cierre": "derecha",
+            "etiquetas": {
+                "interpretacion": (
+                    "Muy buena forma (IL ≤ 10%)",
+                    "Buena forma (10% < IL ≤ 20%)",
+                    "Forma aceptable (20% < IL ≤ 35%)",
+                    "Mala forma (IL > 35%)",
+                ),
+            },
+        },
+    ],
+    "indice_agujas": [
+        {
+            "norma": "UNE-EN 933-4",
+            "version": "1",
+            "limites": (10, 20, 35),
+            "cierre": "derecha",
+            "etiquetas": {
+                "interpretacion": (
+                    "Muy buena forma (IA ≤ 10%)",
+                    "Buena forma (10% < IA ≤ 20%)",
+                    "Forma aceptable (20% < IA ≤ 35%)",
+                    "Mala forma (IA > 35%)",
+                ),
+            },
+        },
+    ],
+    "densidad_suelo": [
+        {
+            "norma": "Rangos típicos de densidad aparente",
+            "version": "1",
+            "limites": (1.2, 1.4, 1.6, 1.8),
+            "cierre": "izquierda",
+            "etiquetas": {
+                "interpretacion": (
+                    "Muy baja densidad (menos de 1.2 g/cm³)",
+                    "Baja densidad (1.2 - 1.4 g/cm³)",
+                    "Densidad media (1.4 - 1.6 g/cm³)",
+                    "Alta densidad (1.6 - 1.8 g/cm³)",
+                    "Muy alta densidad (más de 1.8 g/cm³)",
+                ),
+            },
+        },
+    ],
+    "densidad_arena": [
+        {
+            "norma": "Rangos típicos de densidad aparente",
+            "version": "1",
+            "limites": (1.4, 1.6),
+            "cierre": "izquierda",
+            "etiquetas": {
+                "interpretacion": (
+                    "Baja densidad para arena (menos de 1.4 g/cm³)",
+                    "Densidad normal para arena (1.4 - 1.6 g/cm³)",
+                    "Alta densidad para arena (más de 1.6 g/cm³)",
+                ),
+            },
+        },
+    ],
+    "densidad_arcilla": [
+        {
+            "norma": "Rangos típicos de densidad aparente",
+            "version": "1",
+            "limites": (1.6, 1.8),
+            "cierre": "izquierda",
+            "etiquetas": {
+                "interpretacion": (
+                    "Baja densidad para arcilla (menos de 1.6 g/cm³)",
+                    "Densidad normal para arcilla (1.6 - 1.8 g/cm³)",
+                    "Alta densidad para arcilla (más de 1.8 g/cm³)",
+                ),
+            },
+        },
+    ],
+    "equivalente_arena": [
+        {
+            "norma": "PG-3",
+            "version": "1",
+            "limites": (30, 40, 50),
+            "cierre": "izquierda",
+            "etiquetas": {
+                "clasificacion": (
+                    "Árido con alto contenido de finos arcillosos (EA < 30)",
+                    "Árido con contenido significativo de finos arcillosos (30 ≤ EA < 40)",
+                    "Árido con contenido limitado de finos arcillosos (40 ≤ EA < 50)",
+                    "Árido limpio (EA ≥ 50)",
+                ),
+                "recomendacion": (
+                    "No recomendado para capas de firmes, posible uso en aplicaciones no estructurales",
+                    "Uso limitado, verificar requisitos específicos de la aplicación",
+                    "Apto para algunas capas de firmes y ciertas aplicaciones",
+                    "Apto para la mayoría de usos en obra civil",
+                ),
+            },
+        },
+    ],
+}
+
+# Tabla de densidades a aplicar según el tipo de material
+TABLAS_DENSIDAD_POR_TIPO = {
+    "suelo": "densidad_suelo",
+    "arena": "densidad_arena",
+    "arcilla": "densidad_arcilla",
+}
+
+TIPO_DENSIDAD_NO_RECONOCIDO = "Tipo de suelo no reconocido para interpretación"
+
+
+@medir
+def obtener_tabla_umbrales(clave, norma=None, version=None):
+    """
+    Obtiene una tabla de umbrales de interpretación
+
+    Args:
+        clave (str): Clave del resultado (por ejemplo "cbr" o "equivalente_arena")
+        norma (str, optional): Norma de la tabla. Por defecto, la vigente
+        version (str, optional): Versión de la tabla. Por defecto, la vigente
+
+    Returns:
+        dict: Tabla de umbrales
+
+    Raises:
+        ValueError: Si no existe una tabla para la clave, norma y versión indicadas
+    """
+    if clave not in TABLAS_UMBRALES:
+        raise ValueError(f"No hay tabla de umbrales para '{clave}'")
+
+    candidatas = [
+        tabla for tabla in TABLAS_UMBRALES[clave]
+        if (norma is None or tabla["norma"] == norma)
+        and (version is None or tabla["version"] == version)
+    ]
+
+    if not candidatas:
+        raise ValueError(f"No hay tabla de umbrales para '{clave}' con norma {norma} y versión {version}")
+
+    return candidatas[-1]
+
+
+@medir
+def interpretar_valor(valor, clave, etiqueta="interpretacion", norma=None, version=None):
+    """
+    Interpreta un único resultado según su tabla de umbrales
+
+    Args:
+        valor (float): Valor del resultado
+        clave (str): Clave de la tabla de umbrales
+        etiqueta (str): Columna de etiquetas a devolver
+        norma (str, optional): Norma de la tabla
+        version (str, optional): Versión de la tabla
+
+    Returns:
+        str: Etiqueta del intervalo al que pertenece el valor
+    """
+    tabla = obtener_tabla_umbrales(clave, norma, version)
+    buscar = bisect_right if tabla["cierre"] == "izquierda" else bisect_left
+    return tabla["etiquetas"][etiqueta][buscar(tabla["limites"], valor)]
+
+
+@medir
+def interpretar_valores(valores, clave, etiqueta="interpretacion", norma=None, version=None):
+    """
+    Interpreta un conjunto de resultados según su tabla de umbrales
+
+    Args:
+        valores (array-like): Valores de los resultados
+        clave (str): Clave de la tabla de umbrales
+        etiqueta (str): Columna de etiquetas a devolver
+        norma (str, optional): Norma de la tabla
+        version (str, optional): Versión de la tabla
+
+    Returns:
+        numpy.ndarray: Etiqueta de cada valor (None para valores ausentes)
+    """
+    tabla = obtener_tabla_umbrales(clave, norma, version)
+    valores = np.asarray(valores, dtype=float)
+
+    indices = np.digitize(valores, tabla["limites"], right=tabla["cierre"] == "derecha")
+    etiquetas = np.asarray(tabla["etiquetas"][etiqueta] + (None,), dtype=object)
+
+    # Los valores ausentes se dirigen a la etiqueta vacía añadida al final
+    indices[np.isnan(valores)] = len(etiquetas) - 1
+    return etiquetas[indices]
+
+
+@medir
+def anotar_resultados(df, columnas, norma=None, version=None):
+    """
+    Añade a un DataFrame la interpretación de una o varias columnas de resultados
+
+    Por cada columna se añade una columna "<columna>_<etiqueta>" para cada
+    etiqueta de su tabla. La norma y versión aplicadas quedan registradas en
+    df.attrs["umbrales"].
+
+    Args:
+        df (pandas.DataFrame): Resultados a interpretar
+        columnas (dict): Correspondencia columna -> clave de tabla de umbrales,
+            por ejemplo {"indice_cbr": "cbr"}
+        norma (str, optional): Norma de las tablas
+        version (str, optional): Versión de las tablas
+
+    Returns:
+        pandas.DataFrame: Copia del DataFrame con las columnas de interpretación
+    """
+    df = df.copy()
+    umbrales = dict(df.attrs.get("umbrales", {}))
+
+    for columna, clave in columnas.items():
+        tabla = obtener_tabla_umbrales(clave, norma, version)
+        for etiqueta in tabla["etiquetas"]:
+            df[f"{columna}_{etiqueta}"] = interpretar_valores(df[columna], clave, etiqueta, norma, version)
+        umbrales[columna] = f"{tabla['norma']} v{tabla['version']}"
+
+    df.attrs["umbrales"] = umbrales
+    return df
+
+
+@medir
+def anotar_densidades(df, columna_densidad="densidad_aparente", columna_tipo="tipo_material"):
+    """
+    Añade a un DataFrame la interpretación de densidades aparentes según el
+    tipo de material de cada fila
+
+    Args:
+        df (pandas.DataFrame): Resultados a interpretar
+        columna_densidad (str): Columna con la densidad aparente en g/cm³
+        columna_tipo (str): Columna con el tipo de material
+
+    Returns:
+        pandas.DataFrame: Copia del DataFrame con la columna
+            "<columna_densidad>_interpretacion"
+    """
+    df = df.copy()
+    tipos = df[columna_tipo].fillna("").astype(str).str.lower().to_numpy()
+    interpretaciones = np.full(len(df), TIPO_DENSIDAD_NO_RECONOCIDO, dtype=object)
+
+    for tipo, clave in TABLAS_DENSIDAD_POR_TIPO.items():
+        mascara = tipos == tipo
+        if mascara.any():
+            interpretaciones[mascara] = interpretar_valores(df[columna_densidad].to_numpy()[mascara], clave)
+
+    df[f"{columna_densidad}_interpretacion"] = interpretaciones
+    return df
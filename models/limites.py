@@ -1,7 +1,10 @@
 import sqlite3
-from models.db import obtener_conexion
+from models.db import obtener_conexion, ejecutar_escritura, enrutar_por_muestra
 from models.muestras import actualizar_estado_muestra
+from models.metricas import medir
 
+@medir
+@enrutar_por_muestra
 def guardar_ensayo_limites(codigo_muestra, fecha_ensayo, operario, 
                          limite_liquido, limite_plastico, indice_plasticidad,
                          notas=None):
@@ -20,12 +23,8 @@ def guardar_ensayo_limites(codigo_muestra, fecha_ensayo, operario,
     Returns:
         int: ID del ensayo guardado
     """
-    conn = obtener_conexion()
-    c = conn.cursor()
-    
-    try:
-        # Iniciar transacción
-        conn.execute("BEGIN")
+    def insertar(conn):
+        c = conn.cursor()
         
         # Insertar en la tabla general de ensayos
         c.execute("""
@@ -42,22 +41,17 @@ def guardar_ensayo_limites(codigo_muestra, fecha_ensayo, operario,
         VALUES (?, ?, ?, ?)
         """, (ensayo_id, limite_liquido, limite_plastico, indice_plasticidad))
         
-        # Confirmar transacción
-        conn.execute("COMMIT")
-        
-        # Actualizar estado de la muestra
-        actualizar_estado_muestra(codigo_muestra, "con ensayo de límites")
-        
         return ensayo_id
-        
-    except Exception as e:
-        # Revertir cambios en caso de error
-        conn.execute("ROLLBACK")
-        raise e
     
-    finally:
-        conn.close()
+    ensayo_id = ejecutar_escritura(insertar)
+    
+    # Actualizar estado de la muestra
+    actualizar_estado_muestra(codigo_muestra, "con ensayo de límites")
+    
+    return ensayo_id
 
+@medir
+@enrutar_por_muestra
 def obtener_ensayo_limites(codigo_muestra):
     """
     Obtiene el último ensayo de límites de Atterberg de una muestra
@@ -89,6 +83,8 @@ def obtener_ensayo_limites(codigo_muestra):
     # Convertir a diccionario
     return dict(ensayo)
 
+@medir
+@enrutar_por_muestra
 def obtener_todos_ensayos_limites(codigo_muestra=None):
     """
     Obtiene todos los ensayos de límites de Atterberg, opcionalmente filtrados por muestra
@@ -126,6 +122,7 @@ def obtener_todos_ensayos_limites(codigo_muestra=None):
     
     return ensayos
 
+@medir
 def calcular_indice_plasticidad(limite_liquido, limite_plastico):
     """
     Calcula el índice de plasticidad a partir del límite líquido y plástico
@@ -143,6 +140,7 @@ def calcular_indice_plasticidad(limite_liquido, limite_plastico):
     
     return limite_liquido - limite_plastico
 
+@medir
 def obtener_clasificacion_sucs(limite_liquido, indice_plasticidad):
     """
     Obtiene la clasificación SUCS según Carta de Plasticidad de Casagrande
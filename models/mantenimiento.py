@@ -0,0 +1,336 @@
+import argparse
+import logging
+import os
+import sys
+import time
+
+import models.db as db
+from models.cambios import compactar_cambios
+from models.db import ejecutar_escritura, obtener_conexion
+from models.metricas import medir, observar
+from models.trazas import conectar
+
+# Horas entre mantenimientos programados (0 desactiva la programación)
+INTERVALO_MANTENIMIENTO_HORAS = float(os.environ.get("GARNOCEX_MANTENIMIENTO_INTERVALO_H", "0"))
+
+# Páginas que libera cada paso de incremental_vacuum, pasos máximos por
+# ejecución y pausa entre pasos. Cada paso es una transacción de escritura
+# corta, así que los demás escritores solo esperan a un paso.
+PAGINAS_POR_PASO_VACIADO = 1000
+PASOS_VACIADO_MAXIMOS = int(os.environ.get("GARNOCEX_MANTENIMIENTO_PASOS_VACIADO", "100"))
+PAUSA_ENTRE_PASOS = 0.05
+
+# Filas por índice que examina ANALYZE (PRAGMA analysis_limit): las
+# estadísticas son aproximadas pero ANALYZE no recorre tablas enteras
+LIMITE_ANALISIS = 1000
+
+# Segundos sin escrituras que se consideran inactividad, y espera máxima hasta
+# encontrarla, para truncar el WAL
+SEGUNDOS_INACTIVIDAD = 5
+ESPERA_INACTIVIDAD_MAXIMA = float(os.environ.get("GARNOCEX_MANTENIMIENTO_ESPERA_S", "300"))
+
+# Valores de PRAGMA auto_vacuum
+MODOS_AUTO_VACUUM = {0: "none", 1: "full", 2: "incremental"}
+
+logger = logging.getLogger(__name__)
+
+
+@medir
+def estado_bd():
+    """
+    Devuelve el tamaño de la base de datos y su configuración de vaciado y diario
+
+    Returns:
+        dict: bd_bytes, wal_bytes, paginas, paginas_libres, tamano_pagina,
+            auto_vacuum y journal_mode
+    """
+    tamanos = {}
+    for nombre, ruta in (("bd_bytes", db.ruta_bd()), ("wal_bytes", db.ruta_bd() + "-wal")):
+        try:
+            tamanos[nombre] = os.path.getsize(ruta)
+        except OSError:
+            tamanos[nombre] = 0
+
+    conn = obtener_conexion()
+    try:
+        tamanos.update({
+            "paginas": conn.execute("PRAGMA page_count").fetchone()[0],
+            "paginas_libres": conn.execute("PRAGMA freelist_count").fetchone()[0],
+            "tamano_pagina": conn.execute("PRAGMA page_size").fetchone()[0],
+            "auto_vacuum": MODOS_AUTO_VACUUM.get(conn.execute("PRAGMA auto_vacuum").fetchone()[0]),
+            "journal_mode": conn.execute("PRAGMA journal_mode").fetchone()[0],
+        })
+    finally:
+        conn.close()
+    return tamanos
+
+
+@medir
+def actualizar_estadisticas(completo=False):
+    """
+    Actualiza las estadísticas del planificador de consultas. La primera vez
+    (sin tabla sqlite_stat1) o con completo se ejecuta ANALYZE, limitado a
+    LIMITE_ANALISIS filas por índice; después basta PRAGMA optimize, que solo
+    vuelve a analizar las tablas que han cambiado mucho.
+
+    Args:
+        completo (bool): Ejecutar ANALYZE aunque ya haya estadísticas
+
+    Returns:
+        str: Sentencia ejecutada ("ANALYZE" o "PRAGMA optimize")
+    """
+    def analizar(conn):
+        conn.execute(f"PRAGMA analysis_limit = {LIMITE_ANALISIS}")
+        hay_estadisticas = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'"
+        ).fetchone()
+        if completo or not hay_estadisticas:
+            conn.execute("ANALYZE")
+            return "ANALYZE"
+        conn.execute("PRAGMA optimize")
+        return "PRAGMA optimize"
+
+    return ejecutar_escritura(analizar)
+
+
+@medir
+def activar_vaciado_incremental():
+    """
+    Pasa la base de datos a auto_vacuum=INCREMENTAL. En una base de datos ya
+    creada el cambio exige un VACUUM completo, que reescribe el fichero entero,
+    bloquea las escrituras mientras dura y necesita otro tanto de espacio libre
+    en disco. Se hace una sola vez, en una ventana de mantenimiento.
+
+    Returns:
+        bool: True si se ha cambiado el modo (False si ya era incremental)
+    """
+    conn = conectar(db.ruta_bd(), timeout=db.TIEMPO_ESPERA_BLOQUEO, isolation_level=None)
+    try:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            return False
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+    return True
+
+
+@medir
+def vaciar_incremental(pasos=None, progreso=None):
+    """
+    Devuelve al sistema de ficheros las páginas libres (las que dejan las
+    muestras eliminadas o las imágenes recomprimidas) con pasos de
+    PRAGMA incremental_vacuum de PAGINAS_POR_PASO_VACIADO páginas. Solo tiene
+    efecto con auto_vacuum=INCREMENTAL.
+
+    Args:
+        pasos (int, optional): Pasos máximos. Por defecto, PASOS_VACIADO_MAXIMOS
+        progreso (callable, optional): Función (fraccion, mensaje)
+
+    Returns:
+        dict: paginas_liberadas, pasos dados y paginas_libres que quedan
+    """
+    pasos = pasos or PASOS_VACIADO_MAXIMOS
+
+    def paso(conn):
+        antes = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            # El módulo sqlite3 da un solo paso a una sentencia sin columnas de
+            # resultado, y cada paso de incremental_vacuum libera una sola página
+            for _ in range(min(antes, PAGINAS_POR_PASO_VACIADO)):
+                conn.execute("PRAGMA incremental_vacuum(1)")
+        return antes, conn.execute("PRAGMA freelist_count").fetchone()[0]
+
+    liberadas = 0
+    dados = 0
+    while True:
+        antes, libres = ejecutar_escritura(paso)
+        if libres == antes:
+            break
+        dados += 1
+        liberadas += antes - libres
+        if progreso:
+            progreso(dados / pasos, f"{liberadas} páginas liberadas")
+        if libres == 0 or dados == pasos:
+            break
+        time.sleep(PAUSA_ENTRE_PASOS)
+
+    return {"paginas_liberadas": liberadas, "pasos": dados, "paginas_libres": libres}
+
+
+@medir
+def esperar_inactividad(segundos=None, espera_maxima=None):
+    """
+    Espera a que pasen unos segundos sin que nadie escriba en la base de datos.
+    Las escrituras se detectan con PRAGMA data_version, que cambia cada vez que
+    otra conexión confirma una transacción.
+
+    Args:
+        segundos (float, optional): Segundos seguidos sin escrituras. Por defecto, SEGUNDOS_INACTIVIDAD
+        espera_maxima (float, optional): Segundos máximos de espera. Por defecto, ESPERA_INACTIVIDAD_MAXIMA
+
+    Returns:
+        bool: True si se ha encontrado un periodo sin escrituras
+    """
+    segundos = SEGUNDOS_INACTIVIDAD if segundos is None else segundos
+    espera_maxima = ESPERA_INACTIVIDAD_MAXIMA if espera_maxima is None else espera_maxima
+
+    conn = obtener_conexion()
+    try:
+        limite = time.monotonic() + espera_maxima
+        version = conn.execute("PRAGMA data_version").fetchone()[0]
+        desde = time.monotonic()
+        while time.monotonic() - desde < segundos:
+            if time.monotonic() > limite:
+                return False
+            time.sleep(min(0.5, segundos))
+            actual = conn.execute("PRAGMA data_version").fetchone()[0]
+            if actual != version:
+                version = actual
+                desde = time.monotonic()
+        return True
+    finally:
+        conn.close()
+
+
+@medir
+def checkpoint_wal(truncar=True):
+    """
+    Copia el WAL a la base de datos. Con truncar se usa wal_checkpoint(TRUNCATE),
+    que además deja el WAL en 0 bytes; si hay lectores o escritores que lo
+    impiden, SQLite lo indica y el WAL se vacía en el siguiente. Sin truncar se
+    usa PASSIVE, que no espera a nadie.
+
+    Args:
+        truncar (bool): Usar TRUNCATE en lugar de PASSIVE
+
+    Returns:
+        dict: modo, ocupado (True si no se pudo completar), paginas_wal y
+            paginas_copiadas; None si la base de datos no usa WAL
+    """
+    modo = "TRUNCATE" if truncar else "PASSIVE"
+    conn = obtener_conexion()
+    try:
+        if conn.execute("PRAGMA journal_mode").fetchone()[0] != "wal":
+            return None
+        ocupado, paginas_wal, copiadas = conn.execute(f"PRAGMA wal_checkpoint({modo})").fetchone()
+    finally:
+        conn.close()
+    return {"modo": modo, "ocupado": bool(ocupado), "paginas_wal": paginas_wal, "paginas_copiadas": copiadas}
+
+
+@medir
+def ejecutar_mantenimiento(analizar=False, activar_vaciado=False, pasos_vaciado=None, progreso=None):
+    """
+    Ejecuta el mantenimiento de la base de datos sin detener la aplicación:
+    estadísticas del planificador, compactación del registro de cambios
+    (models/cambios.py), vaciado incremental de las páginas libres y
+    checkpoint del WAL en un periodo sin escrituras (o PASSIVE si no lo hay).
+    Registra en el log el tamaño antes y después y la duración de cada paso.
+
+    Args:
+        analizar (bool): Ejecutar ANALYZE completo en lugar de PRAGMA optimize
+        activar_vaciado (bool): Pasar antes a auto_vacuum=INCREMENTAL con un VACUUM
+            completo (bloquea las escrituras; ver activar_vaciado_incremental)
+        pasos_vaciado (int, optional): Pasos máximos de incremental_vacuum
+        progreso (callable, optional): Función (fraccion, mensaje)
+
+    Returns:
+        dict: antes, despues (estado_bd()), pasos (resultado y segundos de cada paso) y segundos
+    """
+    def avisar(fraccion, mensaje):
+        if progreso:
+            progreso(fraccion, mensaje)
+
+    inicio = time.perf_counter()
+    antes = estado_bd()
+    pasos = {}
+
+    def medir_paso(nombre, funcion, *args, **kwargs):
+        comienzo = time.perf_counter()
+        resultado = funcion(*args, **kwargs)
+        segundos = time.perf_counter() - comienzo
+        observar("duracion_mantenimiento_segundos", segundos, paso=nombre)
+        pasos[nombre] = {"resultado": resultado, "segundos": round(segundos, 3)}
+        return resultado
+
+    if activar_vaciado:
+        avisar(0.0, "Activando el vaciado incremental (VACUUM completo)")
+        medir_paso("activar_vaciado", activar_vaciado_incremental)
+
+    avisar(0.1, "Actualizando las estadísticas del planificador")
+    medir_paso("estadisticas", actualizar_estadisticas, analizar)
+
+    avisar(0.15, "Compactando el registro de cambios")
+    medir_paso("compactar_cambios", compactar_cambios)
+
+    avisar(0.2, "Liberando páginas libres")
+    medir_paso("vaciado_incremental", vaciar_incremental, pasos_vaciado,
+               lambda fraccion, mensaje: avisar(0.2 + fraccion * 0.6, mensaje))
+
+    if antes["journal_mode"] == "wal":
+        avisar(0.8, "Esperando un periodo sin escrituras para vaciar el WAL")
+        inactiva = medir_paso("espera_inactividad", esperar_inactividad)
+        medir_paso("checkpoint_wal", checkpoint_wal, inactiva)
+
+    despues = estado_bd()
+    segundos = round(time.perf_counter() - inicio, 3)
+
+    logger.info(
+        "Mantenimiento en %.1f s: base de datos %d -> %d bytes, WAL %d -> %d bytes, páginas libres %d -> %d; %s",
+        segundos, antes["bd_bytes"], despues["bd_bytes"], antes["wal_bytes"], despues["wal_bytes"],
+        antes["paginas_libres"], despues["paginas_libres"],
+        ", ".join(f"{nombre} {paso['segundos']:.2f} s" for nombre, paso in pasos.items())
+    )
+
+    return {"antes": antes, "despues": despues, "pasos": pasos, "segundos": segundos}
+
+
+def iniciar_mantenimiento_programado():
+    """
+    Programa un trabajo de mantenimiento cada INTERVALO_MANTENIMIENTO_HORAS horas
+    (GARNOCEX_MANTENIMIENTO_INTERVALO_H). Sin intervalo no tiene efecto.
+
+    Returns:
+        bool: True si esta llamada programó el mantenimiento
+    """
+    from models.trabajos import programar_trabajo
+
+    return programar_trabajo("mantenimiento_bd", INTERVALO_MANTENIMIENTO_HORAS)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mantenimiento de la base de datos sin detener la aplicación")
+    parser.add_argument("--analizar", action="store_true",
+                        help="ANALYZE completo en lugar de PRAGMA optimize")
+    parser.add_argument("--activar-vaciado-incremental", action="store_true",
+                        help="Pasa a auto_vacuum=INCREMENTAL con un VACUUM completo (bloquea las escrituras)")
+    parser.add_argument("--pasos", type=int, help="Pasos máximos de incremental_vacuum "
+                                                  f"(por defecto, {PASOS_VACIADO_MAXIMOS})")
+    parser.add_argument("--estado", action="store_true", help="Solo muestra el estado de la base de datos")
+    args = parser.parse_args()
+
+    # La base de datos principal y cada fragmento
+    bases = db.bases_de_datos()
+    for base in bases:
+        with db.en_fragmento(base):
+            if len(bases) > 1:
+                print(db.ruta_bd())
+            if args.estado:
+                for clave, valor in estado_bd().items():
+                    print(f"{clave:<16}{valor:>16}")
+                continue
+
+            resumen = ejecutar_mantenimiento(args.analizar, args.activar_vaciado_incremental, args.pasos,
+                                             progreso=lambda fraccion, mensaje: print(f"  {mensaje}", file=sys.stderr))
+
+            print(f"Mantenimiento completado en {resumen['segundos']:.1f} s")
+            for nombre, paso in resumen["pasos"].items():
+                print(f"  {nombre:<22}{paso['segundos']:>8.2f} s  {paso['resultado']}")
+            print(f"  {'':<22}{'antes':>16}{'después':>16}")
+            for clave in ("bd_bytes", "wal_bytes", "paginas", "paginas_libres"):
+                print(f"  {clave:<22}{resumen['antes'][clave]:>16}{resumen['despues'][clave]:>16}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+import ast
+import json
+import logging
+import os
+import threading
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+from models.metricas import incrementar
+
+# Activa el perfilado de memoria de las páginas ("1" para activarlo)
+PERFILADO_ACTIVO = os.environ.get("GARNOCEX_MEMORIA", "") == "1"
+
+# Se perfila una de cada N ejecuciones de página; el resto no tiene coste
+MUESTREO = max(1, int(os.environ.get("GARNOCEX_MEMORIA_MUESTREO", "10")))
+
+# Marcos de pila que guarda tracemalloc por asignación (suficientes para llegar de pandas/PIL a models/)
+MARCOS = int(os.environ.get("GARNOCEX_MEMORIA_MARCOS", "25"))
+
+# Asignaciones agrupadas que se conservan en cada informe
+TOP_ASIGNACIONES = 10
+
+# Presupuesto por defecto (MB) del pico de memoria de una ejecución de página
+PRESUPUESTO_MB = float(os.environ.get("GARNOCEX_MEMORIA_PRESUPUESTO_MB", "100"))
+
+# Presupuestos por página (MB), p. ej. '{"Consulta de Resultados": 300}'
+PRESUPUESTOS_PAGINA = json.loads(os.environ.get("GARNOCEX_MEMORIA_PRESUPUESTOS", "{}"))
+
+RAIZ_PROYECTO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Directorios cuyas funciones se usan para atribuir las asignaciones
+_DIRECTORIOS_ATRIBUCION = {
+    "pagina": os.path.join(RAIZ_PROYECTO, "pages") + os.sep,
+    "modelo": os.path.join(RAIZ_PROYECTO, "models") + os.sep,
+}
+
+# Módulos de instrumentación de models/ que no cuentan como función del modelo
+_MODULOS_INSTRUMENTACION = {"metricas.py", "trazas.py", "memoria.py"}
+
+logger = logging.getLogger(__name__)
+
+# Un solo perfilado a la vez: tracemalloc es global al proceso
+_bloqueo_perfilado = threading.Lock()
+_bloqueo_contador = threading.Lock()
+_ejecuciones = 0
+_funciones_por_fichero = {}
+_informes = deque(maxlen=50)
+
+
+def presupuesto_pagina(pagina):
+    """
+    Presupuesto de memoria de una página en bytes
+    """
+    return PRESUPUESTOS_PAGINA.get(pagina, PRESUPUESTO_MB) * 1024 * 1024
+
+
+def _funcion_en(fichero, linea):
+    """
+    Nombre (modulo.funcion) de la función del proyecto que contiene una línea
+    """
+    funciones = _funciones_por_fichero.get(fichero)
+    if funciones is None:
+        funciones = []
+        try:
+            with open(fichero, encoding="utf-8") as f:
+                arbol = ast.parse(f.read())
+            for nodo in ast.walk(arbol):
+                if isinstance(nodo, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                    funciones.append((nodo.lineno, nodo.end_lineno, nodo.name))
+        except (OSError, SyntaxError):
+            pass
+        # Las funciones anidadas van después de la que las contiene: se elige la más interna
+        funciones.sort(key=lambda f: (f[0], -f[1]))
+        _funciones_por_fichero[fichero] = funciones
+
+    nombre = "<módulo>"
+    for inicio, fin, funcion in funciones:
+        if inicio <= linea <= fin:
+            nombre = funcion
+    return f"{os.path.splitext(os.path.basename(fichero))[0]}.{nombre}"
+
+
+def _atribuir(traza):
+    """
+    Función de la página más interna y función de los modelos más externa (la que
+    llamó la página) de la pila de una asignación
+    """
+    atribucion = {"pagina": None, "modelo": None}
+    for marco in traza:
+        if marco.filename.startswith(_DIRECTORIOS_ATRIBUCION["pagina"]):
+            atribucion["pagina"] = _funcion_en(marco.filename, marco.lineno)
+        elif (atribucion["modelo"] is None
+              and marco.filename.startswith(_DIRECTORIOS_ATRIBUCION["modelo"])
+              and os.path.basename(marco.filename) not in _MODULOS_INSTRUMENTACION):
+            atribucion["modelo"] = _funcion_en(marco.filename, marco.lineno)
+
+    if atribucion["pagina"] is None and atribucion["modelo"] is None:
+        # Asignación fuera del proyecto (p. ej. app.py o la propia Streamlit)
+        origen = traza[-1]
+        atribucion["pagina"] = f"{os.path.basename(origen.filename)}:{origen.lineno}"
+    return atribucion
+
+
+def _top_asignaciones(estadisticas):
+    """
+    Agrupa las asignaciones retenidas por función de página y de modelo
+    """
+    grupos = {}
+    for estadistica in estadisticas:
+        if estadistica.size <= 0:
+            continue
+        atribucion = _atribuir(estadistica.traceback)
+        clave = (atribucion["pagina"], atribucion["modelo"])
+        grupo = grupos.setdefault(clave, {**atribucion, "bytes": 0, "bloques": 0})
+        grupo["bytes"] += estadistica.size
+        grupo["bloques"] += estadistica.count
+
+    return sorted(grupos.values(), key=lambda g: g["bytes"], reverse=True)[:TOP_ASIGNACIONES]
+
+
+def _toca_perfilar():
+    global _ejecuciones
+    with _bloqueo_contador:
+        _ejecuciones += 1
+        return _ejecuciones % MUESTREO == 0
+
+
+@contextmanager
+def perfilar_pagina(pagina):
+    """
+    Perfila la memoria de una ejecución de página si el perfilado está activo y le
+    toca según el muestreo.
+
+    Solo se traza durante la ejecución perfilada, así que el resto de ejecuciones no
+    tienen coste. El informe recoge el pico de memoria y la memoria que la ejecución
+    deja retenida (p. ej. en st.session_state), con las asignaciones agrupadas por
+    función de la página y del modelo. Si el pico supera el presupuesto de la página
+    se escribe un aviso en el log.
+
+    Como tracemalloc es global al proceso, las asignaciones de otras sesiones
+    simultáneas también se cuentan; la atribución por función permite separarlas.
+
+    Args:
+        pagina (str): Entrada del menú que se está mostrando
+    """
+    if not PERFILADO_ACTIVO or not _toca_perfilar() or not _bloqueo_perfilado.acquire(blocking=False):
+        yield
+        return
+
+    try:
+        ya_activo = tracemalloc.is_tracing()
+        if ya_activo:
+            # Alguien más está trazando (p. ej. python -X tracemalloc): se compara contra el estado previo
+            antes = tracemalloc.take_snapshot()
+            base, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+        else:
+            tracemalloc.start(MARCOS)
+            base = 0
+
+        try:
+            yield
+        finally:
+            despues = tracemalloc.take_snapshot()
+            actual, pico = tracemalloc.get_traced_memory()
+            if not ya_activo:
+                tracemalloc.stop()
+
+            filtros = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, "<frozen importlib._bootstrap*>")]
+            despues = despues.filter_traces(filtros)
+            if ya_activo:
+                estadisticas = despues.compare_to(antes.filter_traces(filtros), "traceback")
+                estadisticas = [
+                    tracemalloc.Statistic(e.traceback, e.size_diff, e.count_diff) for e in estadisticas
+                ]
+            else:
+                estadisticas = despues.statistics("traceback")
+
+            _registrar_informe(pagina, pico - base, actual - base, _top_asignaciones(estadisticas))
+    finally:
+        _bloqueo_perfilado.release()
+
+
+def _registrar_informe(pagina, pico, retenida, asignaciones):
+    presupuesto = presupuesto_pagina(pagina)
+    informe = {
+        "fecha": datetime.now().isoformat(timespec="seconds"),
+        "pagina": pagina,
+        "pico_bytes": pico,
+        "retenida_bytes": retenida,
+        "presupuesto_bytes": presupuesto,
+        "excedido": pico > presupuesto,
+        "asignaciones": asignaciones,
+    }
+    _informes.append(informe)
+
+    if informe["excedido"]:
+        incrementar("memoria_presupuesto_excedido_total", pagina=pagina)
+        principales = ", ".join(
+            f"{a['pagina'] or '-'} / {a['modelo'] or '-'}: {a['bytes'] / 1024 / 1024:.1f} MB"
+            for a in asignaciones[:3]
+        )
+        logger.warning(
+            "La página '%s' ha superado su presupuesto de memoria: pico %.1f MB, retenida %.1f MB, "
+            "presupuesto %.1f MB. Principales asignaciones retenidas: %s",
+            pagina, pico / 1024 / 1024, retenida / 1024 / 1024, presupuesto / 1024 / 1024, principales,
+        )
+
+
+def obtener_informes():
+    """
+    Obtiene los últimos informes de memoria, del más reciente al más antiguo
+
+    Returns:
+        list: Diccionarios con página, pico, memoria retenida, presupuesto y asignaciones principales
+    """
+    return list(reversed(_informes))
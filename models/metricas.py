@@ -0,0 +1,315 @@
+import functools
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Puerto del endpoint HTTP local con las métricas (vacío: sin endpoint)
+PUERTO_METRICAS = os.environ.get("GARNOCEX_METRICAS_PUERTO", "")
+
+# Fichero que se reescribe periódicamente con las métricas (vacío: sin fichero)
+RUTA_METRICAS = os.environ.get("GARNOCEX_METRICAS_FICHERO", "")
+
+# Segundos entre reescrituras del fichero de métricas
+INTERVALO_METRICAS = float(os.environ.get("GARNOCEX_METRICAS_INTERVALO", "15"))
+
+# Límites superiores (segundos) de los histogramas de latencia
+LIMITES_HISTOGRAMA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+PREFIJO = "garnocex_"
+
+# Descripción y tipo de cada métrica, en el orden en que se exportan
+DESCRIPCIONES = {
+    "llamadas_total": ("counter", "Llamadas a funciones de los modelos"),
+    "errores_total": ("counter", "Llamadas a funciones de los modelos que lanzaron una excepción"),
+    "duracion_funcion_segundos": ("histogram", "Duración de las funciones de los modelos"),
+    "renders_pagina_total": ("counter", "Ejecuciones de cada página"),
+    "duracion_pagina_segundos": ("histogram", "Duración de la ejecución de cada página"),
+    "bloqueos_bd_total": ("counter", "Errores 'database is locked' que llegaron a una función de los modelos"),
+    "reintentos_bloqueo_total": ("counter", "Reintentos de escritura por bloqueo de la base de datos"),
+    "escritor_grupos_total": ("counter", "Transacciones confirmadas por el escritor único"),
+    "escritor_escrituras_total": ("counter", "Escrituras confirmadas por el escritor único"),
+    "cache_aciertos_total": ("counter", "Consultas resueltas por una caché"),
+    "cache_fallos_total": ("counter", "Consultas que no estaban en una caché"),
+    "imagen_bytes_servidos_total": ("counter", "Bytes de imágenes leídos de la base de datos"),
+    "memoria_presupuesto_excedido_total": ("counter", "Ejecuciones de página perfiladas que superaron su presupuesto de memoria"),
+    "login_fallidos_total": ("counter", "Inicios de sesión con credenciales incorrectas"),
+    "login_limitados_total": ("counter", "Inicios de sesión rechazados por exceso de intentos o de cálculos de hash"),
+    "trabajos_total": ("counter", "Trabajos en segundo plano terminados, por tipo y estado final"),
+    "duracion_trabajo_segundos": ("histogram", "Duración de los trabajos en segundo plano"),
+    "duracion_mantenimiento_segundos": ("histogram", "Duración de cada paso del mantenimiento de la base de datos"),
+    "bd_bytes": ("gauge", "Tamaño del fichero de base de datos"),
+    "wal_bytes": ("gauge", "Tamaño del fichero WAL de la base de datos"),
+}
+
+_contadores = {}
+_histogramas = {}
+_bloqueo = threading.Lock()
+_exportacion_iniciada = False
+
+
+def _clave(nombre, etiquetas):
+    return (nombre, tuple(sorted(etiquetas.items())))
+
+
+def incrementar(nombre, valor=1, **etiquetas):
+    """
+    Incrementa un contador
+
+    Args:
+        nombre (str): Nombre de la métrica sin prefijo (p. ej. "cache_fallos_total")
+        valor (float): Cantidad a sumar
+        **etiquetas: Etiquetas de la serie (p. ej. cache="paginas")
+    """
+    clave = _clave(nombre, etiquetas)
+    with _bloqueo:
+        _contadores[clave] = _contadores.get(clave, 0) + valor
+
+
+def valor_contador(nombre, **etiquetas):
+    """
+    Obtiene el valor acumulado de un contador
+
+    Args:
+        nombre (str): Nombre de la métrica sin prefijo
+        **etiquetas: Etiquetas que deben tener las series sumadas (ninguna: todas)
+
+    Returns:
+        float: Suma de las series del contador que tienen esas etiquetas
+    """
+    filtro = set(etiquetas.items())
+    with _bloqueo:
+        return sum(valor for (nombre_serie, serie), valor in _contadores.items()
+                   if nombre_serie == nombre and filtro <= set(serie))
+
+
+def observar(nombre, segundos, **etiquetas):
+    """
+    Añade una observación a un histograma de latencia
+
+    Args:
+        nombre (str): Nombre de la métrica sin prefijo
+        segundos (float): Valor observado
+        **etiquetas: Etiquetas de la serie
+    """
+    clave = _clave(nombre, etiquetas)
+    with _bloqueo:
+        histograma = _histogramas.get(clave)
+        if histograma is None:
+            histograma = _histogramas[clave] = {"cubetas": [0] * len(LIMITES_HISTOGRAMA), "suma": 0.0, "cuenta": 0}
+        for i, limite in enumerate(LIMITES_HISTOGRAMA):
+            if segundos <= limite:
+                histograma["cubetas"][i] += 1
+                break
+        histograma["suma"] += segundos
+        histograma["cuenta"] += 1
+
+
+def registrar_cache(cache, fallo):
+    """
+    Registra una consulta a una caché. Para las cachés de Streamlit, cuyo cuerpo solo
+    se ejecuta en los fallos, se llama con fallo=False en cada consulta y con
+    fallo=True dentro de la función cacheada; los aciertos se calculan al exportar.
+
+    Args:
+        cache (str): Nombre de la caché
+        fallo (bool): True si el valor no estaba en la caché
+    """
+    incrementar("cache_fallos_total" if fallo else "cache_consultas_total", cache=cache)
+
+
+def medir(funcion):
+    """
+    Decorador que registra llamadas, errores, bloqueos y latencia de una función de los modelos
+    """
+    nombre = f"{funcion.__module__.rsplit('.', 1)[-1]}.{funcion.__name__}"
+
+    @functools.wraps(funcion)
+    def envoltura(*args, **kwargs):
+        inicio = time.perf_counter()
+        try:
+            return funcion(*args, **kwargs)
+        except sqlite3.OperationalError as e:
+            if "locked" in str(e):
+                incrementar("bloqueos_bd_total", funcion=nombre)
+            incrementar("errores_total", funcion=nombre)
+            raise
+        except Exception:
+            incrementar("errores_total", funcion=nombre)
+            raise
+        finally:
+            incrementar("llamadas_total", funcion=nombre)
+            observar("duracion_funcion_segundos", time.perf_counter() - inicio, funcion=nombre)
+
+    return envoltura
+
+
+@contextmanager
+def medir_pagina(pagina):
+    """
+    Mide la ejecución de una página de la aplicación
+
+    Args:
+        pagina (str): Entrada del menú que se está mostrando
+    """
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        incrementar("renders_pagina_total", pagina=pagina)
+        observar("duracion_pagina_segundos", time.perf_counter() - inicio, pagina=pagina)
+
+
+def _tamanos_ficheros():
+    """
+    Tamaño en bytes de la base de datos y de su WAL (0 si no existen)
+    """
+    from models.db import DB_PATH
+
+    tamanos = {}
+    for nombre, ruta in (("bd_bytes", DB_PATH), ("wal_bytes", DB_PATH + "-wal")):
+        try:
+            tamanos[nombre] = os.path.getsize(ruta)
+        except OSError:
+            tamanos[nombre] = 0
+    return tamanos
+
+
+def _formatear_etiquetas(etiquetas, extra=()):
+    pares = list(etiquetas) + list(extra)
+    if not pares:
+        return ""
+    texto = ",".join(
+        f'{clave}="{str(valor).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+        for clave, valor in pares
+    )
+    return "{" + texto + "}"
+
+
+def exportar_prometheus():
+    """
+    Genera las métricas actuales en formato de texto de Prometheus
+
+    Returns:
+        str: Exposición de texto (versión 0.0.4)
+    """
+    with _bloqueo:
+        contadores = dict(_contadores)
+        histogramas = {clave: dict(h, cubetas=list(h["cubetas"])) for clave, h in _histogramas.items()}
+
+    # Aciertos = consultas - fallos, por caché
+    for (nombre, etiquetas), consultas in list(contadores.items()):
+        if nombre == "cache_consultas_total":
+            del contadores[(nombre, etiquetas)]
+            fallos = contadores.get(("cache_fallos_total", etiquetas), 0)
+            contadores[("cache_aciertos_total", etiquetas)] = max(consultas - fallos, 0)
+
+    lineas = []
+    for nombre, (tipo, descripcion) in DESCRIPCIONES.items():
+        metrica = PREFIJO + nombre
+        lineas.append(f"# HELP {metrica} {descripcion}")
+        lineas.append(f"# TYPE {metrica} {tipo}")
+
+        if tipo == "counter":
+            for (nombre_serie, etiquetas), valor in sorted(contadores.items()):
+                if nombre_serie == nombre:
+                    lineas.append(f"{metrica}{_formatear_etiquetas(etiquetas)} {valor}")
+        elif tipo == "histogram":
+            for (nombre_serie, etiquetas), histograma in sorted(histogramas.items()):
+                if nombre_serie != nombre:
+                    continue
+                acumulado = 0
+                for limite, cuenta in zip(LIMITES_HISTOGRAMA, histograma["cubetas"]):
+                    acumulado += cuenta
+                    lineas.append(f"{metrica}_bucket{_formatear_etiquetas(etiquetas, [('le', limite)])} {acumulado}")
+                lineas.append(f"{metrica}_bucket{_formatear_etiquetas(etiquetas, [('le', '+Inf')])} {histograma['cuenta']}")
+                lineas.append(f"{metrica}_sum{_formatear_etiquetas(etiquetas)} {histograma['suma']}")
+                lineas.append(f"{metrica}_count{_formatear_etiquetas(etiquetas)} {histograma['cuenta']}")
+
+    for nombre, valor in _tamanos_ficheros().items():
+        lineas.insert(lineas.index(f"# TYPE {PREFIJO}{nombre} gauge") + 1, f"{PREFIJO}{nombre} {valor}")
+
+    return "\n".join(lineas) + "\n"
+
+
+def escribir_fichero(ruta):
+    """
+    Escribe las métricas en un fichero de forma atómica (para el textfile collector de node_exporter)
+
+    Args:
+        ruta (str): Ruta del fichero de métricas
+    """
+    temporal = ruta + ".tmp"
+    with open(temporal, "w", encoding="utf-8") as f:
+        f.write(exportar_prometheus())
+    os.replace(temporal, ruta)
+
+
+class _ManejadorMetricas(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        cuerpo = exportar_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def log_message(self, formato, *args):
+        # Las peticiones del scraper no deben llenar la salida de la aplicación
+        pass
+
+
+def _reescribir_periodicamente(ruta, intervalo):
+    while True:
+        try:
+            escribir_fichero(ruta)
+        except OSError as e:
+            print(f"Error al escribir las métricas en {ruta}: {str(e)}")
+        time.sleep(intervalo)
+
+
+def iniciar_exportacion(puerto=None, ruta=None, intervalo=None):
+    """
+    Inicia la exportación de métricas configurada. Solo tiene efecto la primera vez
+    que se llama en el proceso.
+
+    Args:
+        puerto (int, optional): Puerto del endpoint http://127.0.0.1:<puerto>/metrics.
+            Por defecto, GARNOCEX_METRICAS_PUERTO
+        ruta (str, optional): Fichero que se reescribe periódicamente.
+            Por defecto, GARNOCEX_METRICAS_FICHERO
+        intervalo (float, optional): Segundos entre reescrituras del fichero
+
+    Returns:
+        bool: True si esta llamada inició la exportación
+    """
+    global _exportacion_iniciada
+
+    with _bloqueo:
+        if _exportacion_iniciada:
+            return False
+        _exportacion_iniciada = True
+
+    puerto = puerto or PUERTO_METRICAS
+    ruta = ruta or RUTA_METRICAS
+    intervalo = intervalo or INTERVALO_METRICAS
+
+    if puerto:
+        try:
+            servidor = ThreadingHTTPServer(("127.0.0.1", int(puerto)), _ManejadorMetricas)
+            threading.Thread(target=servidor.serve_forever, name="metricas-http", daemon=True).start()
+        except OSError as e:
+            # Sin endpoint la aplicación sigue funcionando; las métricas se siguen acumulando
+            print(f"No se pudo abrir el endpoint de métricas en el puerto {puerto}: {str(e)}")
+
+    if ruta:
+        threading.Thread(
+            target=_reescribir_periodicamente, args=(ruta, intervalo), name="metricas-fichero", daemon=True
+        ).start()
+
+    return True
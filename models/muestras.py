@@ -2,8 +2,12 @@ import io
 import sqlite3
 from datetime import datetime
 from PIL import Image
-from models.db import obtener_conexion
+from models.db import (obtener_conexion, ejecutar_escritura, enrutar_por_muestra, listar_fragmentos,
+                       consultar_fragmentos)
+from models.metricas import medir, incrementar
 
+@medir
+@enrutar_por_muestra
 def guardar_muestra(codigo_muestra, operario, fecha, tipo_material, notas, estado="registrado"):
     """
     Guarda o actualiza una muestra en la base de datos
@@ -19,31 +23,32 @@ def guardar_muestra(codigo_muestra, operario, fecha, tipo_material, notas, estad
     Returns:
         bool: True si la operación fue exitosa
     """
-    conn = obtener_conexion()
-    c = conn.cursor()
-    
-    # Verificar si la muestra ya existe
-    c.execute("SELECT codigo_muestra FROM muestras WHERE codigo_muestra = ?", (codigo_muestra,))
-    resultado = c.fetchone()
-    
-    if resultado:
-        # Actualizar muestra existente
-        c.execute("""
-        UPDATE muestras 
-        SET operario = ?, fecha = ?, tipo_material = ?, estado = ?, notas = ?
-        WHERE codigo_muestra = ?
-        """, (operario, fecha, tipo_material, estado, notas, codigo_muestra))
-    else:
-        # Insertar nueva muestra
-        c.execute("""
-        INSERT INTO muestras (codigo_muestra, operario, fecha, tipo_material, estado, notas)
-        VALUES (?, ?, ?, ?, ?, ?)
-        """, (codigo_muestra, operario, fecha, tipo_material, estado, notas))
-    
-    conn.commit()
-    conn.close()
+    def guardar(conn):
+        c = conn.cursor()
+        
+        # Verificar si la muestra ya existe
+        c.execute("SELECT codigo_muestra FROM muestras WHERE codigo_muestra = ?", (codigo_muestra,))
+        resultado = c.fetchone()
+        
+        if resultado:
+            # Actualizar muestra existente
+            c.execute("""
+            UPDATE muestras 
+            SET operario = ?, fecha = ?, tipo_material = ?, estado = ?, notas = ?
+            WHERE codigo_muestra = ?
+            """, (operario, fecha, tipo_material, estado, notas, codigo_muestra))
+        else:
+            # Insertar nueva muestra
+            c.execute("""
+            INSERT INTO muestras (codigo_muestra, operario, fecha, tipo_material, estado, notas)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """, (codigo_muestra, operario, fecha, tipo_material, estado, notas))
+    
+    ejecutar_escritura(guardar)
     return True
 
+@medir
+@enrutar_por_muestra
 def guardar_imagen(codigo_muestra, imagen, nombre_archivo, descripcion=None):
     """
     Guarda una imagen asociada a una muestra
@@ -57,10 +62,7 @@ def guardar_imagen(codigo_muestra, imagen, nombre_archivo, descripcion=None):
     Returns:
         int: ID de la imagen guardada
     """
-    conn = obtener_conexion()
-    c = conn.cursor()
-    
-    # Convertir imagen a bytes para almacenar en SQLite
+    # Convertir imagen a bytes para almacenar en SQLite (fuera de la transacción)
     img_byte_arr = io.BytesIO()
     imagen.save(img_byte_arr, format='PNG')
     img_byte_arr = img_byte_arr.getvalue()
@@ -68,19 +70,20 @@ def guardar_imagen(codigo_muestra, imagen, nombre_archivo, descripcion=None):
     # Fecha actual para la subida
     fecha_subida = datetime.now().strftime('%Y-%m-%d')
     
-    c.execute("""
-    INSERT INTO imagenes (codigo_muestra, imagen, nombre_archivo, fecha_subida, descripcion)
-    VALUES (?, ?, ?, ?, ?)
-    """, (codigo_muestra, img_byte_arr, nombre_archivo, fecha_subida, descripcion))
-    
-    # Obtener el ID de la imagen insertada
-    imagen_id = c.lastrowid
-    
-    conn.commit()
-    conn.close()
+    def insertar(conn):
+        c = conn.cursor()
+        c.execute("""
+        INSERT INTO imagenes (codigo_muestra, imagen, nombre_archivo, fecha_subida, descripcion)
+        VALUES (?, ?, ?, ?, ?)
+        """, (codigo_muestra, img_byte_arr, nombre_archivo, fecha_subida, descripcion))
+        
+        # Obtener el ID de la imagen insertada
+        return c.lastrowid
     
-    return imagen_id
+    return ejecutar_escritura(insertar)
 
+@medir
+@enrutar_por_muestra
 def guardar_imagen_ensayo(codigo_muestra, ensayo_id, imagen, nombre_archivo, descripcion=None):
     """
     Guarda una imagen asociada a un ensayo específico
@@ -95,20 +98,7 @@ def guardar_imagen_ensayo(codigo_muestra, ensayo_id, imagen, nombre_archivo, des
     Returns:
         int: ID de la imagen guardada
     """
-    conn = obtener_conexion()
-    c = conn.cursor()
-    
-    # Verificar que el ensayo existe y corresponde a la muestra
-    c.execute("""
-    SELECT id FROM ensayos 
-    WHERE id = ? AND codigo_muestra = ?
-    """, (ensayo_id, codigo_muestra))
-    
-    if not c.fetchone():
-        conn.close()
-        raise ValueError(f"El ensayo ID {ensayo_id} no existe o no corresponde a la muestra {codigo_muestra}")
-    
-    # Convertir imagen a bytes para almacenar en SQLite
+    # Convertir imagen a bytes para almacenar en SQLite (fuera de la transacción)
     img_byte_arr = io.BytesIO()
     imagen.save(img_byte_arr, format='PNG')
     img_byte_arr = img_byte_arr.getvalue()
@@ -116,19 +106,30 @@ def guardar_imagen_ensayo(codigo_muestra, ensayo_id, imagen, nombre_archivo, des
     # Fecha actual para la subida
     fecha_subida = datetime.now().strftime('%Y-%m-%d')
     
-    c.execute("""
-    INSERT INTO imagenes (codigo_muestra, ensayo_id, imagen, nombre_archivo, fecha_subida, descripcion)
-    VALUES (?, ?, ?, ?, ?, ?)
-    """, (codigo_muestra, ensayo_id, img_byte_arr, nombre_archivo, fecha_subida, descripcion))
-    
-    # Obtener el ID de la imagen insertada
-    imagen_id = c.lastrowid
-    
-    conn.commit()
-    conn.close()
+    def insertar(conn):
+        c = conn.cursor()
+        
+        # Verificar que el ensayo existe y corresponde a la muestra
+        c.execute("""
+        SELECT id FROM ensayos 
+        WHERE id = ? AND codigo_muestra = ?
+        """, (ensayo_id, codigo_muestra))
+        
+        if not c.fetchone():
+            raise ValueError(f"El ensayo ID {ensayo_id} no existe o no corresponde a la muestra {codigo_muestra}")
+        
+        c.execute("""
+        INSERT INTO imagenes (codigo_muestra, ensayo_id, imagen, nombre_archivo, fecha_subida, descripcion)
+        VALUES (?, ?, ?, ?, ?, ?)
+        """, (codigo_muestra, ensayo_id, img_byte_arr, nombre_archivo, fecha_subida, descripcion))
+        
+        # Obtener el ID de la imagen insertada
+        return c.lastrowid
     
-    return imagen_id
+    return ejecutar_escritura(insertar)
 
+@medir
+@enrutar_por_muestra
 def obtener_imagenes(codigo_muestra, ensayo_id=None):
     """
     Recupera las imágenes asociadas a una muestra o a un ensayo específico
@@ -162,6 +163,7 @@ def obtener_imagenes(codigo_muestra, ensayo_id=None):
     
     imagenes = []
     for img_id, img_data, nombre, fecha, descripcion in resultados:
+        incrementar("imagen_bytes_servidos_total", len(img_data))
         try:
             img = Image.open(io.BytesIO(img_data))
             imagenes.append((img_id, img, nombre, fecha, descripcion))
@@ -171,6 +173,7 @@ def obtener_imagenes(codigo_muestra, ensayo_id=None):
     conn.close()
     return imagenes
 
+@medir
 def obtener_imagen_por_id(imagen_id):
     """
     Recupera una imagen específica por su ID
@@ -195,6 +198,7 @@ def obtener_imagen_por_id(imagen_id):
     
     if resultado:
         img_data, nombre, fecha, descripcion, codigo_muestra, ensayo_id = resultado
+        incrementar("imagen_bytes_servidos_total", len(img_data))
         try:
             img = Image.open(io.BytesIO(img_data))
             return (img, nombre, fecha, descripcion, codigo_muestra, ensayo_id)
@@ -204,6 +208,7 @@ def obtener_imagen_por_id(imagen_id):
     else:
         return None
 
+@medir
 def obtener_muestras(filtros=None):
     """
     Obtiene todas las muestras de la base de datos, opcionalmente filtradas
@@ -215,9 +220,6 @@ def obtener_muestras(filtros=None):
     Returns:
         list: Lista de diccionarios con información de muestras
     """
-    conn = obtener_conexion()
-    c = conn.cursor()
-    
     # Construir consulta base
     query = """
     SELECT m.*, COUNT(DISTINCT e.id) as num_ensayos
@@ -261,6 +263,15 @@ def obtener_muestras(filtros=None):
     # Agrupar por muestra y ordenar por fecha descendente
     query += " GROUP BY m.codigo_muestra ORDER BY m.fecha DESC"
     
+    # Con fragmentos, cada uno se consulta por separado y en paralelo, y se
+    # vuelve a ordenar el conjunto
+    if listar_fragmentos():
+        muestras = [dict(m) for m in consultar_fragmentos(query, params)]
+        muestras.sort(key=lambda m: m["fecha"] or "", reverse=True)
+        return muestras
+    
+    conn = obtener_conexion()
+    c = conn.cursor()
     c.execute(query, params)
     muestras_raw = c.fetchall()
     
@@ -270,6 +281,8 @@ def obtener_muestras(filtros=None):
     conn.close()
     return muestras
 
+@medir
+@enrutar_por_muestra
 def obtener_muestra(codigo_muestra):
     """
     Obtiene información de una muestra específica
@@ -317,6 +330,8 @@ def obtener_muestra(codigo_muestra):
     conn.close()
     return muestra_dict
 
+@medir
+@enrutar_por_muestra
 def actualizar_estado_muestra(codigo_muestra, nuevo_estado):
     """
     Actualiza el estado de una muestra
@@ -328,17 +343,14 @@ def actualizar_estado_muestra(codigo_muestra, nuevo_estado):
     Returns:
         bool: True si la operación fue exitosa
     """
-    conn = obtener_conexion()
-    c = conn.cursor()
-    
-    c.execute("UPDATE muestras SET estado = ? WHERE codigo_muestra = ?", 
-              (nuevo_estado, codigo_muestra))
-    
-    conn.commit()
-    conn.close()
+    ejecutar_escritura(lambda conn: conn.execute(
+        "UPDATE muestras SET estado = ? WHERE codigo_muestra = ?", (nuevo_estado, codigo_muestra)
+    ))
     
     return True
 
+@medir
+@enrutar_por_muestra
 def eliminar_muestra(codigo_muestra):
     """
     Elimina una muestra y todos sus datos asociados
@@ -349,27 +361,22 @@ def eliminar_muestra(codigo_muestra):
     Returns:
         bool: True si la eliminación fue exitosa
     """
-    conn = obtener_conexion()
-    try:
+    def eliminar(conn):
         c = conn.cursor()
         
         # Verificar que la muestra existe
         c.execute("SELECT codigo_muestra FROM muestras WHERE codigo_muestra = ?", (codigo_muestra,))
         if not c.fetchone():
-            conn.close()
             return False
         
-        # Iniciar transacción
-        conn.execute("BEGIN")
-        
         # Obtener IDs de ensayos asociados
         c.execute("SELECT id FROM ensayos WHERE codigo_muestra = ?", (codigo_muestra,))
         ensayos_ids = [row[0] for row in c.fetchall()]
         
         # Eliminar datos de los ensayos específicos
         for ensayo_id in ensayos_ids:
-            # Eliminar datos de tamices (granulometría)
-            c.execute("DELETE FROM datos_tamices WHERE ensayo_id = ?", (ensayo_id,))
+            # Eliminar curvas granulométricas
+            c.execute("DELETE FROM curvas_granulometricas WHERE ensayo_id = ?", (ensayo_id,))
             
             # Eliminar datos de ensayos granulométricos
             c.execute("DELETE FROM ensayos_granulometricos WHERE ensayo_id = ?", (ensayo_id,))
@@ -393,18 +400,15 @@ def eliminar_muestra(codigo_muestra):
         # Eliminar la muestra
         c.execute("DELETE FROM muestras WHERE codigo_muestra = ?", (codigo_muestra,))
         
-        # Confirmar transacción
-        conn.execute("COMMIT")
         return True
-        
+    
+    try:
+        return ejecutar_escritura(eliminar)
     except sqlite3.Error as e:
-        # Revertir cambios en caso de error
-        conn.execute("ROLLBACK")
         print(f"Error al eliminar muestra: {str(e)}")
         return False
-    finally:
-        conn.close()
 
+@medir
 def obtener_tipos_materiales():
     """
     Obtiene la lista de tipos de materiales registrados
@@ -421,6 +425,7 @@ def obtener_tipos_materiales():
     conn.close()
     return tipos
 
+@medir
 def obtener_estados_muestras():
     """
     Obtiene la lista de estados de muestras registrados
@@ -437,6 +442,7 @@ def obtener_estados_muestras():
     conn.close()
     return estados
 
+@medir
 def obtener_operarios():
     """
     Obtiene la lista de operarios registrados
@@ -453,6 +459,7 @@ def obtener_operarios():
     conn.close()
     return operarios
 
+@medir
 def obtener_estadisticas_muestras():
     """
     Obtiene estadísticas básicas sobre las muestras y ensayos
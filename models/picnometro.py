@@ -1,10 +1,14 @@
 import sqlite3
-from models.db import obtener_conexion
+from models.db import obtener_conexion, ejecutar_escritura, enrutar_por_muestra
 from models.muestras import actualizar_estado_muestra
+from models.interpretacion import interpretar_valor, TABLAS_DENSIDAD_POR_TIPO, TIPO_DENSIDAD_NO_RECONOCIDO
+from models.metricas import medir
 
+@medir
+@enrutar_por_muestra
 def guardar_ensayo_picnometro(codigo_muestra, fecha_ensayo, operario, 
                              densidad_aparente, volumen_hoyo, masa_arena_empleada,
-                             masa_arena_cono, densidad_arena, notas=None):
+                             masa_arena_cono, densidad_arena, notas=None, humedad=None):
     """
     Guarda un ensayo de picnómetro de arena y sus datos asociados
     
@@ -18,16 +22,13 @@ def guardar_ensayo_picnometro(codigo_muestra, fecha_ensayo, operario,
         masa_arena_cono (float): Masa de arena en el cono en g
         densidad_arena (float): Densidad de la arena de calibración en g/cm³
         notas (str, optional): Notas adicionales sobre el ensayo
+        humedad (float, optional): Humedad del suelo extraído en porcentaje
         
     Returns:
         int: ID del ensayo guardado
     """
-    conn = obtener_conexion()
-    c = conn.cursor()
-    
-    try:
-        # Iniciar transacción
-        conn.execute("BEGIN")
+    def insertar(conn):
+        c = conn.cursor()
         
         # Insertar en la tabla general de ensayos
         c.execute("""
@@ -42,30 +43,25 @@ def guardar_ensayo_picnometro(codigo_muestra, fecha_ensayo, operario,
         c.execute("""
         INSERT INTO ensayos_picnometro (
             ensayo_id, densidad_aparente, volumen_hoyo, masa_arena_empleada,
-            masa_arena_cono, densidad_arena
+            masa_arena_cono, densidad_arena, humedad
         )
-        VALUES (?, ?, ?, ?, ?, ?)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
         """, (
             ensayo_id, densidad_aparente, volumen_hoyo, masa_arena_empleada,
-            masa_arena_cono, densidad_arena
+            masa_arena_cono, densidad_arena, humedad
         ))
         
-        # Confirmar transacción
-        conn.execute("COMMIT")
-        
-        # Actualizar estado de la muestra
-        actualizar_estado_muestra(codigo_muestra, "con ensayo de picnómetro")
-        
         return ensayo_id
-        
-    except Exception as e:
-        # Revertir cambios en caso de error
-        conn.execute("ROLLBACK")
-        raise e
     
-    finally:
-        conn.close()
+    ensayo_id = ejecutar_escritura(insertar)
+    
+    # Actualizar estado de la muestra
+    actualizar_estado_muestra(codigo_muestra, "con ensayo de picnómetro")
+    
+    return ensayo_id
 
+@medir
+@enrutar_por_muestra
 def obtener_ensayo_picnometro(codigo_muestra):
     """
     Obtiene el último ensayo de picnómetro de arena de una muestra
@@ -97,6 +93,8 @@ def obtener_ensayo_picnometro(codigo_muestra):
     # Convertir a diccionario
     return dict(ensayo)
 
+@medir
+@enrutar_por_muestra
 def obtener_todos_ensayos_picnometro(codigo_muestra=None):
     """
     Obtiene todos los ensayos de picnómetro de arena, opcionalmente filtrados por muestra
@@ -134,6 +132,7 @@ def obtener_todos_ensayos_picnometro(codigo_muestra=None):
     
     return ensayos
 
+@medir
 def calcular_volumen_hoyo(masa_arena_empleada, masa_arena_cono, densidad_arena):
     """
     Calcula el volumen del hoyo
@@ -154,6 +153,7 @@ def calcular_volumen_hoyo(masa_arena_empleada, masa_arena_cono, densidad_arena):
     
     return volumen_hoyo
 
+@medir
 def calcular_densidad_aparente(masa_suelo, volumen_hoyo):
     """
     Calcula la densidad aparente del suelo
@@ -167,6 +167,7 @@ def calcular_densidad_aparente(masa_suelo, volumen_hoyo):
     """
     return masa_suelo / volumen_hoyo
 
+@medir
 def interpretar_densidad(densidad_aparente, tipo_suelo="suelo"):
     """
     Interpreta la densidad aparente según el tipo de suelo
@@ -178,32 +179,9 @@ def interpretar_densidad(densidad_aparente, tipo_suelo="suelo"):
     Returns:
         str: Interpretación de la densidad
     """
-    if tipo_suelo.lower() == "suelo":
-        if densidad_aparente < 1.2:
-            return "Muy baja densidad (menos de 1.2 g/cm³)"
-        elif densidad_aparente < 1.4:
-            return "Baja densidad (1.2 - 1.4 g/cm³)"
-        elif densidad_aparente < 1.6:
-            return "Densidad media (1.4 - 1.6 g/cm³)"
-        elif densidad_aparente < 1.8:
-            return "Alta densidad (1.6 - 1.8 g/cm³)"
-        else:
-            return "Muy alta densidad (más de 1.8 g/cm³)"
-    
-    elif tipo_suelo.lower() == "arena":
-        if densidad_aparente < 1.4:
-            return "Baja densidad para arena (menos de 1.4 g/cm³)"
-        elif densidad_aparente < 1.6:
-            return "Densidad normal para arena (1.4 - 1.6 g/cm³)"
-        else:
-            return "Alta densidad para arena (más de 1.6 g/cm³)"
-    
-    elif tipo_suelo.lower() == "arcilla":
-        if densidad_aparente < 1.6:
-            return "Baja densidad para arcilla (menos de 1.6 g/cm³)"
-        elif densidad_aparente < 1.8:
-            return "Densidad normal para arcilla (1.6 - 1.8 g/cm³)"
-        else:
-            return "Alta densidad para arcilla (más de 1.8 g/cm³)"
-    
-    return "Tipo de suelo no reconocido para interpretación"
\ No newline at end of file
+    clave = TABLAS_DENSIDAD_POR_TIPO.get(tipo_suelo.lower())
+    
+    if clave is None:
+        return TIPO_DENSIDAD_NO_RECONOCIDO
+    
+    return interpretar_valor(densidad_aparente, clave)
@@ -1,7 +1,10 @@
 import sqlite3
-from models.db import obtener_conexion
+from models.db import obtener_conexion, ejecutar_escritura, enrutar_por_muestra
 from models.muestras import actualizar_estado_muestra
+from models.metricas import medir
 
+@medir
+@enrutar_por_muestra
 def guardar_ensayo_proctor(codigo_muestra, fecha_ensayo, operario, 
                           tipo_proctor, densidad_maxima, humedad_optima, 
                           energia_compactacion, numero_capas, golpes_capa,
@@ -26,12 +29,8 @@ def guardar_ensayo_proctor(codigo_muestra, fecha_ensayo, operario,
     Returns:
         int: ID del ensayo guardado
     """
-    conn = obtener_conexion()
-    c = conn.cursor()
-    
-    try:
-        # Iniciar transacción
-        conn.execute("BEGIN")
+    def insertar(conn):
+        c = conn.cursor()
         
         # Insertar en la tabla general de ensayos
         c.execute("""
@@ -68,22 +67,17 @@ def guardar_ensayo_proctor(codigo_muestra, fecha_ensayo, operario,
                 punto["numero_punto"]
             ))
         
-        # Confirmar transacción
-        conn.execute("COMMIT")
-        
-        # Actualizar estado de la muestra
-        actualizar_estado_muestra(codigo_muestra, "con ensayo próctor")
-        
         return ensayo_id
-        
-    except Exception as e:
-        # Revertir cambios en caso de error
-        conn.execute("ROLLBACK")
-        raise e
     
-    finally:
-        conn.close()
+    ensayo_id = ejecutar_escritura(insertar)
+    
+    # Actualizar estado de la muestra
+    actualizar_estado_muestra(codigo_muestra, "con ensayo próctor")
+    
+    return ensayo_id
 
+@medir
+@enrutar_por_muestra
 def obtener_ensayo_proctor(codigo_muestra):
     """
     Obtiene el último ensayo Próctor de una muestra
@@ -126,6 +120,8 @@ def obtener_ensayo_proctor(codigo_muestra):
     conn.close()
     return ensayo_dict
 
+@medir
+@enrutar_por_muestra
 def obtener_todos_ensayos_proctor(codigo_muestra=None):
     """
     Obtiene todos los ensayos Próctor, opcionalmente filtrados por muestra
@@ -177,6 +173,7 @@ def obtener_todos_ensayos_proctor(codigo_muestra=None):
     conn.close()
     return ensayos
 
+@medir
 def ajustar_curva_proctor(puntos):
     """
     Ajusta una curva polinómica a los puntos del ensayo Próctor para determinar
@@ -217,6 +214,7 @@ def ajustar_curva_proctor(puntos):
         max_punto = max(puntos, key=lambda p: p['densidad_seca'])
         return max_punto['densidad_seca'], max_punto['humedad']
 
+@medir
 def calcular_energia_compactacion(tipo_proctor, peso_maza, altura_caida, numero_capas, golpes_capa, volumen_molde):
     """
     Calcula la energía de compactación del ensayo Próctor
@@ -246,6 +244,7 @@ def calcular_energia_compactacion(tipo_proctor, peso_maza, altura_caida, numero_
     
     return energia_compactacion
 
+@medir
 def obtener_parametros_proctor(tipo_proctor):
     """
     Obtiene los parámetros estándar para el ensayo Próctor según su tipo
@@ -0,0 +1,190 @@
+import json
+import threading
+from types import MappingProxyType
+
+import numpy as np
+
+from models.db import obtener_conexion, empaquetar_valores
+from models.metricas import medir
+from utils.tamices import SERIE_POR_DEFECTO, clave_serie
+
+# Norma de las series que no son normalizadas (tamices introducidos a mano)
+NORMA_PERSONALIZADA = "Personalizada"
+
+# Rejilla común de aperturas (mm), equiespaciada en escala logarítmica, para
+# comparar curvas de series de tamices distintas
+REJILLA_LOG = np.geomspace(0.063, 75.0, 49)
+REJILLA_LOG.setflags(write=False)
+
+# Catálogo cargado en memoria: series por ID
+_catalogo = None
+_bloqueo_catalogo = threading.Lock()
+
+
+class SerieTamices:
+    """
+    Serie de tamices del catálogo. Es inmutable: los nombres son una tupla y las
+    aperturas un array de NumPy de solo lectura, en orden decreciente y con 0
+    para el fondo.
+    """
+
+    __slots__ = ("id", "norma", "version", "descripcion", "nombres", "aperturas")
+
+    def __init__(self, id, norma, version, descripcion, nombres, aperturas):
+        aperturas = np.array(aperturas, dtype=float)
+        aperturas.setflags(write=False)
+        for atributo, valor in (("id", id), ("norma", norma), ("version", version),
+                                ("descripcion", descripcion), ("nombres", tuple(nombres)),
+                                ("aperturas", aperturas)):
+            object.__setattr__(self, atributo, valor)
+
+    def __setattr__(self, atributo, valor):
+        raise AttributeError("Las series de tamices del catálogo no se pueden modificar")
+
+    def __reduce__(self):
+        return (SerieTamices, (self.id, self.norma, self.version, self.descripcion, self.nombres, self.aperturas))
+
+    def __len__(self):
+        return len(self.nombres)
+
+    def __repr__(self):
+        return f"SerieTamices({self.id!r}, {len(self)} tamices)"
+
+    def tamices(self):
+        """
+        Devuelve los tamices de la serie con el formato de get_tamices_estandar()
+
+        Returns:
+            list: Lista de diccionarios con nombre y apertura de cada tamiz
+        """
+        return [{"nombre": nombre, "apertura": float(apertura)}
+                for nombre, apertura in zip(self.nombres, self.aperturas)]
+
+
+def _cargar_catalogo():
+    """
+    Lee la tabla series_tamices
+
+    Returns:
+        Mapping: Series de tamices por ID, de solo lectura
+    """
+    conn = obtener_conexion()
+    try:
+        filas = conn.execute("""
+        SELECT id, norma, version, descripcion, tamices, aperturas
+        FROM series_tamices
+        ORDER BY norma, version
+        """).fetchall()
+    finally:
+        conn.close()
+
+    series = {}
+    for fila in filas:
+        series[fila["id"]] = SerieTamices(
+            fila["id"], fila["norma"], fila["version"], fila["descripcion"],
+            json.loads(fila["tamices"]), np.frombuffer(fila["aperturas"], dtype="<f8")
+        )
+
+    return MappingProxyType(series)
+
+
+@medir
+def obtener_catalogo():
+    """
+    Devuelve el catálogo de series de tamices. Se carga de la base de datos una
+    sola vez por proceso.
+
+    Returns:
+        Mapping: Series de tamices (SerieTamices) por ID, de solo lectura
+    """
+    global _catalogo
+    catalogo = _catalogo
+    if catalogo is None:
+        with _bloqueo_catalogo:
+            if _catalogo is None:
+                _catalogo = _cargar_catalogo()
+            catalogo = _catalogo
+    return catalogo
+
+
+def invalidar_catalogo():
+    """
+    Descarta el catálogo en memoria para que se vuelva a leer en el próximo acceso
+    """
+    global _catalogo
+    with _bloqueo_catalogo:
+        _catalogo = None
+
+
+@medir
+def obtener_serie(serie_id):
+    """
+    Devuelve una serie del catálogo
+
+    Args:
+        serie_id (str): ID de la serie
+
+    Returns:
+        SerieTamices: Serie de tamices
+
+    Raises:
+        KeyError: Si la serie no está en el catálogo
+    """
+    series = obtener_catalogo()
+    if serie_id not in series:
+        # Puede haberla registrado otro proceso después de cargar el catálogo
+        invalidar_catalogo()
+        series = obtener_catalogo()
+    return series[serie_id]
+
+
+@medir
+def series_disponibles():
+    """
+    Devuelve las series normalizadas que se pueden elegir al registrar un
+    ensayo: la última versión de cada norma, empezando por la serie por defecto
+
+    Returns:
+        list: Lista de SerieTamices
+    """
+    ultimas = {}
+    for serie in obtener_catalogo().values():
+        if serie.norma != NORMA_PERSONALIZADA:
+            if serie.norma not in ultimas or serie.version > ultimas[serie.norma].version:
+                ultimas[serie.norma] = serie
+
+    return sorted(ultimas.values(), key=lambda serie: (serie.id != SERIE_POR_DEFECTO, serie.norma))
+
+
+@medir
+def registrar_serie(conn, nombres, aperturas):
+    """
+    Devuelve el ID de la serie de tamices con esos nombres y aperturas y, si no
+    está en el catálogo, la añade como serie personalizada. Se ejecuta en la
+    transacción de la conexión indicada, de modo que la serie se guarda junto
+    con el ensayo que la usa.
+
+    Args:
+        conn (sqlite3.Connection): Conexión a la base de datos
+        nombres (list): Nombres de los tamices
+        aperturas (list): Aperturas de los tamices en mm
+
+    Returns:
+        str: ID de la serie
+    """
+    clave = clave_serie(nombres, aperturas)
+
+    fila = conn.execute("SELECT id FROM series_tamices WHERE clave = ?", (clave,)).fetchone()
+    if fila:
+        return fila[0]
+
+    serie_id = f"PERS-{clave[:12]}"
+    conn.execute("""
+    INSERT OR IGNORE INTO series_tamices (id, norma, version, descripcion, clave, tamices, aperturas)
+    VALUES (?, ?, 1, ?, ?, ?, ?)
+    """, (
+        serie_id, NORMA_PERSONALIZADA, f"Serie personalizada de {len(nombres)} tamices", clave,
+        json.dumps(list(nombres), ensure_ascii=False), empaquetar_valores(aperturas)
+    ))
+
+    return serie_id
@@ -0,0 +1,721 @@
+import argparse
+import base64
+import copy
+import hashlib
+import json
+import os
+import sys
+import zipfile
+from datetime import datetime
+
+from models.cambios import CambiosCompactados, cambios_netos
+from models.db import (
+    TABLAS_DETALLE_ENSAYO, TABLAS_ENSAYOS, ejecutar_escritura, en_fragmento, fragmento_actual,
+    leer_blob_por_trozos, listar_fragmentos, obtener_conexion
+)
+from models.metricas import medir
+
+# Versión del formato de los paquetes de sincronización
+FORMATO_PAQUETE = 1
+
+# Filas leídas por consulta al crear un paquete y aplicadas por transacción al
+# aplicarlo. Las imágenes se aplican en transacciones más pequeñas, porque cada
+# una se lee entera del paquete.
+FILAS_POR_LOTE = 500
+IMAGENES_POR_LOTE = 20
+
+# Ficheros del paquete: el manifiesto, un fichero JSON Lines por conjunto de
+# filas y las imágenes, una vez cada contenido, en imagenes/<sha256>
+MANIFIESTO = "manifiesto.json"
+DIRECTORIO_IMAGENES = "imagenes"
+CONJUNTOS = ("series_tamices", "muestras", "ensayos", "imagenes", "bajas")
+
+# Tablas que se sincronizan (con sus bajas); los datos de cada ensayo viajan con él
+TABLAS_SINCRONIZADAS = ("muestras", "ensayos", "imagenes")
+
+
+def _secuencia(conn, tabla):
+    # Última secuencia asignada por AUTOINCREMENT en una tabla
+    fila = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (tabla,)).fetchone()
+    return fila[0] if fila else 0
+
+
+def _columnas(conn, tabla):
+    return {fila[1] for fila in conn.execute(f"PRAGMA table_info({tabla})")}
+
+
+def _filtro(columna, valores, excluir_nodo=None):
+    """
+    Condiciones para leer solo las filas con esos valores de la columna y, si se
+    indica excluir_nodo, sin las versiones que escribió ese nodo (ya las tiene)
+    """
+    condiciones, parametros = "", ()
+    if valores is not None:
+        # Los valores se pasan como un único parámetro JSON: no hay límite de parámetros
+        condiciones, parametros = f"AND {columna} IN (SELECT value FROM json_each(?))", (json.dumps(valores),)
+    if excluir_nodo is not None:
+        condiciones += " AND COALESCE(version, '') NOT LIKE ?"
+        parametros += (f"%:{excluir_nodo}",)
+    return condiciones, parametros
+
+
+@medir
+def identificador_nodo():
+    """
+    Devuelve el identificador de esta base de datos en la sincronización
+
+    Returns:
+        str: Identificador del nodo
+    """
+    conn = obtener_conexion()
+    try:
+        return conn.execute("SELECT id FROM nodo_local").fetchone()[0]
+    finally:
+        conn.close()
+
+
+@medir
+def renovar_nodo():
+    """
+    Da un identificador nuevo a esta base de datos y olvida los pares. Es
+    necesario después de copiar el fichero de otra base de datos, que tiene su
+    mismo identificador.
+
+    Returns:
+        str: Identificador nuevo
+    """
+    def renovar(conn):
+        conn.execute("UPDATE nodo_local SET id = lower(hex(randomblob(8)))")
+        conn.execute("DELETE FROM pares_sincronizacion")
+        return conn.execute("SELECT id FROM nodo_local").fetchone()[0]
+
+    return ejecutar_escritura(renovar)
+
+
+@medir
+def listar_pares():
+    """
+    Lista las bases de datos con las que se ha sincronizado esta
+
+    Returns:
+        list: Diccionarios con nodo, enviado_cambios y enviado_bajas (cursores
+            confirmados por el par), recibido_cambios, recibido_bajas, fecha_envio
+            y fecha_recepcion
+    """
+    conn = obtener_conexion()
+    try:
+        return [dict(fila) for fila in conn.execute("SELECT * FROM pares_sincronizacion ORDER BY nodo")]
+    finally:
+        conn.close()
+
+
+def _leer_muestras(conn, codigos, excluir_nodo=None):
+    filtro, parametros = _filtro("codigo_muestra", codigos, excluir_nodo)
+    ultimo = ""
+    while True:
+        filas = conn.execute(f"""
+        SELECT * FROM muestras WHERE codigo_muestra > ? {filtro} ORDER BY codigo_muestra LIMIT ?
+        """, (ultimo, *parametros, FILAS_POR_LOTE)).fetchall()
+        if not filas:
+            return
+        yield from (dict(fila) for fila in filas)
+        ultimo = filas[-1]["codigo_muestra"]
+
+
+def _leer_ensayos(conn, ids, series, excluir_nodo=None):
+    """
+    Recorre los ensayos con los datos de su tabla específica, su curva
+    granulométrica y sus puntos Próctor, sin IDs locales
+
+    Args:
+        ids (list): IDs de los ensayos, o None para todos
+        series (set): Se le añaden las series de tamices de las curvas leídas
+        excluir_nodo (str, optional): No leer los ensayos cuya versión escribió ese nodo
+
+    Yields:
+        dict: ensayo, tabla y detalle (fila de la tabla específica), curva y puntos
+    """
+    filtro, parametros = _filtro("id", ids, excluir_nodo)
+    ultimo = -2 ** 63
+    while True:
+        filas = [dict(fila) for fila in conn.execute(f"""
+        SELECT * FROM ensayos WHERE id > ? {filtro} ORDER BY id LIMIT ?
+        """, (ultimo, *parametros, FILAS_POR_LOTE))]
+        if not filas:
+            return
+        ultimo = filas[-1]["id"]
+        lote = (json.dumps([fila["id"] for fila in filas]),)
+
+        detalles = {}
+        for tabla in TABLAS_ENSAYOS.values():
+            for detalle in conn.execute(f"""
+            SELECT * FROM {tabla} WHERE ensayo_id IN (SELECT value FROM json_each(?))
+            """, lote):
+                detalle = dict(detalle)
+                detalles[detalle.pop("ensayo_id")] = (tabla, detalle)
+
+        curvas = {}
+        for ensayo_id, serie, masas in conn.execute("""
+        SELECT ensayo_id, serie_tamices, masas_retenidas FROM curvas_granulometricas
+        WHERE ensayo_id IN (SELECT value FROM json_each(?))
+        """, lote):
+            series.add(serie)
+            curvas[ensayo_id] = {"serie_tamices": serie, "masas_retenidas": base64.b64encode(masas).decode("ascii")}
+
+        puntos = {}
+        for punto in conn.execute("""
+        SELECT * FROM puntos_proctor WHERE ensayo_id IN (SELECT value FROM json_each(?))
+        ORDER BY ensayo_id, numero_punto, id
+        """, lote):
+            punto = dict(punto)
+            del punto["id"]
+            puntos.setdefault(punto.pop("ensayo_id"), []).append(punto)
+
+        for fila in filas:
+            ensayo_id = fila.pop("id")
+            tabla, detalle = detalles.get(ensayo_id, (None, None))
+            yield {"ensayo": fila, "tabla": tabla, "detalle": detalle,
+                   "curva": curvas.get(ensayo_id), "puntos": puntos.get(ensayo_id, [])}
+
+
+def _leer_series(conn, series):
+    for fila in conn.execute("""
+    SELECT * FROM series_tamices WHERE id IN (SELECT value FROM json_each(?)) ORDER BY id
+    """, (json.dumps(sorted(series)),)):
+        fila = dict(fila)
+        fila["aperturas"] = base64.b64encode(fila["aperturas"]).decode("ascii")
+        yield fila
+
+
+def _leer_imagenes(conn, ids, pendientes):
+    """
+    Recorre los datos de las imágenes con el SHA-256 de su contenido
+
+    Args:
+        ids (list): IDs de las imágenes, o None para todas
+        pendientes (dict): Se le añade sha256 -> ID de la imagen de cada contenido
+    """
+    filtro, parametros = _filtro("i.id", ids)
+    ultimo = -2 ** 63
+    while True:
+        filas = [dict(fila) for fila in conn.execute(f"""
+        SELECT i.id, i.uid, i.codigo_muestra, e.uid AS ensayo_uid, i.nombre_archivo, i.fecha_subida, i.descripcion
+        FROM imagenes i LEFT JOIN ensayos e ON e.id = i.ensayo_id
+        WHERE i.id > ? {filtro} ORDER BY i.id LIMIT ?
+        """, (ultimo, *parametros, FILAS_POR_LOTE))]
+        if not filas:
+            return
+        ultimo = filas[-1]["id"]
+        for fila in filas:
+            resumen = hashlib.sha256()
+            try:
+                for trozo in leer_blob_por_trozos(conn, "imagenes", "imagen", fila["id"]):
+                    resumen.update(trozo)
+            except KeyError:
+                # Imagen borrada durante la lectura o sin contenido
+                continue
+            fila["sha256"] = resumen.hexdigest()
+            pendientes.setdefault(fila["sha256"], fila.pop("id"))
+            yield fila
+
+
+def _leer_bajas(conn, desde, hasta, excluir_nodo=None):
+    filtro, parametros = _filtro("uid", None, excluir_nodo)
+    ultimo = desde
+    while True:
+        filas = conn.execute(f"""
+        SELECT secuencia, tabla, uid, version FROM bajas
+        WHERE secuencia > ? AND secuencia <= ? {filtro} ORDER BY secuencia LIMIT ?
+        """, (ultimo, hasta, *parametros, FILAS_POR_LOTE)).fetchall()
+        if not filas:
+            return
+        yield from ({"tabla": tabla, "uid": uid, "version": version} for _, tabla, uid, version in filas)
+        ultimo = filas[-1][0]
+
+
+def _comprobar_fragmento():
+    # Con fragmentación cada fragmento es un nodo distinto, con su propio registro de cambios
+    if fragmento_actual() is None and listar_fragmentos():
+        raise ValueError("Con fragmentación, los paquetes se crean y se aplican en cada fragmento (en_fragmento)")
+
+
+def _escribir_lineas(paquete, nombre, filas):
+    # Escribe un fichero JSON Lines en el paquete sin acumular las filas en memoria
+    escritas = 0
+    with paquete.open(nombre, "w", force_zip64=True) as f:
+        for fila in filas:
+            f.write(json.dumps(fila, ensure_ascii=False).encode("utf-8") + b"\n")
+            escritas += 1
+    return escritas
+
+
+@medir
+def crear_paquete(destino, par=None, progreso=None):
+    """
+    Crea un paquete de sincronización: un fichero ZIP con las muestras, los
+    ensayos (con sus datos, curvas y puntos), las imágenes y las bajas. Cada
+    contenido de imagen se guarda una sola vez con su SHA-256 como nombre.
+
+    Si el par ya ha confirmado un paquete anterior (los paquetes que crea llevan
+    los cursores que ha recibido de esta base de datos), el paquete solo lleva
+    las filas cambiadas desde entonces según el registro de cambios. Si no, o
+    si esos cambios ya se han compactado, lleva el archivo completo.
+
+    Args:
+        destino (str): Fichero del paquete
+        par (str, optional): Nodo de la base de datos que va a aplicar el paquete
+        progreso (callable, optional): Función (fracción, mensaje)
+
+    Returns:
+        dict: Manifiesto del paquete
+
+    Raises:
+        ValueError: Si hay fragmentos y no se crea dentro de uno
+    """
+    _comprobar_fragmento()
+
+    def avisar(fraccion, mensaje):
+        if progreso:
+            progreso(fraccion, mensaje)
+
+    conn = obtener_conexion()
+    try:
+        nodo = conn.execute("SELECT id FROM nodo_local").fetchone()[0]
+        hasta = {"cambios": _secuencia(conn, "cambios"), "bajas": _secuencia(conn, "bajas")}
+        pares = {fila["nodo"]: fila for fila in conn.execute("SELECT * FROM pares_sincronizacion")}
+    finally:
+        conn.close()
+
+    desde, netos = None, None
+    if par in pares and pares[par]["enviado_cambios"] is not None:
+        try:
+            netos = cambios_netos(pares[par]["enviado_cambios"], TABLAS_SINCRONIZADAS, hasta["cambios"])
+            desde = {"cambios": pares[par]["enviado_cambios"], "bajas": pares[par]["enviado_bajas"] or 0}
+        except CambiosCompactados:
+            netos = None
+
+    # Filas del paquete: todas o las cambiadas y no borradas (las borradas van en
+    # bajas). Un paquete incremental no devuelve al par las versiones que escribió él.
+    excluir_nodo = None if netos is None else par
+    if netos is None:
+        seleccion = dict.fromkeys(TABLAS_SINCRONIZADAS)
+    else:
+        seleccion = {tabla: [clave for clave, operacion in netos.get(tabla, {}).items() if operacion != "delete"]
+                     for tabla in TABLAS_SINCRONIZADAS}
+        seleccion["ensayos"] = [int(clave) for clave in seleccion["ensayos"]]
+        seleccion["imagenes"] = [int(clave) for clave in seleccion["imagenes"]]
+
+    manifiesto = {
+        "formato": FORMATO_PAQUETE,
+        "nodo": nodo,
+        "par": par,
+        "fecha": datetime.now().isoformat(timespec="seconds"),
+        "completo": netos is None,
+        "desde": desde,
+        "hasta": hasta,
+        # Cursores recibidos de cada par: al aplicar el paquete, el par sabe qué
+        # cambios suyos tiene ya esta base de datos
+        "acuses": {nodo_par: {"cambios": fila["recibido_cambios"], "bajas": fila["recibido_bajas"] or 0}
+                   for nodo_par, fila in pares.items() if fila["recibido_cambios"] is not None},
+        "filas": {},
+    }
+
+    directorio = os.path.dirname(os.path.abspath(destino))
+    os.makedirs(directorio, exist_ok=True)
+    temporal = os.path.join(directorio, f".{os.path.basename(destino)}.tmp")
+    conn = obtener_conexion()
+    try:
+        with zipfile.ZipFile(temporal, "w", compression=zipfile.ZIP_DEFLATED) as paquete:
+            filas = manifiesto["filas"]
+            filas["muestras"] = _escribir_lineas(paquete, "muestras.jsonl",
+                                                 _leer_muestras(conn, seleccion["muestras"], excluir_nodo))
+            avisar(0.2, f"{filas['muestras']} muestras")
+
+            series = set()
+            filas["ensayos"] = _escribir_lineas(paquete, "ensayos.jsonl",
+                                                _leer_ensayos(conn, seleccion["ensayos"], series, excluir_nodo))
+            filas["series_tamices"] = _escribir_lineas(paquete, "series_tamices.jsonl", _leer_series(conn, series))
+            avisar(0.5, f"{filas['ensayos']} ensayos")
+
+            pendientes = {}
+            filas["imagenes"] = _escribir_lineas(paquete, "imagenes.jsonl",
+                                                 _leer_imagenes(conn, seleccion["imagenes"], pendientes))
+            # Las imágenes ya están comprimidas: se guardan sin volver a comprimirlas
+            for sha, imagen_id in pendientes.items():
+                informacion = zipfile.ZipInfo(f"{DIRECTORIO_IMAGENES}/{sha}",
+                                              date_time=datetime.now().timetuple()[:6])
+                informacion.compress_type = zipfile.ZIP_STORED
+                try:
+                    with paquete.open(informacion, "w", force_zip64=True) as f:
+                        for trozo in leer_blob_por_trozos(conn, "imagenes", "imagen", imagen_id):
+                            f.write(trozo)
+                except KeyError:
+                    # Borrada después de leer sus datos: al aplicar se descarta
+                    continue
+            filas["contenidos_imagen"] = len(pendientes)
+            avisar(0.9, f"{filas['imagenes']} imágenes")
+
+            filas["bajas"] = _escribir_lineas(paquete, "bajas.jsonl",
+                                              _leer_bajas(conn, desde["bajas"] if desde else 0, hasta["bajas"],
+                                                          excluir_nodo))
+            paquete.writestr(MANIFIESTO, json.dumps(manifiesto, indent=2, ensure_ascii=False))
+        os.replace(temporal, destino)
+    finally:
+        conn.close()
+        if os.path.exists(temporal):
+            os.remove(temporal)
+
+    if par:
+        ejecutar_escritura(lambda conn: conn.execute("""
+        INSERT INTO pares_sincronizacion (nodo, fecha_envio) VALUES (?, CURRENT_TIMESTAMP)
+        ON CONFLICT (nodo) DO UPDATE SET fecha_envio = excluded.fecha_envio
+        """, (par,)))
+
+    avisar(1.0, "Paquete creado")
+    return manifiesto
+
+
+def _insertar(conn, tabla, fila, columnas):
+    # Inserta las columnas de la fila que existen en la tabla local
+    nombres = [nombre for nombre in fila if nombre in columnas]
+    return conn.execute(
+        f"INSERT INTO {tabla} ({', '.join(nombres)}) VALUES ({', '.join('?' * len(nombres))})",
+        [fila[nombre] for nombre in nombres]
+    ).lastrowid
+
+
+def _actualizar(conn, tabla, fila, columnas, condicion, parametros):
+    nombres = [nombre for nombre in fila if nombre in columnas]
+    conn.execute(f"UPDATE {tabla} SET {', '.join(f'{nombre} = ?' for nombre in nombres)} WHERE {condicion}",
+                 [*(fila[nombre] for nombre in nombres), *parametros])
+
+
+def _version_baja(conn, tabla, uid):
+    fila = conn.execute("SELECT version FROM bajas WHERE tabla = ? AND uid = ?", (tabla, uid)).fetchone()
+    return None if fila is None else fila[0] or ""
+
+
+def _borrar_ensayo(conn, ensayo_id):
+    for tabla in TABLAS_DETALLE_ENSAYO:
+        conn.execute(f"DELETE FROM {tabla} WHERE ensayo_id = ?", (ensayo_id,))
+    conn.execute("UPDATE imagenes SET ensayo_id = NULL WHERE ensayo_id = ?", (ensayo_id,))
+    conn.execute("DELETE FROM ensayos WHERE id = ?", (ensayo_id,))
+
+
+def _borrar_muestra(conn, codigo):
+    for (ensayo_id,) in conn.execute("SELECT id FROM ensayos WHERE codigo_muestra = ?", (codigo,)).fetchall():
+        _borrar_ensayo(conn, ensayo_id)
+    conn.execute("DELETE FROM imagenes WHERE codigo_muestra = ?", (codigo,))
+    conn.execute("DELETE FROM muestras WHERE codigo_muestra = ?", (codigo,))
+
+
+def _aplicar_series(conn, filas, paquete):
+    columnas = _columnas(conn, "series_tamices")
+    aplicadas = 0
+    for fila in filas:
+        fila["aperturas"] = base64.b64decode(fila["aperturas"])
+        nombres = [nombre for nombre in fila if nombre in columnas]
+        # Las series no se modifican y su ID depende de su contenido
+        aplicadas += conn.execute(
+            f"INSERT OR IGNORE INTO series_tamices ({', '.join(nombres)}) VALUES ({', '.join('?' * len(nombres))})",
+            [fila[nombre] for nombre in nombres]
+        ).rowcount
+    return {"aplicadas": aplicadas, "iguales": len(filas) - aplicadas, "descartadas": 0}
+
+
+def _aplicar_muestras(conn, filas, paquete):
+    columnas = _columnas(conn, "muestras")
+    resultado = {"aplicadas": 0, "iguales": 0, "descartadas": 0}
+    for fila in filas:
+        codigo = fila["codigo_muestra"]
+        fila["version"] = fila.get("version") or ""
+        local = conn.execute("SELECT version FROM muestras WHERE codigo_muestra = ?", (codigo,)).fetchone()
+        if local is None:
+            baja = _version_baja(conn, "muestras", codigo)
+            if baja is not None and baja >= fila["version"]:
+                resultado["descartadas"] += 1
+                continue
+            _insertar(conn, "muestras", fila, columnas)
+        elif (local[0] or "") < fila["version"]:
+            _actualizar(conn, "muestras", fila, columnas, "codigo_muestra = ?", (codigo,))
+        else:
+            resultado["iguales" if (local[0] or "") == fila["version"] else "descartadas"] += 1
+            continue
+        resultado["aplicadas"] += 1
+    return resultado
+
+
+def _aplicar_ensayos(conn, registros, paquete):
+    columnas = {tabla: _columnas(conn, tabla) for tabla in ("ensayos", *TABLAS_DETALLE_ENSAYO)}
+    columnas["ensayos"].discard("id")
+    resultado = {"aplicadas": 0, "iguales": 0, "descartadas": 0}
+    for registro in registros:
+        ensayo = registro["ensayo"]
+        uid, version = ensayo["uid"], ensayo.get("version") or ""
+        ensayo["version"] = version
+        local = conn.execute("SELECT id, version FROM ensayos WHERE uid = ?", (uid,)).fetchone()
+        if local is None:
+            baja = _version_baja(conn, "ensayos", uid)
+            muestra = conn.execute("SELECT 1 FROM muestras WHERE codigo_muestra = ?",
+                                   (ensayo["codigo_muestra"],)).fetchone()
+            if (baja is not None and baja >= version) or muestra is None:
+                resultado["descartadas"] += 1
+                continue
+            ensayo_id = _insertar(conn, "ensayos", ensayo, columnas["ensayos"])
+            conn.execute("DELETE FROM bajas WHERE tabla = 'ensayos' AND uid = ?", (uid,))
+        elif (local["version"] or "") < version:
+            ensayo_id = local["id"]
+            _actualizar(conn, "ensayos", ensayo, columnas["ensayos"], "id = ?", (ensayo_id,))
+            for tabla in TABLAS_DETALLE_ENSAYO:
+                conn.execute(f"DELETE FROM {tabla} WHERE ensayo_id = ?", (ensayo_id,))
+        else:
+            resultado["iguales" if (local["version"] or "") == version else "descartadas"] += 1
+            continue
+
+        if registro["tabla"] in TABLAS_ENSAYOS.values() and registro["detalle"] is not None:
+            _insertar(conn, registro["tabla"], {**registro["detalle"], "ensayo_id": ensayo_id},
+                      columnas[registro["tabla"]])
+        if registro["curva"]:
+            curva = {**registro["curva"], "ensayo_id": ensayo_id}
+            curva["masas_retenidas"] = base64.b64decode(curva["masas_retenidas"])
+            _insertar(conn, "curvas_granulometricas", curva, columnas["curvas_granulometricas"])
+        for punto in registro["puntos"]:
+            _insertar(conn, "puntos_proctor", {**punto, "ensayo_id": ensayo_id}, columnas["puntos_proctor"])
+
+        # Los disparadores de los datos del ensayo han cambiado su versión: se deja la recibida
+        conn.execute("UPDATE ensayos SET version = ? WHERE id = ?", (version, ensayo_id))
+        resultado["aplicadas"] += 1
+    return resultado
+
+
+def _aplicar_imagenes(conn, filas, paquete):
+    columnas = _columnas(conn, "imagenes") - {"id", "imagen", "ensayo_id"}
+    resultado = {"aplicadas": 0, "iguales": 0, "descartadas": 0}
+    for fila in filas:
+        # Las imágenes no se modifican: basta con saber si ya está o se ha borrado
+        if conn.execute("SELECT 1 FROM imagenes WHERE uid = ?", (fila["uid"],)).fetchone():
+            resultado["iguales"] += 1
+            continue
+        muestra = conn.execute("SELECT 1 FROM muestras WHERE codigo_muestra = ?",
+                               (fila["codigo_muestra"],)).fetchone()
+        if _version_baja(conn, "imagenes", fila["uid"]) is not None or muestra is None:
+            resultado["descartadas"] += 1
+            continue
+        try:
+            contenido = paquete.read(f"{DIRECTORIO_IMAGENES}/{fila['sha256']}")
+        except KeyError:
+            resultado["descartadas"] += 1
+            continue
+        if hashlib.sha256(contenido).hexdigest() != fila["sha256"]:
+            raise ValueError(f"La imagen {fila['sha256']} del paquete está dañada")
+
+        ensayo = conn.execute("SELECT id FROM ensayos WHERE uid = ?", (fila.get("ensayo_uid"),)).fetchone()
+        _insertar(conn, "imagenes", {**fila, "imagen": contenido, "ensayo_id": ensayo[0] if ensayo else None},
+                  columnas | {"imagen", "ensayo_id"})
+        resultado["aplicadas"] += 1
+    return resultado
+
+
+def _aplicar_bajas(conn, filas, paquete):
+    resultado = {"aplicadas": 0, "iguales": 0, "descartadas": 0}
+    for baja in filas:
+        tabla, uid, version = baja["tabla"], baja["uid"], baja["version"] or ""
+        if tabla not in TABLAS_SINCRONIZADAS:
+            raise ValueError(f"Tabla desconocida en las bajas del paquete: {tabla}")
+        anterior = _version_baja(conn, tabla, uid)
+        if anterior is not None and anterior >= version:
+            resultado["iguales"] += 1
+            continue
+
+        if tabla == "muestras":
+            # La muestra se conserva si aquí se ha modificado, o se le ha añadido
+            # un ensayo, después de borrarla en el otro nodo
+            local = conn.execute("""
+            SELECT max(COALESCE(m.version, ''), COALESCE((SELECT max(version) FROM ensayos WHERE codigo_muestra = ?), ''))
+            FROM muestras m WHERE m.codigo_muestra = ?
+            """, (uid, uid)).fetchone()
+            if local is not None:
+                if local[0] > version:
+                    resultado["descartadas"] += 1
+                    continue
+                _borrar_muestra(conn, uid)
+        elif tabla == "ensayos":
+            local = conn.execute("SELECT id, version FROM ensayos WHERE uid = ?", (uid,)).fetchone()
+            if local is not None:
+                if (local["version"] or "") > version:
+                    resultado["descartadas"] += 1
+                    continue
+                _borrar_ensayo(conn, local["id"])
+        else:
+            conn.execute("DELETE FROM imagenes WHERE uid = ?", (uid,))
+
+        # Se guarda la baja con la versión recibida (el borrado local ha anotado otra)
+        conn.execute("""
+        INSERT OR REPLACE INTO bajas (tabla, uid, version, fecha) VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+        """, (tabla, uid, version))
+        resultado["aplicadas"] += 1
+    return resultado
+
+
+def _aplicar_conjunto(paquete, nombre, aplicar, filas_por_lote):
+    """
+    Aplica un fichero JSON Lines del paquete en transacciones de filas_por_lote
+    filas. Cada transacción se puede repetir: aplicar una fila ya aplicada no
+    la cambia, así que un paquete interrumpido se puede volver a aplicar.
+    """
+    total = {"aplicadas": 0, "iguales": 0, "descartadas": 0}
+
+    def aplicar_lote(lote):
+        # Cada intento de la transacción parte de una copia de las filas
+        resultado = ejecutar_escritura(lambda conn: aplicar(conn, copy.deepcopy(lote), paquete))
+        for clave, valor in resultado.items():
+            total[clave] += valor
+
+    if nombre not in paquete.namelist():
+        return total
+    lote = []
+    with paquete.open(nombre) as f:
+        for linea in f:
+            lote.append(json.loads(linea))
+            if len(lote) >= filas_por_lote:
+                aplicar_lote(lote)
+                lote = []
+    if lote:
+        aplicar_lote(lote)
+    return total
+
+
+@medir
+def aplicar_paquete(ruta, progreso=None):
+    """
+    Aplica un paquete de sincronización de otra base de datos. Cada fila se
+    identifica por el código de la muestra o el uid del ensayo o la imagen, y
+    ante un conflicto gana la versión más reciente: una fila modificada aquí
+    después que en el otro nodo no se sobrescribe, y una baja no borra una fila
+    modificada después. Las transacciones son cortas y aplicar dos veces el
+    mismo paquete no cambia nada.
+
+    Args:
+        ruta (str): Fichero del paquete
+        progreso (callable, optional): Función (fracción, mensaje)
+
+    Returns:
+        dict: Nodo de origen y, por conjunto, filas aplicadas, iguales (ya
+            estaban) y descartadas (aquí hay una versión más reciente)
+
+    Raises:
+        ValueError: Si el paquete no es válido, lo ha creado esta base de datos o
+            es incremental y le faltan cambios anteriores que no se han recibido,
+            o si hay fragmentos y no se aplica dentro de uno
+    """
+    _comprobar_fragmento()
+    with zipfile.ZipFile(ruta) as paquete:
+        try:
+            manifiesto = json.loads(paquete.read(MANIFIESTO))
+        except KeyError:
+            raise ValueError(f"{ruta} no es un paquete de sincronización")
+        if manifiesto.get("formato") != FORMATO_PAQUETE:
+            raise ValueError(f"Formato de paquete no admitido: {manifiesto.get('formato')}")
+
+        conn = obtener_conexion()
+        try:
+            nodo = conn.execute("SELECT id FROM nodo_local").fetchone()[0]
+            par = conn.execute("SELECT * FROM pares_sincronizacion WHERE nodo = ?", (manifiesto["nodo"],)).fetchone()
+        finally:
+            conn.close()
+        if manifiesto["nodo"] == nodo:
+            raise ValueError("El paquete lo ha creado esta misma base de datos")
+        if not manifiesto["completo"]:
+            recibido = (par["recibido_cambios"], par["recibido_bajas"] or 0) if par else (None, 0)
+            if recibido[0] is None or manifiesto["desde"]["cambios"] > recibido[0] \
+                    or manifiesto["desde"]["bajas"] > recibido[1]:
+                raise ValueError(f"Al paquete le faltan cambios anteriores del nodo {manifiesto['nodo']}: "
+                                 "hay que pedirle un paquete completo")
+
+        resumen = {"nodo": manifiesto["nodo"], "completo": manifiesto["completo"]}
+        aplicadores = {
+            "series_tamices": (_aplicar_series, FILAS_POR_LOTE),
+            "muestras": (_aplicar_muestras, FILAS_POR_LOTE),
+            "ensayos": (_aplicar_ensayos, FILAS_POR_LOTE),
+            "imagenes": (_aplicar_imagenes, IMAGENES_POR_LOTE),
+            "bajas": (_aplicar_bajas, FILAS_POR_LOTE),
+        }
+        for i, (conjunto, (aplicar, filas_por_lote)) in enumerate(aplicadores.items(), start=1):
+            resumen[conjunto] = _aplicar_conjunto(paquete, f"{conjunto}.jsonl", aplicar, filas_por_lote)
+            if progreso:
+                progreso(i / (len(aplicadores) + 1), f"{conjunto}: {resumen[conjunto]['aplicadas']} aplicadas")
+
+    # Cursores: lo recibido del par y lo que el par confirma haber recibido de aquí.
+    # Un paquete completo sustituye lo recibido (el par puede haberse restaurado).
+    hasta = manifiesto["hasta"]
+    acuse = manifiesto.get("acuses", {}).get(nodo) or {}
+
+    def guardar_cursores(conn):
+        conn.execute("""
+        INSERT INTO pares_sincronizacion (nodo, recibido_cambios, recibido_bajas, enviado_cambios, enviado_bajas,
+                                          fecha_recepcion)
+        VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+        ON CONFLICT (nodo) DO UPDATE SET
+            recibido_cambios = CASE WHEN ? THEN excluded.recibido_cambios
+                                    ELSE max(COALESCE(recibido_cambios, 0), excluded.recibido_cambios) END,
+            recibido_bajas = CASE WHEN ? THEN excluded.recibido_bajas
+                                  ELSE max(COALESCE(recibido_bajas, 0), excluded.recibido_bajas) END,
+            enviado_cambios = COALESCE(excluded.enviado_cambios, enviado_cambios),
+            enviado_bajas = COALESCE(excluded.enviado_bajas, enviado_bajas),
+            fecha_recepcion = excluded.fecha_recepcion
+        """, (manifiesto["nodo"], hasta["cambios"], hasta["bajas"], acuse.get("cambios"), acuse.get("bajas"),
+              manifiesto["completo"], manifiesto["completo"]))
+
+    ejecutar_escritura(guardar_cursores)
+    if progreso:
+        progreso(1.0, "Paquete aplicado")
+    return resumen
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sincronización entre bases de datos con paquetes de cambios")
+    parser.add_argument("--fragmento", help="Fragmento de la base de datos (con fragmentación, obligatorio "
+                                            "para crear y aplicar paquetes)")
+    ordenes = parser.add_subparsers(dest="orden", required=True)
+    crear = ordenes.add_parser("crear", help="Crea un paquete con los cambios para otra base de datos")
+    crear.add_argument("ruta", help="Fichero del paquete")
+    crear.add_argument("--par", help="Nodo que aplicará el paquete (sin él, el paquete es completo)")
+    aplicar = ordenes.add_parser("aplicar", help="Aplica un paquete de otra base de datos")
+    aplicar.add_argument("ruta", help="Fichero del paquete")
+    nodo = ordenes.add_parser("nodo", help="Muestra el identificador de esta base de datos")
+    nodo.add_argument("--renovar", action="store_true",
+                      help="Da un identificador nuevo (después de copiar el fichero de otra base de datos)")
+    ordenes.add_parser("pares", help="Lista las bases de datos con las que se ha sincronizado")
+    args = parser.parse_args()
+
+    def progreso(fraccion, mensaje):
+        print(f"  {mensaje}", file=sys.stderr)
+
+    with en_fragmento(args.fragmento):
+        if args.orden == "crear":
+            manifiesto = crear_paquete(args.ruta, args.par, progreso)
+            tipo = "completo" if manifiesto["completo"] else "incremental"
+            print(f"Paquete {tipo} {args.ruta} ({os.path.getsize(args.ruta)} bytes) del nodo {manifiesto['nodo']}")
+            for conjunto, filas in manifiesto["filas"].items():
+                print(f"  {conjunto:<20}{filas:>10}")
+
+        elif args.orden == "aplicar":
+            resumen = aplicar_paquete(args.ruta, progreso)
+            print(f"Paquete del nodo {resumen['nodo']} aplicado")
+            print(f"  {'':<16}{'aplicadas':>10}{'iguales':>10}{'descartadas':>12}")
+            for conjunto in CONJUNTOS:
+                filas = resumen[conjunto]
+                print(f"  {conjunto:<16}{filas['aplicadas']:>10}{filas['iguales']:>10}{filas['descartadas']:>12}")
+
+        elif args.orden == "nodo":
+            print(renovar_nodo() if args.renovar else identificador_nodo())
+
+        else:
+            for par in listar_pares():
+                print(f"{par['nodo']}  enviado {par['enviado_cambios']}/{par['enviado_bajas']}  "
+                      f"recibido {par['recibido_cambios']}/{par['recibido_bajas']}  "
+                      f"último envío {par['fecha_envio'] or '-'}  última recepción {par['fecha_recepcion'] or '-'}")
+
+
+if __name__ == "__main__":
+    main()
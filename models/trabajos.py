@@ -0,0 +1,665 @@
+import io
+import json
+import logging
+import os
+import queue
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+from models.db import bases_de_datos, en_fragmento, fragmento_actual, obtener_conexion, ejecutar_escritura
+from models.metricas import incrementar, observar
+
+# Hilos que ejecutan trabajos en segundo plano
+HILOS_TRABAJOS = max(1, int(os.environ.get("GARNOCEX_HILOS_TRABAJOS", "2")))
+
+# Segundos mínimos entre dos escrituras del progreso de un mismo trabajo
+INTERVALO_PROGRESO = float(os.environ.get("GARNOCEX_INTERVALO_PROGRESO", "0.5"))
+
+# Estados de un trabajo
+ESTADOS_ACTIVOS = ("pendiente", "en_curso")
+ESTADOS_FINALES = ("completado", "error", "cancelado")
+
+# Tipos de trabajo registrados: nombre -> (función, descripción)
+TIPOS_TRABAJO = {}
+
+# Segundos entre comprobaciones de los trabajos programados
+INTERVALO_PLANIFICADOR = 60
+
+# Proceso que ejecuta un trabajo, para saber al arrancar si su dueño sigue vivo.
+# El identificador de arranque distingue este proceso de uno anterior con el mismo PID.
+PROPIETARIO = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+logger = logging.getLogger(__name__)
+
+# Cola de IDs de trabajos a ejecutar
+_cola = queue.Queue()
+
+_hilos = []
+_en_ejecucion = set()
+_bloqueo_arranque = threading.Lock()
+
+# Trabajos programados: tipo -> (horas entre ejecuciones, función que da la última)
+_programados = {}
+_planificador = None
+
+
+class TrabajoCancelado(Exception):
+    """
+    Se lanza dentro de un trabajo cuando se ha solicitado su cancelación
+    """
+
+
+class ContextoTrabajo:
+    """
+    Contexto que recibe la función de un trabajo para informar de su progreso.
+
+    Cada llamada a progreso() comprueba además si se ha pedido la cancelación
+    y, en ese caso, lanza TrabajoCancelado. El punto de control guardado se
+    entrega de nuevo al reanudar el trabajo tras un reinicio.
+    """
+
+    def __init__(self, trabajo_id, punto_control=None):
+        self.trabajo_id = trabajo_id
+        self.punto_control = punto_control
+        self._ultima_escritura = 0.0
+
+    def progreso(self, fraccion, mensaje=None, punto_control=None):
+        """
+        Registra el avance del trabajo
+
+        El progreso sin punto de control se escribe como mucho cada
+        INTERVALO_PROGRESO segundos; un punto de control se escribe siempre para
+        no repetir trabajo al reanudar.
+
+        Args:
+            fraccion (float): Avance entre 0 y 1
+            mensaje (str, optional): Descripción del paso actual
+            punto_control (optional): Valor serializable en JSON desde el que reanudar
+        """
+        ahora = time.monotonic()
+        if punto_control is None and ahora - self._ultima_escritura < INTERVALO_PROGRESO:
+            return
+        self._ultima_escritura = ahora
+
+        if punto_control is not None:
+            self.punto_control = punto_control
+
+        def actualizar(conn):
+            conn.execute("""
+            UPDATE trabajos SET progreso = ?, mensaje = COALESCE(?, mensaje), punto_control = ?
+            WHERE id = ?
+            """, (max(0.0, min(1.0, fraccion)), mensaje, json.dumps(self.punto_control), self.trabajo_id))
+            return conn.execute("SELECT cancelar FROM trabajos WHERE id = ?", (self.trabajo_id,)).fetchone()[0]
+
+        # La tabla trabajos está en la base de datos principal, aunque el trabajo
+        # esté recorriendo un fragmento
+        with en_fragmento(None):
+            cancelar = ejecutar_escritura(actualizar)
+        if cancelar:
+            raise TrabajoCancelado()
+
+
+class _ContextoBase:
+    """
+    Contexto de un trabajo mientras recorre una de sus bases de datos
+    (_en_cada_base): lleva el progreso a la parte del total que corresponde a
+    la base y guarda en el punto de control la base en curso.
+    """
+
+    def __init__(self, contexto, indice, total, punto_control):
+        self._contexto = contexto
+        self._indice = indice
+        self._total = total
+        self.trabajo_id = contexto.trabajo_id
+        self.punto_control = punto_control
+
+    def progreso(self, fraccion, mensaje=None, punto_control=None):
+        if punto_control is not None:
+            self.punto_control = punto_control
+            punto_control = [self._indice, punto_control]
+        self._contexto.progreso((self._indice + max(0.0, min(1.0, fraccion))) / self._total, mensaje, punto_control)
+
+
+def tipo_trabajo(nombre, descripcion):
+    """
+    Registra una función como tipo de trabajo
+
+    La función recibe un ContextoTrabajo y los parámetros del trabajo como
+    argumentos con nombre, y devuelve un resultado serializable en JSON.
+
+    Args:
+        nombre (str): Nombre del tipo de trabajo
+        descripcion (str): Descripción que se muestra al lanzarlo
+
+    Returns:
+        callable: Decorador que registra la función
+    """
+    def registrar(funcion):
+        TIPOS_TRABAJO[nombre] = (funcion, descripcion)
+        return funcion
+    return registrar
+
+
+def _fila_a_trabajo(fila):
+    trabajo = dict(fila)
+    for campo in ("parametros", "punto_control", "resultado"):
+        if trabajo.get(campo) is not None:
+            trabajo[campo] = json.loads(trabajo[campo])
+    return trabajo
+
+
+def obtener_trabajo(trabajo_id):
+    """
+    Obtiene el estado de un trabajo. Es una lectura por clave primaria, pensada
+    para consultarse periódicamente desde la interfaz.
+
+    Args:
+        trabajo_id (int): ID del trabajo
+
+    Returns:
+        dict: Datos del trabajo o None si no existe
+    """
+    conn = obtener_conexion()
+    fila = conn.execute("SELECT * FROM trabajos WHERE id = ?", (trabajo_id,)).fetchone()
+    conn.close()
+
+    return _fila_a_trabajo(fila) if fila else None
+
+
+def obtener_trabajos(limite=50, activos=False):
+    """
+    Obtiene los trabajos más recientes
+
+    Args:
+        limite (int): Número máximo de trabajos
+        activos (bool): Devolver solo los pendientes y en curso
+
+    Returns:
+        list: Trabajos del más reciente al más antiguo
+    """
+    conn = obtener_conexion()
+    filtro = f"WHERE estado IN {ESTADOS_ACTIVOS}" if activos else ""
+    filas = conn.execute(f"SELECT * FROM trabajos {filtro} ORDER BY id DESC LIMIT ?", (limite,)).fetchall()
+    conn.close()
+
+    return [_fila_a_trabajo(fila) for fila in filas]
+
+
+def encolar_trabajo(tipo, parametros=None, usuario=None):
+    """
+    Registra un trabajo y lo encola para ejecutarse en segundo plano
+
+    El trabajo no depende de la sesión que lo lanza: sigue ejecutándose aunque
+    se cierre el navegador y, si el servidor se reinicia, se reanuda al arrancar.
+
+    Args:
+        tipo (str): Tipo de trabajo registrado en TIPOS_TRABAJO
+        parametros (dict, optional): Argumentos de la función del trabajo
+        usuario (str, optional): Usuario que lanza el trabajo
+
+    Returns:
+        int: ID del trabajo
+    """
+    if tipo not in TIPOS_TRABAJO:
+        raise ValueError(f"Tipo de trabajo no reconocido: {tipo}")
+
+    def insertar(conn):
+        c = conn.cursor()
+        c.execute("""
+        INSERT INTO trabajos (tipo, parametros, estado, usuario, fecha_creacion)
+        VALUES (?, ?, 'pendiente', ?, CURRENT_TIMESTAMP)
+        """, (tipo, json.dumps(parametros or {}), usuario))
+        return c.lastrowid
+
+    trabajo_id = ejecutar_escritura(insertar)
+
+    iniciar_trabajadores()
+    _cola.put(trabajo_id)
+    return trabajo_id
+
+
+def cancelar_trabajo(trabajo_id):
+    """
+    Solicita la cancelación de un trabajo
+
+    Un trabajo pendiente se cancela inmediatamente; uno en curso se detiene la
+    próxima vez que informe de su progreso.
+
+    Args:
+        trabajo_id (int): ID del trabajo
+
+    Returns:
+        bool: True si el trabajo seguía activo
+    """
+    def cancelar(conn):
+        fila = conn.execute("SELECT estado FROM trabajos WHERE id = ?", (trabajo_id,)).fetchone()
+        if fila is None or fila["estado"] not in ESTADOS_ACTIVOS:
+            return False
+        conn.execute("""
+        UPDATE trabajos SET cancelar = 1,
+            estado = CASE WHEN estado = 'pendiente' THEN 'cancelado' ELSE estado END,
+            fecha_fin = CASE WHEN estado = 'pendiente' THEN CURRENT_TIMESTAMP ELSE fecha_fin END
+        WHERE id = ?
+        """, (trabajo_id,))
+        return True
+
+    return ejecutar_escritura(cancelar)
+
+
+def _propietario_vivo(propietario, trabajo_id):
+    """
+    Indica si el proceso dueño de un trabajo en curso sigue en marcha. Los
+    procesos de otras máquinas se consideran vivos.
+    """
+    if not propietario:
+        return False
+    if propietario == PROPIETARIO:
+        return trabajo_id in _en_ejecucion
+    maquina, pid, _ = propietario.split(":")
+    if maquina != socket.gethostname():
+        return True
+    if int(pid) == os.getpid():
+        # Mismo PID que un proceso anterior que ya terminó
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def reanudar_trabajos():
+    """
+    Encola los trabajos pendientes y los que quedaron en curso en un proceso
+    que ya no existe (p. ej. tras reiniciar el servidor). Se llama al arrancar.
+
+    Returns:
+        list: IDs de los trabajos encolados
+    """
+    conn = obtener_conexion()
+    filas = conn.execute(f"""
+    SELECT id, estado, propietario FROM trabajos WHERE estado IN {ESTADOS_ACTIVOS} ORDER BY id
+    """).fetchall()
+    conn.close()
+
+    encolados = [
+        fila["id"] for fila in filas
+        if fila["estado"] == "pendiente" or not _propietario_vivo(fila["propietario"], fila["id"])
+    ]
+    if encolados:
+        iniciar_trabajadores()
+        for trabajo_id in encolados:
+            _cola.put(trabajo_id)
+    return encolados
+
+
+def _reclamar(trabajo_id):
+    """
+    Marca un trabajo como en curso en este proceso. Si otro proceso lo ha
+    reclamado antes o ya ha terminado, devuelve None.
+    """
+    def reclamar(conn):
+        fila = conn.execute("SELECT * FROM trabajos WHERE id = ?", (trabajo_id,)).fetchone()
+        if fila is None or fila["estado"] not in ESTADOS_ACTIVOS:
+            return None
+        if fila["estado"] == "en_curso" and _propietario_vivo(fila["propietario"], trabajo_id):
+            return None
+        conn.execute("""
+        UPDATE trabajos SET estado = 'en_curso', propietario = ?,
+            fecha_inicio = COALESCE(fecha_inicio, CURRENT_TIMESTAMP)
+        WHERE id = ?
+        """, (PROPIETARIO, trabajo_id))
+        return _fila_a_trabajo(fila)
+
+    return ejecutar_escritura(reclamar)
+
+
+def _finalizar(trabajo_id, estado, resultado=None, error=None):
+    def finalizar(conn):
+        conn.execute("""
+        UPDATE trabajos SET estado = ?, resultado = ?, error = ?, fecha_fin = CURRENT_TIMESTAMP,
+            progreso = CASE WHEN ? = 'completado' THEN 1 ELSE progreso END
+        WHERE id = ?
+        """, (estado, json.dumps(resultado), error, estado, trabajo_id))
+
+    ejecutar_escritura(finalizar)
+
+
+def _ejecutar(trabajo_id):
+    """
+    Ejecuta un trabajo y guarda su resultado, error o cancelación
+    """
+    trabajo = _reclamar(trabajo_id)
+    if trabajo is None:
+        return
+
+    tipo = trabajo["tipo"]
+    inicio = time.perf_counter()
+    _en_ejecucion.add(trabajo_id)
+    try:
+        if trabajo["cancelar"]:
+            raise TrabajoCancelado()
+        funcion, _ = TIPOS_TRABAJO[tipo]
+        resultado = funcion(ContextoTrabajo(trabajo_id, trabajo["punto_control"]), **trabajo["parametros"])
+        estado = "completado"
+        _finalizar(trabajo_id, estado, resultado=resultado)
+    except TrabajoCancelado:
+        estado = "cancelado"
+        _finalizar(trabajo_id, estado)
+    except Exception as e:
+        estado = "error"
+        logger.exception("Error en el trabajo %s (%s)", trabajo_id, tipo)
+        _finalizar(trabajo_id, estado, error=f"{type(e).__name__}: {e}")
+    finally:
+        _en_ejecucion.discard(trabajo_id)
+        observar("duracion_trabajo_segundos", time.perf_counter() - inicio, tipo=tipo)
+
+    incrementar("trabajos_total", tipo=tipo, estado=estado)
+
+
+def _bucle_trabajador():
+    while True:
+        trabajo_id = _cola.get()
+        try:
+            _ejecutar(trabajo_id)
+        except Exception:
+            # Un fallo al leer o guardar el estado no debe detener el hilo
+            logger.exception("No se pudo ejecutar el trabajo %s", trabajo_id)
+
+
+def iniciar_trabajadores():
+    """
+    Arranca los hilos de trabajos si no están en marcha
+
+    Los hilos son independientes de las sesiones de Streamlit, así que un
+    trabajo no ocupa la ejecución interactiva ni termina al cerrarse la
+    pestaña. Son hilos demonio: si el proceso termina, los trabajos en curso
+    se reanudan desde su último punto de control al volver a arrancar.
+
+    Returns:
+        list: Hilos de trabajos
+    """
+    with _bloqueo_arranque:
+        _hilos[:] = [hilo for hilo in _hilos if hilo.is_alive()]
+        while len(_hilos) < HILOS_TRABAJOS:
+            hilo = threading.Thread(target=_bucle_trabajador, name=f"trabajo-{len(_hilos)}", daemon=True)
+            hilo.start()
+            _hilos.append(hilo)
+        return list(_hilos)
+
+
+def ultima_ejecucion(tipo):
+    """
+    Devuelve cuándo terminó el último trabajo completado de un tipo
+
+    Args:
+        tipo (str): Tipo de trabajo
+
+    Returns:
+        float: Timestamp del fin del trabajo, o None si nunca se ha completado
+    """
+    conn = obtener_conexion()
+    fila = conn.execute(
+        "SELECT MAX(fecha_fin) FROM trabajos WHERE tipo = ? AND estado = 'completado'", (tipo,)
+    ).fetchone()
+    conn.close()
+
+    if not fila or fila[0] is None:
+        return None
+    # CURRENT_TIMESTAMP guarda la fecha en UTC
+    return datetime.strptime(fila[0], "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc).timestamp()
+
+
+def _comprobar_programados():
+    activos = {trabajo["tipo"] for trabajo in obtener_trabajos(limite=200, activos=True)}
+    for tipo, (horas, ultima) in list(_programados.items()):
+        if tipo in activos:
+            continue
+        fecha = ultima()
+        if fecha is None or time.time() - fecha >= horas * 3600:
+            encolar_trabajo(tipo, {}, "planificador")
+
+
+def _bucle_planificador():
+    while True:
+        try:
+            _comprobar_programados()
+        except Exception:
+            logger.exception("No se pudieron encolar los trabajos programados")
+        time.sleep(INTERVALO_PLANIFICADOR)
+
+
+def programar_trabajo(tipo, horas, ultima=None):
+    """
+    Encola un trabajo cada cierto número de horas mientras el proceso esté en
+    marcha. Un hilo comprueba cada INTERVALO_PLANIFICADOR segundos los trabajos
+    programados y encola los que toca, salvo que ya haya uno pendiente o en
+    curso del mismo tipo (por ejemplo, lanzado por otro proceso).
+
+    Args:
+        tipo (str): Tipo de trabajo registrado en TIPOS_TRABAJO, sin parámetros obligatorios
+        horas (float): Horas entre ejecuciones. Con 0 o menos no se programa
+        ultima (callable, optional): Función sin argumentos que devuelve el
+            timestamp de la última ejecución (o None). Por defecto, ultima_ejecucion(tipo)
+
+    Returns:
+        bool: True si esta llamada programó el trabajo
+    """
+    global _planificador
+
+    if horas <= 0:
+        return False
+    if tipo not in TIPOS_TRABAJO:
+        raise ValueError(f"Tipo de trabajo no reconocido: {tipo}")
+
+    with _bloqueo_arranque:
+        if tipo in _programados:
+            return False
+        _programados[tipo] = (horas, ultima or (lambda: ultima_ejecucion(tipo)))
+        if _planificador is None:
+            _planificador = threading.Thread(target=_bucle_planificador, name="trabajos-programados", daemon=True)
+            _planificador.start()
+    return True
+
+
+def _en_cada_base(contexto, funcion, principal=False):
+    """
+    Ejecuta un trabajo que recorre una base de datos entera en cada una de las
+    de bases_de_datos() (models/db.py). Sin fragmentación solo hay una y el
+    trabajo se ejecuta tal cual.
+
+    Args:
+        contexto (ContextoTrabajo): Contexto del trabajo
+        funcion (callable): Función que recibe el contexto de la base en curso
+            y devuelve su resultado
+        principal (bool): Recorrer también la base de datos principal
+
+    Returns:
+        El resultado de la función o, con fragmentos, un diccionario base ->
+        resultado ("principal" para la base de datos principal)
+    """
+    bases = bases_de_datos(principal)
+    if len(bases) == 1:
+        with en_fragmento(bases[0]):
+            return funcion(contexto)
+
+    # El punto de control es [índice de la base en curso, su punto de control]
+    inicial, punto_control = contexto.punto_control or [0, None]
+    resultados = {}
+    for indice, base in enumerate(bases[inicial:], start=inicial):
+        with en_fragmento(base):
+            resultados[base or "principal"] = funcion(_ContextoBase(
+                contexto, indice, len(bases), punto_control if indice == inicial else None
+            ))
+    return resultados
+
+
+# Tipos de trabajo. Los módulos de cálculo se importan al ejecutar el trabajo
+# para no cargar pandas al arrancar la aplicación. Los que recorren una base de
+# datos entera se repiten en cada fragmento con _en_cada_base.
+
+@tipo_trabajo("clasificacion_sucs", "Reclasificar todas las muestras según SUCS")
+def _reclasificar_sucs(contexto, lote=500):
+    from models.clasificacion import actualizar_clasificacion_sucs
+
+    def reclasificar(contexto):
+        # El punto de control es el último código clasificado (las muestras se recorren en orden)
+        ultimo = contexto.punto_control or ""
+
+        conn = obtener_conexion()
+        total = conn.execute("SELECT COUNT(*) FROM muestras").fetchone()[0]
+        hechas = conn.execute("SELECT COUNT(*) FROM muestras WHERE codigo_muestra <= ?", (ultimo,)).fetchone()[0]
+        conn.close()
+
+        while True:
+            conn = obtener_conexion()
+            codigos = [fila[0] for fila in conn.execute("""
+            SELECT codigo_muestra FROM muestras WHERE codigo_muestra > ? ORDER BY codigo_muestra LIMIT ?
+            """, (ultimo, lote)).fetchall()]
+            conn.close()
+            if not codigos:
+                break
+
+            actualizar_clasificacion_sucs(codigos)
+            ultimo = codigos[-1]
+            hechas += len(codigos)
+            contexto.progreso(hechas / max(total, 1), f"{hechas} de {total} muestras", punto_control=ultimo)
+
+        return {"muestras": hechas}
+
+    return _en_cada_base(contexto, reclasificar)
+
+
+@tipo_trabajo("control_compactacion", "Recalcular el control de compactación")
+def _recalcular_control_compactacion(contexto, criterio="muestra", completo=True, tolerancia_dias=None):
+    from models.compactacion import actualizar_control_compactacion
+
+    def recalcular(contexto):
+        contexto.progreso(0.0, f"Recalculando el criterio '{criterio}'")
+        procesados = actualizar_control_compactacion(criterio, completo, tolerancia_dias)
+        return {"ensayos": procesados}
+
+    return _en_cada_base(contexto, recalcular)
+
+
+@tipo_trabajo("recompresion_imagenes", "Recomprimir las imágenes guardadas")
+def _recomprimir_imagenes(contexto, lado_maximo=None, lote=20):
+    from PIL import Image
+
+    def recomprimir(contexto):
+        conn = obtener_conexion()
+        total = conn.execute("SELECT COUNT(*) FROM imagenes").fetchone()[0]
+        conn.close()
+
+        # El punto de control es [último ID procesado, imágenes procesadas, bytes ahorrados]
+        ultimo_id, procesadas, ahorrado = contexto.punto_control or [0, 0, 0]
+        while True:
+            conn = obtener_conexion()
+            filas = conn.execute("""
+            SELECT id, imagen FROM imagenes WHERE id > ? ORDER BY id LIMIT ?
+            """, (ultimo_id, lote)).fetchall()
+            conn.close()
+            if not filas:
+                break
+
+            # La compresión se hace fuera de la transacción; solo se guardan las que reducen tamaño
+            nuevas = []
+            for fila in filas:
+                try:
+                    imagen = Image.open(io.BytesIO(fila["imagen"]))
+                    imagen.load()
+                except Exception:
+                    continue
+                if lado_maximo:
+                    imagen.thumbnail((lado_maximo, lado_maximo))
+                salida = io.BytesIO()
+                imagen.save(salida, format="PNG", optimize=True)
+                if salida.tell() < len(fila["imagen"]):
+                    ahorrado += len(fila["imagen"]) - salida.tell()
+                    nuevas.append((salida.getvalue(), fila["id"]))
+
+            if nuevas:
+                ejecutar_escritura(lambda conn: conn.executemany("UPDATE imagenes SET imagen = ? WHERE id = ?", nuevas))
+
+            ultimo_id = filas[-1]["id"]
+            procesadas += len(filas)
+            contexto.progreso(procesadas / max(total, 1), f"{procesadas} de {total} imágenes",
+                              punto_control=[ultimo_id, procesadas, ahorrado])
+
+        return {"imagenes": procesadas, "bytes_ahorrados": ahorrado}
+
+    return _en_cada_base(contexto, recomprimir)
+
+
+@tipo_trabajo("espejo_analitico", "Actualizar el espejo Parquet de analítica")
+def _actualizar_espejo_analitico(contexto):
+    from models.analitica import actualizar_espejo
+
+    # El punto de control es el número de tablas ya copiadas
+    def progreso(copiadas, total, tabla):
+        contexto.progreso(copiadas / total, f"Tabla {tabla} copiada", punto_control=copiadas)
+
+    estado = actualizar_espejo(progreso, desde=contexto.punto_control or 0)
+    return {"filas": sum(estado["tablas"].values())}
+
+
+@tipo_trabajo("exportacion_parquet", "Exportar el archivo de ensayos a Parquet")
+def _exportar_parquet(contexto, destino=None, completa=False):
+    from models.exportacion import exportar_archivo
+
+    # Un lote interrumpido se repite entero al reanudar, así que no hay punto de control
+    resumen = exportar_archivo(destino or None, completa, contexto.progreso)
+    return {"lote": resumen["lote"], "filas": resumen["filas"]}
+
+
+@tipo_trabajo("exportacion_zip", "Exportar muestras, ensayos e imágenes a un ZIP")
+def _exportar_zip(contexto, codigos=None, imagenes=True):
+    from models.exportacion import exportar_zip
+
+    # Un ZIP interrumpido se borra y se repite entero al reanudar
+    return exportar_zip(codigos, imagenes, contexto.progreso)
+
+
+@tipo_trabajo("copia_seguridad", "Copia de seguridad de la base de datos y las imágenes")
+def _copia_seguridad(contexto, imagenes=True):
+    from models.copias import copiar_imagenes, crear_copia, rotar_copias
+
+    # Las imágenes están en los fragmentos cuando los hay
+    con_muestras = bases_de_datos(principal=False)
+
+    def copiar(contexto):
+        # Una copia interrumpida se descarta y se repite entera al reanudar. Durante la
+        # copia no se escribe el progreso: cada escritura en la base de datos la reinicia.
+        contexto.progreso(0.0, "Copiando la base de datos")
+        copia = crear_copia()
+        contexto.progreso(0.8, "Copia de la base de datos verificada")
+        resultado = {"ruta": copia["ruta"], "bytes": copia["bytes"], "reinicios": copia["reinicios"],
+                     "borradas": rotar_copias()}
+        if imagenes and fragmento_actual() in con_muestras:
+            resumen = copiar_imagenes(progreso=lambda fraccion, mensaje: contexto.progreso(0.8 + fraccion * 0.2, mensaje))
+            resultado["imagenes_copiadas"] = resumen["copiadas"]
+        return resultado
+
+    return _en_cada_base(contexto, copiar, principal=True)
+
+
+@tipo_trabajo("mantenimiento_bd", "Mantenimiento de la base de datos")
+def _mantenimiento_bd(contexto, analizar=False, activar_vaciado=False):
+    from models.mantenimiento import ejecutar_mantenimiento
+
+    def mantener(contexto):
+        # Cada paso es idempotente: al reanudar se repite el mantenimiento entero
+        resumen = ejecutar_mantenimiento(analizar, activar_vaciado, progreso=contexto.progreso)
+        return {
+            "segundos": resumen["segundos"],
+            "pasos": {nombre: paso["segundos"] for nombre, paso in resumen["pasos"].items()},
+            **{f"{clave}_antes": resumen["antes"][clave] for clave in ("bd_bytes", "wal_bytes", "paginas_libres")},
+            **{f"{clave}_despues": resumen["despues"][clave] for clave in ("bd_bytes", "wal_bytes", "paginas_libres")},
+        }
+
+    return _en_cada_base(contexto, mantener, principal=True)
@@ -0,0 +1,249 @@
+import contextvars
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+# Umbral (ms) a partir del cual una sentencia se guarda en el registro de consultas lentas
+UMBRAL_CONSULTA_LENTA_MS = float(os.environ.get("GARNOCEX_UMBRAL_CONSULTA_LENTA_MS", "100"))
+
+# Fichero JSON lines del registro persistente de consultas lentas
+RUTA_CONSULTAS_LENTAS = os.environ.get("GARNOCEX_LOG_CONSULTAS_LENTAS", "consultas_lentas.log")
+
+# Sentencias de las que se puede obtener el plan de ejecución
+_PREFIJOS_PLAN = ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE", "REPLACE")
+
+# Sentencias registradas durante la ejecución actual del script (None si no se registra)
+_registro_actual = contextvars.ContextVar("registro_consultas", default=None)
+
+_bloqueo_log = threading.Lock()
+
+
+def iniciar_registro():
+    """
+    Comienza a registrar las sentencias ejecutadas en el contexto actual.
+    Se llama al principio de cada ejecución (rerun) del script.
+
+    Returns:
+        list: Lista en la que se irán añadiendo las sentencias
+    """
+    registro = []
+    _registro_actual.set(registro)
+    return registro
+
+
+def obtener_registro():
+    """
+    Obtiene las sentencias registradas desde la última llamada a iniciar_registro()
+
+    Returns:
+        list: Lista de sentencias (diccionarios) o lista vacía si no se registra
+    """
+    return _registro_actual.get() or []
+
+
+def resumir_registro(registro):
+    """
+    Agrupa las sentencias registradas por texto para detectar repeticiones (N+1)
+
+    Args:
+        registro (list): Sentencias devueltas por obtener_registro()
+
+    Returns:
+        list: Un diccionario por sentencia distinta con número de ejecuciones,
+            tiempo total y filas, ordenado por tiempo total descendente
+    """
+    grupos = {}
+    for sentencia in registro:
+        grupo = grupos.setdefault(sentencia["sql"], {
+            "sql": sentencia["sql"], "ejecuciones": 0, "duracion_ms": 0.0, "filas": 0
+        })
+        grupo["ejecuciones"] += 1
+        grupo["duracion_ms"] += sentencia["duracion_ms"] or 0.0
+        grupo["filas"] += sentencia["filas"] or 0
+
+    return sorted(grupos.values(), key=lambda g: g["duracion_ms"], reverse=True)
+
+
+def _normalizar_sql(sql):
+    return " ".join(sql.split())
+
+
+def _forma_parametros(parametros, multiples=False):
+    """
+    Describe la forma de los parámetros sin registrar sus valores
+    """
+    if multiples:
+        return f"{len(parametros)} filas" if isinstance(parametros, (list, tuple)) else "iterador"
+    if not parametros:
+        return ""
+    if isinstance(parametros, dict):
+        return "{" + ", ".join(f":{clave}" for clave in parametros) + "}"
+    return f"{len(parametros)} posicionales"
+
+
+def _guardar_consulta_lenta(conn, sentencia, parametros):
+    """
+    Añade una sentencia lenta y su plan de ejecución al registro persistente
+    """
+    plan = None
+    if sentencia["sql"].lstrip().upper().startswith(_PREFIJOS_PLAN):
+        try:
+            cursor = sqlite3.Connection.cursor(conn)
+            sqlite3.Cursor.execute(cursor, "EXPLAIN QUERY PLAN " + sentencia["sql"], parametros or ())
+            plan = [fila[-1] for fila in sqlite3.Cursor.fetchall(cursor)]
+        except sqlite3.Error:
+            plan = None
+
+    entrada = dict(sentencia, fecha=datetime.now().isoformat(timespec="seconds"), plan=plan)
+
+    try:
+        with _bloqueo_log:
+            with open(RUTA_CONSULTAS_LENTAS, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entrada, ensure_ascii=False) + "\n")
+    except OSError:
+        # El registro de consultas lentas nunca debe interrumpir la aplicación
+        pass
+
+
+class CursorTrazado(sqlite3.Cursor):
+    """
+    Cursor que mide la duración y las filas de cada sentencia ejecutada
+    """
+
+    def _trazar(self, metodo, sql, parametros, multiples=False):
+        conn = self.connection
+        sentencia = {
+            "sql": _normalizar_sql(sql),
+            "parametros": _forma_parametros(parametros, multiples),
+            "duracion_ms": 0.0,
+            "filas": 0,
+            "sentencias_sqlite": 0,
+        }
+
+        conn._sentencia_actual = sentencia
+        inicio = time.perf_counter()
+        try:
+            resultado = metodo(self, sql, parametros)
+        finally:
+            sentencia["duracion_ms"] += (time.perf_counter() - inicio) * 1000
+            conn._sentencia_actual = None
+
+        # En escrituras las filas afectadas se conocen tras ejecutar
+        if self.rowcount >= 0:
+            sentencia["filas"] = self.rowcount
+
+        self._sentencia = sentencia
+        self._parametros = None if multiples else parametros
+        self._lenta_guardada = False
+
+        registro = _registro_actual.get()
+        if registro is not None:
+            registro.append(sentencia)
+
+        self._comprobar_lenta()
+        return resultado
+
+    def _comprobar_lenta(self):
+        if not self._lenta_guardada and self._sentencia["duracion_ms"] >= UMBRAL_CONSULTA_LENTA_MS:
+            self._lenta_guardada = True
+            _guardar_consulta_lenta(self.connection, self._sentencia, self._parametros)
+
+    def _medir_lectura(self, metodo, *args):
+        sentencia = getattr(self, "_sentencia", None)
+        if sentencia is None:
+            return metodo(self, *args)
+
+        inicio = time.perf_counter()
+        resultado = metodo(self, *args)
+        sentencia["duracion_ms"] += (time.perf_counter() - inicio) * 1000
+        return resultado
+
+    def execute(self, sql, parametros=()):
+        return self._trazar(sqlite3.Cursor.execute, sql, parametros)
+
+    def executemany(self, sql, parametros):
+        if not isinstance(parametros, (list, tuple)):
+            parametros = list(parametros)
+        return self._trazar(sqlite3.Cursor.executemany, sql, parametros, multiples=True)
+
+    def fetchone(self):
+        fila = self._medir_lectura(sqlite3.Cursor.fetchone)
+        if fila is not None and getattr(self, "_sentencia", None):
+            self._sentencia["filas"] += 1
+        return fila
+
+    def fetchmany(self, size=None):
+        filas = self._medir_lectura(sqlite3.Cursor.fetchmany, size or self.arraysize)
+        if getattr(self, "_sentencia", None):
+            self._sentencia["filas"] += len(filas)
+        return filas
+
+    def fetchall(self):
+        filas = self._medir_lectura(sqlite3.Cursor.fetchall)
+        if getattr(self, "_sentencia", None):
+            self._sentencia["filas"] += len(filas)
+            self._comprobar_lenta()
+        return filas
+
+    def __next__(self):
+        fila = self._medir_lectura(sqlite3.Cursor.__next__)
+        if getattr(self, "_sentencia", None):
+            self._sentencia["filas"] += 1
+        return fila
+
+
+class ConexionTrazada(sqlite3.Connection):
+    """
+    Conexión que registra todas sus sentencias a través de CursorTrazado.
+
+    Además, set_trace_callback cuenta las sentencias que SQLite ejecuta
+    realmente (disparadores incluidos) y registra las que no pasan por un
+    cursor, como el COMMIT de conn.commit().
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._sentencia_actual = None
+        self.set_trace_callback(self._traza_sqlite)
+
+    def _traza_sqlite(self, sql):
+        if self._sentencia_actual is not None:
+            self._sentencia_actual["sentencias_sqlite"] += 1
+            return
+
+        registro = _registro_actual.get()
+        if registro is not None and not sql.startswith("EXPLAIN QUERY PLAN"):
+            registro.append({
+                "sql": _normalizar_sql(sql),
+                "parametros": "",
+                "duracion_ms": None,
+                "filas": None,
+                "sentencias_sqlite": 1,
+            })
+
+    def cursor(self, factory=CursorTrazado):
+        return super().cursor(factory)
+
+    def execute(self, sql, parametros=()):
+        return self.cursor().execute(sql, parametros)
+
+    def executemany(self, sql, parametros):
+        return self.cursor().executemany(sql, parametros)
+
+
+def conectar(ruta, factory=ConexionTrazada, **kwargs):
+    """
+    Abre una conexión SQLite trazada
+
+    Args:
+        ruta (str): Ruta del fichero de base de datos
+        factory (type): Clase de la conexión, ConexionTrazada o una subclase
+        **kwargs: Argumentos adicionales para sqlite3.connect
+
+    Returns:
+        ConexionTrazada: Conexión a la base de datos
+    """
+    return sqlite3.connect(ruta, factory=factory, **kwargs)
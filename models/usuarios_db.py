@@ -1,18 +1,64 @@
 import sqlite3
 import hashlib
+import hmac
 import os
 import secrets
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional, Tuple, List, Dict
+from models.trazas import conectar
+from models.db import ejecutar_escritura, TIEMPO_ESPERA_BLOQUEO
+from models.metricas import medir, incrementar
 
-# Ruta de la base de datos
-DB_PATH = "ensayos_geotecnicos.db"
+# Ruta de la base de datos (se puede cambiar con la variable de entorno GARNOCEX_DB_PATH)
+DB_PATH = os.environ.get("GARNOCEX_DB_PATH", "ensayos_geotecnicos.db")
 
+# Duración de un token de sesión en horas
+DURACION_SESION_HORAS = float(os.environ.get("GARNOCEX_DURACION_SESION_HORAS", "12"))
+
+# Clave con la que se firman los tokens de sesión. Si no se define, se genera una
+# y se guarda en la tabla configuracion para que los tokens sobrevivan a un reinicio.
+SECRETO_SESIONES = os.environ.get("GARNOCEX_SECRETO_SESIONES")
+
+# Parámetros del hash de contraseñas. Al cambiar las iteraciones, los hashes
+# existentes se actualizan en el siguiente inicio de sesión correcto.
+ALGORITMO_HASH = "pbkdf2_sha256"
+ITERACIONES_PBKDF2 = int(os.environ.get("GARNOCEX_PBKDF2_ITERACIONES", "100000"))
+
+# Hilos que calculan hashes y cálculos admitidos a la vez (en curso o en espera)
+HILOS_HASH = int(os.environ.get("GARNOCEX_HILOS_HASH", str(max(1, (os.cpu_count() or 2) // 2))))
+MAX_HASH_PENDIENTES = int(os.environ.get("GARNOCEX_MAX_HASH_PENDIENTES", str(HILOS_HASH * 8)))
+
+# Intentos fallidos sin espera por usuario y por IP (una IP puede ser la de todo el laboratorio)
+INTENTOS_LOGIN_USUARIO = int(os.environ.get("GARNOCEX_INTENTOS_LOGIN_USUARIO", "5"))
+INTENTOS_LOGIN_IP = int(os.environ.get("GARNOCEX_INTENTOS_LOGIN_IP", "30"))
+ESPERA_BASE_LOGIN = 1.0
+# Minutos sin fallos tras los que se olvidan los fallos anteriores de una clave
+VENTANA_INTENTOS_LOGIN = float(os.environ.get("GARNOCEX_VENTANA_LOGIN_MIN", "15")) * 60
+ESPERA_MAXIMA_LOGIN = 300.0
+MAX_CLAVES_INTENTOS = 10000
+
+_pool_hash = ThreadPoolExecutor(max_workers=HILOS_HASH, thread_name_prefix="hash")
+_admision_hash = threading.BoundedSemaphore(MAX_HASH_PENDIENTES)
+
+# Intentos fallidos por ("usuario", nickname) o ("ip", dirección): (fallos, bloqueado hasta, último fallo)
+_intentos = OrderedDict()
+_bloqueo_intentos = threading.Lock()
+
+# Hash con el que se comparan los usuarios inexistentes
+_SALT_FICTICIO = secrets.token_hex(32)
+_HASH_FICTICIO = f"{ALGORITMO_HASH}${ITERACIONES_PBKDF2}${'0' * 64}"
+
+@medir
 def get_db_connection():
     """Establece conexión con la base de datos."""
-    conn = sqlite3.connect(DB_PATH)
+    conn = conectar(DB_PATH, timeout=TIEMPO_ESPERA_BLOQUEO)
     conn.row_factory = sqlite3.Row
     return conn
 
+@medir
 def init_users_table():
     """Inicializa la tabla de usuarios si no existe."""
     conn = get_db_connection()
@@ -30,10 +76,56 @@ def init_users_table():
         fecha_modificacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP
     )
     ''')
-    
+
+    # Crear tabla de sesiones: el selector identifica la sesión y va dentro del token firmado
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS sesiones (
+        selector TEXT PRIMARY KEY,
+        usuario_id INTEGER NOT NULL,
+        expira INTEGER NOT NULL,
+        fecha_creacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_sesiones_usuario
+    ON sesiones (usuario_id)
+    ''')
+
+    # Crear tabla de configuración (clave de firma de las sesiones)
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS configuracion (
+        clave TEXT PRIMARY KEY,
+        valor TEXT NOT NULL
+    )
+    ''')
+
     conn.commit()
     conn.close()
 
+class AccesoLimitado(Exception):
+    """Intento de inicio de sesión rechazado por exceso de intentos o de carga."""
+
+    def __init__(self, espera: float):
+        super().__init__(f"Demasiados intentos. Vuelva a intentarlo en {espera:.0f} s")
+        self.espera = espera
+
+def _calcular_hash(password: str, salt: str, iteraciones: int) -> str:
+    """
+    Calcula PBKDF2-SHA256 en el pool de hash. Si ya hay demasiados cálculos en
+    curso o en espera se rechaza el intento en lugar de encolarlo.
+    """
+    if not _admision_hash.acquire(blocking=False):
+        incrementar("login_limitados_total", motivo="ocupado")
+        raise AccesoLimitado(1)
+    try:
+        futuro = _pool_hash.submit(hashlib.pbkdf2_hmac, 'sha256', password.encode('utf-8'),
+                                   salt.encode('utf-8'), iteraciones)
+        return futuro.result().hex()
+    finally:
+        _admision_hash.release()
+
+@medir
 def hash_password(password: str, salt: Optional[str] = None) -> Tuple[str, str]:
     """
     Genera un hash seguro de la contraseña usando PBKDF2 con SHA-256.
@@ -43,23 +135,75 @@ def hash_password(password: str, salt: Optional[str] = None) -> Tuple[str, str]:
         salt: Valor salt opcional. Si no se proporciona, se genera uno nuevo.
         
     Returns:
-        Tupla con (password_hash, salt)
+        Tupla con (password_hash, salt). El hash incluye el algoritmo y las
+        iteraciones ("pbkdf2_sha256$iteraciones$hash") para poder cambiarlas.
     """
     if salt is None:
         # Generar un salt aleatorio de 32 bytes
         salt = secrets.token_hex(32)
         
-    # Aplicar PBKDF2 usando SHA-256 con 100,000 iteraciones
-    key = hashlib.pbkdf2_hmac(
-        'sha256',
-        password.encode('utf-8'),
-        salt.encode('utf-8'),
-        iterations=100000
-    )
+    key = _calcular_hash(password, salt, ITERACIONES_PBKDF2)
     
-    password_hash = key.hex()
+    password_hash = f"{ALGORITMO_HASH}${ITERACIONES_PBKDF2}${key}"
     return password_hash, salt
 
+def _comprobar_password(password: str, password_hash: str, salt: str) -> Tuple[bool, bool]:
+    """
+    Compara una contraseña con su hash guardado en tiempo constante.
+
+    Returns:
+        Tupla con (correcta, hay que actualizar el hash a los parámetros actuales)
+    """
+    if '$' in password_hash:
+        algoritmo, iteraciones, esperado = password_hash.split('$')
+        actual = (algoritmo, int(iteraciones)) == (ALGORITMO_HASH, ITERACIONES_PBKDF2)
+    else:
+        # Formato antiguo: solo el hash hexadecimal, con 100.000 iteraciones
+        iteraciones, esperado, actual = 100000, password_hash, False
+
+    calculado = _calcular_hash(password, salt, int(iteraciones))
+    correcta = hmac.compare_digest(calculado, esperado)
+    return correcta, correcta and not actual
+
+def _espera_login(claves: List[Tuple[str, str]]) -> float:
+    """Segundos que faltan para que se admita otro intento con estas claves."""
+    ahora = time.monotonic()
+    with _bloqueo_intentos:
+        return max((_intentos[clave][1] - ahora for clave in claves if clave in _intentos), default=0)
+
+def _registrar_fallo_login(claves: List[Tuple[str, str]]):
+    """
+    Anota un intento fallido y bloquea la clave con backoff exponencial a partir del límite.
+    Los fallos de una clave se olvidan tras VENTANA_INTENTOS_LOGIN segundos sin fallos.
+    """
+    incrementar("login_fallidos_total")
+    ahora = time.monotonic()
+    with _bloqueo_intentos:
+        for clave in claves:
+            fallos, _, ultimo = _intentos.pop(clave, (0, 0, ahora))
+            if ahora - ultimo > VENTANA_INTENTOS_LOGIN:
+                fallos = 0
+            fallos += 1
+            libres = INTENTOS_LOGIN_USUARIO if clave[0] == "usuario" else INTENTOS_LOGIN_IP
+            bloqueado_hasta = 0
+            if fallos >= libres:
+                bloqueado_hasta = ahora + min(ESPERA_MAXIMA_LOGIN, ESPERA_BASE_LOGIN * 2 ** (fallos - libres))
+            _intentos[clave] = (fallos, bloqueado_hasta, ahora)
+
+        # Se olvidan las claves más antiguas para acotar la memoria
+        while len(_intentos) > MAX_CLAVES_INTENTOS:
+            _intentos.popitem(last=False)
+
+def _registrar_acierto_login(claves: List[Tuple[str, str]]):
+    """
+    Olvida los fallos del usuario. Los de su IP no se descuentan: quien tenga
+    una cuenta válida podría entrar con ella entre intentos contra otras cuentas
+    para vaciar el límite de la IP. Se olvidan con VENTANA_INTENTOS_LOGIN.
+    """
+    with _bloqueo_intentos:
+        _intentos.pop(claves[0], None)
+
+@medir
 def crear_usuario(nombre: str, nickname: str, password: str) -> bool:
     """
     Crea un nuevo usuario en la base de datos.
@@ -71,43 +215,57 @@ def crear_usuario(nombre: str, nickname: str, password: str) -> bool:
         
     Returns:
         True si el usuario se creó con éxito, False si hay error (ej: nickname duplicado)
-    """
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Generar hash y salt de la contraseña
-        password_hash, salt = hash_password(password)
         
+    Raises:
+        AccesoLimitado: Si hay demasiados cálculos de hash en curso
+    """
+    # Generar hash y salt de la contraseña (fuera de la transacción)
+    password_hash, salt = hash_password(password)
+    
+    def insertar(conn):
         # Insertar el nuevo usuario
-        cursor.execute('''
+        conn.execute('''
         INSERT INTO usuarios (nombre, nickname, password_hash, salt)
         VALUES (?, ?, ?, ?)
         ''', (nombre, nickname, password_hash, salt))
-        
-        conn.commit()
-        conn.close()
+    
+    try:
+        ejecutar_escritura(insertar, get_db_connection)
         return True
     except sqlite3.IntegrityError:
         # Error de integridad (nickname duplicado)
-        conn.close()
         return False
     except Exception as e:
         print(f"Error al crear usuario: {e}")
-        conn.close()
         return False
 
-def verificar_credenciales(nickname: str, password: str) -> Optional[Dict]:
+@medir
+def verificar_credenciales(nickname: str, password: str, ip: Optional[str] = None) -> Optional[Dict]:
     """
     Verifica las credenciales de un usuario.
     
+    Los intentos fallidos se limitan por usuario y por dirección IP con un
+    backoff exponencial; un intento limitado se rechaza sin calcular el hash.
+    Si la contraseña es correcta pero su hash usa parámetros antiguos, se
+    vuelve a calcular con los actuales.
+    
     Args:
         nickname: Nombre de usuario
         password: Contraseña en texto plano
+        ip: Dirección IP del cliente (opcional)
         
     Returns:
         Diccionario con datos del usuario si las credenciales son correctas, None en caso contrario
+        
+    Raises:
+        AccesoLimitado: Si hay demasiados intentos fallidos o demasiados cálculos de hash en curso
     """
+    claves = [("usuario", nickname.lower())] + ([("ip", ip)] if ip else [])
+    espera = _espera_login(claves)
+    if espera > 0:
+        incrementar("login_limitados_total", motivo="intentos")
+        raise AccesoLimitado(espera)
+    
     conn = get_db_connection()
     cursor = conn.cursor()
     
@@ -115,31 +273,150 @@ def verificar_credenciales(nickname: str, password: str) -> Optional[Dict]:
     cursor.execute('SELECT * FROM usuarios WHERE nickname = ?', (nickname,))
     usuario = cursor.fetchone()
     
+    conn.close()
+    
     if not usuario:
-        conn.close()
+        # Se calcula un hash igualmente para no revelar qué usuarios existen por el tiempo de respuesta
+        _comprobar_password(password, _HASH_FICTICIO, _SALT_FICTICIO)
+        _registrar_fallo_login(claves)
+        return None
+    
+    correcta, actualizar = _comprobar_password(password, usuario['password_hash'], usuario['salt'])
+    
+    if not correcta:
+        _registrar_fallo_login(claves)
         return None
     
-    # Verificar contraseña
-    stored_hash = usuario['password_hash']
-    salt = usuario['salt']
+    _registrar_acierto_login(claves)
     
-    # Calcular hash de la contraseña proporcionada
-    calculated_hash, _ = hash_password(password, salt)
+    if actualizar:
+        password_hash, salt = hash_password(password)
+        ejecutar_escritura(
+            lambda conn: conn.execute('UPDATE usuarios SET password_hash = ?, salt = ? WHERE id = ?',
+                                      (password_hash, salt, usuario['id'])),
+            get_db_connection
+        )
+    
+    # Convertir el objeto Row a diccionario
+    usuario_dict = dict(usuario)
     
-    if calculated_hash == stored_hash:
-        # Convertir el objeto Row a diccionario
+    # Eliminar datos sensibles
+    del usuario_dict['password_hash']
+    del usuario_dict['salt']
+    
+    return usuario_dict
+
+_secreto = None
+
+def _secreto_sesiones() -> bytes:
+    """Clave de firma de los tokens de sesión, generada y guardada la primera vez."""
+    global _secreto
+    if _secreto is None:
+        if SECRETO_SESIONES:
+            _secreto = SECRETO_SESIONES.encode('utf-8')
+        else:
+            nuevo = secrets.token_hex(32)
+
+            def obtener(conn):
+                # Si otro proceso la ha creado antes se usa la suya
+                conn.execute("INSERT OR IGNORE INTO configuracion (clave, valor) VALUES ('secreto_sesiones', ?)",
+                             (nuevo,))
+                return conn.execute("SELECT valor FROM configuracion WHERE clave = 'secreto_sesiones'").fetchone()[0]
+
+            _secreto = ejecutar_escritura(obtener, get_db_connection).encode('utf-8')
+    return _secreto
+
+def _firmar(selector: str, expira: int) -> str:
+    return hmac.new(_secreto_sesiones(), f"{selector}.{expira}".encode('utf-8'), hashlib.sha256).hexdigest()
+
+@medir
+def crear_sesion(usuario_id: int) -> str:
+    """
+    Crea una sesión para un usuario que acaba de iniciar sesión.
+
+    Args:
+        usuario_id: ID del usuario
+
+    Returns:
+        Token firmado "selector.expiración.firma" con el que restaurar la sesión
+    """
+    selector = secrets.token_urlsafe(16)
+    ahora = int(time.time())
+    expira = ahora + int(DURACION_SESION_HORAS * 3600)
+
+    def insertar(conn):
+        # Aprovechar para descartar las sesiones caducadas
+        conn.execute('DELETE FROM sesiones WHERE expira <= ?', (ahora,))
+        conn.execute('INSERT INTO sesiones (selector, usuario_id, expira) VALUES (?, ?, ?)',
+                     (selector, usuario_id, expira))
+
+    ejecutar_escritura(insertar, get_db_connection)
+    return f"{selector}.{expira}.{_firmar(selector, expira)}"
+
+@medir
+def restaurar_sesion(token: Optional[str]) -> Optional[Dict]:
+    """
+    Obtiene el usuario de un token de sesión sin volver a calcular el hash de la
+    contraseña: se comprueban la firma y la caducidad y se hace una sola
+    consulta por clave primaria.
+
+    Args:
+        token: Token devuelto por crear_sesion
+
+    Returns:
+        Diccionario con datos del usuario o None si el token no es válido, ha
+        caducado o la sesión se ha cerrado
+    """
+    try:
+        selector, expira, firma = token.split('.')
+        expira = int(expira)
+    except (AttributeError, ValueError):
+        return None
+
+    # Los tokens manipulados o caducados se rechazan sin consultar la base de datos
+    if not hmac.compare_digest(firma, _firmar(selector, expira)) or expira <= time.time():
+        return None
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+
+    cursor.execute('''
+    SELECT u.* FROM sesiones s JOIN usuarios u ON u.id = s.usuario_id
+    WHERE s.selector = ? AND s.expira = ?
+    ''', (selector, expira))
+    usuario = cursor.fetchone()
+
+    conn.close()
+
+    if usuario:
         usuario_dict = dict(usuario)
-        
-        # Eliminar datos sensibles
         del usuario_dict['password_hash']
         del usuario_dict['salt']
-        
-        conn.close()
         return usuario_dict
-    
-    conn.close()
+
     return None
 
+@medir
+def revocar_sesion(token: Optional[str]) -> bool:
+    """
+    Cierra una sesión para que su token deje de ser válido.
+
+    Args:
+        token: Token devuelto por crear_sesion
+
+    Returns:
+        True si la sesión existía, False en caso contrario
+    """
+    if not token:
+        return False
+    selector = token.split('.')[0]
+
+    return ejecutar_escritura(
+        lambda conn: conn.execute('DELETE FROM sesiones WHERE selector = ?', (selector,)).rowcount > 0,
+        get_db_connection
+    )
+
+@medir
 def obtener_usuario_por_id(usuario_id: int) -> Optional[Dict]:
     """
     Obtiene información de un usuario por su ID.
@@ -166,6 +443,7 @@ def obtener_usuario_por_id(usuario_id: int) -> Optional[Dict]:
     
     return None
 
+@medir
 def obtener_todos_usuarios() -> List[Dict]:
     """
     Obtiene la lista de todos los usuarios.
@@ -183,6 +461,7 @@ def obtener_todos_usuarios() -> List[Dict]:
     
     return [dict(usuario) for usuario in usuarios]
 
+@medir
 def actualizar_usuario(usuario_id: int, nombre: Optional[str] = None, 
                       nickname: Optional[str] = None, password: Optional[str] = None) -> bool:
     """
@@ -196,64 +475,53 @@ def actualizar_usuario(usuario_id: int, nombre: Optional[str] = None,
         
     Returns:
         True si la actualización fue exitosa, False en caso contrario
-    """
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
         
-        # Verificar si el usuario existe
-        cursor.execute('SELECT * FROM usuarios WHERE id = ?', (usuario_id,))
-        usuario = cursor.fetchone()
-        
-        if not usuario:
-            conn.close()
-            return False
+    Raises:
+        AccesoLimitado: Si se cambia la contraseña y hay demasiados cálculos de hash en curso
+    """
+    # Construir consulta dinámica para actualizar solo los campos proporcionados
+    update_parts = []
+    params = []
+    
+    if nombre is not None:
+        update_parts.append("nombre = ?")
+        params.append(nombre)
         
-        # Construir consulta dinámica para actualizar solo los campos proporcionados
-        update_parts = []
-        params = []
+    if nickname is not None:
+        update_parts.append("nickname = ?")
+        params.append(nickname)
         
-        if nombre is not None:
-            update_parts.append("nombre = ?")
-            params.append(nombre)
-            
-        if nickname is not None:
-            update_parts.append("nickname = ?")
-            params.append(nickname)
-            
+    if password is not None:
+        # El hash se calcula fuera de la transacción
+        password_hash, salt = hash_password(password)
+        update_parts.append("password_hash = ?")
+        params.append(password_hash)
+        update_parts.append("salt = ?")
+        params.append(salt)
+    
+    # Actualizar la fecha de modificación
+    update_parts.append("fecha_modificacion = CURRENT_TIMESTAMP")
+    
+    query = f"UPDATE usuarios SET {', '.join(update_parts)} WHERE id = ?"
+    params.append(usuario_id)
+    
+    def actualizar(conn):
+        # Cambiar la contraseña cierra las sesiones abiertas del usuario
         if password is not None:
-            password_hash, salt = hash_password(password)
-            update_parts.append("password_hash = ?")
-            params.append(password_hash)
-            update_parts.append("salt = ?")
-            params.append(salt)
-        
-        # Actualizar la fecha de modificación
-        update_parts.append("fecha_modificacion = CURRENT_TIMESTAMP")
-        
-        if not update_parts:
-            # No hay nada que actualizar
-            conn.close()
-            return True
-            
-        # Construir y ejecutar la consulta
-        query = f"UPDATE usuarios SET {', '.join(update_parts)} WHERE id = ?"
-        params.append(usuario_id)
-        
-        cursor.execute(query, params)
-        conn.commit()
-        conn.close()
-        
-        return True
+            conn.execute('DELETE FROM sesiones WHERE usuario_id = ?', (usuario_id,))
+        # Si el usuario no existe no se actualiza ninguna fila
+        return conn.execute(query, params).rowcount > 0
+    
+    try:
+        return ejecutar_escritura(actualizar, get_db_connection)
     except sqlite3.IntegrityError:
         # Error de integridad (nickname duplicado)
-        conn.close()
         return False
     except Exception as e:
         print(f"Error al actualizar usuario: {e}")
-        conn.close()
         return False
 
+@medir
 def eliminar_usuario(usuario_id: int) -> bool:
     """
     Elimina un usuario de la base de datos.
@@ -264,25 +532,18 @@ def eliminar_usuario(usuario_id: int) -> bool:
     Returns:
         True si la eliminación fue exitosa, False en caso contrario
     """
+    def eliminar(conn):
+        conn.execute('DELETE FROM sesiones WHERE usuario_id = ?', (usuario_id,))
+        # Si no se encontró el usuario no se elimina ninguna fila
+        return conn.execute('DELETE FROM usuarios WHERE id = ?', (usuario_id,)).rowcount > 0
+    
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('DELETE FROM usuarios WHERE id = ?', (usuario_id,))
-        
-        if cursor.rowcount == 0:
-            # No se encontró el usuario
-            conn.close()
-            return False
-            
-        conn.commit()
-        conn.close()
-        return True
+        return ejecutar_escritura(eliminar, get_db_connection)
     except Exception as e:
         print(f"Error al eliminar usuario: {e}")
-        conn.close()
         return False
 
+@medir
 def verificar_nickname_disponible(nickname: str) -> bool:
     """
     Verifica si un nickname está disponible.
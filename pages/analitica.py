@@ -0,0 +1,108 @@
+import time
+
+import plotly.express as px
+import streamlit as st
+
+from models.analitica import (INFORMES, ORIGEN, REFRESCO_MINUTOS, ejecutar_informe, estado_espejo,
+                              espejo_desactualizado)
+from models.trabajos import encolar_trabajo, obtener_trabajos
+
+
+def actualizacion_en_curso():
+    """
+    Indica si hay un trabajo de actualización del espejo pendiente o en curso
+    """
+    return any(t["tipo"] == "espejo_analitico" for t in obtener_trabajos(limite=50, activos=True))
+
+
+def mostrar_estado_espejo():
+    """
+    Muestra la antigüedad del espejo Parquet y permite actualizarlo
+    """
+    if ORIGEN != "parquet":
+        st.caption("Origen de los datos: base de datos SQLite en solo lectura")
+        return
+
+    estado = estado_espejo()
+    en_curso = actualizacion_en_curso()
+
+    # Un espejo desactualizado se actualiza en segundo plano, sin esperar a que termine
+    if espejo_desactualizado() and not en_curso:
+        encolar_trabajo("espejo_analitico", {}, st.session_state.usuario_actual["nombre"])
+        en_curso = True
+
+    col1, col2 = st.columns([4, 1])
+    with col1:
+        if estado and estado.get("fecha"):
+            minutos = (time.time() - estado["fecha"]) / 60
+            st.caption(f"Datos del espejo Parquet actualizados hace {minutos:.0f} min "
+                       f"(se actualizan cada {REFRESCO_MINUTOS:.0f} min)")
+        else:
+            st.caption("El espejo Parquet todavía no se ha creado")
+        if en_curso:
+            st.caption("Actualización del espejo en curso (página Trabajos)")
+    with col2:
+        if st.button("Actualizar datos", disabled=en_curso):
+            encolar_trabajo("espejo_analitico", {}, st.session_state.usuario_actual["nombre"])
+            st.rerun()
+
+
+def mostrar_grafico(df, grafico):
+    """
+    Muestra el gráfico de un informe
+
+    Args:
+        df (pandas.DataFrame): Resultado del informe
+        grafico (tuple): (tipo, x, y, color)
+    """
+    tipo, x, y, color = grafico
+    funcion = px.line if tipo == "line" else px.bar
+    st.plotly_chart(funcion(df, x=x, y=y, color=color), use_container_width=True)
+
+
+def mostrar_pagina_analitica():
+    """
+    Muestra la página de analítica del archivo de ensayos
+    """
+    st.header("Analítica")
+    st.write(
+        "Informes sobre todo el archivo de ensayos. Se calculan con DuckDB sobre una copia "
+        "en columnas de los datos, sin bloquear la base de datos de los operarios."
+    )
+
+    try:
+        mostrar_estado_espejo()
+
+        if ORIGEN == "parquet" and estado_espejo() is None:
+            st.info("Los informes estarán disponibles cuando termine la primera copia de los datos.")
+            return
+
+        informe = st.selectbox("Informe:", list(INFORMES), format_func=lambda i: INFORMES[i][0])
+
+        filtrar = st.checkbox("Filtrar por fechas")
+        desde = hasta = None
+        if filtrar:
+            col1, col2 = st.columns(2)
+            with col1:
+                desde = st.date_input("Desde")
+            with col2:
+                hasta = st.date_input("Hasta")
+
+        df = ejecutar_informe(informe, desde, hasta)
+
+        if df.empty:
+            st.info("No hay datos para este informe")
+            return
+
+        grafico = INFORMES[informe][2]
+        if grafico:
+            mostrar_grafico(df, grafico)
+        st.dataframe(df, use_container_width=True)
+        st.download_button(
+            "Descargar CSV",
+            df.to_csv(index=False),
+            file_name=f"{informe}.csv",
+            mime="text/csv"
+        )
+    except Exception as e:
+        st.error(f"Error al calcular el informe: {str(e)}")
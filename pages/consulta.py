@@ -1,3 +1,4 @@
+import os
 import streamlit as st
 import numpy as np
 import pandas as pd
@@ -5,9 +6,78 @@ from datetime import datetime
 import plotly.graph_objects as go
 
 from models.muestras import obtener_muestras, obtener_muestra, obtener_imagenes
+from models.trabajos import ESTADOS_ACTIVOS, encolar_trabajo, obtener_trabajo
 from models.granulometria import obtener_ensayo_granulometrico
 from utils.graficos import generar_grafico_granulometrico
 
+# Segundos entre dos consultas del progreso de la exportación
+INTERVALO_REFRESCO = 2
+
+def leer_fichero(ruta):
+    """
+    Lee un fichero exportado; se llama solo al pulsar el botón de descarga
+    """
+    with open(ruta, "rb") as f:
+        return f.read()
+
+def mostrar_estado_exportacion():
+    """
+    Muestra el progreso de la exportación ZIP en curso y, al terminar, la descarga
+    """
+    trabajo = obtener_trabajo(st.session_state.exportacion_zip)
+    if trabajo is None:
+        return
+    
+    if trabajo["estado"] in ESTADOS_ACTIVOS:
+        st.progress(trabajo["progreso"] or 0.0, text=trabajo["mensaje"] or "Exportación pendiente")
+    elif trabajo["estado"] == "completado":
+        resultado = trabajo["resultado"]
+        if os.path.exists(resultado["ruta"]):
+            st.download_button(
+                label=f"Descargar ZIP ({resultado['bytes'] / 1e6:.1f} MB)",
+                data=lambda: leer_fichero(resultado["ruta"]),
+                file_name=f"ensayos_{trabajo['id']}.zip",
+                mime="application/zip"
+            )
+        else:
+            st.warning("El fichero exportado ya no está disponible. Vuelva a exportar las muestras.")
+    elif trabajo["estado"] == "error":
+        st.error(f"Error en la exportación: {trabajo['error']}")
+    else:
+        st.info("Exportación cancelada")
+    
+    # Cuando termina la exportación se deja de consultar el progreso
+    if st.session_state.get("exportacion_zip_activa") and trabajo["estado"] not in ESTADOS_ACTIVOS:
+        st.session_state.exportacion_zip_activa = False
+        st.rerun()
+
+def mostrar_exportacion_zip(codigos, total):
+    """
+    Permite exportar las muestras filtradas con sus ensayos e imágenes a un ZIP.
+    La exportación es un trabajo en segundo plano y la descarga se ofrece al terminar.
+    
+    Args:
+        codigos (list): Códigos de las muestras filtradas
+        total (int): Número total de muestras
+    """
+    with st.expander("Exportar muestras filtradas (ZIP)"):
+        st.caption("Un CSV por tabla (muestras, ensayos de cada tipo, curvas granulométricas "
+                   "y puntos Próctor) y las imágenes de las muestras.")
+        incluir_imagenes = st.checkbox("Incluir imágenes", value=True)
+        if st.button(f"Exportar {len(codigos)} muestras"):
+            parametros = {"codigos": None if len(codigos) == total else codigos, "imagenes": incluir_imagenes}
+            st.session_state.exportacion_zip = encolar_trabajo(
+                "exportacion_zip", parametros, st.session_state.usuario_actual["nombre"]
+            )
+        
+        if st.session_state.get("exportacion_zip"):
+            # Solo se refresca el fragmento del progreso, y solo mientras la exportación está activa
+            trabajo = obtener_trabajo(st.session_state.exportacion_zip)
+            st.session_state.exportacion_zip_activa = bool(trabajo and trabajo["estado"] in ESTADOS_ACTIVOS)
+            st.fragment(
+                run_every=INTERVALO_REFRESCO if st.session_state.exportacion_zip_activa else None
+            )(mostrar_estado_exportacion)()
+
 def mostrar_pagina_consulta():
     """
     Muestra la página de consulta de resultados
@@ -121,6 +191,9 @@ def mostrar_pagina_consulta():
             st.warning("No hay muestras que coincidan con los filtros aplicados.")
             return
         
+        # --- EXPORTACIÓN ---
+        mostrar_exportacion_zip(df_filtrado["codigo_muestra"].tolist(), len(df_muestras))
+        
         # --- SELECCIÓN MÚLTIPLE DE MUESTRAS ---
         st.subheader("Selección de Muestras para Comparación")
         
@@ -14,7 +14,8 @@ from models.usuarios_db import (
     actualizar_usuario, 
     eliminar_usuario, 
     verificar_credenciales,
-    verificar_nickname_disponible
+    verificar_nickname_disponible,
+    AccesoLimitado
 )
 
 # Configuración de la página
@@ -39,7 +40,7 @@ if 'vista_actual' not in st.session_state:
 
 def login_usuario(nickname, password):
     """Inicia sesión de usuario."""
-    usuario = verificar_credenciales(nickname, password)
+    usuario = verificar_credenciales(nickname, password, st.context.ip_address)
     if usuario:
         st.session_state.autenticado = True
         st.session_state.usuario_actual = usuario
@@ -79,7 +80,12 @@ def mostrar_login():
             
     if submit_button:
         if nickname and password:
-            if login_usuario(nickname, password):
+            try:
+                correcto = login_usuario(nickname, password)
+            except AccesoLimitado as e:
+                st.warning(str(e))
+                return
+            if correcto:
                 st.success("¡Inicio de sesión exitoso!")
                 time.sleep(1)
                 st.rerun()
@@ -125,7 +131,12 @@ def mostrar_registro():
         else:
             # Verificar si el nickname está disponible
             if verificar_nickname_disponible(nickname):
-                if crear_usuario(nombre, nickname, password):
+                try:
+                    creado = crear_usuario(nombre, nickname, password)
+                except AccesoLimitado as e:
+                    st.warning(str(e))
+                    return
+                if creado:
                     st.success("Usuario creado con éxito")
                     time.sleep(1)
                     cambiar_vista("login")
@@ -4,7 +4,7 @@ from datetime import datetime
 
 from models.muestras import obtener_muestras, obtener_muestra
 from models.granulometria import guardar_ensayo_granulometrico, obtener_ensayo_granulometrico
-from utils.tamices import get_tamices_estandar
+from models.series_tamices import series_disponibles
 from utils.calculo import procesar_datos_tamices, calcular_diametros_caracteristicos, calcular_coeficientes
 from utils.graficos import generar_grafico_granulometrico
 
@@ -59,6 +59,14 @@ def mostrar_pagina_granulometria():
             with col3:
                 st.write(f"**Tipo Material:** {muestra['tipo_material']}")
             
+            # Serie de tamices del ensayo (fuera del formulario para cambiar los campos al elegirla)
+            series = {serie.id: serie for serie in series_disponibles()}
+            serie = series[st.selectbox(
+                "Serie de Tamices",
+                options=list(series),
+                format_func=lambda serie_id: series[serie_id].descripcion
+            )]
+            
             # Formulario de ensayo granulométrico
             with st.form("formulario_granulometria"):
                 # Datos generales del ensayo
@@ -75,7 +83,7 @@ def mostrar_pagina_granulometria():
                 # Tamices y masas retenidas
                 st.subheader("Masas Retenidas por Tamiz")
                 
-                tamices = get_tamices_estandar()
+                tamices = serie.tamices()
                 masas_retenidas = []
                 
                 # Crear campos para cada tamiz
@@ -95,7 +103,7 @@ def mostrar_pagina_granulometria():
                                     f"Tamiz {tamiz['nombre']} ({tamiz['apertura']} mm)",
                                     min_value=0.0,
                                     step=0.1,
-                                    key=f"tamiz_{tamiz_idx}"
+                                    key=f"tamiz_{serie.id}_{tamiz_idx}"
                                 )
                                 masas_retenidas.append(masa)
                 
@@ -57,10 +57,10 @@ def mostrar_pagina_inicio():
     
     try:
         # Intentar obtener estadísticas reales de la base de datos
-        from models.db import obtener_conexion
+        from models.db import obtener_conexion, DB_PATH
         
         # Comprobar si la base de datos existe
-        db_exists = os.path.exists('ensayos_geotecnicos.db')
+        db_exists = os.path.exists(DB_PATH)
         
         if db_exists:
             conn = obtener_conexion()
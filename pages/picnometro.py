@@ -93,6 +93,7 @@ def mostrar_pagina_picnometro():
                     masa_arena_empleada = st.number_input("Masa total de arena empleada (g)", min_value=0.1, step=0.1)
                     masa_arena_cono = st.number_input("Masa de arena en el cono (g)", min_value=0.0, step=0.1)
                     densidad_arena = st.number_input("Densidad de la arena de calibración (g/cm³)", min_value=0.1, step=0.01, value=1.5)
+                    humedad = st.number_input("Humedad del suelo (%) (0 si no se ha medido)", min_value=0.0, step=0.1)
                 
                 with col2:
                     st.markdown("#### Cálculos Automáticos")
@@ -154,7 +155,8 @@ def mostrar_pagina_picnometro():
                         ensayo_id = guardar_ensayo_picnometro(
                             codigo_seleccionado, fecha_ensayo, operario_ensayo,
                             densidad_aparente, volumen_hoyo, masa_arena_empleada,
-                            masa_arena_cono, densidad_arena, notas
+                            masa_arena_cono, densidad_arena, notas,
+                            humedad=humedad if humedad > 0 else None
                         )
                         
                         # Guardar imágenes si hay
@@ -0,0 +1,108 @@
+import streamlit as st
+
+from models.compactacion import CRITERIOS_ENLACE
+from models.trabajos import (TIPOS_TRABAJO, ESTADOS_ACTIVOS, encolar_trabajo, obtener_trabajos,
+                             cancelar_trabajo)
+
+# Segundos entre dos consultas del progreso mientras hay trabajos activos
+INTERVALO_REFRESCO = 2
+
+ICONOS_ESTADO = {
+    "pendiente": "⏳",
+    "en_curso": "⚙️",
+    "completado": "✅",
+    "error": "❌",
+    "cancelado": "🚫",
+}
+
+
+def mostrar_formulario_trabajo():
+    """
+    Muestra el formulario para lanzar un trabajo en segundo plano
+    """
+    tipo = st.selectbox(
+        "Trabajo:",
+        list(TIPOS_TRABAJO),
+        format_func=lambda t: TIPOS_TRABAJO[t][1],
+    )
+
+    parametros = {}
+    if tipo == "control_compactacion":
+        parametros["criterio"] = st.selectbox("Criterio de enlace:", list(CRITERIOS_ENLACE))
+        parametros["completo"] = st.checkbox("Recalcular todos los ensayos", value=True)
+    elif tipo == "recompresion_imagenes":
+        lado = st.number_input("Lado máximo en píxeles (0 para no reducir):", min_value=0, value=0, step=100)
+        parametros["lado_maximo"] = int(lado) or None
+    elif tipo == "exportacion_parquet":
+        parametros["destino"] = st.text_input("Directorio de destino (vacío para el predeterminado):").strip()
+        parametros["completa"] = st.checkbox("Rehacer la exportación completa", value=False)
+    elif tipo == "copia_seguridad":
+        parametros["imagenes"] = st.checkbox("Copiar también las imágenes", value=True)
+    elif tipo == "mantenimiento_bd":
+        parametros["analizar"] = st.checkbox("ANALYZE completo", value=False)
+        parametros["activar_vaciado"] = st.checkbox(
+            "Activar el vaciado incremental (VACUUM completo: bloquea las escrituras mientras dura)", value=False
+        )
+
+    if st.button("Lanzar trabajo"):
+        trabajo_id = encolar_trabajo(tipo, parametros, st.session_state.usuario_actual["nombre"])
+        st.success(f"Trabajo {trabajo_id} encolado. Puede seguir usando la aplicación o cerrar la pestaña.")
+
+
+def mostrar_trabajos():
+    """
+    Muestra los trabajos recientes con su progreso
+    """
+    trabajos = obtener_trabajos(limite=20)
+
+    if not trabajos:
+        st.info("No hay trabajos registrados")
+        return
+
+    for trabajo in trabajos:
+        descripcion = TIPOS_TRABAJO.get(trabajo["tipo"], (None, trabajo["tipo"]))[1]
+        col1, col2 = st.columns([5, 1])
+
+        with col1:
+            st.write(f"{ICONOS_ESTADO.get(trabajo['estado'], '')} **#{trabajo['id']} {descripcion}** "
+                     f"({trabajo['estado']}, {trabajo['usuario'] or '-'}, {trabajo['fecha_creacion']})")
+            if trabajo["estado"] in ESTADOS_ACTIVOS:
+                st.progress(trabajo["progreso"] or 0.0, text=trabajo["mensaje"] or "")
+            elif trabajo["estado"] == "error":
+                st.error(trabajo["error"])
+            elif trabajo["estado"] == "completado":
+                st.caption(f"Resultado: {trabajo['resultado']}")
+
+        with col2:
+            if trabajo["estado"] in ESTADOS_ACTIVOS and not trabajo["cancelar"]:
+                if st.button("Cancelar", key=f"cancelar_trabajo_{trabajo['id']}"):
+                    cancelar_trabajo(trabajo["id"])
+                    st.rerun(scope="fragment")
+
+    # Cuando no quedan trabajos activos se deja de consultar el progreso
+    if st.session_state.get("trabajos_activos") and not any(t["estado"] in ESTADOS_ACTIVOS for t in trabajos):
+        st.session_state.trabajos_activos = False
+        st.rerun()
+
+
+def mostrar_pagina_trabajos():
+    """
+    Muestra la página de trabajos en segundo plano
+    """
+    st.header("Trabajos en Segundo Plano")
+    st.write(
+        "Las operaciones largas se ejecutan fuera de la página: continúan aunque se cierre "
+        "el navegador y se reanudan si se reinicia el servidor."
+    )
+
+    try:
+        with st.expander("Lanzar un trabajo", expanded=False):
+            mostrar_formulario_trabajo()
+
+        st.subheader("Trabajos recientes")
+
+        # Solo se refresca el fragmento de la lista, y solo mientras hay trabajos activos
+        st.session_state.trabajos_activos = bool(obtener_trabajos(limite=1, activos=True))
+        st.fragment(run_every=INTERVALO_REFRESCO if st.session_state.trabajos_activos else None)(mostrar_trabajos)()
+    except Exception as e:
+        st.error(f"Error al mostrar los trabajos: {str(e)}")
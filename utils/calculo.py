@@ -1,3 +1,5 @@
+import numpy as np
+
 def procesar_datos_tamices(tamices, masas_retenidas, masa_total):
     """
     Procesa los datos de los tamices y calcula porcentajes
@@ -31,6 +33,74 @@ def procesar_datos_tamices(tamices, masas_retenidas, masa_total):
     
     return datos_tamices
 
+def calcular_porcentajes_tamices(masas_retenidas, masa_total):
+    """
+    Calcula los porcentajes de una o varias curvas granulométricas a la vez, con
+    el mismo resultado que procesar_datos_tamices
+    
+    Args:
+        masas_retenidas (array-like): Masas retenidas en cada tamiz, una fila por curva
+        masa_total (float o array-like): Masa total de cada curva
+        
+    Returns:
+        tuple: (porcentaje_retenido, porcentaje_retenido_acumulado, porcentaje_pasa),
+            arrays con la forma de masas_retenidas
+    """
+    masas = np.asarray(masas_retenidas, dtype=float)
+    total = np.asarray(masa_total, dtype=float)[..., np.newaxis]
+    
+    # Sin masa total (0 o nula) los porcentajes retenidos son 0
+    valida = total > 0
+    divisor = np.where(valida, total, 1.0)
+    porcentaje_retenido = np.where(valida, masas / divisor * 100, 0.0)
+    porcentaje_retenido_acumulado = np.where(valida, np.cumsum(masas, axis=-1) / divisor * 100, 0.0)
+    
+    return porcentaje_retenido, porcentaje_retenido_acumulado, 100 - porcentaje_retenido_acumulado
+
+def remuestrear_pasa(aperturas, porcentaje_pasa, aperturas_objetivo):
+    """
+    Interpola el porcentaje que pasa de una o varias curvas de una misma serie de
+    tamices en otras aperturas, linealmente en escala logarítmica de apertura.
+    Permite comparar curvas de series distintas sobre las mismas aperturas.
+
+    Args:
+        aperturas (array-like): Aperturas de la serie en mm (0 para el fondo)
+        porcentaje_pasa (array-like): Porcentaje que pasa, una fila por curva
+        aperturas_objetivo (array-like): Aperturas en mm en las que se interpola
+
+    Returns:
+        numpy.ndarray: Matriz (curvas, aperturas_objetivo); NaN fuera del intervalo
+            de aperturas de la serie (no se extrapola)
+    """
+    aperturas = np.asarray(aperturas, dtype=float)
+    pasa = np.atleast_2d(np.asarray(porcentaje_pasa, dtype=float))
+    objetivo = np.asarray(aperturas_objetivo, dtype=float)
+    resultado = np.full((len(pasa), len(objetivo)), np.nan)
+
+    # Tamices con abertura (sin el fondo) en orden creciente
+    con_abertura = np.flatnonzero(aperturas > 0)
+    if not len(con_abertura):
+        return resultado
+    orden = con_abertura[np.argsort(aperturas[con_abertura], kind="stable")]
+    x = np.log(aperturas[orden])
+    y = pasa[:, orden]
+
+    with np.errstate(divide="ignore"):
+        x_objetivo = np.log(objetivo)
+    dentro = np.flatnonzero((x_objetivo >= x[0] - 1e-9) & (x_objetivo <= x[-1] + 1e-9))
+    if len(x) == 1:
+        resultado[:, dentro] = y[:, [0]]
+        return resultado
+
+    # Tramo de cada apertura objetivo y peso del extremo superior (1 si coincide con él)
+    i = np.clip(np.searchsorted(x, x_objetivo[dentro]) - 1, 0, len(x) - 2)
+    ancho = x[i + 1] - x[i]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        peso = np.where(ancho > 0, np.clip((x_objetivo[dentro] - x[i]) / ancho, 0, 1), 1.0)
+    resultado[:, dentro] = y[:, i] * (1 - peso) + y[:, i + 1] * peso
+
+    return resultado
+
 def interpolar(x, y, valor_y):
     """
     Realiza interpolación lineal para encontrar un valor x para un y dado
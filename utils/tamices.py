@@ -1,27 +1,93 @@
+import hashlib
+import json
+
+# Series de tamices normalizadas. Se cargan en el catálogo de series de tamices
+# (tabla series_tamices, models/series_tamices.py) y los ensayos guardan solo su
+# identificador. Una serie del catálogo no cambia nunca: si una norma modifica su
+# serie, se añade como una versión nueva con otro identificador.
+SERIES_NORMALIZADAS = {
+    "ASTM": {
+        "norma": "ASTM E11",
+        "version": 1,
+        "descripcion": "Serie ASTM",
+        "tamices": (
+            ("3\"", 75.0),
+            ("2\"", 50.0),
+            ("1 1/2\"", 37.5),
+            ("1\"", 25.0),
+            ("3/4\"", 19.0),
+            ("1/2\"", 12.5),
+            ("3/8\"", 9.5),
+            ("No. 4", 4.75),
+            ("No. 10", 2.00),
+            ("No. 20", 0.85),
+            ("No. 40", 0.425),
+            ("No. 60", 0.250),
+            ("No. 100", 0.150),
+            ("No. 200", 0.075),
+            ("Fondo", 0),
+        ),
+    },
+    # Tamices de la plantilla Granulometría E1AH-1, con las aperturas nominales de la norma
+    "UNE-EN 933-2": {
+        "norma": "UNE-EN 933-2",
+        "version": 1,
+        "descripcion": "Serie UNE-EN 933-2 (plantilla E1AH-1)",
+        "tamices": (
+            ("40 mm", 40.0),
+            ("31,5 mm", 31.5),
+            ("25 mm", 25.0),
+            ("20 mm", 20.0),
+            ("16 mm", 16.0),
+            ("14 mm", 14.0),
+            ("12,5 mm", 12.5),
+            ("10 mm", 10.0),
+            ("8 mm", 8.0),
+            ("6,3 mm", 6.3),
+            ("5 mm", 5.0),
+            ("4 mm", 4.0),
+            ("2 mm", 2.0),
+            ("1 mm", 1.0),
+            ("0,5 mm", 0.5),
+            ("0,4 mm", 0.4),
+            ("0,25 mm", 0.25),
+            ("0,2 mm", 0.2),
+            ("0,125 mm", 0.125),
+            ("0,063 mm", 0.063),
+            ("Fondo", 0),
+        ),
+    },
+}
+
+# Serie que se propone al registrar un ensayo
+SERIE_POR_DEFECTO = "ASTM"
+
 def get_tamices_estandar():
     """
     Devuelve una lista de tamices estándar utilizados en ensayos granulométricos
-    
+
     Returns:
         list: Lista de diccionarios con nombre y apertura de cada tamiz
     """
     return [
-        {"nombre": "3\"", "apertura": 75.0},
-        {"nombre": "2\"", "apertura": 50.0},
-        {"nombre": "1 1/2\"", "apertura": 37.5},
-        {"nombre": "1\"", "apertura": 25.0},
-        {"nombre": "3/4\"", "apertura": 19.0},
-        {"nombre": "1/2\"", "apertura": 12.5},
-        {"nombre": "3/8\"", "apertura": 9.5},
-        {"nombre": "No. 4", "apertura": 4.75},
-        {"nombre": "No. 10", "apertura": 2.00},
-        {"nombre": "No. 20", "apertura": 0.85},
-        {"nombre": "No. 40", "apertura": 0.425},
-        {"nombre": "No. 60", "apertura": 0.250},
-        {"nombre": "No. 100", "apertura": 0.150},
-        {"nombre": "No. 200", "apertura": 0.075},
-        {"nombre": "Fondo", "apertura": 0}
+        {"nombre": nombre, "apertura": apertura}
+        for nombre, apertura in SERIES_NORMALIZADAS[SERIE_POR_DEFECTO]["tamices"]
     ]
 
 # Alias para la misma función (por compatibilidad)
-get_tamices = get_tamices_estandar
\ No newline at end of file
+get_tamices = get_tamices_estandar
+
+def clave_serie(nombres, aperturas):
+    """
+    Calcula la clave que identifica una serie de tamices por su contenido
+
+    Args:
+        nombres (list): Nombres de los tamices
+        aperturas (list): Aperturas de los tamices en mm
+
+    Returns:
+        str: Resumen SHA-1 de los nombres y las aperturas
+    """
+    contenido = json.dumps([list(nombres), [round(float(apertura), 9) for apertura in aperturas]],
+                           ensure_ascii=False)
+    return hashlib.sha1(contenido.encode("utf-8")).hexdigest()